@@ -13,6 +13,8 @@
 # limitations under the License.
 
 # pylint: disable=C0114,C0301
+import os
+
 from protenix.config.extend_types import (
     GlobalConfigValue,
     ListValue,
@@ -126,6 +128,16 @@ model_configs = {
         "lddt_metrics_chunk_size": ValueMaybeNone(
             1
         ),  # only works if loss_metrics_sparse_enable, can set as default 1
+        # Replace chunk_size by the fastest of the candidates (or no chunking) that fits in
+        # memory_budget, probed once per (N_token, N_atom, N_msa) bucket and cached in cache_path
+        "chunk_tuning": {
+            "enable": False,
+            "candidates": ListValue([4, 16, 64, 256]),
+            "memory_budget": 0.8,
+            "cache_path": os.path.join(
+                os.path.expanduser("~"), ".cache", "protenix", "chunk_sizes.json"
+            ),
+        },
     },
     "train_noise_sampler": {
         "p_mean": -1.2,
@@ -151,6 +163,14 @@ model_configs = {
     "model": {
         "N_model_seed": 1,  # for inference
         "N_cycle": 4,
+        "adaptive_recycle": {
+            # only used in inference: stop recycling once the trunk has converged
+            "enable": False,
+            "min_cycle": 3,
+            "max_cycle": -1,  # -1 means using N_cycle as the maximum
+            "signal": "contact",  # "contact": mean abs change of distogram contact probs; "norm": relative change of |s|, |z|
+            "tolerance": 1e-3,
+        },
         "input_embedder": {
             "c_atom": GlobalConfigValue("c_atom"),
             "c_atompair": GlobalConfigValue("c_atompair"),
@@ -48,6 +48,8 @@ default_weighted_pdb_configs = {
             "ligand": 1,
         },
         "force_recompute_weight": True,
+        # save the computed weights next to the indices csv, keyed by a hash of configs and indices
+        "cache_weight": True,
     },
     "cropping_configs": {
         "method_weights": ListValue([0.2, 0.4, 0.4]),
@@ -114,6 +116,7 @@ if (not os.path.exists(CCD_COMPONENTS_FILE_PATH)) or (
 
 data_configs = {
     "num_dl_workers": 16,
+    "prefetch_factor": 2,  # batches loaded in advance by each dataloader worker
     "epoch_size": 10000,
     "train_ref_pos_augment": True,
     "test_ref_pos_augment": True,
@@ -122,6 +125,14 @@ data_configs = {
         "train_sample_weights": ListValue([1.0]),
         "sampler_type": "weighted",
     },
+    # Samples that fail to load are recorded in <error_dir>/quarantine.jsonl
+    "quarantine": {
+        "enable": True,
+        "min_failures": 2,  # number of failures before a sample is quarantined
+        "weight": 0.0,  # sampling weight multiplier of quarantined samples, 0 to skip them
+        # comma separated quarantine.jsonl of previous runs, so that they are skipped from the start
+        "registry_fpaths": "",
+    },
     "test_sets": ListValue(["recentPDB_1536_sample384_0925"]),
     "weightedPDB_before2109_wopb_nometalc_0925": {
         "base_info": {
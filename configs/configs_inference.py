@@ -27,10 +27,12 @@ inference_configs = {
     "dump_dir": "./output",
     "need_atom_confidence": False,
     "sorted_by_ranking_score": True,
+    "confidence_format": "json",  # "json" or "npz": one float16 NPZ per seed for the full data
     "input_json_path": RequiredValue(str),
     "load_checkpoint_path": os.path.join(
         code_directory, "./release_data/checkpoint/model_v0.2.0.pt"
     ),
+    "fast_load_checkpoint": True,  # build the model on the meta device and mmap the checkpoint weights
     "num_workers": 16,
     "use_msa": True,
 }
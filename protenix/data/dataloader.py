@@ -13,7 +13,8 @@
 # limitations under the License.
 
 import math
-from typing import Iterator, Optional, Sequence
+import time
+from typing import Callable, Iterator, Optional, Sequence
 
 import torch
 import torch.distributed as dist
@@ -21,7 +22,10 @@ from ml_collections.config_dict import ConfigDict
 from torch.utils.data import DataLoader, DistributedSampler, Sampler
 
 from protenix.data.dataset import Dataset, get_datasets
+from protenix.data.indices_store import PDBGroupedIndices
+from protenix.data.quarantine import apply_quarantine
 from protenix.utils.logger import get_logger
+from protenix.utils.torch_utils import record_stream, to_device
 
 logger = get_logger(__name__)
 
@@ -37,6 +41,8 @@ class WeightedSampler(Sampler):
         num_samples: int,
         replacement: bool,
         seed: int = 0,
+        quarantine_fn: Optional[Callable[[], Sequence[int]]] = None,
+        quarantine_weight: float = 0.0,
     ):
         """
         Args:
@@ -44,12 +50,16 @@ class WeightedSampler(Sampler):
             num_samples (int): The number of samples to be drawn.
             replacement (bool): Whether sampling is done with replacement.
             seed (int): The seed for the random number generator.
+            quarantine_fn (Callable, optional): Returns the indices of the quarantined samples, called every epoch.
+            quarantine_weight (float): Weight multiplier of the quarantined samples, 0 to skip them.
         """
         self.weights = torch.as_tensor(weights, dtype=torch.double)
         self.replacement = replacement
         self.seed = seed
         self.epoch = 0
         self.num_samples = num_samples
+        self.quarantine_fn = quarantine_fn
+        self.quarantine_weight = quarantine_weight
 
     def __iter__(self) -> Iterator[int]:
         """
@@ -61,10 +71,17 @@ class WeightedSampler(Sampler):
         Returns:
             iter: An iterator over the sampled indices.
         """
+        weights = self.weights
+        if self.quarantine_fn is not None:
+            quarantined_indices = self.quarantine_fn()
+            logger.info(f"#Quarantined samples: {len(quarantined_indices)}")
+            weights = apply_quarantine(
+                weights, quarantined_indices, self.quarantine_weight
+            )
         g = torch.Generator()
         g.manual_seed(self.seed + self.epoch)
         indices = torch.multinomial(
-            self.weights, self.num_samples, self.replacement, generator=g
+            weights, self.num_samples, self.replacement, generator=g
         ).tolist()
         return iter(indices)
 
@@ -89,6 +106,8 @@ class DistributedWeightedSampler(DistributedSampler):
         rank: Optional[int] = None,
         replacement: bool = True,
         seed: int = 0,
+        quarantine_fn: Optional[Callable[[], Sequence[int]]] = None,
+        quarantine_weight: float = 0.0,
     ):
         """
         Args:
@@ -99,6 +118,9 @@ class DistributedWeightedSampler(DistributedSampler):
             rank (int, optional): The rank of the current process in a distributed environment. Defaults to None.
             replacement (bool, optional): Whether to sample with replacement. Defaults to True.
             seed (int, optional): The random seed for reproducibility. Defaults to 0.
+            quarantine_fn (Callable, optional): Returns the indices of the quarantined samples, called every epoch.
+                It must return the same indices on all the ranks.
+            quarantine_weight (float, optional): Weight multiplier of the quarantined samples, 0 to skip them.
         """
         super().__init__(dataset, num_replicas=num_replicas, rank=rank, shuffle=False)
         self.weights = torch.as_tensor(weights, dtype=torch.double)
@@ -106,6 +128,8 @@ class DistributedWeightedSampler(DistributedSampler):
         self.seed = seed
         self.epoch = 0
         self.num_samples = num_samples
+        self.quarantine_fn = quarantine_fn
+        self.quarantine_weight = quarantine_weight
 
         self.num_samples_per_replica = int(
             math.ceil(self.num_samples / self.num_replicas)
@@ -123,10 +147,18 @@ class DistributedWeightedSampler(DistributedSampler):
         Returns:
             iter: An iterator over the sampled indices for the current process.
         """
+        weights = self.weights
+        if self.quarantine_fn is not None:
+            quarantined_indices = self.quarantine_fn()
+            if self.rank == 0:
+                logger.info(f"#Quarantined samples: {len(quarantined_indices)}")
+            weights = apply_quarantine(
+                weights, quarantined_indices, self.quarantine_weight
+            )
         g = torch.Generator()
         g.manual_seed(self.seed + self.epoch)
         indices = torch.multinomial(
-            self.weights, self.num_samples, self.replacement, generator=g
+            weights, self.num_samples, self.replacement, generator=g
         ).tolist()
         indices = indices[self.rank : self.total_size : self.num_replicas]
         return iter(indices)
@@ -187,11 +219,11 @@ class KeySumBalancedSampler(Sampler):
         while len(indices) < self.num_replicas:
             indices += indices[: (self.num_replicas - len(indices))]
 
-        if isinstance(self.dataset.indices_list, list):
+        if isinstance(self.dataset.indices_list, PDBGroupedIndices):
             # e.g. recentPDB test set
-            dataset_values = [
-                x[self.key].astype(int)[0] for x in self.dataset.indices_list
-            ]
+            dataset_values = (
+                self.dataset.indices_list.first_rows()[self.key].astype(int).to_numpy()
+            )
         else:
             # e.g. posebuster test set
             dataset_values = self.dataset.indices_list[self.key].astype(int).to_numpy()
@@ -299,6 +331,58 @@ class DistributedDataLoader(DataLoader):
         return _iterator
 
 
+class DevicePrefetcher(object):
+    """
+    Iterates over a dataloader and moves the batches to the device, one batch ahead.
+
+    On GPU, batch k+1 is copied on a side stream with non-blocking copies from pinned memory
+    (DataLoader(pin_memory=True)) while step k runs. `stall_time` accumulates the seconds
+    spent waiting for the dataloader.
+    """
+
+    def __init__(self, dataloader: DataLoader, device: torch.device):
+        self.dataloader = dataloader
+        self.device = torch.device(device)
+        self.stream = (
+            torch.cuda.Stream(device=self.device)
+            if self.device.type == "cuda"
+            else None
+        )
+        self.stall_time = 0.0
+
+    def _load(self, iterator: Iterator):
+        start = time.perf_counter()
+        batch = next(iterator, None)
+        self.stall_time += time.perf_counter() - start
+        if batch is None:
+            return None
+        if self.stream is None:
+            return to_device(batch, self.device)
+        with torch.cuda.stream(self.stream):
+            return to_device(batch, self.device, non_blocking=True)
+
+    def __iter__(self):
+        iterator = iter(self.dataloader)
+        next_batch = self._load(iterator)
+        while next_batch is not None:
+            batch = next_batch
+            if self.stream is not None:
+                current_stream = torch.cuda.current_stream(self.device)
+                current_stream.wait_stream(self.stream)
+                # The tensors were allocated on the side stream but are used on the current one
+                record_stream(batch, current_stream)
+            next_batch = self._load(iterator)
+            yield batch
+
+    def pop_stall_time(self) -> float:
+        """
+        Returns:
+            float: the seconds spent waiting for the dataloader since the last call.
+        """
+        stall_time, self.stall_time = self.stall_time, 0.0
+        return stall_time
+
+
 def get_dataloaders(
     configs: ConfigDict, world_size: int, seed: int, error_dir: Optional[str] = None
 ):
@@ -316,6 +400,28 @@ def get_dataloaders(
 
     """
     train_dataset, test_datasets = get_datasets(configs, error_dir)
+    loader_kwargs = {
+        "num_workers": configs.data.num_dl_workers,
+        # Pinned batches can be copied to the GPU asynchronously, see DevicePrefetcher
+        "pin_memory": torch.cuda.is_available(),
+    }
+    if configs.data.num_dl_workers > 0:
+        loader_kwargs["prefetch_factor"] = configs.data.get("prefetch_factor", 2)
+    quarantine_configs = configs.data.get("quarantine", {})
+    quarantine_params = {}
+    if error_dir is not None and quarantine_configs.get("enable", False):
+
+        def get_quarantined_indices():
+            # Rank 0 decides, so that all the ranks sample with the same weights
+            quarantined_indices = [train_dataset.get_quarantined_indices()]
+            if world_size > 1 and dist.is_initialized():
+                dist.broadcast_object_list(quarantined_indices, src=0)
+            return quarantined_indices[0]
+
+        quarantine_params = {
+            "quarantine_fn": get_quarantined_indices,
+            "quarantine_weight": quarantine_configs.get("weight", 0.0),
+        }
     if world_size > 1:
         train_sampler = DistributedWeightedSampler(
             train_dataset,
@@ -323,12 +429,13 @@ def get_dataloaders(
             num_samples=configs.data.epoch_size,
             replacement=True,
             seed=seed,
+            **quarantine_params,
         )
         train_dl = DistributedDataLoader(
             dataset=train_dataset,
             batch_size=1,
             shuffle=False,
-            num_workers=configs.data.num_dl_workers,
+            **loader_kwargs,
             collate_fn=lambda batch: batch[0],
             sampler=train_sampler,
         )
@@ -339,12 +446,13 @@ def get_dataloaders(
             num_samples=configs.data.epoch_size,
             replacement=True,
             seed=seed,
+            **quarantine_params,
         )
         train_dl = IterDataLoader(
             dataset=train_dataset,
             batch_size=1,
             shuffle=False,
-            num_workers=configs.data.num_dl_workers,
+            **loader_kwargs,
             collate_fn=lambda batch: batch[0],
             sampler=train_sampler,
         )
@@ -362,7 +470,7 @@ def get_dataloaders(
             test_dataset,
             batch_size=1,
             shuffle=False,
-            num_workers=configs.data.num_dl_workers,
+            **loader_kwargs,
             sampler=test_sampler,
             collate_fn=lambda batch: batch[0],
         )
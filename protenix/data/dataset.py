@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import json
 import os
 import random
@@ -30,11 +31,16 @@ from torch.utils.data import Dataset
 from protenix.data.constants import EvaluationChainInterface
 from protenix.data.data_pipeline import DataPipeline
 from protenix.data.featurizer import Featurizer
+from protenix.data.indices_store import (
+    IndicesStore,
+    IndicesView,
+    PDBGroupedIndices,
+)
 from protenix.data.msa_featurizer import MSAFeaturizer
+from protenix.data.quarantine import QuarantineRegistry
 from protenix.data.tokenizer import TokenArray
 from protenix.data.utils import data_type_transform, make_dummy_feature
 from protenix.utils.cropping import CropData
-from protenix.utils.file_io import read_indices_csv
 from protenix.utils.logger import get_logger
 from protenix.utils.torch_utils import dict_to_tensor
 
@@ -102,6 +108,8 @@ class BaseSingleDataset(Dataset):
         self.error_dir = kwargs.get("error_dir", None)
         if self.error_dir is not None:
             os.makedirs(self.error_dir, exist_ok=True)
+        # Registry of the samples that failed, shared by workers and ranks through error_dir
+        self.quarantine = kwargs.get("quarantine", None)
 
         self.msa_featurizer = msa_featurizer
         self.template_featurizer = template_featurizer
@@ -134,90 +142,87 @@ class BaseSingleDataset(Dataset):
                     pdb_filter_list.append(l)
         return pdb_filter_list
 
-    def read_indices_list(self, indices_fpath: Union[str, Path]) -> pd.DataFrame:
+    def read_indices_list(
+        self, indices_fpath: Union[str, Path]
+    ) -> Union[IndicesView, PDBGroupedIndices]:
         """
         Reads and processes a list of indices from a CSV file.
+        The CSV is converted once into a memory-mapped columnar store, the filters are applied
+        to its columns and the dataset keeps the positions of the remaining rows. A row is only
+        loaded into pandas when its sample is requested.
 
         Args:
             indices_fpath: Path to the CSV file containing the indices.
 
         Returns:
-            A DataFrame containing the processed indices.
+            An IndicesView of the processed indices, or a PDBGroupedIndices if group_by_pdb_id.
         """
-        indices_list = read_indices_csv(indices_fpath)
-        num_data = len(indices_list)
+        store = IndicesStore.from_csv(indices_fpath)
+        num_data = len(store)
         logger.info(f"#Rows in indices list: {num_data}")
+        valid_mask = np.ones(num_data, dtype=bool)
         # Filter by pdb_list
         if self.pdb_list is not None:
             pdb_filter_list = set(self.read_pdb_list(pdb_list=self.pdb_list))
-            indices_list = indices_list[indices_list["pdb_id"].isin(pdb_filter_list)]
-            logger.info(f"[filtered by pdb_list] #Rows: {len(indices_list)}")
+            valid_mask &= store.isin("pdb_id", pdb_filter_list)
+            logger.info(f"[filtered by pdb_list] #Rows: {valid_mask.sum()}")
 
         # Filter by max_n_token
         if self.max_n_token > 0:
-            valid_mask = indices_list["num_tokens"].astype(int) <= self.max_n_token
-            removed_list = indices_list[~valid_mask]
-            indices_list = indices_list[valid_mask]
-            logger.info(f"[removed] #Rows: {len(removed_list)}")
-            logger.info(f"[removed] #PDB: {removed_list['pdb_id'].nunique()}")
+            n_token_mask = store.column("num_tokens").astype(int) <= self.max_n_token
+            removed_mask = valid_mask & ~n_token_mask
+            valid_mask &= n_token_mask
+            removed_pdb_ids = store.column("pdb_id")[
+                removed_mask & ~store.isnull("pdb_id")
+            ]
+            logger.info(f"[removed] #Rows: {removed_mask.sum()}")
+            logger.info(f"[removed] #PDB: {len(np.unique(removed_pdb_ids))}")
             logger.info(
-                f"[filtered by n_token ({self.max_n_token})] #Rows: {len(indices_list)}"
+                f"[filtered by n_token ({self.max_n_token})] #Rows: {valid_mask.sum()}"
             )
 
         # Filter by exclusion_dict
         for col_name, exclusion_list in self.exclusion_dict.items():
             cols = col_name.split("|")
             exclusion_set = {tuple(excl.split("|")) for excl in exclusion_list}
-
-            def is_valid(row):
-                return tuple(row[col] for col in cols) not in exclusion_set
-
-            valid_mask = indices_list.apply(is_valid, axis=1)
-            indices_list = indices_list[valid_mask].reset_index(drop=True)
+            valid_mask &= ~store.isin(cols, exclusion_set)
             logger.info(
-                f"[Excluded by {col_name} -- {exclusion_list}] #Rows: {len(indices_list)}"
+                f"[Excluded by {col_name} -- {exclusion_list}] #Rows: {valid_mask.sum()}"
+            )
+        indices_list = IndicesView(store, np.nonzero(valid_mask)[0])
+        self.print_data_stats(
+            indices_list.to_dataframe(
+                columns=[
+                    c
+                    for c in ("pdb_id", "mol_1_type", "mol_2_type", "cluster_id")
+                    if c in store.columns
+                ]
             )
-        self.print_data_stats(indices_list)
+        )
 
         # Group by pdb_id
-        # A list of dataframe. Each contains one pdb with multiple rows.
+        # Rows sorted by pdb_id, with the row offsets of each pdb.
         if self.group_by_pdb_id:
-            indices_list = [
-                df.reset_index() for _, df in indices_list.groupby("pdb_id", sort=True)
-            ]
+            indices_list = PDBGroupedIndices.from_indices(indices_list)
 
         if self.sort_by_n_token:
             # Sort the dataset in a descending order, so that if OOM it will raise Error at an early stage.
             if self.group_by_pdb_id:
-                indices_list = sorted(
-                    indices_list,
-                    key=lambda df: int(df["num_tokens"].iloc[0]),
-                    reverse=True,
-                )
+                n_token = indices_list.first_rows().column("num_tokens").astype(int)
             else:
-                indices_list = indices_list.sort_values(
-                    by="num_tokens", key=lambda x: x.astype(int), ascending=False
-                ).reset_index(drop=True)
+                n_token = indices_list.column("num_tokens").astype(int)
+            indices_list = indices_list.select(np.argsort(-n_token, kind="stable"))
 
         if self.find_eval_chain_interface:
             # Remove data that does not contain eval_type in the EvaluationChainInterface list
             if self.group_by_pdb_id:
-                indices_list = [
-                    df
-                    for df in indices_list
-                    if len(
-                        set(df["eval_type"].to_list()).intersection(
-                            set(EvaluationChainInterface)
-                        )
-                    )
-                    > 0
-                ]
+                is_eval = indices_list.indices.isin("eval_type", EvaluationChainInterface)
+                indices_list = indices_list.select(
+                    np.nonzero(indices_list.any_row(is_eval))[0]
+                )
             else:
-                indices_list = indices_list[
-                    indices_list["eval_type"].apply(
-                        lambda x: x in EvaluationChainInterface
-                    )
-                ]
+                is_eval = indices_list.isin("eval_type", EvaluationChainInterface)
+                indices_list = indices_list.select(np.nonzero(is_eval)[0])
         if self.limits > 0 and len(indices_list) > self.limits:
             logger.info(
                 f"Limit indices list size from {len(indices_list)} to {self.limits}"
@@ -234,16 +239,12 @@ class BaseSingleDataset(Dataset):
         """
         if self.name:
             logger.info("-" * 10 + f" Dataset {self.name}" + "-" * 10)
-        df["mol_group_type"] = df.apply(
-            lambda row: "_".join(
-                sorted(
-                    [
-                        str(row["mol_1_type"]),
-                        str(row["mol_2_type"]).replace("nan", "intra"),
-                    ]
-                )
-            ),
-            axis=1,
+        mol_1_type = df["mol_1_type"].astype(str)
+        mol_2_type = df["mol_2_type"].astype(str).str.replace("nan", "intra")
+        df["mol_group_type"] = (
+            mol_1_type.where(mol_1_type <= mol_2_type, mol_2_type)
+            + "_"
+            + mol_2_type.where(mol_1_type <= mol_2_type, mol_1_type)
         )
 
         group_size_dict = dict(df["mol_group_type"].value_counts())
@@ -264,29 +265,86 @@ class BaseSingleDataset(Dataset):
     def __len__(self) -> int:
         return len(self.indices_list)
 
-    def save_error_data(self, idx: int, error_message: str) -> None:
+    @staticmethod
+    def get_sample_key(sample_indice: Union[pd.Series, pd.DataFrame]) -> Union[str, pd.Series]:
         """
-        Saves the error data for a specific index to a JSON file in the error directory.
+        Key of a sample, also used as the name of its error file.
+
+        Args:
+            sample_indice: A row of the indices list, or several rows.
+
+        Returns:
+            "{pdb_id}-{chain_1_id}-{chain_2_id}", or a Series of keys.
+        """
+        if isinstance(sample_indice, pd.DataFrame):
+            return (
+                sample_indice["pdb_id"].astype(str)
+                + "-"
+                + sample_indice["chain_1_id"].astype(str)
+                + "-"
+                + sample_indice["chain_2_id"].astype(str)
+            )
+        return f"{sample_indice.pdb_id}-{sample_indice.chain_1_id}-{sample_indice.chain_2_id}"
+
+    def get_quarantined_indices(self) -> np.ndarray:
+        """
+        Returns:
+            Indices of the samples quarantined in the registry.
+        """
+        if self.quarantine is None:
+            return np.zeros(0, dtype=np.int64)
+        self.quarantine.refresh()
+        keys = self.quarantine.quarantined_keys(self.name)
+        if len(keys) == 0:
+            return np.zeros(0, dtype=np.int64)
+        indices = (
+            self.indices_list.first_rows()
+            if self.group_by_pdb_id
+            else self.indices_list
+        )
+        sample_keys = self.get_sample_key(
+            indices.to_dataframe(columns=["pdb_id", "chain_1_id", "chain_2_id"])
+        )
+        return np.nonzero(sample_keys.isin(keys).to_numpy())[0]
+
+    def save_error_data(
+        self, idx: int, error_message: str, error_type: Optional[str] = None
+    ) -> None:
+        """
+        Saves the error data for a specific index to a JSON file in the error directory,
+        and records the failure in the quarantine registry.
 
         Args:
             idx: The index of the data sample that caused the error.
             error_message: The error message to be saved.
+            error_type: The exception class name.
         """
         if self.error_dir is not None:
             sample_indice = self._get_sample_indice(idx=idx)
             data = sample_indice.to_dict()
             data["error"] = error_message
 
-            filename = f"{sample_indice.pdb_id}-{sample_indice.chain_1_id}-{sample_indice.chain_2_id}.json"
-            fpath = os.path.join(self.error_dir, filename)
+            sample_key = self.get_sample_key(sample_indice)
+            fpath = os.path.join(self.error_dir, f"{sample_key}.json")
             if not os.path.exists(fpath):
                 with open(fpath, "w") as f:
                     json.dump(data, f)
+            if self.quarantine is not None:
+                self.quarantine.record(
+                    self.name, sample_key, error_type or "Exception", idx=idx
+                )
+
+    def _is_quarantined(self, idx: int) -> bool:
+        if self.quarantine is None:
+            return False
+        sample_key = self.get_sample_key(self._get_sample_indice(idx=idx))
+        return self.quarantine.is_quarantined(self.name, sample_key)
 
     def __getitem__(self, idx: int):
         """
         Retrieves a data sample by processing the given index.
         If an error occurs, it attempts to handle it by either saving the error data or randomly sampling another index.
+        With random_sample_if_failed, quarantined samples are replaced by random ones without being processed.
 
         Args:
             idx: The index of the data sample to retrieve.
@@ -296,12 +354,17 @@ class BaseSingleDataset(Dataset):
         """
         # Try at most 10 times
         for _ in range(10):
+            if self.random_sample_if_failed:
+                for _ in range(100):
+                    if not self._is_quarantined(idx):
+                        break
+                    idx = random.choice(range(len(self.indices_list)))
             try:
                 data = self.process_one(idx)
                 return data
             except Exception as e:
                 error_message = f"{e} at idx {idx}:\n{traceback.format_exc()}"
-                self.save_error_data(idx, error_message)
+                self.save_error_data(idx, error_message, error_type=type(e).__name__)
 
                 if self.random_sample_if_failed:
                     logger.exception(f"[skip data {idx}] {error_message}")
@@ -585,7 +648,7 @@ class BaseSingleDataset(Dataset):
             # Row-0 of PDB-idx
             sample_indice = self.indices_list[idx].iloc[0]
         else:
-            sample_indice = self.indices_list.iloc[idx]
+            sample_indice = self.indices_list.row(idx)
         return sample_indice
 
     def _get_eval_chain_interface_mask(
@@ -604,7 +667,7 @@ class BaseSingleDataset(Dataset):
         if self.group_by_pdb_id:
             df = self.indices_list[idx]
         else:
-            df = self.indices_list.iloc[idx : idx + 1]
+            df = self.indices_list.to_dataframe(np.array([idx]))
 
         # Only consider chain/interfaces defined in EvaluationChainInterface
         df = df[df["eval_type"].apply(lambda x: x in EvaluationChainInterface)].copy()
@@ -888,6 +951,18 @@ class WeightedMultiDataset(Dataset):
             self.within_dataset_indices[index]
         ]
 
+    def get_quarantined_indices(self) -> np.ndarray:
+        """
+        Returns:
+            Global indices of the samples quarantined in the registries of the datasets.
+        """
+        quarantined_indices = []
+        offset = 0
+        for dataset in self.datasets:
+            quarantined_indices.append(dataset.get_quarantined_indices() + offset)
+            offset += len(dataset)
+        return np.concatenate(quarantined_indices)
+
 
 def get_weighted_pdb_weight(
     data_type: str,
@@ -936,60 +1011,109 @@ def get_weighted_pdb_weight(
     return weight
 
 
+WEIGHT_COLUMNS = [
+    "pdb_id",
+    "assembly_id",
+    "entity_1_id",
+    "entity_2_id",
+    "cluster_id",
+    "type",
+    "mol_1_type",
+    "mol_2_type",
+]
+
+
 def calc_weights_for_df(
-    indices_df: pd.DataFrame, beta_dict: dict[str, Any], alpha_dict: dict[str, Any]
+    indices_df: pd.DataFrame,
+    beta_dict: dict[str, Any],
+    alpha_dict: dict[str, Any],
+    eps: float = 1e-9,
 ) -> pd.DataFrame:
     """
     Calculate weights for each example in the dataframe.
+    Same weights as calling get_weighted_pdb_weight row by row, computed with column operations.
 
     Args:
         indices_df: A pandas DataFrame containing the indices.
         beta_dict: A dictionary containing beta values for different data types.
         alpha_dict: A dictionary containing alpha values for different data types.
+        eps: A small epsilon value to avoid division by zero. Default is 1e-9.
 
     Returns:
         A pandas DataFrame with an column 'weights' containing the calculated weights.
     """
     # Specific to assembly, and entities (chain or interface)
-    indices_df["pdb_sorted_entity_id"] = indices_df.apply(
-        lambda x: f"{x['pdb_id']}_{x['assembly_id']}_{'_'.join(sorted([str(x['entity_1_id']), str(x['entity_2_id'])]))}",
-        axis=1,
-    )
-
-    entity_member_num_dict = {}
-    for pdb_sorted_entity_id, sub_df in indices_df.groupby("pdb_sorted_entity_id"):
-        # Number of repeatative entities in the same assembly
-        entity_member_num_dict[pdb_sorted_entity_id] = len(sub_df)
-    indices_df["pdb_sorted_entity_id_member_num"] = indices_df.apply(
-        lambda x: entity_member_num_dict[x["pdb_sorted_entity_id"]], axis=1
+    entity_1_id = indices_df["entity_1_id"].astype(str)
+    entity_2_id = indices_df["entity_2_id"].astype(str)
+    entity_1_is_first = entity_1_id <= entity_2_id
+    indices_df["pdb_sorted_entity_id"] = (
+        indices_df["pdb_id"].astype(str)
+        + "_"
+        + indices_df["assembly_id"].astype(str)
+        + "_"
+        + entity_1_id.where(entity_1_is_first, entity_2_id)
+        + "_"
+        + entity_2_id.where(entity_1_is_first, entity_1_id)
     )
 
-    cluster_size_record = {}
-    for cluster_id, sub_df in indices_df.groupby("cluster_id"):
-        cluster_size_record[cluster_id] = len(set(sub_df["pdb_sorted_entity_id"]))
-
-    weights = []
-    for _, row in indices_df.iterrows():
-        data_type = row["type"]
-        cluster_size = cluster_size_record[row["cluster_id"]]
-        chain_count = {"prot": 0, "nuc": 0, "ligand": 0}
-        for mol_type in [row["mol_1_type"], row["mol_2_type"]]:
-            if chain_count.get(mol_type) is None:
-                continue
-            chain_count[mol_type] += 1
-        # Weight specific to (assembly, entity(chain/interface))
-        weight = get_weighted_pdb_weight(
-            data_type=data_type,
-            cluster_size=cluster_size,
-            chain_count=chain_count,
-            beta_dict=beta_dict,
-            alpha_dict=alpha_dict,
-        )
-        weights.append(weight)
+    # Number of repeatative entities in the same assembly
+    indices_df["pdb_sorted_entity_id_member_num"] = indices_df.groupby(
+        "pdb_sorted_entity_id", sort=False
+    )["pdb_sorted_entity_id"].transform("size")
+
+    cluster_size = indices_df.groupby("cluster_id", sort=False, dropna=False)[
+        "pdb_sorted_entity_id"
+    ].transform("nunique")
+
+    data_type = indices_df["type"]
+    assert data_type.isin(["chain", "interface"]).all()
+    beta = data_type.map(beta_dict).astype(float)
+
+    # Only prot/nuc/ligand chains are counted
+    chain_alpha = {
+        mol_type: alpha_dict[mol_type] for mol_type in ["prot", "nuc", "ligand"]
+    }
+    alpha = indices_df["mol_1_type"].map(chain_alpha).fillna(0).astype(
+        float
+    ) + indices_df["mol_2_type"].map(chain_alpha).fillna(0).astype(float)
+
+    # Weight specific to (assembly, entity(chain/interface))
+    weights = beta * alpha / (cluster_size + eps)
     indices_df["weights"] = weights / indices_df["pdb_sorted_entity_id_member_num"]
     return indices_df
 
 
+def get_weight_cache_path(
+    indices_fpath: Union[str, Path],
+    indices_df: pd.DataFrame,
+    beta_dict: dict[str, Any],
+    alpha_dict: dict[str, Any],
+) -> Path:
+    """
+    Path of the cached sample weights, next to the indices CSV. The file name is keyed by a hash of
+    the weight configs and of the columns the weights depend on, so a change of either (e.g. of the
+    dataset filters) gives a different cache file.
+
+    Args:
+        indices_fpath: Path to the CSV file containing the indices.
+        indices_df: The (filtered) indices DataFrame.
+        beta_dict: A dictionary containing beta values for different data types.
+        alpha_dict: A dictionary containing alpha values for different data types.
+
+    Returns:
+        Path: path of the cache file.
+    """
+    sha1 = hashlib.sha1()
+    sha1.update(
+        json.dumps({"beta": beta_dict, "alpha": alpha_dict}, sort_keys=True).encode()
+    )
+    sha1.update(
+        pd.util.hash_pandas_object(indices_df[WEIGHT_COLUMNS], index=False).values
+    )
+    indices_fpath = Path(indices_fpath)
+    return indices_fpath.parent / f"{indices_fpath.name}.weights.{sha1.hexdigest()[:16]}.npy"
+
+
 def get_sample_weights(
     sampler_type: str,
     indices_df: pd.DataFrame = None,
@@ -1003,6 +1127,8 @@ def get_sample_weights(
         "ligand": 1,
     },
     force_recompute_weight: bool = False,
+    cache_weight: bool = False,
+    indices_fpath: Optional[Union[str, Path]] = None,
 ) -> Union[pd.Series, list[float]]:
     """
     Computes sample weights based on the specified sampler type.
@@ -1013,6 +1139,8 @@ def get_sample_weights(
         beta_dict: A dictionary containing beta values for different data types.
         alpha_dict: A dictionary containing alpha values for different data types.
         force_recompute_weight: Whether to force recomputation of weights even if they already exist.
+        cache_weight: Whether to save the computed weights next to indices_fpath and reuse them later.
+        indices_fpath: Path to the CSV file containing the indices. Required by cache_weight.
 
     Returns:
         A list of sample weights.
@@ -1023,11 +1151,32 @@ def get_sample_weights(
     if sampler_type == "weighted":
         assert indices_df is not None
         if "weights" not in indices_df.columns or force_recompute_weight:
-            indices_df = calc_weights_for_df(
-                indices_df=indices_df,
-                beta_dict=beta_dict,
-                alpha_dict=alpha_dict,
-            )
+            cache_path = None
+            if cache_weight and indices_fpath is not None:
+                cache_path = get_weight_cache_path(
+                    indices_fpath, indices_df, beta_dict, alpha_dict
+                )
+            if cache_path is not None and cache_path.exists():
+                logger.info(f"Load sample weights from {cache_path}")
+                indices_df["weights"] = np.load(cache_path)
+            else:
+                indices_df = calc_weights_for_df(
+                    indices_df=indices_df,
+                    beta_dict=beta_dict,
+                    alpha_dict=alpha_dict,
+                )
+                if cache_path is not None:
+                    try:
+                        # Write to a temporary file first, other ranks may read it at the same time
+                        tmp_path = cache_path.with_name(
+                            f"{cache_path.name}.{os.getpid()}.tmp"
+                        )
+                        with open(tmp_path, "wb") as f:
+                            np.save(f, indices_df["weights"].to_numpy())
+                        os.replace(tmp_path, cache_path)
+                        logger.info(f"Save sample weights to {cache_path}")
+                    except OSError as e:
+                        logger.warning(f"Can not save sample weights cache: {e}")
         return indices_df["weights"].astype("float32")
     elif sampler_type == "uniform":
         assert indices_df is not None
@@ -1066,6 +1215,18 @@ def get_datasets(
         }
 
     data_config = configs.data
+    quarantine_configs = data_config.get("quarantine", {})
+    quarantine = None
+    if error_dir is not None and quarantine_configs.get("enable", False):
+        quarantine = QuarantineRegistry(
+            error_dir,
+            min_failures=quarantine_configs.get("min_failures", 2),
+            extra_fpaths=[
+                fpath
+                for fpath in quarantine_configs.get("registry_fpaths", "").split(",")
+                if fpath
+            ],
+        )
     logger.info(f"Using train sets {data_config.train_sets}")
     assert len(data_config.train_sets) == len(
         data_config.train_sampler.train_sample_weights
@@ -1081,12 +1242,14 @@ def get_datasets(
             "train_ref_pos_augment", True
         )
         dataset_param["limits"] = data_config.get("limits", -1)
+        dataset_param["quarantine"] = quarantine
         train_dataset = BaseSingleDataset(**dataset_param)
         train_datasets.append(train_dataset)
         datapoint_weights.append(
             get_sample_weights(
                 **data_config[train_name]["sampler_configs"],
-                indices_df=train_dataset.indices_list,
+                indices_df=train_dataset.indices_list.to_dataframe(),
+                indices_fpath=train_dataset.indices_fpath,
             )
         )
     train_dataset = WeightedMultiDataset(
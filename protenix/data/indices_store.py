@@ -0,0 +1,443 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from protenix.data.kv_store import get_cache_path
+from protenix.utils.file_io import read_indices_csv
+from protenix.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+STORE_VERSION = 1
+
+
+def _source_fingerprint(csv_path: Path) -> dict:
+    stat = os.stat(csv_path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def _is_canonical_int(values: np.ndarray) -> bool:
+    # True if str(int(x)) == x for all the values, so the int64 column is lossless
+    if len(values) == 0:
+        return False
+    try:
+        ints = values.astype(np.int64)
+    except (ValueError, OverflowError):
+        return False
+    return bool((ints.astype(str) == values).all())
+
+
+def _is_up_to_date(store_dir: Path, csv_path: Path) -> bool:
+    meta_path = store_dir / "meta.json"
+    if not meta_path.exists():
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+    return meta.get("version") == STORE_VERSION and meta.get(
+        "source"
+    ) == _source_fingerprint(csv_path)
+
+
+def _get_store_key(csv_path: Path) -> str:
+    fingerprint = _source_fingerprint(csv_path)
+    return f"v{STORE_VERSION}-{fingerprint['mtime_ns']}-{fingerprint['size']}"
+
+
+def _remove_stale_stores(base_dir: Path, key: str) -> None:
+    # Processes that still map the files of a stale store keep reading them
+    for path in base_dir.iterdir():
+        if path.name != key and not path.name.endswith(".tmp"):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def convert_indices_csv(
+    csv_path: Union[str, Path], store_dir: Optional[Union[str, Path]] = None
+) -> Path:
+    """
+    Convert an indices CSV into a directory of memory-mappable column files:
+        <column>.npy: int64 if all the values are canonical integers, else fixed-width unicode.
+        <column>.isnull.npy: bool mask of the missing values, if any.
+        meta.json: columns, dtypes and the fingerprint of the source CSV.
+    A complete store is never replaced: if another process wrote store_dir in the meantime,
+    its store is kept.
+
+    Args:
+        csv_path (Union[str, Path]): the indices CSV.
+        store_dir (Optional[Union[str, Path]]): output directory.
+            Defaults to "<csv_path>.columns/<version and fingerprint of the CSV>".
+
+    Returns:
+        Path: the store directory.
+    """
+    csv_path = Path(csv_path)
+    store_dir = Path(
+        store_dir or Path(f"{csv_path}.columns") / _get_store_key(csv_path)
+    )
+    if _is_up_to_date(store_dir, csv_path):
+        return store_dir
+    df = read_indices_csv(csv_path)
+
+    tmp_dir = store_dir.with_name(f"{store_dir.name}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    columns = []
+    for i, name in enumerate(df.columns):
+        isnull = df[name].isna().to_numpy()
+        values = df[name].fillna("").to_numpy(dtype=str)
+        if not isnull.any() and _is_canonical_int(values):
+            dtype = "int"
+            values = values.astype(np.int64)
+        else:
+            dtype = "str"
+        np.save(tmp_dir / f"{i}.npy", values)
+        if isnull.any():
+            np.save(tmp_dir / f"{i}.isnull.npy", isnull)
+        columns.append({"name": name, "dtype": dtype, "has_null": bool(isnull.any())})
+    meta = {
+        "version": STORE_VERSION,
+        "num_rows": len(df),
+        "columns": columns,
+        "source": _source_fingerprint(csv_path),
+    }
+    with open(tmp_dir / "meta.json", "w") as f:
+        json.dump(meta, f, indent=1)
+
+    try:
+        # Fails if another process already renamed its complete store to store_dir
+        os.replace(tmp_dir, store_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not _is_up_to_date(store_dir, csv_path):
+            raise
+    return store_dir
+
+
+class IndicesStore(object):
+    """
+    Columnar, memory-mapped view of an indices CSV.
+
+    Columns are loaded with np.load(mmap_mode="r"): DataLoader workers share the pages
+    of the store instead of each holding a copy of a DataFrame of Python strings.
+    Pickling only carries the directory, and the worker maps the same files again.
+    """
+
+    def __init__(self, store_dir: Union[str, Path]) -> None:
+        self.store_dir = Path(store_dir)
+        self._load()
+
+    def _load(self) -> None:
+        with open(self.store_dir / "meta.json") as f:
+            self.meta = json.load(f)
+        self.num_rows = self.meta["num_rows"]
+        self.columns = [c["name"] for c in self.meta["columns"]]
+        self._column_info = {}
+        self._columns = {}
+        self._isnull = {}
+        for i, c in enumerate(self.meta["columns"]):
+            name = c["name"]
+            self._column_info[name] = (i, c["dtype"], c["has_null"])
+            self._columns[name] = np.load(self.store_dir / f"{i}.npy", mmap_mode="r")
+            if c["has_null"]:
+                self._isnull[name] = np.load(
+                    self.store_dir / f"{i}.isnull.npy", mmap_mode="r"
+                )
+
+    def __getstate__(self) -> dict:
+        return {"store_dir": self.store_dir}
+
+    def __setstate__(self, state: dict) -> None:
+        self.store_dir = state["store_dir"]
+        self._load()
+
+    @classmethod
+    def from_csv(cls, csv_path: Union[str, Path]) -> "IndicesStore":
+        """
+        Open the store of an indices CSV in "<csv_path>.columns", building it if it is missing
+        or out of date. Falls back to get_cache_path(csv_path, "columns") if the CSV directory is
+        read-only, where the store is reused by the other processes and runs.
+
+        Args:
+            csv_path (Union[str, Path]): the indices CSV.
+
+        Returns:
+            IndicesStore: the store.
+        """
+        csv_path = Path(csv_path)
+        key = _get_store_key(csv_path)
+        base_dir = Path(f"{csv_path}.columns")
+        cache_dir = get_cache_path(csv_path, "columns")
+        for path in [base_dir, cache_dir]:
+            if _is_up_to_date(path / key, csv_path):
+                return cls(path / key)
+        store_dir = base_dir / key
+        logger.info(f"Converting {csv_path} to columnar store {store_dir}")
+        try:
+            store = cls(convert_indices_csv(csv_path, store_dir))
+            _remove_stale_stores(base_dir, key)
+            return store
+        except OSError as e:
+            logger.warning(f"Can not write {store_dir} ({e}), use {cache_dir}")
+            store = cls(convert_indices_csv(csv_path, cache_dir / key))
+            _remove_stale_stores(cache_dir, key)
+            return store
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Args:
+            name (str): column name.
+
+        Returns:
+            np.ndarray: memory-mapped values, int64 or fixed-width unicode ("" for missing values).
+                [num_rows]
+        """
+        return self._columns[name]
+
+    def isnull(self, name: str) -> np.ndarray:
+        """
+        Args:
+            name (str): column name.
+
+        Returns:
+            np.ndarray: mask of the missing values.
+                [num_rows]
+        """
+        if name not in self._isnull:
+            return np.zeros(self.num_rows, dtype=bool)
+        return self._isnull[name]
+
+    def isin(self, names: Union[str, Sequence[str]], values) -> np.ndarray:
+        """
+        Vectorized membership test of one or several columns. Missing values never match.
+
+        Args:
+            names (Union[str, Sequence[str]]): a column name, or several column names.
+            values: the values, or tuples of values if several columns are given.
+
+        Returns:
+            np.ndarray: bool mask.
+                [num_rows]
+        """
+        if isinstance(names, str):
+            column = self.column(names)
+            if self._column_info[names][1] == "int":
+                # compare as strings, as in the CSV
+                values = {str(v) for v in values}
+                column = column.astype(str)
+            mask = np.isin(column, np.array(sorted(values), dtype=str))
+            return mask & ~self.isnull(names)
+
+        keys = pd.MultiIndex.from_arrays(
+            [self.column(name).astype(str) for name in names]
+        )
+        mask = keys.isin([tuple(str(v) for v in value) for value in values])
+        for name in names:
+            mask &= ~self.isnull(name)
+        return mask
+
+    def to_dataframe(
+        self,
+        rows: Optional[np.ndarray] = None,
+        columns: Optional[Sequence[str]] = None,
+    ) -> pd.DataFrame:
+        """
+        Materialize rows as a DataFrame equal to read_indices_csv (str values, NaN for missing values).
+
+        Args:
+            rows (Optional[np.ndarray]): row positions. Defaults to None (all the rows).
+            columns (Optional[Sequence[str]]): columns to load. Defaults to None (all the columns).
+
+        Returns:
+            pd.DataFrame: the rows, indexed by their row positions.
+        """
+        columns = self.columns if columns is None else list(columns)
+        data = {}
+        for name in columns:
+            values = self.column(name)
+            values = values[rows] if rows is not None else values[:]
+            values = values.astype(str).astype(object)
+            if self._column_info[name][2]:
+                isnull = self.isnull(name)
+                isnull = isnull[rows] if rows is not None else isnull[:]
+                values[isnull] = np.nan
+            data[name] = values
+        index = rows if rows is not None else None
+        return pd.DataFrame(data, index=index, columns=columns)
+
+
+class IndicesView(object):
+    """
+    Rows of an IndicesStore, selected and ordered by their row positions.
+
+    Only the row positions are held in memory: a dataset keeps a view instead of a DataFrame,
+    and loads the row of a sample when it is requested.
+    """
+
+    def __init__(self, store: IndicesStore, rows: Optional[np.ndarray] = None) -> None:
+        self.store = store
+        if rows is None:
+            rows = np.arange(len(store))
+        self.rows = np.asarray(rows, dtype=np.int64)
+
+    @property
+    def columns(self) -> List[str]:
+        return self.store.columns
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, idx: Union[slice, np.ndarray]) -> "IndicesView":
+        return self.select(np.arange(len(self))[idx])
+
+    def select(self, positions: np.ndarray) -> "IndicesView":
+        """
+        Args:
+            positions (np.ndarray): the positions in this view to keep, in the new order.
+
+        Returns:
+            IndicesView: the selected rows, sharing the same store.
+        """
+        return IndicesView(self.store, self.rows[positions])
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Args:
+            name (str): column name.
+
+        Returns:
+            np.ndarray: the values of the rows, int64 or fixed-width unicode.
+                [len(self)]
+        """
+        return self.store.column(name)[self.rows]
+
+    def isnull(self, name: str) -> np.ndarray:
+        return self.store.isnull(name)[self.rows]
+
+    def isin(self, names: Union[str, Sequence[str]], values) -> np.ndarray:
+        """Same as IndicesStore.isin, for the rows of the view."""
+        return self.store.isin(names, values)[self.rows]
+
+    def row(self, idx: int) -> pd.Series:
+        """
+        Args:
+            idx (int): position in the view.
+
+        Returns:
+            pd.Series: the row, with the values of read_indices_csv.
+        """
+        return self.to_dataframe(np.array([idx])).iloc[0]
+
+    def to_dataframe(
+        self,
+        positions: Optional[np.ndarray] = None,
+        columns: Optional[Sequence[str]] = None,
+    ) -> pd.DataFrame:
+        """
+        Args:
+            positions (Optional[np.ndarray]): positions in the view. Defaults to None (all the rows).
+            columns (Optional[Sequence[str]]): columns to load. Defaults to None (all the columns).
+
+        Returns:
+            pd.DataFrame: the rows as in IndicesStore.to_dataframe.
+        """
+        rows = self.rows if positions is None else self.rows[positions]
+        return self.store.to_dataframe(rows, columns)
+
+
+class PDBGroupedIndices(object):
+    """
+    Indices grouped by pdb_id, stored as a view sorted by pdb_id plus the [start, end) row
+    offsets of each group, instead of one DataFrame per PDB.
+    Indexing with an int returns the DataFrame of the group, as the list of DataFrames did.
+    """
+
+    def __init__(
+        self, indices: IndicesView, starts: np.ndarray, ends: np.ndarray
+    ) -> None:
+        self.indices = indices
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+
+    @classmethod
+    def from_indices(cls, indices: IndicesView) -> "PDBGroupedIndices":
+        """
+        Group rows by pdb_id, same order as df.groupby("pdb_id", sort=True).
+
+        Args:
+            indices (IndicesView): the indices.
+
+        Returns:
+            PDBGroupedIndices: the grouped indices.
+        """
+        indices = indices.select(np.nonzero(~indices.isnull("pdb_id"))[0])
+        pdb_id = indices.column("pdb_id").astype(str)
+        order = np.argsort(pdb_id, kind="stable")
+        indices = indices.select(order)
+        _, starts = np.unique(pdb_id[order], return_index=True)
+        ends = np.append(starts[1:], len(indices))
+        return cls(indices, starts, ends)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return self.select(np.arange(len(self))[idx])
+        return self.indices.to_dataframe(
+            np.arange(self.starts[idx], self.ends[idx])
+        ).reset_index()
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def select(self, group_ids: np.ndarray) -> "PDBGroupedIndices":
+        """
+        Args:
+            group_ids (np.ndarray): the groups to keep, in the new order.
+
+        Returns:
+            PDBGroupedIndices: the selected groups, sharing the same view.
+        """
+        return PDBGroupedIndices(
+            self.indices, self.starts[group_ids], self.ends[group_ids]
+        )
+
+    def first_rows(self) -> IndicesView:
+        """
+        Returns:
+            IndicesView: the first row of each group.
+        """
+        return self.indices.select(self.starts)
+
+    def any_row(self, mask: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            mask (np.ndarray): a bool mask over the rows of the view.
+
+        Returns:
+            np.ndarray: whether each group has a row in the mask.
+        """
+        cumsum = np.concatenate([[0], np.cumsum(mask)])
+        return (cumsum[self.ends] - cumsum[self.starts]) > 0
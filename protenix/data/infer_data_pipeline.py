@@ -17,7 +17,7 @@ import logging
 import time
 import traceback
 import warnings
-from typing import Any, Mapping
+from typing import Any, Mapping, Optional
 
 import torch
 from biotite.structure import AtomArray
@@ -69,16 +69,27 @@ def get_inference_dataloader(configs: Any) -> DataLoader:
 class InferenceDataset(Dataset):
     def __init__(
         self,
-        input_json_path: str,
+        input_json_path: Optional[str],
         dump_dir: str,
         use_msa: bool = True,
+        inputs: Optional[list[dict[str, Any]]] = None,
     ) -> None:
-
+        """
+        Args:
+            input_json_path (Optional[str]): path to the input json. Can be None if `inputs` is given.
+            dump_dir (str): output directory.
+            use_msa (bool): whether to build msa features. Defaults to True.
+            inputs (Optional[list[dict[str, Any]]]): already parsed input samples, used
+                instead of reading `input_json_path`. Defaults to None.
+        """
         self.input_json_path = input_json_path
         self.dump_dir = dump_dir
         self.use_msa = use_msa
-        with open(self.input_json_path, "r") as f:
-            self.inputs = json.load(f)
+        if inputs is not None:
+            self.inputs = inputs
+        else:
+            with open(self.input_json_path, "r") as f:
+                self.inputs = json.load(f)
 
     def process_one(
         self,
@@ -14,18 +14,33 @@
 
 
 import argparse
-import copy
+import concurrent.futures
+import hashlib
 import json
+import multiprocessing
 import os
+import tempfile
+import traceback
 from collections import defaultdict
+from typing import Iterable, Optional
 
 import numpy as np
 from biotite.structure import AtomArray, get_chain_starts, get_residue_starts
 
+from protenix.data import ccd
 from protenix.data.constants import STD_RESIDUES
 from protenix.data.filter import Filter
 from protenix.data.parser import AddAtomArrayAnnot, MMCIFParser
-from protenix.data.utils import get_lig_lig_bonds, get_ligand_polymer_bond_mask
+from protenix.data.utils import (
+    get_lig_lig_bonds,
+    get_ligand_polymer_bond_mask,
+    pdb_to_cif,
+)
+from protenix.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+STRUCTURE_SUFFIXES = (".cif", ".pdb")
 
 
 def merge_covalent_bonds(
@@ -62,7 +77,8 @@ def merge_covalent_bonds(
         counts1 = bonds_entity_counts[k][0]
         counts2 = bonds_entity_counts[k][1]
         if counts1 == counts2 == len(v):
-            bond_dict_copy = copy.deepcopy(v[0])
+            # The values are str and int, a shallow copy is enough
+            bond_dict_copy = dict(v[0])
             del bond_dict_copy["copy1"]
             del bond_dict_copy["copy2"]
             merged_covalent_bonds.append(bond_dict_copy)
@@ -297,6 +313,234 @@ def cif_to_input_json(
     return json_dict
 
 
+def collect_structure_files(input_path: str) -> list[str]:
+    """
+    List the structure files to convert.
+
+    Args:
+        input_path (str): a .cif/.pdb file, a directory searched recursively, or a manifest
+            text file listing one structure file path per line (relative to the manifest).
+
+    Returns:
+        list[str]: the sorted .cif/.pdb file paths.
+    """
+    if not os.path.exists(input_path):
+        raise RuntimeError(f"input file {input_path} not exists.")
+    if os.path.isdir(input_path):
+        input_files = [
+            os.path.join(root, name)
+            for root, _, names in os.walk(input_path)
+            for name in names
+        ]
+    elif input_path.endswith(STRUCTURE_SUFFIXES):
+        input_files = [input_path]
+    elif os.path.isfile(input_path):
+        manifest_dir = os.path.dirname(input_path)
+        with open(input_path, "r") as f:
+            input_files = [
+                os.path.join(manifest_dir, line.strip())
+                for line in f
+                if line.strip() and not line.startswith("#")
+            ]
+    else:
+        raise RuntimeError(f"can not read a special file: {input_path}")
+    return sorted(f for f in input_files if f.endswith(STRUCTURE_SUFFIXES))
+
+
+def get_output_json_path(
+    input_file: str,
+    out_dir: str,
+    assembly_id: str = None,
+    altloc: str = "first",
+) -> str:
+    """
+    Deterministic output path of a structure file, so that reruns find the previous outputs.
+    The hash of the absolute input path and of the conversion options tells apart the files
+    with the same name, and the outputs of the same file converted with other options.
+
+    Args:
+        input_file (str): the .cif/.pdb file path.
+        out_dir (str): the output directory.
+        assembly_id (str, optional): Assembly ID. Defaults to None.
+        altloc (str, optional): Altloc selection. Defaults to "first".
+
+    Returns:
+        str: the output json file path.
+    """
+    stem, _ = os.path.splitext(os.path.basename(input_file))
+    key = json.dumps([os.path.abspath(input_file), assembly_id, altloc])
+    path_hash = hashlib.md5(key.encode("utf-8")).hexdigest()
+    return os.path.join(out_dir, f"{stem[:20]}-{path_hash[:12]}.json")
+
+
+def is_up_to_date(input_file: str, output_json: str) -> bool:
+    """Whether output_json exists and is not older than input_file."""
+    return (
+        os.path.exists(output_json)
+        and os.path.getmtime(output_json) >= os.path.getmtime(input_file)
+    )
+
+
+def structure_to_input_json(
+    input_file: str,
+    output_json: str,
+    assembly_id: str = None,
+    altloc: str = "first",
+) -> Optional[str]:
+    """
+    Convert a .cif or .pdb file to a Protenix input json file. The json file is written
+    atomically, so that an interrupted conversion never leaves a truncated output.
+
+    Args:
+        input_file (str): the .cif/.pdb file path.
+        output_json (str): the output json file path.
+        assembly_id (str, optional): Assembly ID. Defaults to None.
+        altloc (str, optional): Altloc selection. Defaults to "first".
+
+    Returns:
+        Optional[str]: the formatted traceback if the conversion failed, else None.
+    """
+    tmp_json = f"{output_json}.{os.getpid()}.tmp"
+    try:
+        if input_file.endswith(".pdb"):
+            stem, _ = os.path.splitext(os.path.basename(input_file))
+            with tempfile.NamedTemporaryFile(suffix=".cif") as tmp:
+                pdb_to_cif(input_file, tmp.name)
+                cif_to_input_json(
+                    tmp.name,
+                    assembly_id=assembly_id,
+                    altloc=altloc,
+                    sample_name=stem[:20],
+                    output_json=tmp_json,
+                )
+        else:
+            cif_to_input_json(
+                input_file,
+                assembly_id=assembly_id,
+                altloc=altloc,
+                output_json=tmp_json,
+            )
+        os.replace(tmp_json, output_json)
+    except Exception:  # pylint: disable=broad-except
+        if os.path.exists(tmp_json):
+            os.remove(tmp_json)
+        return traceback.format_exc()
+    return None
+
+
+def _preload_ccd() -> None:
+    # Parse the CCD once in the parent, the forked workers share its pages copy-on-write
+    # instead of each reading the components file again.
+    if os.path.exists(ccd.COMPONENTS_FILE):
+        ccd.biotite_load_ccd_cif()
+
+
+def bulk_cif_to_input_json(
+    input_files: Iterable[str],
+    out_dir: str,
+    assembly_id: str = None,
+    altloc: str = "first",
+    num_workers: int = 1,
+    overwrite: bool = False,
+) -> dict[str, list]:
+    """
+    Convert many .cif/.pdb files to Protenix input json files with a process pool.
+
+    Each input is written to get_output_json_path(input_file, out_dir, assembly_id, altloc)
+    as soon as it is converted. Inputs whose output is already up to date are skipped
+    unless overwrite is set, so an interrupted run can be resumed. A failed input does not
+    stop the others: its traceback is recorded, and one line per processed input is
+    appended to "<out_dir>/tojson_log.jsonl".
+
+    Args:
+        input_files (Iterable[str]): the .cif/.pdb file paths.
+        out_dir (str): the output directory.
+        assembly_id (str, optional): Assembly ID. Defaults to None.
+        altloc (str, optional): Altloc selection. Defaults to "first".
+        num_workers (int, optional): number of worker processes, 1 converts in this
+            process. Defaults to 1.
+        overwrite (bool, optional): convert the inputs even if their output is up to date.
+            Defaults to False.
+
+    Returns:
+        dict[str, list]: the output paths under "converted" and "skipped", and the
+            (input path, traceback) pairs under "failed".
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    results = {"converted": [], "skipped": [], "failed": []}
+    todo = []
+    for input_file in input_files:
+        output_json = get_output_json_path(input_file, out_dir, assembly_id, altloc)
+        if not overwrite and is_up_to_date(input_file, output_json):
+            results["skipped"].append(output_json)
+        else:
+            todo.append((input_file, output_json))
+    logger.info(
+        f"tojson: {len(todo)} files to convert, {len(results['skipped'])} up to date"
+    )
+
+    log_path = os.path.join(out_dir, "tojson_log.jsonl")
+    with open(log_path, "a") as log_f:
+
+        def record(input_file: str, output_json: str, error: Optional[str]):
+            if error is None:
+                results["converted"].append(output_json)
+            else:
+                results["failed"].append((input_file, error))
+                logger.warning(f"tojson failed for {input_file}:\n{error}")
+            log_f.write(
+                json.dumps(
+                    {
+                        "input": input_file,
+                        "output": output_json if error is None else None,
+                        "error": error,
+                    }
+                )
+                + "\n"
+            )
+            log_f.flush()
+
+        if num_workers <= 1 or len(todo) <= 1:
+            for input_file, output_json in todo:
+                error = structure_to_input_json(
+                    input_file, output_json, assembly_id, altloc
+                )
+                record(input_file, output_json, error)
+        else:
+            if "fork" in multiprocessing.get_all_start_methods():
+                mp_context = multiprocessing.get_context("fork")
+                _preload_ccd()
+            else:
+                mp_context = None
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(num_workers, len(todo)), mp_context=mp_context
+            ) as executor:
+                futures = {
+                    executor.submit(
+                        structure_to_input_json,
+                        input_file,
+                        output_json,
+                        assembly_id,
+                        altloc,
+                    ): (input_file, output_json)
+                    for input_file, output_json in todo
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    input_file, output_json = futures[future]
+                    try:
+                        error = future.result()
+                    except Exception:  # pylint: disable=broad-except
+                        # The worker died, e.g. killed by the OOM killer
+                        error = traceback.format_exc()
+                    record(input_file, output_json, error)
+
+    logger.info(
+        f"tojson: {len(results['converted'])} converted, {len(results['skipped'])} "
+        f"skipped, {len(results['failed'])} failed, see {log_path}"
+    )
+    return results
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -0,0 +1,265 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, Union
+
+import numpy as np
+
+from protenix.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+TABLE_VERSION = 1
+
+
+def get_cache_path(source_path: Union[str, Path], suffix: str) -> Path:
+    """
+    Deterministic cache location of the files derived from source_path, for when they can
+    not be written next to it. The cache directory is $PROTENIX_CACHE_DIR, else
+    $XDG_CACHE_HOME/protenix (~/.cache/protenix by default), and the hash of the absolute
+    source path tells apart the sources with the same name.
+
+    Args:
+        source_path (Union[str, Path]): the source file.
+        suffix (str): suffix of the derived files.
+
+    Returns:
+        Path: "<cache_dir>/<source name>-<path hash>.<suffix>"
+    """
+    cache_dir = os.environ.get("PROTENIX_CACHE_DIR")
+    if not cache_dir:
+        xdg_cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+        cache_dir = Path(xdg_cache_home) / "protenix"
+    source_path = Path(source_path).resolve()
+    path_hash = hashlib.md5(str(source_path).encode("utf-8")).hexdigest()
+    return Path(cache_dir) / f"{source_path.name}-{path_hash[:12]}.{suffix}"
+
+
+def _fingerprint(source_path: Path) -> dict:
+    stat = os.stat(source_path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def _is_up_to_date(table_dir: Path, source_path: Path) -> bool:
+    meta_path = table_dir / "meta.json"
+    if not meta_path.exists():
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+    return meta.get("version") == TABLE_VERSION and meta.get(
+        "source"
+    ) == _fingerprint(source_path)
+
+
+def _pack(blobs: list[bytes]) -> tuple[np.ndarray, np.ndarray]:
+    offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in blobs], out=offsets[1:])
+    data = np.frombuffer(b"".join(blobs), dtype=np.uint8)
+    return data, offsets
+
+
+def write_string_table(
+    items: Iterable[tuple[str, Any]],
+    table_dir: Union[str, Path],
+    source_path: Union[str, Path] = None,
+) -> Path:
+    """
+    Write a key -> value mapping as a sorted string table:
+        keys.npy / key_offsets.npy: the UTF-8 keys in sorted order, concatenated.
+        values.npy / value_offsets.npy: the JSON-encoded values, in the order of the keys.
+        meta.json: number of keys and the fingerprint of the source file.
+    Duplicated keys keep the last value, like a dict.
+
+    Args:
+        items (Iterable[tuple[str, Any]]): (key, JSON serializable value) pairs.
+        table_dir (Union[str, Path]): output directory.
+        source_path (Union[str, Path]): the file the items come from, to detect stale tables.
+
+    Returns:
+        Path: the table directory.
+    """
+    table_dir = Path(table_dir)
+    mapping = {str(k).encode("utf-8"): v for k, v in items}
+    keys = sorted(mapping)
+    key_data, key_offsets = _pack(keys)
+    value_data, value_offsets = _pack(
+        [json.dumps(mapping[k], separators=(",", ":")).encode("utf-8") for k in keys]
+    )
+
+    tmp_dir = table_dir.with_name(f"{table_dir.name}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    np.save(tmp_dir / "keys.npy", key_data)
+    np.save(tmp_dir / "key_offsets.npy", key_offsets)
+    np.save(tmp_dir / "values.npy", value_data)
+    np.save(tmp_dir / "value_offsets.npy", value_offsets)
+    meta = {
+        "version": TABLE_VERSION,
+        "num_keys": len(keys),
+        "source": _fingerprint(Path(source_path)) if source_path else None,
+    }
+    with open(tmp_dir / "meta.json", "w") as f:
+        json.dump(meta, f, indent=1)
+
+    # Another process may have written the same table in the meantime
+    if source_path and _is_up_to_date(table_dir, Path(source_path)):
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return table_dir
+    shutil.rmtree(table_dir, ignore_errors=True)
+    try:
+        os.replace(tmp_dir, table_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not table_dir.exists():
+            raise
+    return table_dir
+
+
+class _SortedKeys(object):
+    # Sequence view of the keys for bisect, decoding only the probed keys
+    def __init__(self, data: np.ndarray, offsets: np.ndarray) -> None:
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> bytes:
+        return self.data[self.offsets[i] : self.offsets[i + 1]].tobytes()
+
+
+class StringTable(object):
+    """
+    Read-only, memory-mapped str -> JSON value mapping with a dict-like interface.
+
+    Lookups are a binary search over the sorted keys, so the table is never loaded into
+    Python objects: the DataLoader workers share the page cache of the files instead of
+    each holding its own copy of a large dict. Pickling only carries the directory, and
+    the worker maps the same files again.
+    """
+
+    def __init__(self, table_dir: Union[str, Path]) -> None:
+        self.table_dir = Path(table_dir)
+        self._load()
+
+    def _load(self) -> None:
+        with open(self.table_dir / "meta.json") as f:
+            self.meta = json.load(f)
+        self.num_keys = self.meta["num_keys"]
+        # Empty arrays can not be memory-mapped
+        mmap_mode = "r" if self.num_keys > 0 else None
+        self._keys = _SortedKeys(
+            np.load(self.table_dir / "keys.npy", mmap_mode=mmap_mode),
+            np.load(self.table_dir / "key_offsets.npy", mmap_mode=mmap_mode),
+        )
+        self._values = np.load(self.table_dir / "values.npy", mmap_mode=mmap_mode)
+        self._value_offsets = np.load(
+            self.table_dir / "value_offsets.npy", mmap_mode=mmap_mode
+        )
+
+    def __getstate__(self) -> dict:
+        return {"table_dir": self.table_dir}
+
+    def __setstate__(self, state: dict) -> None:
+        self.table_dir = state["table_dir"]
+        self._load()
+
+    @classmethod
+    def from_source(
+        cls,
+        source_path: Union[str, Path],
+        load_items: Callable[[Path], Iterable[tuple[str, Any]]],
+        suffix: str = "kv",
+    ) -> "StringTable":
+        """
+        Open the table "<source_path>.<suffix>", (re)building it from the source file if it is
+        missing or out of date. Falls back to get_cache_path(source_path, suffix) if the source
+        directory is read-only, where the table is reused by the other processes and runs.
+
+        Args:
+            source_path (Union[str, Path]): the source file of the mapping.
+            load_items (Callable[[Path], Iterable[tuple[str, Any]]]): parses the source file
+                into (key, value) pairs, only called when the table is (re)built.
+            suffix (str): suffix of the table directory, to keep several tables per source.
+
+        Returns:
+            StringTable: the table.
+        """
+        source_path = Path(source_path)
+        table_dir = Path(f"{source_path}.{suffix}")
+        cache_dir = get_cache_path(source_path, suffix)
+        for path in [table_dir, cache_dir]:
+            if _is_up_to_date(path, source_path):
+                return cls(path)
+        logger.info(f"Converting {source_path} to string table {table_dir}")
+        try:
+            return cls(
+                write_string_table(load_items(source_path), table_dir, source_path)
+            )
+        except OSError as e:
+            logger.warning(f"Can not write {table_dir} ({e}), use {cache_dir}")
+            cache_dir.parent.mkdir(parents=True, exist_ok=True)
+            # Parse the source again: load_items may return a consumed generator
+            return cls(
+                write_string_table(load_items(source_path), cache_dir, source_path)
+            )
+
+    def _find(self, key: str) -> int:
+        key = key.encode("utf-8")
+        i = bisect.bisect_left(self._keys, key)
+        if i < self.num_keys and self._keys[i] == key:
+            return i
+        return -1
+
+    def __len__(self) -> int:
+        return self.num_keys
+
+    def __contains__(self, key: str) -> bool:
+        return isinstance(key, str) and self._find(key) >= 0
+
+    def __getitem__(self, key: str) -> Any:
+        i = self._find(key) if isinstance(key, str) else -1
+        if i < 0:
+            raise KeyError(key)
+        start, end = self._value_offsets[i], self._value_offsets[i + 1]
+        return json.loads(self._values[start:end].tobytes())
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self) -> Iterator[str]:
+        for i in range(self.num_keys):
+            yield self._keys[i].decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        return self.keys()
+
+    def items(self) -> Iterator[tuple[str, Any]]:
+        for key in self.keys():
+            yield key, self[key]
+
+
+def load_json_items(json_path: Path) -> Iterable[tuple[str, Any]]:
+    """(key, value) pairs of a JSON file holding a single object"""
+    with open(json_path, "r") as f:
+        return json.load(f).items()
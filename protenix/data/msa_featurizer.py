@@ -12,7 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
 import os
 import shutil
 from abc import ABC, abstractmethod
@@ -27,6 +26,7 @@ import torch
 from biotite.structure import AtomArray
 
 from protenix.data.constants import STD_RESIDUES, rna_order_with_x
+from protenix.data.kv_store import StringTable, load_json_items
 from protenix.data.msa_utils import (
     PROT_TYPE_NAME,
     FeatureDict,
@@ -319,12 +319,15 @@ class PROTMSAFeaturizer(BaseMSAFeaturizer):
         else:
             self.non_pairing_db = [db_name for db_name in non_pairing_db.split(",")]
 
-        with open(seq_to_pdb_idx_path, "r") as f:
-            self.seq_to_pdb_idx = json.load(f)
+        # Memory-mapped, shared by the DataLoader workers instead of copied into each
+        self.seq_to_pdb_idx = StringTable.from_source(
+            seq_to_pdb_idx_path, load_items=load_json_items
+        )
         # If distillation data is avaiable
         if distillation_index_file is not None:
-            with open(distillation_index_file, "r") as f:
-                self.distillation_pdb_id_to_msa_dir = json.load(f)
+            self.distillation_pdb_id_to_msa_dir = StringTable.from_source(
+                distillation_index_file, load_items=load_json_items
+            )
         else:
             self.distillation_pdb_id_to_msa_dir = None
 
@@ -520,8 +523,10 @@ class RNAMSAFeaturizer(BaseMSAFeaturizer):
         # By default, use all the database in paper
         self.rna_msa_dir = rna_msa_dir
         self.non_pairing_db = ["rfam", "rnacentral", "nucleotide"]
-        with open(seq_to_pdb_idx_path, "r") as f:
-            self.seq_to_pdb_idx = json.load(f)  # it's rna sequence to pdb list
+        # it's rna sequence to pdb list
+        self.seq_to_pdb_idx = StringTable.from_source(
+            seq_to_pdb_idx_path, load_items=load_json_items
+        )
 
     def get_msa_path(
         self, db_name: str, sequence: str, pdb_id_entity_id: str, reduced: bool = True
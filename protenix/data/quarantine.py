@@ -0,0 +1,198 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Optional, Sequence, Union
+
+import torch
+
+from protenix.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+QUARANTINE_FILENAME = "quarantine.jsonl"
+
+
+class QuarantineRegistry(object):
+    """
+    Registry of the training samples that failed to load.
+
+    Failures are appended as json lines to "<error_dir>/quarantine.jsonl". Each record is written
+    with a single O_APPEND write, so the dataloader workers of all the ranks can share the file.
+    Registries of previous runs can be loaded read-only with `extra_fpaths`.
+    """
+
+    def __init__(
+        self,
+        error_dir: Union[str, Path],
+        min_failures: int = 2,
+        extra_fpaths: Sequence[Union[str, Path]] = (),
+        refresh_interval: float = 30.0,
+    ) -> None:
+        """
+        Args:
+            error_dir (Union[str, Path]): the error directory of the run.
+            min_failures (int): number of failures after which a sample is quarantined, so that
+                a single transient error (e.g. an I/O timeout) does not exclude it. Defaults to 2.
+            extra_fpaths (Sequence[Union[str, Path]]): registries of previous runs. Defaults to ().
+            refresh_interval (float): min seconds between two reads of the registries
+                in `is_quarantined`. Defaults to 30.0.
+        """
+        self.fpath = os.path.join(error_dir, QUARANTINE_FILENAME)
+        self.min_failures = min_failures
+        self.refresh_interval = refresh_interval
+        self.fpaths = [self.fpath] + [
+            str(p) for p in extra_fpaths if str(p) != self.fpath
+        ]
+        self._offsets = {fpath: 0 for fpath in self.fpaths}
+        # {dataset_name: {sample_key: Counter({error_type: count})}}
+        self._failures = {}
+        self._last_refresh = -float("inf")
+        for fpath in self.fpaths[1:]:
+            if not os.path.exists(fpath):
+                logger.warning(f"Quarantine registry {fpath} does not exist")
+        self.refresh()
+
+    def record(
+        self,
+        dataset_name: str,
+        sample_key: str,
+        error_type: str,
+        idx: Optional[int] = None,
+    ) -> None:
+        """
+        Record a failure of a sample.
+
+        Args:
+            dataset_name (str): the dataset name.
+            sample_key (str): the sample key, see BaseSingleDataset.get_sample_key.
+            error_type (str): the exception class name.
+            idx (Optional[int]): the index of the sample in the dataset. Defaults to None.
+        """
+        line = json.dumps(
+            {
+                "dataset": dataset_name,
+                "sample": sample_key,
+                "error_type": error_type,
+                "idx": idx,
+                "time": time.time(),
+            }
+        )
+        try:
+            fd = os.open(self.fpath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, (line + "\n").encode())
+            finally:
+                os.close(fd)
+            # Also picks up the records of the other processes
+            self.refresh()
+        except OSError as e:
+            logger.warning(f"Can not write quarantine registry {self.fpath}: {e}")
+            # Still quarantine it in this process
+            self._add(dataset_name, sample_key, error_type)
+
+    def _add(self, dataset_name: str, sample_key: str, error_type: str) -> None:
+        samples = self._failures.setdefault(dataset_name, {})
+        samples.setdefault(sample_key, Counter())[error_type] += 1
+
+    def refresh(self) -> None:
+        """
+        Read the records appended to the registries since the last call.
+        """
+        for fpath in self.fpaths:
+            if not os.path.exists(fpath):
+                continue
+            with open(fpath, "rb") as f:
+                f.seek(self._offsets[fpath])
+                data = f.read()
+            # Only consume complete lines, a record may be half written
+            end = data.rfind(b"\n") + 1
+            self._offsets[fpath] += end
+            for line in data[:end].splitlines():
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self._add(record["dataset"], record["sample"], record["error_type"])
+        self._last_refresh = time.monotonic()
+
+    def failures(self, dataset_name: str) -> dict[str, Counter]:
+        """
+        Args:
+            dataset_name (str): the dataset name.
+
+        Returns:
+            dict[str, Counter]: the failures count of each error type, by sample key.
+        """
+        return self._failures.get(dataset_name, {})
+
+    def quarantined_keys(self, dataset_name: str) -> set[str]:
+        """
+        Args:
+            dataset_name (str): the dataset name.
+
+        Returns:
+            set[str]: the keys of the quarantined samples.
+        """
+        return {
+            key
+            for key, counter in self.failures(dataset_name).items()
+            if sum(counter.values()) >= self.min_failures
+        }
+
+    def is_quarantined(self, dataset_name: str, sample_key: str) -> bool:
+        """
+        Whether a sample is quarantined. The registries are re-read at most every refresh_interval.
+
+        Args:
+            dataset_name (str): the dataset name.
+            sample_key (str): the sample key.
+
+        Returns:
+            bool: whether the sample is quarantined.
+        """
+        if time.monotonic() - self._last_refresh > self.refresh_interval:
+            self.refresh()
+        counter = self.failures(dataset_name).get(sample_key)
+        return counter is not None and sum(counter.values()) >= self.min_failures
+
+
+def apply_quarantine(
+    weights: torch.Tensor, quarantined_indices: Sequence[int], factor: float
+) -> torch.Tensor:
+    """
+    Scale the sampling weights of the quarantined samples.
+
+    Args:
+        weights (torch.Tensor): the sampling weights.
+            [N_sample]
+        quarantined_indices (Sequence[int]): indices of the quarantined samples.
+        factor (float): weight multiplier of the quarantined samples, 0 to skip them.
+
+    Returns:
+        torch.Tensor: the new sampling weights, or `weights` if there is nothing left to sample.
+            [N_sample]
+    """
+    if len(quarantined_indices) == 0:
+        return weights
+    new_weights = weights.clone()
+    new_weights[torch.as_tensor(quarantined_indices, dtype=torch.long)] *= factor
+    if new_weights.sum() <= 0:
+        logger.warning("All the samples are quarantined, ignore the quarantine")
+        return weights
+    return new_weights
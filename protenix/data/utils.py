@@ -12,22 +12,28 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from __future__ import annotations
+
 import argparse
 import copy
 import functools
 import os
 import re
 from collections import defaultdict
-from typing import Mapping, Sequence
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator, Mapping, Sequence
 
 import biotite.structure as struc
 import numpy as np
-import torch
 from biotite.structure import AtomArray
 from biotite.structure.io import pdbx
 from biotite.structure.io.pdb import PDBFile
 
 from protenix.data.constants import DNA_STD_RESIDUES, PRO_STD_RESIDUES, RNA_STD_RESIDUES
+from protenix.data.kv_store import StringTable
+
+if TYPE_CHECKING:
+    import torch
 
 
 def remove_numbers(s: str) -> str:
@@ -182,20 +188,9 @@ def get_ligand_polymer_bond_mask(
     return lig_polymer_bonds
 
 
-@functools.lru_cache
-def parse_pdb_cluster_file_to_dict(
-    cluster_file: str, remove_uniprot: bool = True
-) -> dict[str, tuple]:
-    """parse PDB cluster file, and return a pandas dataframe
-    example cluster file:
-    https://cdn.rcsb.org/resources/sequence/clusters/clusters-by-entity-40.txt
-
-    Args:
-        cluster_file (str): cluster_file path
-    Returns:
-        dict(str, tuple(str, str)): {pdb_id}_{entity_id} --> [cluster_id, cluster_size]
-    """
-    pdb_cluster_dict = {}
+def _iter_pdb_cluster_file(
+    cluster_file: Path, remove_uniprot: bool = True
+) -> Iterator[tuple[str, tuple]]:
     with open(cluster_file) as f:
         for line in f:
             pdb_clusters = []
@@ -210,8 +205,33 @@ def parse_pdb_cluster_file_to_dict(
             # use first member as cluster id.
             cluster_id = f"pdb_cluster_{pdb_clusters[0]}"
             for ids in pdb_clusters:
-                pdb_cluster_dict[ids.lower()] = (cluster_id, cluster_size)
-    return pdb_cluster_dict
+                yield ids.lower(), (cluster_id, cluster_size)
+
+
+@functools.lru_cache
+def parse_pdb_cluster_file_to_dict(
+    cluster_file: str, remove_uniprot: bool = True
+) -> StringTable:
+    """parse PDB cluster file, and return a read-only dict-like mapping
+    example cluster file:
+    https://cdn.rcsb.org/resources/sequence/clusters/clusters-by-entity-40.txt
+
+    The mapping is a memory-mapped StringTable cached next to the cluster file,
+    so that it is parsed once and shared by all the processes reading it.
+
+    Args:
+        cluster_file (str): cluster_file path
+        remove_uniprot (bool): skip the AF_/MA_ members. Defaults to True.
+    Returns:
+        StringTable: {pdb_id}_{entity_id} --> [cluster_id, cluster_size]
+    """
+    return StringTable.from_source(
+        cluster_file,
+        load_items=functools.partial(
+            _iter_pdb_cluster_file, remove_uniprot=remove_uniprot
+        ),
+        suffix="cluster.kv" if remove_uniprot else "cluster_all.kv",
+    )
 
 
 def get_clean_data(atom_array: AtomArray) -> AtomArray:
@@ -423,6 +443,9 @@ def make_dummy_feature(
     features_dict: Mapping[str, torch.Tensor],
     dummy_feats: Sequence = ["msa"],
 ) -> dict[str, torch.Tensor]:
+    # torch is imported lazily, to keep the json conversion free of it
+    import torch
+
     num_token = features_dict["token_index"].shape[0]
     num_atom = features_dict["atom_to_token_idx"].shape[0]
     num_msa = 1
@@ -474,6 +497,8 @@ def make_dummy_feature(
 def data_type_transform(
     feat_or_label_dict: Mapping[str, torch.Tensor]
 ) -> tuple[dict[str, torch.Tensor], dict[str, torch.Tensor], AtomArray]:
+    import torch
+
     for key, value in feat_or_label_dict.items():
         if key in IntDataList:
             feat_or_label_dict[key] = value.to(torch.long)
@@ -135,6 +135,7 @@ def sample_diffusion(
     diffusion_chunk_size: Optional[int] = None,
     inplace_safe: bool = False,
     attn_chunk_size: Optional[int] = None,
+    local_layout: Optional[Any] = None,
 ) -> torch.Tensor:
     """Implements Algorithm 18 in AF3.
     It performances denoising steps from time 0 to time T.
@@ -159,6 +160,8 @@ def sample_diffusion(
         diffusion_chunk_size (Optional[int]): Chunk size for diffusion operation. Defaults to None.
         inplace_safe (bool): Whether to use inplace operations safely. Defaults to False.
         attn_chunk_size (Optional[int]): Chunk size for attention operation. Defaults to None.
+        local_layout (Optional[Any]): precomputed atom-local attention layout of the complex, shared by
+            all the denoising steps. If None, denoise_net builds it at each step. Defaults to None.
 
     Returns:
         torch.Tensor: the denoised coordinates of x in inference stage
@@ -213,6 +216,7 @@ def sample_diffusion(
                 z_trunk=z_trunk,
                 chunk_size=attn_chunk_size,
                 inplace_safe=inplace_safe,
+                local_layout=local_layout,
             )
 
             delta = (x_noisy - x_denoised) / t_hat[
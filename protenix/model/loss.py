@@ -19,13 +19,13 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from protenix.metrics.rmsd import weighted_rigid_align
 from protenix.model.modules.frames import (
     expressCoordinatesInFrame,
     gather_frame_atom_by_indices,
 )
 from protenix.model.utils import expand_at_dim
 from protenix.openfold_local.utils.checkpointing import get_checkpoint_fn
+from protenix.utils.kabsch import kabsch_align
 from protenix.utils.torch_utils import cdist
 
 
@@ -1083,31 +1083,22 @@ class MSELoss(nn.Module):
         true_coordinate = true_coordinate * coordinate_mask.unsqueeze(dim=-1)
         pred_coordinate = pred_coordinate * coordinate_mask[..., None, :, None]
 
-        # Reshape to add "N_sample" dimension
-        true_coordinate = expand_at_dim(
-            true_coordinate, dim=-3, n=N_sample
+        # Align GT coords to predicted coords, broadcasting GT over the "N_sample" dimension.
+        # Computed in float32 as some ops do not support BFloat16 training.
+        true_coordinate_aligned, _, _ = kabsch_align(
+            src=true_coordinate.unsqueeze(dim=-3).detach(),  # [..., 1, N_atom, 3]
+            tgt=pred_coordinate.detach(),  # [..., N_sample, N_atom, 3]
+            weight=weight.unsqueeze(dim=-2),  # [1, N_atom] or [..., 1, N_atom]
+            # torch.svd as before, until the quaternion solver is validated for training
+            solver="svd",
+            compute_dtype=torch.float32,
         )  # [..., N_sample, N_atom, 3]
+        true_coordinate_aligned = true_coordinate_aligned.to(pred_coordinate.dtype)
         if len(weight.shape) > 1:
             weight = expand_at_dim(
                 weight, dim=-2, n=N_sample
             )  # [..., N_sample, N_atom]
 
-        # Align GT coords to predicted coords
-        d = pred_coordinate.dtype
-        # Some ops in weighted_rigid_align do not support BFloat16 training
-        with torch.cuda.amp.autocast(enabled=False):
-            true_coordinate_aligned = weighted_rigid_align(
-                x=true_coordinate.to(torch.float32),  # [..., N_sample, N_atom, 3]
-                x_target=pred_coordinate.to(
-                    torch.float32
-                ),  # [..., N_sample, N_atom, 3]
-                atom_weight=weight.to(
-                    torch.float32
-                ),  # [N_atom] or [..., N_sample, N_atom]
-                stop_gradient=True,
-            )  # [..., N_sample, N_atom, 3]
-            true_coordinate_aligned = true_coordinate_aligned.to(d)
-
         return (true_coordinate_aligned.detach(), weight.detach())
 
     def forward(
@@ -18,7 +18,11 @@ import torch
 import torch.nn as nn
 
 from protenix.model.modules.embedders import FourierEmbedding, RelativePositionEncoding
-from protenix.model.modules.primitives import LinearNoBias, Transition
+from protenix.model.modules.primitives import (
+    LinearNoBias,
+    LocalAttentionLayout,
+    Transition,
+)
 from protenix.model.modules.transformer import (
     AtomAttentionDecoder,
     AtomAttentionEncoder,
@@ -327,6 +331,25 @@ class DiffusionModule(nn.Module):
         if initialization.get("zero_init_dit_output", False):
             nn.init.zeros_(self.atom_attention_decoder.linear_no_bias_out.weight)
 
+    def prepare_local_layout(
+        self, input_feature_dict: dict[str, Union[torch.Tensor, int, float, dict]]
+    ) -> LocalAttentionLayout:
+        """Precompute the layout of the atom-local attention, which only depends on the complex.
+        It can be built once and passed to all the denoising steps.
+
+        Args:
+            input_feature_dict (dict[str, Union[torch.Tensor, int, float, dict]]): input meta feature dict
+
+        Returns:
+            LocalAttentionLayout: the layout of the atom-local attention.
+        """
+        assert (
+            self.atom_attention_encoder.n_queries
+            == self.atom_attention_decoder.n_queries
+        )
+        assert self.atom_attention_encoder.n_keys == self.atom_attention_decoder.n_keys
+        return self.atom_attention_encoder.prepare_local_layout(input_feature_dict)
+
     def f_forward(
         self,
         r_noisy: torch.Tensor,
@@ -337,6 +360,7 @@ class DiffusionModule(nn.Module):
         z_trunk: torch.Tensor,
         inplace_safe: bool = False,
         chunk_size: Optional[int] = None,
+        local_layout: Optional[LocalAttentionLayout] = None,
     ) -> torch.Tensor:
         """The raw network to be trained.
         As in EDM equation (7), this is F_theta(c_in * x, c_noise(sigma)).
@@ -356,6 +380,8 @@ class DiffusionModule(nn.Module):
                 [..., N_tokens, N_tokens, c_z]
             inplace_safe (bool): Whether it is safe to use inplace operations. Defaults to False.
             chunk_size (Optional[int]): Chunk size for memory-efficient operations. Defaults to None.
+            local_layout (LocalAttentionLayout, optional): precomputed layout of the atom-local attention.
+                Built from input_feature_dict if None. Defaults to None.
 
         Returns:
             torch.Tensor: coordinates update
@@ -363,6 +389,8 @@ class DiffusionModule(nn.Module):
         """
         N_sample = r_noisy.size(-3)
         assert t_hat_noise_level.size(-1) == N_sample
+        if local_layout is None:
+            local_layout = self.prepare_local_layout(input_feature_dict)
 
         blocks_per_ckpt = self.blocks_per_ckpt
         if not torch.is_grad_enabled():
@@ -409,6 +437,7 @@ class DiffusionModule(nn.Module):
                 z_pair,
                 inplace_safe,
                 chunk_size,
+                local_layout,
             )
         else:
             # Sequence-local Atom Attention and aggregation to coarse-grained tokens
@@ -419,6 +448,7 @@ class DiffusionModule(nn.Module):
                 z=z_pair,
                 inplace_safe=inplace_safe,
                 chunk_size=chunk_size,
+                local_layout=local_layout,
             )
         # Full self-attention on token level.
         if inplace_safe:
@@ -451,6 +481,7 @@ class DiffusionModule(nn.Module):
                 p_skip,
                 inplace_safe,
                 chunk_size,
+                local_layout,
             )
         else:
             # Broadcast token activations to atoms and run Sequence-local Atom Attention
@@ -462,6 +493,7 @@ class DiffusionModule(nn.Module):
                 p_skip=p_skip,
                 inplace_safe=inplace_safe,
                 chunk_size=chunk_size,
+                local_layout=local_layout,
             )
 
         return r_update
@@ -476,6 +508,7 @@ class DiffusionModule(nn.Module):
         z_trunk: torch.Tensor,
         inplace_safe: bool = False,
         chunk_size: Optional[int] = None,
+        local_layout: Optional[LocalAttentionLayout] = None,
     ) -> torch.Tensor:
         """One step denoise: x_noisy, noise_level -> x_denoised
 
@@ -493,6 +526,8 @@ class DiffusionModule(nn.Module):
                 [..., N_tokens, N_tokens, c_z]
             inplace_safe (bool): Whether it is safe to use inplace operations. Defaults to False.
             chunk_size (Optional[int]): Chunk size for memory-efficient operations. Defaults to None.
+            local_layout (LocalAttentionLayout, optional): precomputed layout of the atom-local attention,
+                see prepare_local_layout. Defaults to None.
 
         Returns:
             torch.Tensor: the denoised coordinates of x
@@ -519,6 +554,7 @@ class DiffusionModule(nn.Module):
             z_trunk=z_trunk,
             inplace_safe=inplace_safe,
             chunk_size=chunk_size,
+            local_layout=local_layout,
         )
 
         # Rescale updates to positions and combine with input positions
@@ -365,43 +365,91 @@ class MSAPairWeightedAveraging(nn.Module):
             in_features=self.c * self.n_heads, out_features=self.c_m
         )
 
-    def forward(self, m: torch.Tensor, z: torch.Tensor) -> torch.Tensor:
+    def _weighted_average(self, m: torch.Tensor, w: torch.Tensor) -> torch.Tensor:
         """
         Args:
-            m (torch.Tensor): msa embedding
-                [...,n_msa_sampled, n_token, c_m]
-            z (torch.Tensor): pair embedding
-                [...,n_token, n_token, c_z]
+            m (torch.Tensor): msa embedding, all the rows or a chunk of them
+                [...,n_msa_rows, n_token, c_m]
+            w (torch.Tensor): softmax weights of the pair embedding
+                [...,n_token, n_token, n_heads]
         Returns:
-            torch.Tensor: updated msa embedding
-                [...,n_msa_sampled, n_token, c_m]
+            torch.Tensor: update of the msa embedding rows
+                [...,n_msa_rows, n_token, c_m]
         """
         # Input projections
-        m = self.layernorm_m(m)  # [...,n_msa_sampled, n_token, c_m]
-        v = self.linear_no_bias_mv(m)  # [...,n_msa_sampled, n_token, n_heads * c]
+        m = self.layernorm_m(m)  # [...,n_msa_rows, n_token, c_m]
+        v = self.linear_no_bias_mv(m)  # [...,n_msa_rows, n_token, n_heads * c]
         v = v.reshape(
             *v.shape[:-1], self.n_heads, self.c
-        )  # [...,n_msa_sampled, n_token, n_heads, c]
-        b = self.linear_no_bias_z(
-            self.layernorm_z(z)
-        )  # [...,n_token, n_token, n_heads]
+        )  # [...,n_msa_rows, n_token, n_heads, c]
         g = torch.sigmoid(
             self.linear_no_bias_mg(m)
-        )  # [...,n_msa_sampled, n_token, n_heads * c]
+        )  # [...,n_msa_rows, n_token, n_heads * c]
         g = g.reshape(
             *g.shape[:-1], self.n_heads, self.c
-        )  # [...,n_msa_sampled, n_token, n_heads, c]
-        w = self.softmax_w(b)  # [...,n_token, n_token, n_heads]
+        )  # [...,n_msa_rows, n_token, n_heads, c]
         wv = torch.einsum(
             "...ijh,...mjhc->...mihc", w, v
-        )  # [...,n_msa_sampled,n_token,n_heads,c]
+        )  # [...,n_msa_rows,n_token,n_heads,c]
         o = g * wv
         o = o.reshape(
             *o.shape[:-2], self.n_heads * self.c
-        )  # [...,n_msa_sampled, n_token, n_heads * c]
-        m = self.linear_no_bias_out(o)  # [...,n_msa_sampled, n_token, c_m]
+        )  # [...,n_msa_rows, n_token, n_heads * c]
+        m = self.linear_no_bias_out(o)  # [...,n_msa_rows, n_token, c_m]
         return m
 
+    def forward(
+        self,
+        m: torch.Tensor,
+        z: torch.Tensor,
+        inplace_safe: bool = False,
+        chunk_size: Optional[int] = None,
+        _add_with_inplace: bool = False,
+    ) -> torch.Tensor:
+        """
+        The rows of the msa are independent given the pair weights, so with chunk_size
+        they are processed chunk_size rows at a time, and the intermediates of the
+        weighted average never exist for all the rows at once.
+
+        Args:
+            m (torch.Tensor): msa embedding
+                [...,n_msa_sampled, n_token, c_m]
+            z (torch.Tensor): pair embedding
+                [...,n_token, n_token, c_z]
+            inplace_safe (bool): Whether it is safe to use inplace operations. Defaults to False.
+            chunk_size (Optional[int]): Number of msa rows per chunk. Defaults to None.
+            _add_with_inplace (bool): If inplace_safe, add the update to m in place
+                and return m. Defaults to False.
+        Returns:
+            torch.Tensor: updated msa embedding (or m + update if _add_with_inplace)
+                [...,n_msa_sampled, n_token, c_m]
+        """
+        b = self.linear_no_bias_z(
+            self.layernorm_z(z)
+        )  # [...,n_token, n_token, n_heads]
+        w = self.softmax_w(b)  # [...,n_token, n_token, n_heads]
+        del b
+
+        n_msa = m.shape[-3]
+        if chunk_size is None or chunk_size >= n_msa:
+            chunk_size = n_msa
+        if inplace_safe and _add_with_inplace:
+            for start in range(0, n_msa, chunk_size):
+                m_chunk = m[..., start : start + chunk_size, :, :]
+                m_chunk += self._weighted_average(m_chunk, w)
+            return m
+        if chunk_size == n_msa:
+            return self._weighted_average(m, w)
+        out = None
+        for start in range(0, n_msa, chunk_size):
+            update = self._weighted_average(m[..., start : start + chunk_size, :, :], w)
+            if out is None:
+                # dtype of the projections, may differ from m under autocast
+                out = update.new_empty((*m.shape[:-1], update.shape[-1]))
+            out[..., start : start + chunk_size, :, :] = update
+            del update
+        return out
+
 
 class MSAStack(nn.Module):
     """
@@ -421,19 +469,41 @@ class MSAStack(nn.Module):
         self.dropout_row = DropoutRowwise(dropout)
         self.transition_m = Transition(c_in=c_m, n=4)
 
-    def forward(self, m: torch.Tensor, z: torch.Tensor) -> torch.Tensor:
+    def forward(
+        self,
+        m: torch.Tensor,
+        z: torch.Tensor,
+        inplace_safe: bool = False,
+        chunk_size: Optional[int] = None,
+    ) -> torch.Tensor:
         """
         Args:
             m (torch.Tensor): msa embedding
                 [...,n_msa_sampled, n_token, c_m]
             z (torch.Tensor): pair embedding
                 [...,n_token, n_token, c_z]
+            inplace_safe (bool): Whether it is safe to use inplace operations. Defaults to False.
+            chunk_size (Optional[int]): Chunk size for memory-efficient operations. Defaults to None.
 
         Returns:
             torch.Tensor: updated msa embedding
                 [...,n_msa_sampled, n_token, c_m]
         """
-        m = m + self.dropout_row(self.msa_pair_weighted_averaging(m, z))
+        if inplace_safe:
+            m = self.msa_pair_weighted_averaging(
+                m,
+                z,
+                inplace_safe=inplace_safe,
+                chunk_size=chunk_size,
+                _add_with_inplace=True,
+            )
+            m += self.transition_m(m)
+            return m
+        m = m + self.dropout_row(
+            self.msa_pair_weighted_averaging(
+                m, z, inplace_safe=inplace_safe, chunk_size=chunk_size
+            )
+        )
         m = m + self.transition_m(m)
         return m
 
@@ -512,7 +582,9 @@ class MSABlock(nn.Module):
         )
         if not self.is_last_block:
             # MSA stack
-            m = self.msa_stack(m, z)
+            m = self.msa_stack(
+                m, z, inplace_safe=inplace_safe, chunk_size=chunk_size
+            )
         # Pair stack
         _, z = self.pair_stack(
             s=None,
@@ -335,6 +335,135 @@ def rearrange_qk_to_dense_trunk(
     return q_trunked, k_trunked, padding_info
 
 
+class LocalAttentionLayout(object):
+    """Padded shapes, masks and gather indices of the sequence-local atom attention.
+
+    They only depend on N_atom, n_queries and n_keys (and on atom_to_token_idx for the
+    token pair gathering), so they are computed once per complex and shared by all the
+    AtomTransformer blocks and all the diffusion steps, instead of being rebuilt by
+    rearrange_qk_to_dense_trunk / rearrange_to_dense_trunk in every block.
+    """
+
+    def __init__(
+        self,
+        n: int,
+        n_queries: int = 32,
+        n_keys: int = 128,
+        device: Optional[torch.device] = None,
+        atom_to_token_idx: Optional[torch.Tensor] = None,
+    ) -> None:
+        """
+        Args:
+            n (int): the number of atoms.
+            n_queries (int, optional): local window size of query tensor. Defaults to 32.
+            n_keys (int, optional): local window size of key/value tensor. Defaults to 128.
+            device (torch.device, optional): device of the masks and indices. Defaults to None.
+            atom_to_token_idx (torch.Tensor, optional): map atom idx to token idx. Defaults to None.
+                [N_atom]
+        """
+        assert n_keys >= n_queries
+        assert n_queries & 0x01 == 0
+        assert n_keys & 0x01 == 0
+        self.n = n
+        self.n_queries = n_queries
+        self.n_keys = n_keys
+        self.n_trunks = int(math.ceil(n / n_queries))
+        self.q_pad = self.n_trunks * n_queries - n
+        self.k_pad_left = (n_keys - n_queries) // 2
+        self.k_pad_right = int(
+            (self.n_trunks - 1 / 2) * n_queries + n_keys / 2 - n + 1 / 2
+        )
+
+        # Positions in the original sequence
+        # q_index: [n_trunks, n_queries], k_index: [n_trunks, n_keys]
+        trunk_start = (
+            torch.arange(self.n_trunks, device=device)[:, None] * n_queries
+        )
+        q_index = trunk_start + torch.arange(n_queries, device=device)
+        k_index = trunk_start + torch.arange(n_keys, device=device) - self.k_pad_left
+        # [n_trunks, n_queries, n_keys]
+        self.mask_trunked = ((q_index < n)[..., None]) & (
+            ((k_index >= 0) & (k_index < n))[..., None, :]
+        )
+        self._attn_bias_cache = {}
+
+        self.atom_to_token_idx_q = None
+        self.atom_to_token_idx_k = None
+        if atom_to_token_idx is not None:
+            assert atom_to_token_idx.shape == (n,)
+            self.atom_to_token_idx_q = self.trunk_q(atom_to_token_idx, dim=-1)
+            self.atom_to_token_idx_k = self.trunk_k(atom_to_token_idx, dim=-1)
+
+    def trunk_q(self, x: torch.Tensor, dim: int) -> torch.Tensor:
+        """Rearrange a query tensor into blocks, as q_trunked in rearrange_qk_to_dense_trunk.
+
+        Args:
+            x (torch.Tensor): query tensor
+                [..., n, ...] (n is at dimension dim)
+            dim (int): along which dimension to build the trunks.
+
+        Returns:
+            torch.Tensor: [..., n_trunks, n_queries, ...]
+        """
+        x = pad_at_dim(x, dim=dim, pad_length=(0, self.q_pad))
+        return reshape_at_dim(x, dim=dim, target_shape=(self.n_trunks, self.n_queries))
+
+    def trunk_k(self, x: torch.Tensor, dim: int) -> torch.Tensor:
+        """Rearrange a key/value tensor into overlapping blocks, as k_trunked in rearrange_qk_to_dense_trunk.
+
+        Args:
+            x (torch.Tensor): key/value tensor
+                [..., n, ...] (n is at dimension dim)
+            dim (int): along which dimension to build the trunks.
+
+        Returns:
+            torch.Tensor: [..., n_trunks, n_keys, ...]
+        """
+        if dim < 0:
+            dim = len(x.shape) + dim
+        x = pad_at_dim(x, dim=dim, pad_length=(self.k_pad_left, self.k_pad_right))
+        x = x.unfold(dim, size=self.n_keys, step=self.n_queries)
+        return move_final_dim_to_dim(x, dim=dim + 1)
+
+    def attn_bias_trunked(
+        self, dtype: torch.dtype = torch.float32, inf: float = 1e10
+    ) -> torch.Tensor:
+        """The attention bias masking the padded positions, as in rearrange_to_dense_trunk.
+
+        Args:
+            dtype (torch.dtype, optional): dtype of the bias. Defaults to torch.float32.
+            inf (float, optional): used for attention masking. Defaults to 1e10.
+
+        Returns:
+            torch.Tensor: 0 for valid positions and -inf for padded ones
+                [n_trunks, n_queries, n_keys]
+        """
+        key = (dtype, inf)
+        if key not in self._attn_bias_cache:
+            self._attn_bias_cache[key] = torch.zeros(
+                self.mask_trunked.shape, dtype=dtype, device=self.mask_trunked.device
+            ).masked_fill_(~self.mask_trunked, -inf)
+        return self._attn_bias_cache[key]
+
+    def gather_pair_embedding(self, z_token: torch.Tensor) -> torch.Tensor:
+        """Broadcast token pair embedding to local atom pairs, as broadcast_token_to_local_atom_pair.
+
+        Args:
+            z_token (torch.Tensor): token pair embedding
+                [..., N_token, N_token, d]
+
+        Returns:
+            torch.Tensor: atom pair embedding, with local blocked shape
+                [..., n_trunks, n_queries, n_keys, d]
+        """
+        assert (
+            self.atom_to_token_idx_q is not None
+        ), "The layout needs the atom_to_token_idx of a single complex, of shape [N_atom]"
+        return gather_pair_embedding_in_dense_trunk(
+            z_token, idx_q=self.atom_to_token_idx_q, idx_k=self.atom_to_token_idx_k
+        )
+
+
 def optimized_concat_split(attn_bias: torch.Tensor, n_queries: int) -> torch.Tensor:
     """Optimized concatenation and splitting of attention bias tensor.
 
@@ -443,6 +572,7 @@ def _local_attention(
     attn_weight_dropout_p: float = 0.0,
     inplace_safe: bool = False,
     chunk_size: Optional[int] = None,
+    local_layout: Optional[LocalAttentionLayout] = None,
 ) -> torch.Tensor:
     """Local attention
 
@@ -462,6 +592,7 @@ def _local_attention(
         inf (float): inf number used for attention bias. Defaults to 1e10.
         use_efficient_implementation (bool): whether to use the torch.nn.functional.scaled_dot_product_attention, Defaults to False.
         attn_weight_dropout_p (float): Dropout probability; if greater than 0.0, dropout is applied, Defaults to 0.0.
+        local_layout (LocalAttentionLayout, optional): precomputed layout of the local attention. Defaults to None.
     Returns:
         torch.Tensor: standard attention output
             [..., Q, d]
@@ -474,17 +605,26 @@ def _local_attention(
     # q: [*, n, d] -> [*, n_trunks, n_queries, d]
     # kv: [*, n, d] -> [*, n_trunks, n_keys, d]
     # attn_bias: [*, n, d] -> [*, n_trunks, n_queries, n_keys]
-    q_trunked, k_trunked, v_trunked, attn_bias_trunked, q_pad_length = (
-        rearrange_to_dense_trunk(
-            q=q,
-            k=k,
-            v=v,
-            n_queries=n_queries,
-            n_keys=n_keys,
-            attn_bias=attn_bias,
-            inf=inf,
+    if local_layout is not None and attn_bias is None:
+        assert local_layout.n == q.size(-2)
+        assert (local_layout.n_queries, local_layout.n_keys) == (n_queries, n_keys)
+        q_trunked = local_layout.trunk_q(q, dim=-2)
+        k_trunked = local_layout.trunk_k(k, dim=-2)
+        v_trunked = local_layout.trunk_k(v, dim=-2)
+        attn_bias_trunked = local_layout.attn_bias_trunked(dtype=q.dtype, inf=inf)
+        q_pad_length = local_layout.q_pad
+    else:
+        q_trunked, k_trunked, v_trunked, attn_bias_trunked, q_pad_length = (
+            rearrange_to_dense_trunk(
+                q=q,
+                k=k,
+                v=v,
+                n_queries=n_queries,
+                n_keys=n_keys,
+                attn_bias=attn_bias,
+                inf=inf,
+            )
         )
-    )
 
     # Apply attention
     # [..., n_trunks, n_queries, d]
@@ -712,6 +852,7 @@ class Attention(nn.Module):
         inf: Optional[float] = 1e10,
         inplace_safe: bool = False,
         chunk_size: Optional[int] = None,
+        local_layout: Optional[LocalAttentionLayout] = None,
     ) -> torch.Tensor:
         """
 
@@ -726,6 +867,8 @@ class Attention(nn.Module):
                 [..., H, n_trunks, n_queries, n_keys] or [..., n_trunks, n_queries, n_keys]
             n_queries (int, optional): local window size of query tensor. If not None, will perform local attention. Defaults to None.
             n_keys (int, optional): local window size of key tensor. Defaults to None.
+            local_layout (LocalAttentionLayout, optional): precomputed layout of the local attention,
+                only used by "local_cross_attention" method. Defaults to None.
 
         Returns:
             torch.Tensor: attention update
@@ -793,6 +936,7 @@ class Attention(nn.Module):
                     attn_weight_dropout_p=self.attn_weight_dropout_p,
                     inplace_safe=inplace_safe,
                     chunk_size=chunk_size,
+                    local_layout=local_layout,
                 )
             else:
                 raise ValueError(
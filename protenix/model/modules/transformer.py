@@ -24,8 +24,7 @@ from protenix.model.modules.primitives import (
     Attention,
     BiasInitLinear,
     LinearNoBias,
-    broadcast_token_to_local_atom_pair,
-    rearrange_qk_to_dense_trunk,
+    LocalAttentionLayout,
 )
 from protenix.model.utils import (
     aggregate_atom_to_token,
@@ -103,6 +102,7 @@ class AttentionPairBias(nn.Module):
         n_keys: int = 128,
         inplace_safe: bool = False,
         chunk_size: Optional[int] = None,
+        local_layout: Optional[LocalAttentionLayout] = None,
     ) -> torch.Tensor:
         """Used by Algorithm 24, with beta_ij being the local mask. Used in AtomTransformer.
 
@@ -117,6 +117,7 @@ class AttentionPairBias(nn.Module):
             n_keys (int, optional): local window size of key tensor. Defaults to 128.
             inplace_safe (bool): Whether it is safe to use inplace operations. Defaults to False.
             chunk_size (Optional[int]): Chunk size for memory-efficient operations. Defaults to None.
+            local_layout (LocalAttentionLayout, optional): precomputed layout of the local attention. Defaults to None.
 
         Returns:
             torch.Tensor: the updated a from AttentionPairBias
@@ -144,6 +145,7 @@ class AttentionPairBias(nn.Module):
             n_keys=n_keys,
             inplace_safe=inplace_safe,
             chunk_size=chunk_size,
+            local_layout=local_layout,
         )
         return a
 
@@ -188,6 +190,7 @@ class AttentionPairBias(nn.Module):
         n_keys: Optional[int] = None,
         inplace_safe: bool = False,
         chunk_size: Optional[int] = None,
+        local_layout: Optional[LocalAttentionLayout] = None,
     ) -> torch.Tensor:
         """Details are given in local_forward and standard_forward"""
         # Input projections
@@ -206,6 +209,7 @@ class AttentionPairBias(nn.Module):
                 n_keys,
                 inplace_safe=inplace_safe,
                 chunk_size=chunk_size,
+                local_layout=local_layout,
             )
         else:
             a = self.standard_multihead_attention(a, s, z, inplace_safe=inplace_safe)
@@ -261,6 +265,7 @@ class DiffusionTransformerBlock(nn.Module):
         n_keys: Optional[int] = None,
         inplace_safe: bool = False,
         chunk_size: Optional[int] = None,
+        local_layout: Optional[LocalAttentionLayout] = None,
     ) -> torch.Tensor:
         """
         Args:
@@ -274,6 +279,7 @@ class DiffusionTransformerBlock(nn.Module):
             n_keys (int, optional): local window size of key tensor. Defaults to None.
             inplace_safe (bool): Whether it is safe to use inplace operations. Defaults to False.
             chunk_size (Optional[int]): Chunk size for memory-efficient operations. Defaults to None.
+            local_layout (LocalAttentionLayout, optional): precomputed layout of the local attention. Defaults to None.
 
         Returns:
             torch.Tensor: the output of DiffusionTransformerBlock
@@ -287,6 +293,7 @@ class DiffusionTransformerBlock(nn.Module):
             n_keys=n_keys,
             inplace_safe=inplace_safe,
             chunk_size=chunk_size,
+            local_layout=local_layout,
         )
         if inplace_safe:
             attn_out += a
@@ -343,6 +350,7 @@ class DiffusionTransformer(nn.Module):
         inplace_safe: bool = False,
         chunk_size: Optional[int] = None,
         clear_cache_between_blocks: bool = False,
+        local_layout: Optional[LocalAttentionLayout] = None,
     ):
         blocks = [
             partial(
@@ -351,6 +359,7 @@ class DiffusionTransformer(nn.Module):
                 n_keys=n_keys,
                 inplace_safe=inplace_safe,
                 chunk_size=chunk_size,
+                local_layout=local_layout,
             )
             for b in self.blocks
         ]
@@ -372,6 +381,7 @@ class DiffusionTransformer(nn.Module):
         n_keys: Optional[int] = None,
         inplace_safe: bool = False,
         chunk_size: Optional[int] = None,
+        local_layout: Optional[LocalAttentionLayout] = None,
     ) -> torch.Tensor:
         """
         Args:
@@ -383,6 +393,7 @@ class DiffusionTransformer(nn.Module):
                 [..., N, N, c_z]
             n_queries (int, optional): local window size of query tensor. If not None, will perform local attention. Defaults to None.
             n_keys (int, optional): local window size of key tensor. Defaults to None.
+            local_layout (LocalAttentionLayout, optional): precomputed layout of the local attention. Defaults to None.
 
         Returns:
             torch.Tensor: the output of DiffusionTransformer
@@ -398,6 +409,7 @@ class DiffusionTransformer(nn.Module):
             inplace_safe=inplace_safe,
             chunk_size=chunk_size,
             clear_cache_between_blocks=clear_cache_between_blocks,
+            local_layout=local_layout,
         )
         blocks_per_ckpt = self.blocks_per_ckpt
         if not torch.is_grad_enabled():
@@ -461,6 +473,7 @@ class AtomTransformer(nn.Module):
         p: torch.Tensor,
         inplace_safe: bool = False,
         chunk_size: Optional[int] = None,
+        local_layout: Optional[LocalAttentionLayout] = None,
     ) -> torch.Tensor:
         """
         Args:
@@ -470,6 +483,7 @@ class AtomTransformer(nn.Module):
                 [..., N_atom, c_atom]
             p (torch.Tensor): atompair embedding in dense block shape.
                 [..., n_blocks, n_queries, n_keys, c_atompair]
+            local_layout (LocalAttentionLayout, optional): precomputed layout of the local attention. Defaults to None.
 
         Returns:
             torch.Tensor: the output of AtomTransformer
@@ -487,6 +501,7 @@ class AtomTransformer(nn.Module):
             n_keys=self.n_keys,
             inplace_safe=inplace_safe,
             chunk_size=chunk_size,
+            local_layout=local_layout,
         )
 
 
@@ -677,6 +692,28 @@ class AtomAttentionEncoder(nn.Module):
                 self.linear_no_bias_q.weight, a=0, mode="fan_in", nonlinearity="relu"
             )
 
+    def prepare_local_layout(
+        self, input_feature_dict: dict[str, Union[torch.Tensor, int, float, dict]]
+    ) -> LocalAttentionLayout:
+        """Precompute the layout of the sequence-local atom attention for a complex.
+
+        Args:
+            input_feature_dict (dict[str, Union[torch.Tensor, int, float, dict]]): input meta feature dict
+
+        Returns:
+            LocalAttentionLayout: the layout shared by the encoder and the decoder.
+        """
+        atom_to_token_idx = input_feature_dict["atom_to_token_idx"]
+        return LocalAttentionLayout(
+            n=input_feature_dict["ref_pos"].size(-2),
+            n_queries=self.n_queries,
+            n_keys=self.n_keys,
+            device=atom_to_token_idx.device,
+            atom_to_token_idx=(
+                atom_to_token_idx if len(atom_to_token_idx.shape) == 1 else None
+            ),
+        )
+
     def forward(
         self,
         input_feature_dict: dict[str, Union[torch.Tensor, int, float, dict]],
@@ -685,6 +722,7 @@ class AtomAttentionEncoder(nn.Module):
         z: torch.Tensor = None,
         inplace_safe: bool = False,
         chunk_size: Optional[int] = None,
+        local_layout: Optional[LocalAttentionLayout] = None,
     ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
         """
         Args:
@@ -695,6 +733,8 @@ class AtomAttentionEncoder(nn.Module):
                 [..., N_sample, N_token, c_s] if has_coords else None.
             z (torch.Tensor, optional): pair embedding
                 [..., N_sample, N_token, N_token, c_z] if has_coords else None.
+            local_layout (LocalAttentionLayout, optional): precomputed layout of the local attention.
+                Built from input_feature_dict if None. Defaults to None.
 
         Returns:
             tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]: the output of AtomAttentionEncoder
@@ -734,28 +774,25 @@ class AtomAttentionEncoder(nn.Module):
         # Line2-Line4: Embed offsets between atom reference positions
 
         # Prepare tensors in dense trunks for local operations
-        q_trunked_list, k_trunked_list, pad_info = rearrange_qk_to_dense_trunk(
-            q=[input_feature_dict["ref_pos"], input_feature_dict["ref_space_uid"]],
-            k=[input_feature_dict["ref_pos"], input_feature_dict["ref_space_uid"]],
-            dim_q=[-2, -1],
-            dim_k=[-2, -1],
-            n_queries=self.n_queries,
-            n_keys=self.n_keys,
-            compute_mask=True,
-        )
+        if local_layout is None:
+            local_layout = self.prepare_local_layout(input_feature_dict)
+        ref_pos = input_feature_dict["ref_pos"]
+        ref_space_uid = input_feature_dict["ref_space_uid"]
 
         # Compute atom pair feature
         d_lm = (
-            q_trunked_list[0][..., None, :] - k_trunked_list[0][..., None, :, :]
+            local_layout.trunk_q(ref_pos, dim=-2)[..., None, :]
+            - local_layout.trunk_k(ref_pos, dim=-2)[..., None, :, :]
         )  # [..., n_blocks, n_queries, n_keys, 3]
         v_lm = (
-            q_trunked_list[1][..., None].int() == k_trunked_list[1][..., None, :].int()
+            local_layout.trunk_q(ref_space_uid, dim=-1)[..., None].int()
+            == local_layout.trunk_k(ref_space_uid, dim=-1)[..., None, :].int()
         ).unsqueeze(
             dim=-1
         )  # [..., n_blocks, n_queries, n_keys, 1]
-        p_lm = (self.linear_no_bias_d(d_lm) * v_lm) * pad_info[
-            "mask_trunked"
-        ].unsqueeze(
+        p_lm = (
+            self.linear_no_bias_d(d_lm) * v_lm
+        ) * local_layout.mask_trunked.unsqueeze(
             dim=-1
         )  # [..., n_blocks, n_queries, n_keys, C_atompair]
 
@@ -793,12 +830,8 @@ class AtomAttentionEncoder(nn.Module):
                     )
                 )
             )  # [..., N_sample, N_atom, c_atom]
-            z_local_pairs, _ = broadcast_token_to_local_atom_pair(
-                z_token=z,
-                atom_to_token_idx=atom_to_token_idx,
-                n_queries=self.n_queries,
-                n_keys=self.n_keys,
-                compute_mask=False,
+            z_local_pairs = local_layout.gather_pair_embedding(
+                z_token=z
             )  # [..., N_sample, n_blocks, n_queries, n_keys, c_z]
             p_lm = p_lm.unsqueeze(dim=-5) + self.linear_no_bias_z(
                 self.layernorm_z(z_local_pairs)
@@ -810,15 +843,8 @@ class AtomAttentionEncoder(nn.Module):
             )  # [..., N_sample, N_atom, c_atom]
 
         # Add the combined single conditioning to the pair representation
-        c_l_q, c_l_k, _ = rearrange_qk_to_dense_trunk(
-            q=c_l,
-            k=c_l,
-            dim_q=-2,
-            dim_k=-2,
-            n_queries=self.n_queries,
-            n_keys=self.n_keys,
-            compute_mask=False,
-        )
+        c_l_q = local_layout.trunk_q(c_l, dim=-2)
+        c_l_k = local_layout.trunk_k(c_l, dim=-2)
         if inplace_safe:
             p_lm += self.linear_no_bias_cl(F.relu(c_l_q[..., None, :]))
             p_lm += self.linear_no_bias_cm(F.relu(c_l_k[..., None, :, :]))
@@ -835,7 +861,7 @@ class AtomAttentionEncoder(nn.Module):
 
         # Cross attention transformer
         q_l = self.atom_transformer(
-            q_l, c_l, p_lm, chunk_size=chunk_size
+            q_l, c_l, p_lm, chunk_size=chunk_size, local_layout=local_layout
         )  # [..., (N_sample), N_atom, c_atom]
 
         # Aggregate per-atom representation to per-token representation
@@ -908,6 +934,7 @@ class AtomAttentionDecoder(nn.Module):
         p_skip: torch.Tensor,
         inplace_safe: bool = False,
         chunk_size: Optional[int] = None,
+        local_layout: Optional[LocalAttentionLayout] = None,
     ) -> torch.Tensor:
         """
         Args:
@@ -920,6 +947,7 @@ class AtomAttentionDecoder(nn.Module):
                 [..., N_atom, c_atom]
             p_skip (torch.Tensor): atompair single embedding
                 [..., n_blocks, n_queries, n_keys, c_atompair]
+            local_layout (LocalAttentionLayout, optional): precomputed layout of the local attention. Defaults to None.
 
         Returns:
             torch.Tensor: the updated nosiy coordinates
@@ -937,7 +965,12 @@ class AtomAttentionDecoder(nn.Module):
 
         # Cross attention transformer
         q = self.atom_transformer(
-            q, c_skip, p_skip, inplace_safe=inplace_safe, chunk_size=chunk_size
+            q,
+            c_skip,
+            p_skip,
+            inplace_safe=inplace_safe,
+            chunk_size=chunk_size,
+            local_layout=local_layout,
         )
 
         # Map to positions update
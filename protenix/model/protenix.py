@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import time
 from typing import Any, Optional
 
@@ -28,6 +29,7 @@ from protenix.model.generator import (
 )
 from protenix.model.utils import simple_merge_dict_list
 from protenix.openfold_local.model.primitives import LayerNorm
+from protenix.utils.chunk_tuning import PersistentChunkSizeTuner
 from protenix.utils.logger import get_logger
 from protenix.utils.permutation.permutation import SymmetricPermutation
 from protenix.utils.torch_utils import autocasting_disable_decorator
@@ -108,28 +110,164 @@ class Protenix(nn.Module):
         self.layernorm_z_cycle = LayerNorm(self.c_z)
         self.layernorm_s = LayerNorm(self.c_s)
 
+        tuning_configs = self.configs.infer_setting.get("chunk_tuning", {})
+        if tuning_configs.get("enable", False):
+            self.chunk_size_tuner = PersistentChunkSizeTuner(
+                candidates=tuning_configs.candidates,
+                cache_path=tuning_configs.cache_path,
+                memory_budget=tuning_configs.memory_budget,
+                config_key=self._get_chunk_tuning_config_key(),
+            )
+        else:
+            self.chunk_size_tuner = None
+
         # Zero init the recycling layer
         nn.init.zeros_(self.linear_no_bias_z_cycle.weight)
         nn.init.zeros_(self.linear_no_bias_s.weight)
 
+    def get_recycle_signal(
+        self, s: torch.Tensor, z: torch.Tensor, signal: str = "contact"
+    ) -> torch.Tensor:
+        """
+        Compute a cheap summary of the trunk output used to monitor recycling convergence.
+
+        Args:
+            s (torch.Tensor): single embedding
+                [..., N_token, c_s]
+            z (torch.Tensor): pair embedding
+                [..., N_token, N_token, c_z]
+            signal (str): "contact" for the distogram-derived contact map,
+                "norm" for the norms of s and z. Defaults to "contact".
+
+        Returns:
+            torch.Tensor: the convergence signal of the current cycle
+        """
+        if signal == "contact":
+            return sample_confidence.compute_contact_prob(
+                distogram_logits=self.distogram_head(z),
+                **sample_confidence.get_bin_params(self.configs.loss.distogram),
+            )
+        elif signal == "norm":
+            return torch.stack(
+                [
+                    torch.linalg.vector_norm(s.float()),
+                    torch.linalg.vector_norm(z.float()),
+                ]
+            )
+        else:
+            raise ValueError(f"Unsupported recycling convergence signal: {signal}")
+
+    @staticmethod
+    def get_recycle_delta(
+        prev_signal: torch.Tensor, cur_signal: torch.Tensor, signal: str = "contact"
+    ) -> float:
+        """
+        Measure the change of the convergence signal between two consecutive cycles.
+
+        Returns:
+            float: mean absolute change of contact probs for "contact",
+                max relative change of the norms for "norm"
+        """
+        if signal == "norm":
+            return (
+                ((cur_signal - prev_signal).abs() / prev_signal.clamp(min=1e-6))
+                .max()
+                .item()
+            )
+        return (cur_signal - prev_signal).abs().mean().item()
+
+    def _get_chunk_tuning_config_key(self) -> str:
+        # Everything that changes the memory and speed of a forward pass of a given shape
+        key = str(
+            [
+                self.configs.model,
+                self.configs.get("dtype"),
+                self.configs.skip_amp,
+                self.configs.sample_diffusion.get("N_sample"),
+                self.configs.infer_setting.sample_diffusion_chunk_size,
+                self.configs.use_memory_efficient_kernel,
+                self.configs.use_deepspeed_evo_attention,
+                self.configs.use_lma,
+            ]
+        )
+        return hashlib.md5(key.encode("utf-8")).hexdigest()
+
+    def tune_chunk_size(self, input_feature_dict: dict[str, Any]) -> Optional[int]:
+        """
+        Get the inference chunk size from the chunk size tuner. The probe runs one recycle of the
+        trunk and one denoising step, with the random state restored afterwards.
+
+        Args:
+            input_feature_dict (dict[str, Any]): input features
+
+        Returns:
+            Optional[int]: the chunk size, None for no chunking.
+        """
+        device = input_feature_dict["residue_index"].device
+        N_token = input_feature_dict["residue_index"].shape[-1]
+        N_atom = input_feature_dict["atom_to_token_idx"].shape[-1]
+        N_msa = (
+            input_feature_dict["msa"].shape[-2] if "msa" in input_feature_dict else 0
+        )
+
+        def probe(chunk_size: Optional[int]) -> None:
+            # MSA sampling draws from numpy
+            np_state = np.random.get_state()
+            try:
+                with torch.random.fork_rng(
+                    devices=[device] if device.type == "cuda" else []
+                ):
+                    s_inputs, s, z, _ = self.get_pairformer_output(
+                        input_feature_dict=input_feature_dict,
+                        N_cycle=1,
+                        inplace_safe=True,
+                        chunk_size=chunk_size,
+                    )
+                    self.sample_diffusion(
+                        denoise_net=self.diffusion_module,
+                        input_feature_dict=input_feature_dict,
+                        s_inputs=s_inputs,
+                        s_trunk=s,
+                        z_trunk=z,
+                        N_sample=self.configs.sample_diffusion["N_sample"],
+                        noise_schedule=self.inference_noise_scheduler(
+                            N_step=1, device=s_inputs.device, dtype=s_inputs.dtype
+                        ),
+                        inplace_safe=True,
+                        attn_chunk_size=chunk_size,
+                    )
+            finally:
+                np.random.set_state(np_state)
+
+        return self.chunk_size_tuner.tune(
+            probe, device=device, N_token=N_token, N_atom=N_atom, N_msa=N_msa
+        )
+
     def get_pairformer_output(
         self,
         input_feature_dict: dict[str, Any],
-        N_cycle: int,
+        N_cycle: Optional[int] = None,
         inplace_safe: bool = False,
         chunk_size: Optional[int] = None,
-    ) -> tuple[torch.Tensor, ...]:
+    ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor, int]:
         """
         The forward pass from the input to pairformer output
 
+        If `model.adaptive_recycle.enable` is set and the model is not training, recycling
+        stops as soon as the convergence signal changes by less than the tolerance, after
+        at least `min_cycle` and at most N_cycle cycles.
+
         Args:
             input_feature_dict (dict[str, Any]): input features
-            N_cycle (int): number of cycles
+            N_cycle (Optional[int]): maximum number of cycles. Defaults to None for the configured
+                one: `adaptive_recycle.max_cycle` if set and adaptive recycling is on, else
+                `model.N_cycle`. An explicit value always wins.
             inplace_safe (bool): Whether it is safe to use inplace operations. Defaults to False.
             chunk_size (Optional[int]): Chunk size for memory-efficient operations. Defaults to None.
 
         Returns:
-            Tuple[torch.Tensor, ...]: s_inputs, s, z
+            tuple[torch.Tensor, torch.Tensor, torch.Tensor, int]: s_inputs, s, z and
+                the number of cycles actually run
         """
         N_token = input_feature_dict["residue_index"].shape[-1]
         if N_token <= 16:
@@ -167,6 +305,19 @@ class Protenix(nn.Module):
         z = torch.zeros_like(z_init)
         s = torch.zeros_like(s_init)
 
+        adaptive_configs = self.configs.model.get("adaptive_recycle", {})
+        adaptive_recycle = (not self.training) and adaptive_configs.get(
+            "enable", False
+        )
+        if N_cycle is None:
+            N_cycle = self.N_cycle
+            if adaptive_recycle and adaptive_configs.max_cycle > 0:
+                N_cycle = adaptive_configs.max_cycle
+        if adaptive_recycle:
+            min_cycle = min(adaptive_configs.min_cycle, N_cycle)
+            prev_signal = None
+        N_cycle_used = N_cycle
+
         # Line 7-13 recycling
         for cycle_no in range(N_cycle):
             with torch.set_grad_enabled(
@@ -236,13 +387,26 @@ class Protenix(nn.Module):
                     chunk_size=chunk_size,
                 )
 
+            if adaptive_recycle and cycle_no < N_cycle - 1:
+                cur_signal = self.get_recycle_signal(
+                    s, z, signal=adaptive_configs.signal
+                )
+                if prev_signal is not None and cycle_no + 1 >= min_cycle:
+                    delta = self.get_recycle_delta(
+                        prev_signal, cur_signal, signal=adaptive_configs.signal
+                    )
+                    if delta < adaptive_configs.tolerance:
+                        N_cycle_used = cycle_no + 1
+                        break
+                prev_signal = cur_signal
+
         if self.train_confidence_only:
             self.input_embedder.train()
             self.template_embedder.train()
             self.msa_module.train()
             self.pairformer_stack.train()
 
-        return s_inputs, s, z
+        return s_inputs, s, z, N_cycle_used
 
     def sample_diffusion(self, **kwargs) -> torch.Tensor:
         """
@@ -251,6 +415,10 @@ class Protenix(nn.Module):
         Returns:
             torch.Tensor: The result of the diffusion sampling process.
         """
+        # The tuned chunk size if given, else the configured one
+        attn_chunk_size = kwargs.pop(
+            "attn_chunk_size", self.configs.infer_setting.chunk_size
+        )
         _configs = {
             key: self.configs.sample_diffusion.get(key)
             for key in [
@@ -262,14 +430,16 @@ class Protenix(nn.Module):
         }
         _configs.update(
             {
-                "attn_chunk_size": (
-                    self.configs.infer_setting.chunk_size if not self.training else None
-                ),
+                "attn_chunk_size": attn_chunk_size if not self.training else None,
                 "diffusion_chunk_size": (
                     self.configs.infer_setting.sample_diffusion_chunk_size
                     if not self.training
                     else None
                 ),
+                # The atom-local attention layout is shared by all the denoising steps
+                "local_layout": self.diffusion_module.prepare_local_layout(
+                    kwargs["input_feature_dict"]
+                ),
             }
         )
         return autocasting_disable_decorator(self.configs.skip_amp.sample_diffusion)(
@@ -291,7 +461,7 @@ class Protenix(nn.Module):
         self,
         input_feature_dict: dict[str, Any],
         label_dict: dict[str, Any],
-        N_cycle: int,
+        N_cycle: Optional[int],
         mode: str,
         inplace_safe: bool = True,
         chunk_size: Optional[int] = 4,
@@ -304,7 +474,7 @@ class Protenix(nn.Module):
         Args:
             input_feature_dict (dict[str, Any]): Input features dictionary.
             label_dict (dict[str, Any]): Label dictionary.
-            N_cycle (int): Number of cycles.
+            N_cycle (Optional[int]): Number of cycles, None for the configured one.
             mode (str): Mode of operation (e.g., 'inference').
             inplace_safe (bool): Whether to use inplace operations safely. Defaults to True.
             chunk_size (Optional[int]): Chunk size for memory-efficient operations. Defaults to 4.
@@ -346,6 +516,7 @@ class Protenix(nn.Module):
             "pae": _cat(pred_dicts, "pae"),
             "pde": _cat(pred_dicts, "pde"),
             "resolved": _cat(pred_dicts, "resolved"),
+            "num_recycles": _cat(pred_dicts, "num_recycles"),
         }
 
         all_log_dict = simple_merge_dict_list(log_dicts)
@@ -356,7 +527,7 @@ class Protenix(nn.Module):
         self,
         input_feature_dict: dict[str, Any],
         label_dict: dict[str, Any],
-        N_cycle: int,
+        N_cycle: Optional[int],
         mode: str,
         inplace_safe: bool = True,
         chunk_size: Optional[int] = 4,
@@ -379,7 +550,7 @@ class Protenix(nn.Module):
         pred_dict = {}
         time_tracker = {}
 
-        s_inputs, s, z = self.get_pairformer_output(
+        s_inputs, s, z, N_cycle = self.get_pairformer_output(
             input_feature_dict=input_feature_dict,
             N_cycle=N_cycle,
             inplace_safe=inplace_safe,
@@ -420,6 +591,13 @@ class Protenix(nn.Module):
             N_sample=N_sample,
             noise_schedule=noise_schedule,
             inplace_safe=inplace_safe,
+            attn_chunk_size=chunk_size,
+        )
+        pred_dict["num_recycles"] = torch.full(
+            (pred_dict["coordinate"].size(-3),),
+            N_cycle,
+            dtype=torch.long,
+            device=s_inputs.device,
         )
 
         step_diffusion = time.time()
@@ -533,7 +711,7 @@ class Protenix(nn.Module):
         else:
             deepspeed_evo_attention_condition_satisfy = True
 
-        s_inputs, s, z = self.get_pairformer_output(
+        s_inputs, s, z, _ = self.get_pairformer_output(
             input_feature_dict=input_feature_dict,
             N_cycle=N_cycle,
             inplace_safe=inplace_safe,
@@ -671,6 +849,8 @@ class Protenix(nn.Module):
         assert mode in ["train", "inference", "eval"]
         inplace_safe = not (self.training or torch.is_grad_enabled())
         chunk_size = self.configs.infer_setting.chunk_size if inplace_safe else None
+        if inplace_safe and mode != "train" and self.chunk_size_tuner is not None:
+            chunk_size = self.tune_chunk_size(input_feature_dict)
 
         if mode == "train":
             nc_rng = np.random.RandomState(current_step)
@@ -692,7 +872,7 @@ class Protenix(nn.Module):
             pred_dict, log_dict, time_tracker = self.main_inference_loop(
                 input_feature_dict=input_feature_dict,
                 label_dict=None,
-                N_cycle=self.N_cycle,
+                N_cycle=None,
                 mode=mode,
                 inplace_safe=inplace_safe,
                 chunk_size=chunk_size,
@@ -711,7 +891,7 @@ class Protenix(nn.Module):
             pred_dict, log_dict, time_tracker = self.main_inference_loop(
                 input_feature_dict=input_feature_dict,
                 label_dict=label_dict,
-                N_cycle=self.N_cycle,
+                N_cycle=None,
                 mode=mode,
                 inplace_safe=inplace_safe,
                 chunk_size=chunk_size,
@@ -15,6 +15,7 @@
 from typing import Optional, Union
 
 import torch
+import torch.nn.functional as F
 from ml_collections.config_dict import ConfigDict
 
 from protenix.metrics.clash import Clash
@@ -452,6 +453,27 @@ def calculate_ptm(
     return ptm
 
 
+def _segment_max(
+    x: torch.Tensor, segment_ids: torch.LongTensor, num_segments: int
+) -> torch.Tensor:
+    """Max over the token dimension within each segment.
+
+    Args:
+        x (torch.Tensor): values, rows to be ignored should be -inf.
+            Shape: [..., N_token, D]
+        segment_ids (torch.LongTensor): segment index of each token.
+            Shape: [N_token, ]
+        num_segments (int): number of segments.
+
+    Returns:
+        torch.Tensor: -inf for the segments without any valid token.
+            Shape: [..., num_segments, D]
+    """
+    out = x.new_full(x.shape[:-2] + (num_segments, x.shape[-1]), -float("inf"))
+    index = segment_ids[:, None].expand(x.shape[-2:]).expand_as(x)
+    return out.scatter_reduce(-2, index, x, reduce="amax", include_self=True)
+
+
 def calculate_chain_based_ptm(
     pae_prob: torch.Tensor,
     has_frame: torch.BoolTensor,
@@ -460,10 +482,16 @@ def calculate_chain_based_ptm(
     min_bin: float,
     max_bin: float,
     no_bins: int,
+    eps: float = 1e-8,
 ) -> dict[str, torch.Tensor]:
     """
     Compute chain-based pTM scores.
 
+    The same values as calling calculate_ptm / calculate_iptm for every chain and chain pair,
+    but pae_prob is only reduced once into per-token, per-chain bin sums. The TM expectations
+    are then computed once for each distinct normalization length d0 and aggregated over the
+    chains with segment reductions.
+
     Args:
         pae_prob (torch.Tensor): Predicted probability from PAE loss head.
             Shape: [..., N_token, N_token, N_bins]
@@ -476,6 +504,7 @@ def calculate_chain_based_ptm(
         min_bin (float): Minimum bin value.
         max_bin (float): Maximum bin value.
         no_bins (int): Number of bins.
+        eps (float): Small value to avoid division by zero, as in calculate_iptm. Defaults to 1e-8.
 
     Returns:
         dict: Dictionary containing chain-based pTM scores.
@@ -484,92 +513,106 @@ def calculate_chain_based_ptm(
             - chain_pair_iptm (torch.Tensor): Pairwise ipTM scores between chains.
             - chain_pair_iptm_global (torch.Tensor): Global pairwise ipTM scores between chains.
     """
-
-    has_frame = has_frame.bool()
-    asym_id = asym_id.long()
-    asym_id_to_asym_mask = {aid.item(): asym_id == aid for aid in torch.unique(asym_id)}
-    chain_is_ligand = {
-        aid.item(): token_is_ligand[asym_id == aid].sum() >= (asym_id == aid).sum() // 2
-        for aid in torch.unique(asym_id)
-    }
-
-    batch_shape = pae_prob.shape[:-3]
-
-    # Chain_pair_iptm
-    # Change to dense tensor, otherwise it's troublesome in break_down_to_per_sample_dict and traverse_and_aggregate across different devices
-    N_chain = len(asym_id_to_asym_mask)
-    chain_pair_iptm = torch.zeros(size=batch_shape + (N_chain, N_chain)).to(
-        pae_prob.device
+    device = pae_prob.device
+    has_frame = has_frame.bool().to(device)
+    asym_id = asym_id.long().to(device)
+    # chain index of each token: [N_token]
+    _, chain_idx = torch.unique(asym_id, return_inverse=True)
+    N_chain = int(chain_idx.max().item()) + 1
+    chain_one_hot = F.one_hot(chain_idx, N_chain)  # [N_token, N_chain]
+
+    chain_size = chain_one_hot.sum(dim=0)  # [N_chain]
+    num_ligand = (token_is_ligand.to(device).long()[:, None] * chain_one_hot).sum(dim=0)
+    chain_is_ligand = num_ligand >= chain_size // 2  # [N_chain]
+    chain_has_frame = (has_frame[:, None] & chain_one_hot.bool()).any(dim=0)
+
+    # Sum of the pae probability over the tokens of each chain
+    # [..., N_token, N_chain, N_bins]
+    chain_pae_prob = pae_prob.new_zeros(
+        pae_prob.shape[:-2] + (N_chain, pae_prob.shape[-1])
+    ).index_add_(-2, chain_idx, pae_prob)
+
+    # The TM-score normalization of chain_ptm uses the size of the chain,
+    # and the one of chain_pair_iptm uses the size of the pair of chains.
+    pair_size = chain_size[:, None] + chain_size[None, :]  # [N_chain, N_chain]
+    d0_list = sorted(
+        set(chain_size.tolist()) | set(pair_size.flatten().tolist()),
+    )
+    d0_index = {d0: i for i, d0 in enumerate(d0_list)}
+    bin_center = get_bin_centers(min_bin, max_bin, no_bins).to(device)
+    per_bin_weight = torch.stack(
+        [1 / (1 + (bin_center / calculate_normalization(d0)) ** 2) for d0 in d0_list],
+        dim=-1,
+    ).to(
+        pae_prob.dtype
+    )  # [N_bins, N_d0]
+
+    # Sum of the TM expectation over the tokens of each chain, for each d0
+    # [..., N_token, N_chain, N_d0]
+    chain_token_tm = chain_pae_prob @ per_bin_weight
+
+    # chain_ptm: max over tokens with frame of the mean over the same chain
+    ptm_d0 = torch.tensor([d0_index[n] for n in chain_size.tolist()], device=device)
+    # [..., N_token, 1]
+    token_ptm = chain_token_tm.flatten(start_dim=-2).gather(
+        -1,
+        (chain_idx * len(d0_list) + ptm_d0[chain_idx]).expand(
+            chain_token_tm.shape[:-2]
+        )[..., None],
+    )
+    token_ptm = token_ptm / chain_size[chain_idx][:, None]
+    token_ptm = token_ptm.masked_fill(~has_frame[:, None], -float("inf"))
+    chain_ptm = _segment_max(token_ptm, chain_idx, N_chain)[..., 0]
+    chain_ptm = chain_ptm.masked_fill(~chain_has_frame, 0)
+
+    # chain_pair_iptm: for the pair (a, b), max over tokens with frame in a of the
+    # mean over the tokens of b, and vice versa.
+    pair_d0 = torch.tensor(
+        [[d0_index[n] for n in row] for row in pair_size.tolist()], device=device
+    )  # [N_chain, N_chain]
+    # [..., N_token, N_chain]
+    token_iptm = chain_token_tm.gather(
+        -1, pair_d0[chain_idx].expand(chain_token_tm.shape[:-1])[..., None]
+    )[..., 0] / (eps + chain_size)
+    token_iptm = token_iptm.masked_fill(~has_frame[:, None], -float("inf"))
+    chain_pair_max = _segment_max(token_iptm, chain_idx, N_chain)  # [..., N_chain, N_chain]
+    chain_pair_iptm = torch.maximum(chain_pair_max, chain_pair_max.transpose(-1, -2))
+    chain_pair_iptm = chain_pair_iptm.masked_fill(
+        torch.isinf(chain_pair_iptm) | torch.eye(N_chain, dtype=torch.bool, device=device),
+        0,
     )
-    for aid_1 in range(N_chain):
-        for aid_2 in range(N_chain):
-            if aid_1 == aid_2:
-                continue
-            if aid_1 > aid_2:
-                chain_pair_iptm[:, aid_1, aid_2] = chain_pair_iptm[:, aid_2, aid_1]
-                continue
-            pair_mask = asym_id_to_asym_mask[aid_1] + asym_id_to_asym_mask[aid_2]
-            chain_pair_iptm[:, aid_1, aid_2] = calculate_iptm(
-                pae_prob,
-                has_frame,
-                asym_id,
-                min_bin,
-                max_bin,
-                no_bins,
-                token_mask=pair_mask,
-            )
-
-    # chain_ptm
-    chain_ptm = torch.zeros(size=batch_shape + (N_chain,)).to(pae_prob.device)
-    for aid, asym_mask in asym_id_to_asym_mask.items():
-        chain_ptm[:, aid] = calculate_ptm(
-            pae_prob,
-            has_frame,
-            min_bin,
-            max_bin,
-            no_bins,
-            token_mask=asym_mask,
-        )
-
-    # Chain iptm
-    chain_has_frame = [
-        (asym_id_to_asym_mask[i] * has_frame).any() for i in range(N_chain)
-    ]
 
-    chain_iptm = torch.zeros(size=batch_shape + (N_chain,)).to(pae_prob.device)
-    for aid, asym_mask in asym_id_to_asym_mask.items():
-        pairs = [
-            (i, j)
-            for i in range(N_chain)
-            for j in range(N_chain)
-            if (i == aid or j == aid) and (i != j) and chain_has_frame[i]
-        ]
-        vals = [chain_pair_iptm[:, i, j] for (i, j) in pairs]
-        if len(vals) > 0:
-            chain_iptm[:, aid] = torch.stack(vals, dim=-1).mean(dim=-1)
-
-    # Chain_pair_iptm_global
-    chain_pair_iptm_global = torch.zeros(size=batch_shape + (N_chain, N_chain)).to(
-        pae_prob.device
+    # chain_iptm: mean of chain_pair_iptm over the pairs (i, j) involving the chain, where i has frame
+    off_diag = ~torch.eye(N_chain, dtype=torch.bool, device=device)
+    pair_weight = (
+        chain_has_frame[:, None] & off_diag
+    ).float()  # pair (i, j) is counted if chain i has frame
+    pair_sum = (chain_pair_iptm * pair_weight).sum(dim=-1) + (
+        chain_pair_iptm * pair_weight
+    ).sum(dim=-2)
+    pair_count = pair_weight.sum(dim=-1) + pair_weight.sum(dim=-2)
+    chain_iptm = torch.where(
+        pair_count > 0, pair_sum / pair_count.clamp(min=1), torch.zeros_like(pair_sum)
     )
-    for aid_1 in range(N_chain):
-        for aid_2 in range(N_chain):
-            if aid_1 == aid_2:
-                continue
-            if chain_is_ligand[aid_1]:
-                chain_pair_iptm_global[:, aid_1, aid_2] = chain_iptm[:, aid_1]
-            elif chain_is_ligand[aid_2]:
-                chain_pair_iptm_global[:, aid_1, aid_2] = chain_iptm[:, aid_2]
-            else:
-                chain_pair_iptm_global[:, aid_1, aid_2] = (
-                    chain_iptm[:, aid_1] + chain_iptm[:, aid_2]
-                ) * 0.5
+
+    # chain_pair_iptm_global
+    chain_iptm_1 = chain_iptm[..., :, None].expand(chain_pair_iptm.shape)
+    chain_iptm_2 = chain_iptm[..., None, :].expand(chain_pair_iptm.shape)
+    chain_pair_iptm_global = torch.where(
+        chain_is_ligand[:, None],
+        chain_iptm_1,
+        torch.where(
+            chain_is_ligand[None, :],
+            chain_iptm_2,
+            (chain_iptm_1 + chain_iptm_2) * 0.5,
+        ),
+    ).masked_fill(~off_diag, 0)
 
     return {
-        "chain_ptm": chain_ptm,
-        "chain_iptm": chain_iptm,
-        "chain_pair_iptm": chain_pair_iptm,
-        "chain_pair_iptm_global": chain_pair_iptm_global,
+        "chain_ptm": chain_ptm.float(),
+        "chain_iptm": chain_iptm.float(),
+        "chain_pair_iptm": chain_pair_iptm.float(),
+        "chain_pair_iptm_global": chain_pair_iptm_global.float(),
     }
 
 
@@ -0,0 +1,140 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+import torch
+import torch.nn as nn
+
+
+def strip_state_dict_prefix(
+    state_dict: dict[str, torch.Tensor], prefix: str = "module."
+) -> dict[str, torch.Tensor]:
+    """
+    Remove a key prefix (e.g. the "module." added by DDP) from a state dict in place.
+
+    Args:
+        state_dict (dict[str, torch.Tensor]): the state dict.
+        prefix (str): the prefix to remove. Defaults to "module.".
+
+    Returns:
+        dict[str, torch.Tensor]: the same state dict with normalized keys.
+    """
+    for key in list(state_dict.keys()):
+        if key.startswith(prefix):
+            state_dict[key[len(prefix) :]] = state_dict.pop(key)
+    return state_dict
+
+
+def load_model_state_dict(
+    checkpoint_path: Union[str, Path],
+    mmap: bool = True,
+) -> dict[str, torch.Tensor]:
+    """
+    Load model weights from a training checkpoint ({"model": state_dict, ...}) or from a
+    flat weights file written by `convert_checkpoint`.
+
+    With mmap=True, tensors are memory-mapped from the file instead of being read into
+    host memory, so pages are only touched when they are copied to their final device.
+
+    Args:
+        checkpoint_path (Union[str, Path]): checkpoint path.
+        mmap (bool): whether to memory-map the checkpoint. Defaults to True.
+
+    Returns:
+        dict[str, torch.Tensor]: model state dict without the "module." prefix.
+    """
+    checkpoint = torch.load(checkpoint_path, map_location="cpu", mmap=mmap)
+    if "model" in checkpoint and isinstance(checkpoint["model"], dict):
+        checkpoint = checkpoint["model"]
+    return strip_state_dict_prefix(checkpoint)
+
+
+def init_empty_model(model_fn: Callable[..., nn.Module], *args, **kwargs) -> nn.Module:
+    """
+    Build a model on the meta device, skipping the allocation and the random
+    initialization of its parameters. The parameters must be filled with
+    `load_state_dict_to_empty_model` before use.
+
+    Args:
+        model_fn (Callable[..., nn.Module]): the model class or factory.
+
+    Returns:
+        nn.Module: the model with parameters on the meta device.
+    """
+    with torch.device("meta"):
+        return model_fn(*args, **kwargs)
+
+
+def load_state_dict_to_empty_model(
+    model: nn.Module,
+    state_dict: dict[str, torch.Tensor],
+    device: Union[str, torch.device],
+    strict: bool = True,
+) -> nn.Module:
+    """
+    Materialize the parameters of a model built by `init_empty_model` from a state dict.
+
+    The checkpoint tensors are assigned to the model instead of being copied into freshly
+    initialized parameters, and are then moved to `device` once.
+
+    Args:
+        model (nn.Module): the model on the meta device.
+        state_dict (dict[str, torch.Tensor]): the (memory-mapped) state dict.
+        device (Union[str, torch.device]): the target device.
+        strict (bool): same as `nn.Module.load_state_dict`. Defaults to True.
+
+    Returns:
+        nn.Module: the model with parameters on `device`.
+    """
+    model.load_state_dict(state_dict, strict=strict, assign=True)
+    missing = [
+        name
+        for name, tensor in list(model.named_parameters()) + list(model.named_buffers())
+        if tensor.is_meta
+    ]
+    if len(missing) > 0:
+        raise RuntimeError(
+            f"{len(missing)} parameters are not initialized by the checkpoint, "
+            f"e.g. {missing[:5]}. Disable the fast loading to use random init for them."
+        )
+    return model.to(device)
+
+
+def convert_checkpoint(
+    checkpoint_path: Union[str, Path],
+    output_path: Union[str, Path],
+    dtype: Optional[torch.dtype] = None,
+) -> dict[str, tuple]:
+    """
+    Convert a training checkpoint into a flat, prefix-normalized weights file
+    ({param_name: tensor}), without optimizer or scheduler states.
+
+    Args:
+        checkpoint_path (Union[str, Path]): training checkpoint path.
+        output_path (Union[str, Path]): output weights path.
+        dtype (Optional[torch.dtype]): cast floating point weights to this dtype. Defaults to None.
+
+    Returns:
+        dict[str, tuple]: the shape of each saved weight.
+    """
+    state_dict = load_model_state_dict(checkpoint_path, mmap=True)
+    flat_state_dict = {}
+    for key, value in state_dict.items():
+        if dtype is not None and value.is_floating_point():
+            value = value.to(dtype)
+        flat_state_dict[key] = value.contiguous()
+    torch.save(flat_state_dict, output_path)
+    return {k: tuple(v.shape) for k, v in flat_state_dict.items()}
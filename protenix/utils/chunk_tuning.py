@@ -0,0 +1,215 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import math
+import os
+import time
+from typing import Any, Callable, Optional, Sequence
+
+import torch
+
+from protenix.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def _is_oom(e: BaseException) -> bool:
+    return isinstance(e, torch.cuda.OutOfMemoryError) or (
+        isinstance(e, RuntimeError) and "out of memory" in str(e)
+    )
+
+
+def _device_name(device: torch.device) -> str:
+    if device.type == "cuda":
+        return torch.cuda.get_device_name(device)
+    return device.type
+
+
+class PersistentChunkSizeTuner(object):
+    """
+    Chooses the inference chunk size per shape bucket by probing, and persists the choices.
+
+    On the first request for a (N_token, N_atom, N_msa) bucket, a representative function is run
+    once to warm up, then num_runs times with no chunking and with each candidate chunk size.
+    The candidate with the fastest run whose peak memory fits in the budget is kept. Choices are
+    stored in a JSON cache file keyed by device name and model config, so later jobs on the same
+    hardware skip the probing.
+
+    Shapes are rounded up to their bucket size, and a bucket is tuned with the first shape seen in
+    it: keep the memory budget below 1 to leave room for the larger shapes of the bucket.
+    """
+
+    def __init__(
+        self,
+        candidates: Sequence[int],
+        cache_path: str = "",
+        memory_budget: float = 0.8,
+        config_key: str = "",
+        bucket_sizes: Sequence[int] = (256, 2048, 1024),
+        num_runs: int = 2,
+    ) -> None:
+        """
+        Args:
+            candidates (Sequence[int]): chunk sizes to probe, besides no chunking.
+            cache_path (str): JSON file of the persisted choices. Not persisted if empty.
+            memory_budget (float): fraction of the device memory the probe may use at peak.
+            config_key (str): identifies the model config the choices are valid for.
+            bucket_sizes (Sequence[int]): bucket sizes of N_token, N_atom and N_msa.
+            num_runs (int): timed runs per candidate, the fastest one is used. At least 2,
+                so that a single noisy run does not decide.
+        """
+        self.candidates = sorted(set(int(c) for c in candidates), reverse=True)
+        assert len(self.candidates) > 0 and self.candidates[-1] > 0
+        self.cache_path = cache_path
+        self.memory_budget = memory_budget
+        self.config_key = config_key
+        self.bucket_sizes = bucket_sizes
+        assert num_runs >= 2
+        self.num_runs = num_runs
+        self.cache = self._read_cache()
+
+    def _read_cache(self) -> dict:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignore unreadable chunk size cache {self.cache_path}: {e}")
+            return {}
+
+    def _write_cache(self, device_key: str, bucket_key: str, chunk_size: Optional[int]):
+        if not self.cache_path:
+            return
+        # Merge with the choices other jobs may have written meanwhile
+        cache = self._read_cache()
+        cache.setdefault(device_key, {})[bucket_key] = chunk_size
+        self.cache = cache
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump(cache, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning(f"Can not write chunk size cache {self.cache_path}: {e}")
+
+    def get_bucket(self, N_token: int, N_atom: int, N_msa: int) -> tuple[int, int, int]:
+        """
+        Round the shapes up to their bucket size.
+
+        Args:
+            N_token (int): number of tokens.
+            N_atom (int): number of atoms.
+            N_msa (int): number of MSA rows.
+
+        Returns:
+            tuple[int, int, int]: the bucket.
+        """
+        return tuple(
+            int(math.ceil(max(n, 1) / size) * size)
+            for n, size in zip((N_token, N_atom, N_msa), self.bucket_sizes)
+        )
+
+    def _probe(
+        self,
+        fn: Callable[[Optional[int]], Any],
+        chunk_size: Optional[int],
+        device,
+        num_runs: int,
+    ) -> Optional[float]:
+        """
+        Run fn num_runs times, return its fastest runtime or None if it does not fit in the
+        memory budget.
+        """
+        is_cuda = device.type == "cuda"
+        if is_cuda:
+            torch.cuda.empty_cache()
+            torch.cuda.reset_peak_memory_stats(device)
+            base_memory = torch.cuda.memory_allocated(device)
+            free, _ = torch.cuda.mem_get_info(device)
+            total = torch.cuda.get_device_properties(device).total_memory
+            budget = min(self.memory_budget * total - base_memory, free)
+        best = None
+        for _ in range(num_runs):
+            if is_cuda:
+                torch.cuda.synchronize(device)
+            start = time.time()
+            try:
+                with torch.no_grad():
+                    fn(chunk_size)
+                if is_cuda:
+                    torch.cuda.synchronize(device)
+            except Exception as e:  # pylint: disable=broad-except
+                if not _is_oom(e):
+                    raise
+                if is_cuda:
+                    torch.cuda.empty_cache()
+                return None
+            elapsed = time.time() - start
+            if is_cuda:
+                peak = torch.cuda.max_memory_allocated(device) - base_memory
+                torch.cuda.empty_cache()
+                if peak > budget:
+                    return None
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def tune(
+        self,
+        fn: Callable[[Optional[int]], Any],
+        device: torch.device,
+        N_token: int,
+        N_atom: int,
+        N_msa: int,
+    ) -> Optional[int]:
+        """
+        Get the chunk size of a shape bucket, probing fn on the first request.
+
+        Args:
+            fn (Callable[[Optional[int]], Any]): representative function, called with a chunk size
+                (None for no chunking). It must not change the model or its inputs.
+            device (torch.device): the device the model runs on.
+            N_token (int): number of tokens.
+            N_atom (int): number of atoms.
+            N_msa (int): number of MSA rows.
+
+        Returns:
+            Optional[int]: the chunk size, None for no chunking.
+        """
+        device_key = f"{_device_name(device)}|{self.config_key}"
+        bucket_key = "_".join(str(n) for n in self.get_bucket(N_token, N_atom, N_msa))
+        device_cache = self.cache.get(device_key, {})
+        if bucket_key in device_cache:
+            return device_cache[bucket_key]
+
+        # Untimed warm-up (kernel compilation, allocator caching) with the smallest candidate
+        self._probe(fn, self.candidates[-1], device, num_runs=1)
+        runtimes = {}
+        for chunk_size in [None] + self.candidates:
+            elapsed = self._probe(fn, chunk_size, device, num_runs=self.num_runs)
+            if elapsed is not None:
+                runtimes[chunk_size] = elapsed
+        if runtimes:
+            best = min(runtimes, key=runtimes.get)
+        else:
+            # Nothing fits: use the most memory efficient candidate and hope for the best
+            best = self.candidates[-1]
+        logger.info(
+            f"Tuned chunk size for bucket {bucket_key} on {device_key}: {best}, "
+            f"runtimes {runtimes}"
+        )
+        self._write_cache(device_key, bucket_key, best)
+        return best
@@ -15,9 +15,12 @@
 import gzip
 import json
 import pickle
+import struct
+import zipfile
 from pathlib import Path
 from typing import Any, Union
 
+import numpy as np
 import pandas as pd
 
 from protenix.utils.torch_utils import map_values_to_list
@@ -101,3 +104,51 @@ def save_json(data: dict, output_fpath: Union[str, Path], indent: int = 4):
             json.dump(data_json, f, indent=indent)
         else:
             json.dump(data_json, f)
+
+
+def load_npz_mmap(npz: Union[str, Path]) -> dict[str, np.ndarray]:
+    """
+    Load the arrays of an NPZ file written by np.savez as read-only memory maps.
+    Nothing is read until the arrays are used, which makes opening large files cheap.
+    Compressed members (np.savez_compressed) can not be mapped and are read eagerly.
+
+    Args:
+        npz (Union[str, Path]): An NPZ file path.
+
+    Returns:
+        dict[str, np.ndarray]: The arrays by name.
+    """
+    arrays = {}
+    with zipfile.ZipFile(npz) as zf, open(npz, "rb") as f:
+        for info in zf.infolist():
+            name = info.filename[: -len(".npy")]
+            if info.compress_type == zipfile.ZIP_STORED:
+                # Skip the local file header, whose extra field may differ from the central directory
+                f.seek(info.header_offset)
+                name_len, extra_len = struct.unpack("<HH", f.read(30)[26:30])
+                f.seek(info.header_offset + 30 + name_len + extra_len)
+                read_header = {
+                    (1, 0): np.lib.format.read_array_header_1_0,
+                    (2, 0): np.lib.format.read_array_header_2_0,
+                }.get(np.lib.format.read_magic(f))
+            else:
+                read_header = None
+            if read_header is None:
+                with zf.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+            shape, fortran_order, dtype = read_header(f)
+            if dtype.hasobject:
+                raise ValueError(f"Can not memory-map object array {name} of {npz}")
+            if np.prod(shape) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+                continue
+            arrays[name] = np.memmap(
+                npz,
+                dtype=dtype,
+                mode="r",
+                offset=f.tell(),
+                shape=shape,
+                order="F" if fortran_order else "C",
+            )
+    return arrays
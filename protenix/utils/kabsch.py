@@ -0,0 +1,277 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Optional
+
+import torch
+
+KABSCH_SOLVERS = ("auto", "svd", "quaternion")
+
+
+def _rotation_by_svd(H: torch.Tensor, allow_reflection: bool) -> torch.Tensor:
+    """Rotation maximizing tr(R @ H) by SVD, H: [..., 3, 3]"""
+    u, s, v = torch.svd(H)
+    u = u.transpose(-1, -2)
+    if allow_reflection:
+        return torch.matmul(v, u)
+    det = torch.linalg.det(torch.matmul(v, u))
+    diagonal = torch.stack([torch.ones_like(det), torch.ones_like(det), det], dim=-1)
+    return torch.matmul(v, torch.matmul(torch.diag_embed(diagonal), u))
+
+
+def _horn_matrix(H: torch.Tensor) -> torch.Tensor:
+    """Horn's symmetric 4x4 matrix, whose top eigenvector is the optimal quaternion"""
+    Sxx, Sxy, Sxz = H[..., 0, 0], H[..., 0, 1], H[..., 0, 2]
+    Syx, Syy, Syz = H[..., 1, 0], H[..., 1, 1], H[..., 1, 2]
+    Szx, Szy, Szz = H[..., 2, 0], H[..., 2, 1], H[..., 2, 2]
+    return torch.stack(
+        [
+            torch.stack([Sxx + Syy + Szz, Syz - Szy, Szx - Sxz, Sxy - Syx], dim=-1),
+            torch.stack([Syz - Szy, Sxx - Syy - Szz, Sxy + Syx, Szx + Sxz], dim=-1),
+            torch.stack([Szx - Sxz, Sxy + Syx, -Sxx + Syy - Szz, Syz + Szy], dim=-1),
+            torch.stack([Sxy - Syx, Szx + Sxz, Syz + Szy, -Sxx - Syy + Szz], dim=-1),
+        ],
+        dim=-2,
+    )  # [..., 4, 4]
+
+
+def _det_and_adjugate_4x4(A: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+    """Determinant [...] and adjugate [..., 4, 4] of 4x4 matrices from their 2x2 minors"""
+    a = [[A[..., i, j] for j in range(4)] for i in range(4)]
+    s0 = a[0][0] * a[1][1] - a[1][0] * a[0][1]
+    s1 = a[0][0] * a[1][2] - a[1][0] * a[0][2]
+    s2 = a[0][0] * a[1][3] - a[1][0] * a[0][3]
+    s3 = a[0][1] * a[1][2] - a[1][1] * a[0][2]
+    s4 = a[0][1] * a[1][3] - a[1][1] * a[0][3]
+    s5 = a[0][2] * a[1][3] - a[1][2] * a[0][3]
+    c5 = a[2][2] * a[3][3] - a[3][2] * a[2][3]
+    c4 = a[2][1] * a[3][3] - a[3][1] * a[2][3]
+    c3 = a[2][1] * a[3][2] - a[3][1] * a[2][2]
+    c2 = a[2][0] * a[3][3] - a[3][0] * a[2][3]
+    c1 = a[2][0] * a[3][2] - a[3][0] * a[2][2]
+    c0 = a[2][0] * a[3][1] - a[3][0] * a[2][1]
+    det = s0 * c5 - s1 * c4 + s2 * c3 + s3 * c2 - s4 * c1 + s5 * c0
+    adj = [
+        [
+            a[1][1] * c5 - a[1][2] * c4 + a[1][3] * c3,
+            -a[0][1] * c5 + a[0][2] * c4 - a[0][3] * c3,
+            a[3][1] * s5 - a[3][2] * s4 + a[3][3] * s3,
+            -a[2][1] * s5 + a[2][2] * s4 - a[2][3] * s3,
+        ],
+        [
+            -a[1][0] * c5 + a[1][2] * c2 - a[1][3] * c1,
+            a[0][0] * c5 - a[0][2] * c2 + a[0][3] * c1,
+            -a[3][0] * s5 + a[3][2] * s2 - a[3][3] * s1,
+            a[2][0] * s5 - a[2][2] * s2 + a[2][3] * s1,
+        ],
+        [
+            a[1][0] * c4 - a[1][1] * c2 + a[1][3] * c0,
+            -a[0][0] * c4 + a[0][1] * c2 - a[0][3] * c0,
+            a[3][0] * s4 - a[3][1] * s2 + a[3][3] * s0,
+            -a[2][0] * s4 + a[2][1] * s2 - a[2][3] * s0,
+        ],
+        [
+            -a[1][0] * c3 + a[1][1] * c1 - a[1][2] * c0,
+            a[0][0] * c3 - a[0][1] * c1 + a[0][2] * c0,
+            -a[3][0] * s3 + a[3][1] * s1 - a[3][2] * s0,
+            a[2][0] * s3 - a[2][1] * s1 + a[2][2] * s0,
+        ],
+    ]
+    return det, torch.stack([torch.stack(row, dim=-1) for row in adj], dim=-2)
+
+
+def _top_eigenvector_by_squaring(M: torch.Tensor, num_squarings: int = 24) -> torch.Tensor:
+    """Top eigenvector of positive semi-definite 4x4 matrices: the columns of M^(2^k)"""
+    for _ in range(num_squarings):
+        M = M / M.abs().amax(dim=(-2, -1), keepdim=True)
+        M = torch.matmul(M, M)
+    col = torch.linalg.norm(M, dim=-2).argmax(dim=-1)
+    return torch.gather(M, -1, col[..., None, None].expand(*M.shape[:-1], 1))[..., 0]
+
+
+def _rotation_by_quaternion(H: torch.Tensor, num_newton_steps: int = 30) -> torch.Tensor:
+    """
+    Rotation maximizing tr(R @ H) with Horn's quaternion method, H: [..., 3, 3].
+
+    The optimal unit quaternion is the top eigenvector of the traceless symmetric 4x4 matrix
+    K built from H. As in the QCP method, its top eigenvalue is the largest root of the
+    characteristic polynomial x^4 - 2 ||H||^2 x^2 - 8 det(H) x + det(K), found by Newton
+    steps from the upper bound ||K||_F = 2 ||H||, and the eigenvector is a row of the
+    adjugate of K - x * I. Everything is elementwise or 4x4 in float64, there is no
+    per-matrix LAPACK call. When the top eigenvalue is (nearly) degenerate, i.e. the
+    optimal rotation is not unique, the eigenvector is found by repeated squaring instead.
+    The number of Newton steps is fixed and the fallback is selected with torch.where,
+    so that the solver never synchronizes with the host.
+    """
+    H = H.to(torch.float64)
+    K = _horn_matrix(H)
+    norm_H = torch.linalg.norm(H, dim=(-2, -1))
+    c2 = -2 * norm_H**2
+    c1 = -8 * torch.linalg.det(H)
+    c0, _ = _det_and_adjugate_4x4(K)
+
+    # Newton steps from above converge monotonically, as all the roots are real. Well
+    # separated roots converge in less than 20 steps, the (nearly) multiple ones that
+    # converge slowly go to the fallback below.
+    x = 2 * norm_H
+    for _ in range(num_newton_steps):
+        p = ((x * x + c2) * x + c1) * x + c0
+        dp = (4 * x * x + 2 * c2) * x + c1
+        step = torch.where(dp > 0, p / dp.clamp(min=1e-300), torch.zeros_like(p))
+        x = x - step.clamp(min=0)
+
+    eye = torch.eye(4, dtype=H.dtype, device=H.device)
+    _, adj = _det_and_adjugate_4x4(K - x[..., None, None] * eye)
+    row_norm = torch.linalg.norm(adj, dim=-1)  # [..., 4]
+    best_norm, row = row_norm.max(dim=-1)
+    q = torch.gather(adj, -2, row[..., None, None].expand(*adj.shape[:-2], 1, 4))[
+        ..., 0, :
+    ]
+    degenerate = best_norm <= 1e-6 * (2 * norm_H) ** 3
+    # K + ||K|| * I is positive semi-definite, the offset keeps K = 0 well defined
+    M = K + (2 * norm_H[..., None, None] + 1e-30) * eye
+    q = torch.where(degenerate[..., None], _top_eigenvector_by_squaring(M), q)
+    q = q / torch.linalg.norm(q, dim=-1, keepdim=True)
+
+    w, x, y, z = q.unbind(dim=-1)
+    return torch.stack(
+        [
+            torch.stack(
+                [w * w + x * x - y * y - z * z, 2 * (x * y - w * z), 2 * (x * z + w * y)],
+                dim=-1,
+            ),
+            torch.stack(
+                [2 * (y * x + w * z), w * w - x * x + y * y - z * z, 2 * (y * z - w * x)],
+                dim=-1,
+            ),
+            torch.stack(
+                [2 * (z * x - w * y), 2 * (z * y + w * x), w * w - x * x - y * y + z * z],
+                dim=-1,
+            ),
+        ],
+        dim=-2,
+    )
+
+
+def weighted_kabsch(
+    src: torch.Tensor,
+    tgt: torch.Tensor,
+    weight: Optional[torch.Tensor] = None,
+    mask: Optional[torch.Tensor] = None,
+    allow_reflection: bool = False,
+    solver: str = "auto",
+    compute_dtype: Optional[torch.dtype] = None,
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    Find the rigid transformation that best aligns src to tgt in the weighted least-squares
+    sense, for any number of leading batch dimensions. The batch dimensions of all the inputs
+    are broadcast together, so e.g. one target can be aligned to many samples without
+    expanding it.
+
+    Args:
+        src (torch.Tensor): the coordinates to move.
+            [..., N, 3]
+        tgt (torch.Tensor): the target coordinates.
+            [..., N, 3]
+        weight (torch.Tensor, optional): the weight of each point. Defaults to 1.
+            [..., N]
+        mask (torch.Tensor, optional): the points to align, multiplied into the weight.
+            [..., N]
+        allow_reflection (bool): whether the transformation may be a reflection.
+            Only supported by the svd solver, which is then always used.
+        solver (str): "quaternion" solves the 3x3 problem with batched closed-form ops in
+            float64, "svd" with torch.svd in compute_dtype. "auto" uses the quaternion solver
+            on GPU, where batched SVD is slow and synchronizes, and torch.svd on CPU.
+        compute_dtype (torch.dtype, optional): dtype of the reductions over the points.
+            Defaults to float32 for half precision inputs, otherwise to the input dtype.
+            Autocast is disabled inside the function.
+
+    Returns:
+        rot (torch.Tensor): the rotation (or reflection) matrix.
+            [..., 3, 3]
+        trans (torch.Tensor): the translation, src @ rot.transpose(-1, -2) + trans ~ tgt.
+            [..., 1, 3]
+    """
+    assert solver in KABSCH_SOLVERS, f"unknown kabsch solver {solver}"
+    if compute_dtype is None:
+        compute_dtype = torch.promote_types(src.dtype, tgt.dtype)
+        if compute_dtype in (torch.float16, torch.bfloat16):
+            compute_dtype = torch.float32
+    if weight is None:
+        weight = torch.ones(src.shape[:-1], dtype=compute_dtype, device=src.device)
+    if mask is not None:
+        weight = weight * mask
+
+    with torch.autocast(device_type=src.device.type, enabled=False):
+        src = src.to(compute_dtype)
+        tgt = tgt.to(compute_dtype)
+        weight = weight.to(compute_dtype).unsqueeze(-1)  # [..., N, 1]
+
+        weight_sum = weight.sum(dim=-2, keepdim=True)  # [..., 1, 1]
+        src_centroid = (src * weight).sum(dim=-2, keepdim=True) / weight_sum
+        tgt_centroid = (tgt * weight).sum(dim=-2, keepdim=True) / weight_sum
+        # [..., 3, 3]
+        H = torch.matmul(
+            ((src - src_centroid) * weight).transpose(-2, -1), tgt - tgt_centroid
+        )
+        if solver == "auto":
+            solver = "svd" if src.device.type == "cpu" else "quaternion"
+        if solver == "svd" or allow_reflection:
+            rot = _rotation_by_svd(H, allow_reflection)
+        else:
+            rot = _rotation_by_quaternion(H).to(compute_dtype)
+        trans = tgt_centroid - torch.matmul(src_centroid, rot.transpose(-1, -2))
+    return rot, trans
+
+
+def apply_transform(
+    pose: torch.Tensor, rot: torch.Tensor, trans: torch.Tensor
+) -> torch.Tensor:
+    """
+    Args:
+        pose (torch.Tensor): [..., N, 3]
+        rot (torch.Tensor): [..., 3, 3]
+        trans (torch.Tensor): [..., 1, 3]
+
+    Returns:
+        torch.Tensor: pose @ rot.transpose(-1, -2) + trans, [..., N, 3]
+    """
+    return torch.matmul(pose, rot.transpose(-1, -2)) + trans
+
+
+def kabsch_align(
+    src: torch.Tensor,
+    tgt: torch.Tensor,
+    weight: Optional[torch.Tensor] = None,
+    mask: Optional[torch.Tensor] = None,
+    allow_reflection: bool = False,
+    solver: str = "auto",
+    compute_dtype: Optional[torch.dtype] = None,
+) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    Align src to tgt, see weighted_kabsch for the arguments.
+
+    Returns:
+        aligned (torch.Tensor): all the points of src moved by the transformation, in the
+            dtype of src.
+            [..., N, 3]
+        rot (torch.Tensor): [..., 3, 3]
+        trans (torch.Tensor): [..., 1, 3]
+    """
+    rot, trans = weighted_kabsch(
+        src, tgt, weight, mask, allow_reflection, solver, compute_dtype
+    )
+    with torch.autocast(device_type=src.device.type, enabled=False):
+        aligned = apply_transform(src.to(rot.dtype), rot, trans)
+    return aligned.to(src.dtype), rot, trans
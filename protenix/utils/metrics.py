@@ -15,7 +15,7 @@
 import numpy as np
 import torch
 
-from protenix.utils.distributed import gather_and_merge
+from protenix.utils.distributed import DIST_WRAPPER, gather_and_merge
 
 common_aggregator = {
     "avg": lambda x: np.mean(x),
@@ -72,3 +72,71 @@ class SimpleMetricAggregator(object):
         if self.need_gather and not self.gather_before_calc:  # need gather after calc
             results = gather_and_merge(results, aggregation_func=np.mean)
         return results
+
+
+class DeviceMetricAggregator(object):
+    """
+    Running averages of metrics, accumulated on the device of the values.
+
+    `add` never moves data to the host, so it does not block the training loop. The sums and counts
+    are reduced across ranks in a single all-reduce in `calc`. The results are the same as
+    SimpleMetricAggregator(["avg"]).
+    """
+
+    def __init__(self, need_gather=True):
+        self.need_gather = need_gather
+        self._sums = {}
+        self._counts = {}
+
+    def add(self, key, value, namespace="default"):
+        plain_key = f"{namespace}/{key}" if namespace != "default" else key
+        if isinstance(value, torch.Tensor):
+            value = value.detach()
+            value_sum, value_count = value.double().sum(), value.numel()
+        elif isinstance(value, (float, int, np.ndarray)):
+            value_sum, value_count = float(np.sum(value)), np.size(value)
+        else:
+            raise ValueError(f"Unsupported type for metric data: {type(value)}")
+        self._sums[plain_key] = self._sums.get(plain_key, 0.0) + value_sum
+        self._counts[plain_key] = self._counts.get(plain_key, 0) + value_count
+
+    def calc(self):
+        sums, self._sums = self._sums, {}
+        counts, self._counts = self._counts, {}
+        need_gather = self.need_gather and DIST_WRAPPER.world_size > 1
+        keys = set(sums)
+        if need_gather:
+            # Ranks may have seen different metrics
+            keys = set().union(*DIST_WRAPPER.all_gather_object(sorted(keys)))
+        keys = sorted(keys)
+        if len(keys) == 0:
+            return {}
+
+        # Reduce where the values are, with a single copy to the host at the end
+        device = next(
+            (v.device for v in sums.values() if isinstance(v, torch.Tensor)),
+            torch.device("cpu"),
+        )
+        if need_gather:
+            if torch.distributed.get_backend() == "nccl":
+                device = torch.device("cuda", torch.cuda.current_device())
+            else:
+                device = torch.device("cpu")
+        stats = torch.stack(
+            [
+                torch.as_tensor(sums.get(key, 0.0), dtype=torch.float64).to(device)
+                for key in keys
+            ]
+            + [
+                torch.tensor(float(counts.get(key, 0)), dtype=torch.float64, device=device)
+                for key in keys
+            ]
+        )
+        if need_gather:
+            torch.distributed.all_reduce(stats)
+        stats = stats.cpu().numpy().reshape(2, len(keys))
+        return {
+            f"{key}.avg": stats[0, i] / stats[1, i]
+            for i, key in enumerate(keys)
+            if stats[1, i] > 0
+        }
@@ -14,8 +14,8 @@
 
 import torch
 
-from protenix.metrics.rmsd import rmsd, self_aligned_rmsd
-from protenix.model.utils import expand_at_dim, pad_at_dim
+from protenix.metrics.rmsd import self_aligned_rmsd
+from protenix.model.utils import expand_at_dim
 from protenix.utils.logger import get_logger
 from protenix.utils.permutation.utils import Checker, save_permutation_error
 
@@ -105,165 +105,173 @@ def run(
         return {}, {}, None
 
 
-def collect_residues_with_symmetric_atoms(
-    coord: torch.Tensor,
-    coord_mask: torch.Tensor,
+# Last input of get_residue_permutations: (ref_space_uid, atom_perm_list, residue_permutations)
+_residue_permutation_cache = {}
+
+
+def build_residue_permutations(
     ref_space_uid: torch.Tensor,
     atom_perm_list: list[list],
     run_checker: bool = False,
-) -> tuple[list]:
-    """Convert atom-level permutation attributes to residue-level attributes.
-    Only residues that require symmetric corrections are returned.
+) -> dict:
+    """Convert atom-level permutation attributes to flat index tensors over the candidate
+    permutations of all residues. Residues are bucketed by (N_res_atom, N_perm), so each bucket is
+    converted with a single tensor op. Only residues with a non-identity permutation are kept.
+
+    The candidates of a residue are the identity followed by its unique permutations, sorted like
+    torch.unique(dim=...). Each (residue, candidate, atom) triple is an entry of the flat tensors,
+    so the RMSDs of all the candidates are computed by one gather and one index_add.
+    This only depends on the input features, see get_residue_permutations for the cached version.
 
     Args:
-        coord (torch.Tensor): Coordinates of atoms.
-            [N_atom, 3]
-        coord_mask (torch.Tensor): The mask indicating whether the atom is resolved in GT.
-            [N_atom]
         ref_space_uid (torch.Tensor): Each (chain id, residue index) tuple has a unique ID.
             [N_atom]
         atom_perm_list (list[list]): The atom permutation list, where each sublist contains
                                    the permutation information of the corresponding residue.
             len(atom_perm_list) = N_atom.
             len(atom_perm_list[i]) = N_perm for the residue of atom i.
+        run_checker (bool): If true, check the permutations.
 
+    Returns:
+        dict: A dictionary containing
+            - N_res (int): number of residues.
+            - N_perm_res (int): number of residues with a non-identity permutation.
+            - N_max_perm (int): max number of candidates per residue, including the identity.
+            - slot (torch.Tensor): [N_entry] residue index * N_max_perm + candidate index.
+            - atom_index (torch.Tensor): [N_entry] index of the atom.
+            - permuted_atom_index (torch.Tensor): [N_entry] index of the atom moved to atom_index
+                by the candidate permutation.
+            - is_candidate (torch.Tensor): [N_perm_res, N_max_perm] False for the padded and
+                duplicated candidates.
     """
-
-    device = coord_mask.device
+    device = ref_space_uid.device
+    N_atom = len(ref_space_uid)
 
     # Find start & end positions of each residue
-    diff = torch.tensor([True] + (ref_space_uid[1:] != ref_space_uid[:-1]).tolist())
-    start_positions = torch.cat(
-        (torch.nonzero(diff, as_tuple=True)[0], torch.tensor([len(ref_space_uid)]))
-    )
-    res_start_end = list(
-        zip(start_positions[:-1].tolist(), start_positions[1:].tolist())
-    )  # [N_res, 2]
-    N_res = len(res_start_end)
+    is_start = torch.ones(N_atom, dtype=torch.bool, device=device)
+    is_start[1:] = ref_space_uid[1:] != ref_space_uid[:-1]
+    starts = torch.nonzero(is_start).squeeze(-1)
+    ends = torch.cat([starts[1:], starts.new_tensor([N_atom])])
+    N_res = len(starts)
     assert N_res == len(torch.unique(ref_space_uid))
 
-    position_list = []
-    perm_list = []
-    coord_list = []
-    coord_mask_list = []
-
-    # Traverse residues and store the corresponding data
-    for start, end in res_start_end:
-
-        assert len(torch.unique(ref_space_uid[start:end])) == 1
-
-        # Skip if this residue contains < 3 resolved atoms.
-        # Alignment requires at least 3 atoms to obtain a reasonable result.
-        res_coord_mask = coord_mask[start:end].bool()  # [N_res_atom]
-        if res_coord_mask.sum() < 3:
-            continue
-
-        # Drop duplicated permutations
-        perm = torch.tensor(atom_perm_list[start:end], device=device, dtype=torch.long)
-        perm = torch.unique(perm, dim=-1)  # [N_res_atom, N_perm]
-        N_res_atom, N_perm = perm.size()
+    # Bucket residues by (N_res_atom, N_perm)
+    buckets = {}
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        buckets.setdefault((end - start, len(atom_perm_list[start])), []).append(start)
+
+    bucket_list = []
+    for (N_res_atom, N_perm), bucket_starts in buckets.items():
+        res_start = torch.tensor(bucket_starts, dtype=torch.long, device=device)
+        if isinstance(atom_perm_list, torch.Tensor):
+            perm = atom_perm_list[
+                res_start[:, None] + torch.arange(N_res_atom, device=device)
+            ].to(device=device, dtype=torch.long)
+        else:
+            perm = torch.tensor(
+                [atom_perm_list[start : start + N_res_atom] for start in bucket_starts],
+                dtype=torch.long,
+                device=device,
+            )
+        perm = perm.transpose(-1, -2)  # [N_bucket_res, N_perm, N_res_atom]
 
         # Basic checks
-        assert perm.min().item() == 0
-        assert perm.max().item() == N_res_atom - 1
-
-        # Development checks
+        assert (perm.amin(dim=(-1, -2)) == 0).all()
+        assert (perm.amax(dim=(-1, -2)) == N_res_atom - 1).all()
         if run_checker:
-            Checker.are_permutations(perm, dim=0)
-            Checker.contains_identity(perm, dim=0)
+            Checker.are_permutations(perm, dim=-1)
 
-        # If all symmetric atoms are unresolved, drop the permutation
-        identity_perm = torch.arange(len(perm), device=device).unsqueeze(
-            dim=-1
-        )  # [N_res_atom, 1]
-        is_sym_atom = perm != identity_perm  # [N_res_atom, N_perm]
-        is_sym_atom_resolved = is_sym_atom * res_coord_mask.unsqueeze(dim=-1)
-        is_valid_perm = is_sym_atom_resolved.any(dim=0)
-        if not is_valid_perm.any():
-            # Skip if no valid permutation (other than identity) exists
+        # Skip residues without any non-identity permutation
+        identity = torch.arange(N_res_atom, device=device)
+        has_sym_atom = (perm != identity).any(dim=-1).any(dim=-1)
+        perm, res_start = perm[has_sym_atom], res_start[has_sym_atom]
+        if len(res_start) == 0:
             continue
-        perm = perm[..., is_valid_perm]
-        perm = torch.cat([identity_perm, perm], dim=-1)  # Put identity to the first
-        perm = perm.transpose(-1, -2)  # [N_perm, N_res_atom]
 
-        position_list.append((start, end))
-        perm_list.append(perm)
-        coord_mask_list.append(res_coord_mask)
-        coord_list.append(coord[start:end, :])
-
-    return position_list, coord_list, coord_mask_list, perm_list, N_res
-
-
-def collect_permuted_coords(
-    coord_list: list[torch.Tensor],
-    coord_mask_list: list[torch.Tensor],
-    perm_list: list[torch.Tensor],
+        # Sort the permutations lexicographically and flag the duplicated ones, like torch.unique
+        order = torch.arange(N_perm, device=device).expand(len(res_start), N_perm)
+        for i in reversed(range(N_res_atom)):
+            key = perm[..., i].gather(-1, order)
+            order = order.gather(-1, torch.sort(key, dim=-1, stable=True).indices)
+        perm = perm.gather(1, order.unsqueeze(-1).expand_as(perm))
+        is_unique = torch.ones(perm.shape[:-1], dtype=torch.bool, device=device)
+        is_unique[:, 1:] = (perm[:, 1:] != perm[:, :-1]).any(dim=-1)
+
+        # Put identity to the first
+        perm = torch.cat([identity.expand(len(res_start), 1, N_res_atom), perm], dim=1)
+        is_unique = torch.cat([is_unique.new_ones(len(res_start), 1), is_unique], dim=1)
+        bucket_list.append((res_start, perm, is_unique))
+
+    N_perm_res = sum(len(res_start) for res_start, _, _ in bucket_list)
+    N_max_perm = max([perm.size(1) for _, perm, _ in bucket_list], default=1)
+    is_candidate = torch.zeros(
+        (N_perm_res, N_max_perm), dtype=torch.bool, device=device
+    )
+    slot, atom_index, permuted_atom_index = [], [], []
+    res_offset = 0
+    for res_start, perm, is_unique in bucket_list:
+        N_bucket_res, N_perm, N_res_atom = perm.size()
+        res_index = res_offset + torch.arange(N_bucket_res, device=device)
+        cand_index = torch.arange(N_perm, device=device)
+        is_candidate[res_index, :N_perm] = is_unique
+        slot.append(
+            (res_index[:, None, None] * N_max_perm + cand_index[None, :, None])
+            .expand_as(perm)
+            .flatten()
+        )
+        atom_index.append(
+            (res_start[:, None, None] + torch.arange(N_res_atom, device=device))
+            .expand_as(perm)
+            .flatten()
+        )
+        permuted_atom_index.append((res_start[:, None, None] + perm).flatten())
+        res_offset += N_bucket_res
+
+    empty = torch.zeros(0, dtype=torch.long, device=device)
+    return {
+        "N_res": N_res,
+        "N_perm_res": N_perm_res,
+        "N_max_perm": N_max_perm,
+        "slot": torch.cat(slot) if slot else empty,
+        "atom_index": torch.cat(atom_index) if atom_index else empty,
+        "permuted_atom_index": (
+            torch.cat(permuted_atom_index) if permuted_atom_index else empty
+        ),
+        "is_candidate": is_candidate,
+    }
+
+
+def get_residue_permutations(
+    ref_space_uid: torch.Tensor,
+    atom_perm_list: list[list],
     run_checker: bool = False,
-) -> tuple[torch.Tensor]:
-    """Apply permutations to coordinates and coordinate masks
+) -> dict:
+    """Cached build_residue_permutations. The result of the last input is kept, and reused when the
+    same ref_space_uid and atom_perm_list objects are passed again, e.g. when the label and then the
+    diffusion samples of the same input are permuted.
 
     Args:
-        coord_list (list[torch.Tensor]): A list of coordinates.
-            Each element is a tensor of shape [N_res_atom, 3]. The value N_res_atom can
-            vary across different residues.
-        coord_mask_list (list[torch.Tensor]): A list of coordinate masks.
-            Each element is a tensor of shape [N_res_atom].
-        perm_list (list[torch.Tensor]): list of permutations.
-            Each element is a long tensor of shape [N_perm, N_res_atom]. The value N_perm
-            can vary across different residues.
+        Please refer to the args of `build_residue_permutations`.
 
     Returns:
-        torch.Tensor:
-            [N_total_perm, MAX_N_res_atom, 3]
-            [N_total_perm, MAX_N_res_atom]
+        dict: Please refer to `build_residue_permutations`.
     """
-
-    MAX_N_res_atom = max(perm.size(-1) for perm in perm_list)
-    perm_coord = []  # [N_total_perm, N_res_atom, 3]
-    perm_coord_mask = []  # [N_total_perm, N_res_atom]
-
-    N_total_perm = 0
-    for perm, res_coord, res_coord_mask in zip(perm_list, coord_list, coord_mask_list):
-
-        # Basic shape checks
-        N_perm, N_res_atom = perm.size()
-        assert res_coord.size(-1) == 3
-        assert res_coord.size(0) == res_coord_mask.size(0) == perm.size(-1)
-
-        # Permute coordinates & masks
-        res_coord_permuted = res_coord[perm]  # [N_perm, N_res_atom, 3]
-        res_coord_mask_permuted = res_coord_mask[perm]  # [N_perm, N_res_atom]
-        assert res_coord_permuted.size() == (N_perm, N_res_atom, 3)
-        assert res_coord_mask_permuted.size() == (N_perm, N_res_atom)
-
-        if run_checker:
-            Checker.are_permutations(perm, dim=-1)
-            Checker.batch_permute(perm, res_coord, res_coord_permuted)
-            Checker.batch_permute(perm, res_coord_mask, res_coord_mask_permuted)
-
-        # Pad to MAX_N_res_atom
-        N_res_atom = perm.size(dim=-1)
-        if N_res_atom < MAX_N_res_atom:
-            pad_length = (0, MAX_N_res_atom - N_res_atom)
-            res_coord_permuted = pad_at_dim(
-                res_coord_permuted, dim=-2, pad_length=pad_length
-            )  # [N_perm, MAX_N_res_atom, 3]
-            res_coord_mask_permuted = pad_at_dim(
-                res_coord_mask_permuted, dim=-1, pad_length=pad_length
-            )
-
-        N_total_perm += N_perm
-        perm_coord.append(res_coord_permuted)
-        perm_coord_mask.append(res_coord_mask_permuted)
-
-    perm_coord = torch.cat(perm_coord, dim=0)
-    perm_coord_mask = torch.cat(perm_coord_mask, dim=0)
-
-    # Shape check
-    assert perm_coord.size() == (N_total_perm, MAX_N_res_atom, 3)
-    assert perm_coord_mask.size() == (N_total_perm, MAX_N_res_atom)
-
-    return perm_coord, perm_coord_mask
+    cached = _residue_permutation_cache.get("last")
+    if (
+        cached is not None
+        and cached[0] is ref_space_uid
+        and cached[1] is atom_perm_list
+    ):
+        return cached[2]
+    residue_permutations = build_residue_permutations(
+        ref_space_uid, atom_perm_list, run_checker=run_checker
+    )
+    _residue_permutation_cache["last"] = (
+        ref_space_uid,
+        atom_perm_list,
+        residue_permutations,
+    )
+    return residue_permutations
 
 
 class AtomPermutation(object):
@@ -365,154 +373,109 @@ class AtomPermutation(object):
             assert len(batch_shape) == 1
             return torch.stack([identity for _ in range(batch_shape[0])], dim=0)
 
+    @staticmethod
+    def _get_valid_candidates(
+        residue_permutations: dict, true_coord_mask: torch.Tensor
+    ) -> tuple[torch.Tensor]:
+        """Find the candidate permutations that move resolved atoms, and the residues to optimize.
+
+        Args:
+            residue_permutations (dict): the output of `get_residue_permutations`.
+            true_coord_mask (torch.Tensor): The mask indicating whether the atom is resolved.
+                [N_atom]
+
+        Returns:
+            is_valid_candidate (torch.Tensor): [N_perm_res, N_max_perm], always True for the identity.
+            is_valid_residue (torch.Tensor): [N_perm_res] residues with >= 3 resolved atoms and a valid
+                non-identity candidate.
+        """
+        slot = residue_permutations["slot"]
+        atom_index = residue_permutations["atom_index"]
+        permuted_atom_index = residue_permutations["permuted_atom_index"]
+        is_candidate = residue_permutations["is_candidate"]
+        coord_mask = true_coord_mask.bool()
+
+        # If all symmetric atoms are unresolved, drop the permutation
+        is_sym_atom_resolved = (permuted_atom_index != atom_index) & coord_mask[atom_index]
+        n_sym_atom_resolved = torch.zeros(
+            is_candidate.numel(), device=slot.device
+        ).index_add_(0, slot, is_sym_atom_resolved.float())
+        is_valid_candidate = is_candidate & (n_sym_atom_resolved.view_as(is_candidate) > 0)
+        is_valid_candidate[:, 0] = True
+
+        # Skip residues with < 3 resolved atoms.
+        # Alignment requires at least 3 atoms to obtain a reasonable result.
+        n_resolved = torch.zeros(is_candidate.numel(), device=slot.device).index_add_(
+            0, slot, coord_mask[atom_index].float()
+        )
+        is_valid_residue = (n_resolved.view_as(is_candidate)[:, 0] >= 3) & (
+            is_valid_candidate[:, 1:].any(dim=-1)
+        )
+        return is_valid_candidate, is_valid_residue
+
     @staticmethod
     def _optimize_per_residue_permutation_by_rmsd(
-        per_residue_pred_coord_list: list[torch.Tensor],
-        per_residue_coord_list: list[torch.Tensor],
-        per_residue_coord_mask_list: list[torch.Tensor],
-        per_residue_perm_list: list[torch.Tensor],
+        pred_coord: torch.Tensor,
+        true_coord: torch.Tensor,
+        true_coord_mask: torch.Tensor,
+        residue_permutations: dict,
+        is_valid_candidate: torch.Tensor,
         eps: float = 1e-8,
-        run_checker: bool = False,
-    ) -> tuple[list[torch.Tensor]]:
+    ) -> tuple[torch.Tensor]:
         """Find the optimal permutations of true coordinates and coordinate masks to minimize the
-        RMSD between true coordinates and predicted coordinates.
+        RMSD between true coordinates and predicted coordinates of each residue.
+        The RMSDs of all the candidates of all the residues are computed at once.
 
         Args:
-            per_residue_pred_coord_list (torch.Tensor): List of residues. Each element records
-                the predicted atom coordinates of one residue. Each element has shape
-                [N_res_atom, 3] or [Batch, N_res_atom, 3]
-            per_residue_coord_list (list[torch.Tensor]): List of residues. Each element records
-                the atom coordinates of one residue. Each element has shape [N_res_atom, 3].
-            per_residue_coord_mask_list (list[torch.Tensor]): List of residues. Each element records
-                the atom coordinate masks of one residue. Each element has shape [N_res_atom].
-            per_residue_perm_list (list[torch.Tensor]): List of residues. Each element records
-                the atom permutations of one residue. Each element has shape [N_perm, N_res_atom].
-            eps (float, optional): A small number, used in alignment. Defaults to 1e-8.
-            run_checker (bool, optional): If True, run extensive checks.
+            pred_coord (torch.Tensor): Predicted coordinates, aligned to the true coordinates.
+                [N_atom, 3] or [Batch, N_atom, 3]
+            true_coord (torch.Tensor): True coordinates.
+                [N_atom, 3]
+            true_coord_mask (torch.Tensor): The mask indicating whether the atom is resolved.
+                [N_atom]
+            residue_permutations (dict): the output of `get_residue_permutations`.
+            is_valid_candidate (torch.Tensor): the output of `_get_valid_candidates`.
+                [N_perm_res, N_max_perm]
+            eps (float, optional): A small number, used in rmsd. Defaults to 1e-8.
 
         Returns:
-            best_permutation_list (list[torch.Tensor]): List of residues. Each element records the
-                optimal permutation that should apply to true coordinates for one residue. Each element
-                has shape
-                [N_res_atom] or [Batch, N_res_atom]
-            is_permuted_list (list[torch.Tensor]): List of residues. Each element records whether the
-                atoms in this residue is permuted. Each element has shape
-                [] or [Batch]
-            optimized_rmsd_list (list[torch.Tensor]): List of residues. Each element records the optimized
-                rmsd of the residue. Each element has shape
-                [] or [Batch]
-            original_rmsd_list (list[torch.Tensor]): List of residues. Each element records the original
-                rmsd of the residue. Each element has shape
-                [] or [Batch]
+            best_candidate (torch.Tensor): index of the best candidate of each residue, 0 is the identity.
+                [N_perm_res] or [Batch, N_perm_res]
+            optimized_rmsd (torch.Tensor): the optimized rmsd of each residue.
+                [N_perm_res] or [Batch, N_perm_res]
+            original_rmsd (torch.Tensor): the rmsd of each residue without permutation.
+                [N_perm_res] or [Batch, N_perm_res]
         """
+        slot = residue_permutations["slot"]
+        atom_index = residue_permutations["atom_index"]
+        permuted_atom_index = residue_permutations["permuted_atom_index"]
+        batch_shape = pred_coord.shape[:-2]
+        N_slot = is_valid_candidate.numel()
 
-        # Find max number of per-residue atoms
-        per_residue_N_perm = [perm.size(0) for perm in per_residue_perm_list]
-        per_residue_N_atom = [perm.size(1) for perm in per_residue_perm_list]
-        N_max_atom = max(per_residue_N_atom)
-
-        # Permute true coordinates & masks according to the permutations in per_residue_perm_list
-        permuted_coord, permuted_coord_mask = collect_permuted_coords(
-            coord_list=per_residue_coord_list,
-            coord_mask_list=per_residue_coord_mask_list,
-            perm_list=per_residue_perm_list,
-            run_checker=run_checker,
-        )  # [N_total_perm, N_max_atom, 3], [N_total_perm, N_max_atom]
-        assert permuted_coord.size(-2) == permuted_coord_mask.size(-1) == N_max_atom
-        N_total_perm = permuted_coord.size(0)
-
-        # Pad 'pred_coord' to the same shape as 'permuted_coord'
-        per_residue_pred_coord_list = [
-            pad_at_dim(
-                p_coord, dim=-2, pad_length=(0, N_max_atom - p_coord.size(dim=-2))
-            )
-            for p_coord in per_residue_pred_coord_list
-        ]
-        # Repeat N_perm times for each residue
-        pred_coord = torch.stack(
-            sum(
-                [
-                    [p_coord] * N_perm
-                    for N_perm, p_coord in zip(
-                        per_residue_N_perm, per_residue_pred_coord_list
-                    )
-                ],
-                [],
-            ),
-            dim=-3,
-        )  # [N_total_perm, N_max_atom, 3] or [Batch, N_total_perm, N_max_atom, 3]
-        assert pred_coord.shape[-3:] == (N_total_perm, N_max_atom, 3)
-
-        batch_shape = pred_coord.shape[:-3]
-        assert len(batch_shape) in [0, 1]
-        if len(batch_shape) == 1:
-            # expand true coord & mask to have the same batch size as pred coord
-            Batch = pred_coord.size(0)
-            permuted_coord = expand_at_dim(permuted_coord, dim=0, n=Batch)
-            permuted_coord_mask = expand_at_dim(permuted_coord_mask, dim=0, n=Batch)
-
-        # Compute per-residue rmsd
         with torch.cuda.amp.autocast(enabled=False):
-            per_res_rmsd = rmsd(
-                pred_pose=pred_coord.to(torch.float32),
-                true_pose=permuted_coord.to(torch.float32),
-                mask=permuted_coord_mask,
-                eps=eps,
-                reduce=False,
-            )  # [N_total_perm] or [Batch, N_total_perm]
-            assert per_res_rmsd.size() == batch_shape + (N_total_perm,)
-
-        # Find the best permutation
-        best_permutation_list = []
-        is_permuted_list = []
-        original_rmsd_list = []
-        optimized_rmsd_list = []
-        i = 0
-
-        # Enumerate over all residues (could be improved by scatter)
-        for N_perm, N_res_atom, perm in zip(
-            per_residue_N_perm, per_residue_N_atom, per_residue_perm_list
-        ):
-            cur_res_rmsd = per_res_rmsd[..., i : i + N_perm]  # [batch_shape, N_perm]
-            best_rmsd, best_j = torch.min(cur_res_rmsd, dim=-1)  # [batch_shape]
-            best_perm = perm[best_j]  # [batch_shape, N_res_atom]
-            best_permutation_list.append(best_perm)
-
-            is_permuted_list.append(
-                best_j > 0
-            )  # The first of the perm lists is the identity
-
-            optimized_rmsd_list.append(best_rmsd)
-            original_rmsd_list.append(cur_res_rmsd[..., 0])
-
-            i += N_perm
-
-            if run_checker:
-                assert perm.size() == (N_perm, N_res_atom)
-                assert cur_res_rmsd.size() == batch_shape + (N_perm,)
-                assert best_rmsd.size() == batch_shape
-                assert best_j.size() == batch_shape
-                assert best_perm.size() == batch_shape + (N_res_atom,)
-                Checker.are_permutations(best_perm, dim=-1)
-
-                def _check_identity(j_value, perm):
-                    if j_value > 0:
-                        Checker.not_contain_identity(perm)
-                    else:
-                        Checker.contains_identity(perm)
-
-                if best_j.dim() == 0:
-                    _check_identity(best_j, best_perm)
-                else:
-                    for j_value, perm_j in zip(best_j, best_perm):
-                        _check_identity(j_value, perm_j)
+            # Squared error of each (residue, candidate, atom) entry
+            permuted_coord_mask = true_coord_mask[permuted_atom_index].float()
+            squared_error = torch.square(
+                pred_coord[..., atom_index, :].to(torch.float32)
+                - true_coord[permuted_atom_index].to(torch.float32)
+            ).sum(dim=-1) * permuted_coord_mask  # [..., N_entry]
+            # Reduce to the per-candidate rmsd
+            squared_error = squared_error.new_zeros(batch_shape + (N_slot,)).index_add_(
+                -1, slot, squared_error
+            )
+            n_atom = permuted_coord_mask.new_zeros(N_slot).index_add_(
+                0, slot, permuted_coord_mask
+            )
+            per_candidate_rmsd = (squared_error / n_atom).add(eps).sqrt()
+            per_candidate_rmsd = per_candidate_rmsd.view(
+                batch_shape + is_valid_candidate.shape
+            )
 
-        return (
-            best_permutation_list,
-            is_permuted_list,
-            optimized_rmsd_list,
-            original_rmsd_list,
+        # Find the best permutation. The first of the candidates is the identity.
+        optimized_rmsd, best_candidate = torch.min(
+            per_candidate_rmsd.masked_fill(~is_valid_candidate, torch.inf), dim=-1
         )
+        return best_candidate, optimized_rmsd, per_candidate_rmsd[..., 0]
 
     def __call__(
         self,
@@ -570,37 +533,39 @@ class AtomPermutation(object):
         )
 
         # Collect residues that require permutations
-        (
-            per_residue_position_list,
-            per_residue_coord_list,
-            per_residue_coord_mask_list,
-            per_residue_perm_list,
-            N_res,
-        ) = collect_residues_with_symmetric_atoms(
-            coord=true_coord,
-            coord_mask=true_coord_mask,
-            ref_space_uid=ref_space_uid,
-            atom_perm_list=atom_perm_list,
-            run_checker=run_checker,
+        residue_permutations = get_residue_permutations(
+            ref_space_uid, atom_perm_list, run_checker=run_checker
         )
-        log_dict["N_res"] = N_res
-        log_dict["N_res_with_symmetry"] = len(per_residue_coord_list)
+        is_valid_candidate, is_valid_residue = self._get_valid_candidates(
+            residue_permutations, true_coord_mask
+        )
+        log_dict["N_res"] = residue_permutations["N_res"]
+        log_dict["N_res_with_symmetry"] = is_valid_residue.sum().item()
         log_dict["N_res_permuted"] = 0.0
         log_dict["has_res_permuted"] = 0
 
         # If no residues contain symmetry, return now.
-        if not per_residue_perm_list:
+        if log_dict["N_res_with_symmetry"] == 0:
             print("No atom permutation is needed. Return the identity permutation.")
             return (permutation, log_dict)
 
+        slot = residue_permutations["slot"]
+        atom_index = residue_permutations["atom_index"]
+        permuted_atom_index = residue_permutations["permuted_atom_index"]
+        N_max_perm = residue_permutations["N_max_perm"]
+        entry_residue = torch.div(slot, N_max_perm, rounding_mode="floor")
+        entry_candidate = slot % N_max_perm
+
         # no_permute_atom_mask: 1 represent this atom can not be permuted
-        no_permute_atom_mask = torch.ones_like(true_coord_mask)
-        for (start, end), per_residue_perm in zip(
-            per_residue_position_list, per_residue_perm_list
-        ):
-            no_permute_atom_mask[start:end] = 1 - (
-                (per_residue_perm != per_residue_perm[0]).sum(dim=0) > 0
-            ).to(torch.int32)
+        is_sym_atom = (
+            (permuted_atom_index != atom_index)
+            & is_valid_candidate.flatten()[slot]
+            & is_valid_residue[entry_residue]
+        )
+        n_sym = torch.zeros(N_atom, device=device).index_add_(
+            0, atom_index, is_sym_atom.float()
+        )
+        no_permute_atom_mask = (n_sym == 0).to(true_coord_mask.dtype)
 
         # Perform a global alignment of predictions to true coordinates
         if alignment_mask is None:
@@ -630,78 +595,32 @@ class AtomPermutation(object):
         )
         log_dict["unpermuted_rmsd"] = aligned_rmsd.mean().item()  # [Batch]
 
-        """ 
-        To efficiently optimize the residues parallely, group the residues
-        according to the number of atoms in each residue.
-        """
-        per_residue_N_atom = [coord.size(0) for coord in per_residue_coord_list]
-        res_atom_cutoff = [15, 30, 50, 100, 100000]
-        grouped_indices = {}
-        for i, n in enumerate(per_residue_N_atom):
-            for atom_cutoff in res_atom_cutoff:
-                if n <= atom_cutoff:
-                    break
-            grouped_indices.setdefault(atom_cutoff, []).append(i)
-
-        assert len(sum(list(grouped_indices.values()), [])) == len(
-            per_residue_perm_list
-        )
-
-        residue_position_list = []
-        residue_best_permutation_list = []
-        residue_is_permuted_list = []
-        residue_optimized_rmsd_list = []
-        residue_original_rmsd_list = []
-        for atom_cutoff, residue_group in grouped_indices.items():
-
-            if verbose:
-                print(f"{len(residue_group)} residues have <={atom_cutoff} atoms.")
-
-            # Enumerte permutations within each residue to minimize per-residue RMSD
-            per_res_pos_list = [per_residue_position_list[i] for i in residue_group]
-            (
-                per_res_best_permutation,
-                per_res_is_permuted,
-                per_res_optimized_rmsd,
-                per_res_ori_rmsd,
-            ) = self._optimize_per_residue_permutation_by_rmsd(
-                per_residue_pred_coord_list=[
-                    transformed_pred_coord[..., pos[0] : pos[1], :]
-                    for pos in per_res_pos_list
-                ],
-                per_residue_coord_list=[
-                    per_residue_coord_list[i] for i in residue_group
-                ],
-                per_residue_coord_mask_list=[
-                    per_residue_coord_mask_list[i] for i in residue_group
-                ],
-                per_residue_perm_list=[per_residue_perm_list[i] for i in residue_group],
-                eps=self.eps,
-                run_checker=self.run_checker,
-            )
-            residue_position_list.extend(per_res_pos_list)
-            residue_best_permutation_list.extend(per_res_best_permutation)
-            residue_is_permuted_list.extend(per_res_is_permuted)
-            residue_optimized_rmsd_list.extend(per_res_optimized_rmsd)
-            residue_original_rmsd_list.extend(per_res_ori_rmsd)
+        # Enumerate permutations within each residue to minimize per-residue RMSD
+        best_candidate, _, _ = self._optimize_per_residue_permutation_by_rmsd(
+            pred_coord=transformed_pred_coord,
+            true_coord=true_coord,
+            true_coord_mask=true_coord_mask,
+            residue_permutations=residue_permutations,
+            is_valid_candidate=is_valid_candidate,
+            eps=self.eps,
+        )  # [..., N_perm_res]
+        best_candidate = best_candidate * is_valid_residue
 
         # Aggregate per_residue results
-        # 1. Best permutation
-        indices_list = [
-            torch.arange(pos[0], pos[1], device=device) for pos in residue_position_list
-        ]
-        residue_atom_indices = torch.cat(indices_list, dim=-1)  # [N_perm_atom]
-        residue_best_permutation = torch.cat(
-            [
-                ind[perm]
-                for ind, perm in zip(indices_list, residue_best_permutation_list)
-            ],
-            dim=-1,
-        )  # [Batch, N_perm_atom] or [N_perm_atom]
-        permutation[..., residue_atom_indices] = residue_best_permutation
+        # 1. Best permutation: scatter the entries of the best candidates
+        is_best = entry_candidate == best_candidate[..., entry_residue]  # [..., N_entry]
+        if len(batch_shape) == 0:
+            permutation[atom_index[is_best]] = permuted_atom_index[is_best]
+        else:
+            batch_index, entry_index = torch.nonzero(is_best, as_tuple=True)
+            permutation[batch_index, atom_index[entry_index]] = permuted_atom_index[
+                entry_index
+            ]
+        if self.run_checker or run_checker:
+            Checker.are_permutations(permutation, dim=-1)
 
         # 2. Other statistics
-        is_res_permuted = torch.stack(residue_is_permuted_list, dim=-1).float()
+        is_res_permuted = (best_candidate > 0).float()
         log_dict["N_res_permuted"] = is_res_permuted.sum(dim=-1).mean().item()
         log_dict["has_res_permuted"] = (
             (is_res_permuted.sum(dim=-1) > 0).float().mean().item()
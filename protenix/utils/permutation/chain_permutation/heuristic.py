@@ -16,7 +16,7 @@ import random
 
 import torch
 
-from protenix.metrics.rmsd import rmsd, self_aligned_rmsd
+from protenix.metrics.rmsd import align_pred_to_true, rmsd, self_aligned_rmsd
 from protenix.utils.logger import get_logger
 from protenix.utils.permutation.chain_permutation.utils import (
     apply_transform,
@@ -104,32 +104,31 @@ def correct_symmetric_chains(
         return output_dict, log_dict, permute_pred_indices, permute_label_indices
     else:
         assert not permute_label, "Only supports prediction permutations in batch mode."
+        assert pred_dict["coordinate"].size(-2) == label_full_dict["coordinate"].size(
+            -2
+        )
         pred_coord = []
         log_dict = {}
         best_matches = []
         permute_pred_indices = []
         permute_label_indices = []
-        # Loop over all samples to find best matches one by one
-        for i, pred_coord_i in enumerate(pred_dict["coordinate"]):
-            (
-                best_match_i,
-                permute_pred_indices_i,
-                permute_label_indices_i,
-                pred_dict_i,
-                log_dict_i,
-            ) = _correct_symmetric_chains_for_one_sample(
-                {**pred_dict, "coordinate": pred_coord_i},
-                label_full_dict,
-                max_num_chains,
-                permute_label=False,
-                extra_label_keys=[],
-                **kwargs,
+        # Find the best matches of all samples at once
+        with torch.no_grad():
+            results = MultiChainPermutation(**kwargs).batched_call(
+                pred_dict=pred_dict,
+                label_full_dict=label_full_dict,
+                max_num_chains=max_num_chains,
             )
-
+        for pred_coord_i, (
+            best_match_i,
+            permute_pred_indices_i,
+            permute_label_indices_i,
+            log_dict_i,
+        ) in zip(pred_dict["coordinate"], results):
             best_matches.append(best_match_i)
             permute_pred_indices.append(permute_pred_indices_i)
             permute_label_indices.append(permute_label_indices_i)
-            pred_coord.append(pred_dict_i["coordinate"])
+            pred_coord.append(pred_coord_i[permute_pred_indices_i.tolist(), :])
             for key, value in log_dict_i.items():
                 log_dict.setdefault(key, []).append(value)
 
@@ -475,6 +474,19 @@ class MultiChainPermutation(object):
             anchor_pred_asym_id (int): selected asym chain.
         """
 
+        # If multiple asym chains remain, return a random one.
+        anchor_pred_asym_id = random.choice(self._find_anchor_candidates())
+
+        return anchor_pred_asym_id
+
+    def _find_anchor_candidates(self) -> list[int]:
+        """
+        Find the candidate anchor chains in the prediction, see find_anchor_asym_chain_in_predictions.
+
+        Return:
+            candidate_asyms (list[int]): the candidate asym chains, any of them can be the anchor.
+        """
+
         # Do not consider asym with fewer than 4 tokens in Prediction
         asym_to_asym_length = {
             asym_id: len(asym_dict["coordinate"])
@@ -540,11 +552,7 @@ class MultiChainPermutation(object):
             for asym_id in candidate_asyms
             if asym_to_asym_length[asym_id] == max_asym_length
         ]
-
-        # If multiple asym chains remain, return a random one.
-        anchor_pred_asym_id = random.choice(candidate_asyms)
-
-        return anchor_pred_asym_id
+        return candidate_asyms
 
     @staticmethod
     def _select_atoms_by_mol_atom_index(input_dict: dict, mol_atom_index: torch.Tensor):
@@ -754,6 +762,228 @@ class MultiChainPermutation(object):
 
         return best_gt_asym_id, best_error
 
+    def _build_chain_pair_index(self) -> dict[str, torch.Tensor]:
+        """
+        Token indices of all the (pred chain, groundtruth chain) pairs of the same entity, padded to
+        the longest predicted chain. The label tokens of a pair are selected by the mol_atom_index of
+        the predicted chain, as in _select_atoms_by_mol_atom_index.
+
+        Returns:
+            dict[str, torch.Tensor]: A dictionary containing
+                - pred_asym_ids / gt_asym_ids: the asym ids of the P predicted and G groundtruth chains.
+                - pred_index: [P, L] indices of the tokens of each predicted chain.
+                - label_index: [P, G, L] indices of the matching label tokens of each pair.
+                - pair_mask: [P, G, L] resolved tokens of each pair, False for pairs of different entities.
+                - same_entity: [P, G] whether the two chains have the same entity.
+        """
+        pred_asym_ids = list(self.pred_asym_dict.keys())
+        gt_asym_ids = list(self.label_asym_dict.keys())
+        pred_mol_id = self.pred_token_dict["mol_id"]
+        label_mol_id = self.label_token_dict["mol_id"]
+        device = pred_mol_id.device
+        P, G = len(pred_asym_ids), len(gt_asym_ids)
+        L = max(len(asym_dict["coordinate"]) for asym_dict in self.pred_asym_dict.values())
+
+        pred_index = torch.zeros((P, L), dtype=torch.long, device=device)
+        pred_pad_mask = torch.zeros((P, L), dtype=torch.bool, device=device)
+        label_index = torch.zeros((P, G, L), dtype=torch.long, device=device)
+        same_entity = torch.zeros((P, G), dtype=torch.bool, device=device)
+        label_token_index = torch.arange(len(label_mol_id), device=device)
+        for i, pred_asym_id in enumerate(pred_asym_ids):
+            index = torch.nonzero(pred_mol_id == pred_asym_id).squeeze(-1)
+            pred_index[i, : len(index)] = index
+            pred_pad_mask[i, : len(index)] = True
+            entity_id = self.pred_token_dict["asym_to_entity"][pred_asym_id]
+            for j, gt_asym_id in enumerate(gt_asym_ids):
+                if self.label_token_dict["asym_to_entity"][gt_asym_id] != entity_id:
+                    continue
+                gt_mask = label_mol_id == gt_asym_id
+                gt_asym_dict = MultiChainPermutation._select_atoms_by_mol_atom_index(
+                    {
+                        "mol_atom_index": self.label_token_dict["mol_atom_index"][gt_mask],
+                        "indices": label_token_index[gt_mask],
+                    },
+                    self.pred_asym_dict[pred_asym_id]["mol_atom_index"],
+                )
+                label_index[i, j, : len(index)] = gt_asym_dict["indices"]
+                same_entity[i, j] = True
+
+        pair_mask = (
+            pred_pad_mask[:, None, :]
+            & same_entity[..., None]
+            & self.label_token_dict["coordinate_mask"].bool()[label_index]
+        )
+        return {
+            "pred_asym_ids": pred_asym_ids,
+            "gt_asym_ids": gt_asym_ids,
+            "pred_index": pred_index,
+            "label_index": label_index,
+            "pair_mask": pair_mask,
+            "same_entity": same_entity,
+        }
+
+    def compute_best_match_heuristic_batched(
+        self, pred_token_coordinate: torch.Tensor
+    ) -> list[dict[int, int]]:
+        """
+        Batched compute_best_match_heuristic over the diffusion samples. The samples share the chain
+        layout parsed by process_input, so all the (sample, candidate anchor) alignments are solved
+        with a single batched SVD, and the greedy chain matching runs on tensors of chain centroid
+        distances of shape [N_sample, N_anchor, N_pred_chain, N_gt_chain].
+        The random anchor choices are drawn in the same order as calling compute_best_match_heuristic
+        sample by sample, so the chosen matches are the same.
+
+        Args:
+            pred_token_coordinate (torch.Tensor): coordinates of the predicted tokens. Shape: [N_sample, N_token, 3].
+
+        Returns:
+            list[dict[int, int]]: the best match of each sample, mapping pred chain IDs to those of the groundtruth.
+        """
+        pair_index = self._build_chain_pair_index()
+        pred_asym_ids, gt_asym_ids = pair_index["pred_asym_ids"], pair_index["gt_asym_ids"]
+        pair_mask, same_entity = pair_index["pair_mask"], pair_index["same_entity"]
+        pred_pos = {asym_id: i for i, asym_id in enumerate(pred_asym_ids)}
+        gt_pos = {asym_id: j for j, asym_id in enumerate(gt_asym_ids)}
+        N_sample = pred_token_coordinate.size(0)
+        P, G = len(pred_asym_ids), len(gt_asym_ids)
+        device = pred_token_coordinate.device
+
+        # Candidate anchor pairs of each sample, drawing the random choices in the per-sample order
+        anchor_candidates = self._find_anchor_candidates()
+        anchor_pairs = []
+        for _ in range(N_sample):
+            anchor_pred_asym_id = random.choice(anchor_candidates)
+            anchor_entity_id = self.pred_token_dict["asym_to_entity"][anchor_pred_asym_id]
+            if self.find_gt_anchor_first:
+                anchor_gt_asym_id = random.choice(
+                    self.label_token_dict["entity_to_asym"][anchor_entity_id].tolist()
+                )
+                anchor_pairs.append(
+                    [
+                        (gt_pos[anchor_gt_asym_id], pred_pos[k])
+                        for k in self.pred_token_dict["entity_to_asym"][
+                            anchor_entity_id
+                        ].tolist()
+                    ]
+                )
+            else:
+                anchor_pairs.append(
+                    [
+                        (gt_pos[k], pred_pos[anchor_pred_asym_id])
+                        for k in self.label_token_dict["entity_to_asym"][
+                            anchor_entity_id
+                        ].tolist()
+                    ]
+                )
+        N_anchor = max(len(pairs) for pairs in anchor_pairs)
+        anchor_gt = torch.zeros((N_sample, N_anchor), dtype=torch.long, device=device)
+        anchor_pred = torch.zeros((N_sample, N_anchor), dtype=torch.long, device=device)
+        anchor_valid = torch.zeros((N_sample, N_anchor), dtype=torch.bool, device=device)
+        for i, pairs in enumerate(anchor_pairs):
+            anchor_gt[i, : len(pairs)] = torch.tensor([g for g, _ in pairs], device=device)
+            anchor_pred[i, : len(pairs)] = torch.tensor([p for _, p in pairs], device=device)
+            anchor_valid[i, : len(pairs)] = True
+
+        with torch.cuda.amp.autocast(enabled=False):
+            # [N_sample, P, L, 3]
+            pred_coord = pred_token_coordinate.to(torch.float32)[
+                :, pair_index["pred_index"]
+            ]
+            # [P, G, L, 3]
+            label_coord = self.label_token_dict["coordinate"].to(torch.float32)[
+                pair_index["label_index"]
+            ]
+            float_mask = pair_mask.to(torch.float32)
+
+            # Align GT anchors to Pred anchors, [N_sample, N_anchor]
+            anchor_mask = pair_mask[anchor_pred, anchor_gt]
+            # Anchors without resolved tokens are skipped
+            anchor_valid = anchor_valid & anchor_mask.any(dim=-1)
+            anchor_mask = torch.where(
+                anchor_valid[..., None], anchor_mask, torch.ones_like(anchor_mask)
+            )
+            sample_index = torch.arange(N_sample, device=device)[:, None]
+            _, rot, trans = align_pred_to_true(
+                pred_pose=label_coord[anchor_pred, anchor_gt],
+                true_pose=pred_coord[sample_index, anchor_pred],
+                atom_mask=anchor_mask.to(torch.float32),
+                allowing_reflection=False,
+            )
+
+            # Centroids of the resolved tokens of each pair, the transform of the mean is the mean of
+            # the transformed tokens.
+            n_resolved = float_mask.sum(dim=-1)  # [P, G]
+            resolved = n_resolved > 0
+            label_center = torch.einsum("pgld,pgl->pgd", label_coord, float_mask)
+            label_center = label_center / n_resolved.clamp(min=1)[..., None]
+            pred_center = torch.einsum("spld,pgl->spgd", pred_coord, float_mask)
+            pred_center = pred_center / n_resolved.clamp(min=1)[..., None]
+            aligned_label_center = apply_transform(
+                label_center.reshape(1, 1, P * G, 3), rot, trans
+            ).reshape(N_sample, N_anchor, P, G, 3)
+            # [N_sample, N_anchor, P, G]
+            center_dist = torch.norm(aligned_label_center - pred_center[:, None], dim=-1)
+
+        # Greedily match the remaining chains, longer chains choose their match first
+        match = torch.zeros((N_sample, N_anchor, P), dtype=torch.long, device=device)
+        is_anchor = torch.zeros((N_sample, N_anchor, P), dtype=torch.bool, device=device)
+        available = torch.ones((N_sample, N_anchor, G), dtype=torch.bool, device=device)
+        match.scatter_(-1, anchor_pred[..., None], anchor_gt[..., None])
+        is_anchor.scatter_(-1, anchor_pred[..., None], True)
+        available.scatter_(-1, anchor_gt[..., None], False)
+        order = sorted(
+            range(P),
+            key=lambda i: -self.pred_asym_dict[pred_asym_ids[i]]["coordinate"].size(-2),
+        )
+        for i in order:
+            candidates = available & same_entity[i]
+            assert (candidates.any(dim=-1) | is_anchor[..., i] | ~anchor_valid).all()
+            resolved_candidates = candidates & resolved[i]
+            # The closest resolved candidate, or the first candidate if they are all unresolved
+            closest = center_dist[..., i, :].masked_fill(~resolved_candidates, torch.inf)
+            chosen = torch.where(
+                resolved_candidates.any(dim=-1),
+                closest.argmin(dim=-1),
+                candidates.to(torch.int8).argmax(dim=-1),
+            )
+            chosen = torch.where(is_anchor[..., i], match[..., i], chosen)
+            match[..., i] = chosen
+            available.scatter_(-1, chosen[..., None], False)
+
+        # Score the matches, [N_sample, N_anchor, P]
+        chain_index = torch.arange(P, device=device)
+        matched_resolved = resolved[chain_index, match]
+        if self.use_center_rmsd:
+            chain_rmsd = center_dist.gather(-1, match[..., None]).squeeze(-1)
+        else:
+            with torch.cuda.amp.autocast(enabled=False):
+                matched_mask = float_mask[chain_index, match]
+                matched_coord = label_coord[chain_index, match]  # [N_sample, N_anchor, P, L, 3]
+                aligned_coord = apply_transform(
+                    matched_coord.flatten(2, 3), rot, trans
+                ).view_as(matched_coord)
+                err2 = (
+                    torch.square(aligned_coord - pred_coord[:, None]).sum(dim=-1)
+                    * matched_mask
+                ).sum(dim=-1) / matched_mask.sum(dim=-1).clamp(min=1)
+                chain_rmsd = err2.sqrt()
+        chain_rmsd = torch.where(
+            matched_resolved, chain_rmsd, torch.zeros_like(chain_rmsd)
+        )
+        total_rmsd = chain_rmsd.mean(dim=-1).masked_fill(~anchor_valid, torch.inf)
+
+        assert anchor_valid.any(dim=-1).all()
+        best_anchor = total_rmsd.argmin(dim=-1)
+        best_matches = []
+        for matched_gt in match[sample_index.squeeze(-1), best_anchor].tolist():
+            best_matches.append(
+                {
+                    pred_asym_id: gt_asym_ids[j]
+                    for pred_asym_id, j in zip(pred_asym_ids, matched_gt)
+                }
+            )
+        return best_matches
+
     @staticmethod
     def build_permuted_indice(
         pred_dict: dict, label_full_dict: dict, best_match: dict[int, int]
@@ -866,6 +1096,26 @@ class MultiChainPermutation(object):
 
         best_match = self.compute_best_match_heuristic()
 
+        return self.check_best_match(pred_dict, label_full_dict, best_match)
+
+    def check_best_match(
+        self,
+        pred_dict: dict[str, torch.Tensor],
+        label_full_dict: dict[str, torch.Tensor],
+        best_match: dict[int, int],
+    ):
+        """
+        Build the permutation indices of the best match, and revert it to the original chain assignment
+        if it does not improve the aligned RMSD (unless accept_it_as_it_is).
+
+        Args:
+            pred_dict (dict): A dictionary containing the predicted coordinates. Shape: [N_atom, 3].
+            label_full_dict (dict): A dictionary containing the groundtruth and its attributes.
+            best_match (dict[int, int]): {pred_mol_id: gt_mol_id} best match found by the heuristic.
+
+        Returns:
+            tuple: the same as __call__.
+        """
         permuted_indices = self.build_permuted_indice(
             pred_dict, label_full_dict, best_match
         )
@@ -944,3 +1194,48 @@ class MultiChainPermutation(object):
             permute_pred_indices = None
 
         return best_match, permute_pred_indices, permuted_indices, log_dict
+
+    def batched_call(
+        self,
+        pred_dict: dict[str, torch.Tensor],
+        label_full_dict: dict[str, torch.Tensor],
+        max_num_chains: int = 20,
+    ):
+        """
+        Call function for a batch of predicted samples sharing the same features, equivalent to calling
+        the class on each sample in turn.
+
+        Args:
+            pred_dict (dict): A dictionary containing the predicted coordinates. Shape: [N_sample, N_atom, 3].
+            label_full_dict (dict): A dictionary containing the groundtruth and its attributes.
+            max_num_chains (int): Maximum number of chains allowed.
+
+        Returns:
+            list[tuple]: the outputs of __call__ for each sample.
+        """
+        pred_coordinate = pred_dict["coordinate"]
+        pred_dict = {**pred_dict, "coordinate": pred_coordinate[0]}
+        match, has_sym_chain = self.process_input(
+            pred_dict, label_full_dict, max_num_chains
+        )
+
+        if match is not None:
+            indices = self.build_permuted_indice(pred_dict, label_full_dict, match)
+            pred_indices = torch.argsort(indices)
+            return [
+                (match, pred_indices.clone(), indices.clone(), {"has_sym_chain": False})
+                for _ in range(pred_coordinate.size(0))
+            ]
+
+        rep_atom_mask = pred_dict["pae_rep_atom_mask"].bool()
+        best_matches = self.compute_best_match_heuristic_batched(
+            pred_coordinate[:, rep_atom_mask]
+        )
+        return [
+            self.check_best_match(
+                {**pred_dict, "coordinate": pred_coordinate_i},
+                label_full_dict,
+                best_match,
+            )
+            for pred_coordinate_i, best_match in zip(pred_coordinate, best_matches)
+        ]
@@ -101,20 +101,29 @@ def permute_pred_to_optimize_pocket_aligned_rmsd(
     # Enumerate over the batch dimension of pred_coord
     # to find the optimal chain assignment for each sample.
 
+    # Align every candidate pocket of every sample to the true pocket at once
+    N_sample = pred_coord.size(0)
+    pocket_atom_index = torch.stack(
+        [mask.nonzero().squeeze(-1) for mask in candidate_pockets.values()]
+    )  # [N_pocket, N_pocket_atom]
+    # [N_sample, N_pocket, N_pocket_atom, 3]
+    pred_pocket_coord = pred_coord[:, pocket_atom_index]
+    pocket_rot, pocket_trans = get_optimal_transform(
+        src_atoms=pred_pocket_coord,
+        tgt_atoms=true_coord[true_pocket_mask].expand_as(pred_pocket_coord),
+        mask=true_coord_mask[true_pocket_mask].expand(pred_pocket_coord.shape[:-1]),
+    )  # [N_sample, N_pocket, 3, 3], [N_sample, N_pocket, 1, 3]
+
     def _find_protein_ligand_chains_for_one_sample(
         coord: torch.Tensor,
+        rots: torch.Tensor,
+        transs: torch.Tensor,
     ):
         best_results = {}
         unpermuted_results = {}
-        for poc_asym_id, pocket_mask in candidate_pockets.items():
-            # Align pocket_i to true pocket
-            rot, trans = get_optimal_transform(
-                src_atoms=coord[pocket_mask].clone(),
-                tgt_atoms=true_coord[true_pocket_mask],
-                mask=true_coord_mask[true_pocket_mask],
-            )
-            # Transform predicted coordinates according to the aligment results
-            aligned_pred_coord = apply_transform(coord.clone(), rot=rot, trans=trans)
+        for k, poc_asym_id in enumerate(candidate_pockets):
+            # Transform predicted coordinates according to the aligment of pocket_k to true pocket
+            aligned_pred_coord = apply_transform(coord, rot=rots[k], trans=transs[k])
 
             # Find the best ligand
             ordered_lig_asym_ids = [i for i in candidate_ligands]
@@ -232,13 +241,14 @@ def permute_pred_to_optimize_pocket_aligned_rmsd(
 
         return atom_indices, aligned_pred_coord, per_sample_log_dict
 
-    N_sample = pred_coord.size(0)
     permute_pred_indices = []
     permuted_aligned_pred_coord = []
     sample_log_dicts = []
     for i in range(N_sample):
         atom_indices, aligned_pred_coord, per_sample_log_dict = (
-            _find_protein_ligand_chains_for_one_sample(pred_coord[i])
+            _find_protein_ligand_chains_for_one_sample(
+                pred_coord[i], pocket_rot[i], pocket_trans[i]
+            )
         )
         permute_pred_indices.append(atom_indices)
         permuted_aligned_pred_coord.append(aligned_pred_coord)
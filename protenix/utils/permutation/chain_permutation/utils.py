@@ -14,7 +14,7 @@
 
 import torch
 
-from protenix.metrics.rmsd import align_pred_to_true
+from protenix.utils.kabsch import apply_transform, weighted_kabsch
 
 
 def get_optimal_transform(
@@ -24,12 +24,12 @@ def get_optimal_transform(
 ) -> tuple[torch.Tensor]:
     """
     A function that obtain the transformation that optimally align
-    src_atoms to tgt_atoms.
+    src_atoms to tgt_atoms. Leading batch dimensions are aligned independently.
 
     Args:
-        src_atoms: ground-truth centre atom positions, shape: [N, 3]
-        tgt_atoms: predicted centre atom positions, shape: [N, 3]
-        mask: a vector of boolean values, shape: [N]
+        src_atoms: ground-truth centre atom positions, shape: [..., N, 3]
+        tgt_atoms: predicted centre atom positions, shape: [..., N, 3]
+        mask: a vector of boolean values, shape: [..., N]
 
     Returns:
         tuple[torch.Tensor]: A rotation matrix that records the optimal rotation
@@ -39,25 +39,20 @@ def get_optimal_transform(
     assert src_atoms.shape == tgt_atoms.shape, (src_atoms.shape, tgt_atoms.shape)
     assert src_atoms.shape[-1] == 3
     if mask is not None:
-        mask = mask.bool()
-        assert mask.dim() == 1, "mask should have the shape of [N]"
         assert mask.shape[-1] == src_atoms.shape[-2]
-        src_atoms = src_atoms[mask, :]
-        tgt_atoms = tgt_atoms[mask, :]
-
-    with torch.cuda.amp.autocast(enabled=False):
-        _, rot, trans = align_pred_to_true(
-            pred_pose=src_atoms.to(dtype=torch.float32),
-            true_pose=tgt_atoms.to(dtype=torch.float32),
-            allowing_reflection=False,
-        )  # svd alignment does not support BF16
-
+        # Masked atoms get a zero weight instead of being indexed out, to keep the batch shape.
+        # Their coordinates are zeroed as they may be undefined.
+        mask = mask.bool()
+        src_atoms = torch.where(mask[..., None], src_atoms, 0.0)
+        tgt_atoms = torch.where(mask[..., None], tgt_atoms, 0.0)
+        mask = mask.to(torch.float32)
+
+    # svd alignment does not support BF16
+    rot, trans = weighted_kabsch(
+        src_atoms, tgt_atoms, mask=mask, compute_dtype=torch.float32
+    )
     return rot, trans
 
 
-def apply_transform(pose, rot, trans):
-    return torch.matmul(pose, rot.transpose(-1, -2)) + trans
-
-
 def num_unique_matches(match_list: list[dict]):
     return len({tuple(sorted(match.items())) for match in match_list})
@@ -21,21 +21,33 @@ from torch import nn
 from torch.nn.parameter import Parameter
 
 
-def to_device(obj, device):
+def to_device(obj, device, non_blocking: bool = False):
     """Move tensor or dict of tensors to device"""
     if isinstance(obj, dict):
         for k, v in obj.items():
             if isinstance(v, dict):
-                to_device(v, device)
+                to_device(v, device, non_blocking)
             elif isinstance(v, torch.Tensor):
-                obj[k] = obj[k].to(device)
+                obj[k] = obj[k].to(device, non_blocking=non_blocking)
     elif isinstance(obj, torch.Tensor):
-        obj = obj.to(device)
+        obj = obj.to(device, non_blocking=non_blocking)
     else:
         raise Exception(f"type {type(obj)} not supported")
     return obj
 
 
+def record_stream(obj, stream: torch.cuda.Stream):
+    """Mark the CUDA tensors of a (nested) dict or list as used by stream, see Tensor.record_stream"""
+    if isinstance(obj, list):
+        for x in obj:
+            record_stream(x, stream)
+    elif isinstance(obj, dict):
+        for v in obj.values():
+            record_stream(v, stream)
+    elif isinstance(obj, torch.Tensor) and obj.is_cuda:
+        obj.record_stream(stream)
+
+
 def cdist(a: torch.Tensor, b: torch.Tensor = None):
     # for tensor shape [1, 512 * 14, 3], donot_use_mm_for_euclid_dist mode costs 0.0489s,
     # while use_mm_for_euclid_dist_if_necessary costs 0.0419s on cpu. On GPU there two costs
@@ -13,6 +13,8 @@
 # limitations under the License.
 
 import inspect
+from contextlib import contextmanager
+from typing import Iterable, Iterator
 
 import torch
 import torch.distributed as dist
@@ -116,3 +118,29 @@ def is_loss_nan_check(loss: torch.Tensor) -> bool:
     if nan_flag.item() > 0.0:
         return True
     return False
+
+
+@contextmanager
+def zero_grads_if(
+    parameters: Iterable[torch.Tensor], condition: torch.Tensor
+) -> Iterator[None]:
+    """Zero the gradients that the backward passes in the context add to the parameters if condition is True.
+
+    The gradients are masked on device by hooks, as they reach the parameters. The NaN of a bad
+    loss never makes it to .grad, nor to the gradients reduced by DDP, and the gradients already
+    accumulated by the other iterations are kept.
+
+    Args:
+        parameters: the parameters of the model
+        condition: bool tensor with a single element, on the device of the parameters
+    """
+    handles = [
+        p.register_hook(lambda grad: grad.masked_fill(condition, 0.0))
+        for p in parameters
+        if p.requires_grad
+    ]
+    try:
+        yield
+    finally:
+        for handle in handles:
+            handle.remove()
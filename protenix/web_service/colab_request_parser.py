@@ -28,7 +28,6 @@ import numpy as np
 
 import protenix.data.ccd as ccd
 import requests
-from protenix.data.json_to_feature import SampleDictToFeatures
 from protenix.web_service.colab_request_utils import run_mmseqs2_service
 from protenix.web_service.dependency_url import URL
 
@@ -156,6 +155,9 @@ class RequestParser(object):
         tmp_json_dict = deepcopy(input_json_dict)
         tmp_json_dict["sequences"] = sequences
 
+        # The featurizer pulls in torch, only import it when a json is parsed
+        from protenix.data.json_to_feature import SampleDictToFeatures
+
         cache_paths = self.download_data_cache()
         ccd.COMPONENTS_FILE = cache_paths["ccd_components_file"]
         ccd.RKDIT_MOL_PKL = Path(cache_paths["ccd_components_rdkit_mol_file"])
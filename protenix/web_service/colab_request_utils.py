@@ -12,11 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import concurrent.futures
 import logging
 import os
+import random
 import tarfile
+import threading
 import time
-from typing import List, Tuple
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
 
 import requests
 from requests.auth import HTTPBasicAuth
@@ -29,6 +32,25 @@ username = "example_user"
 password = "example_password"
 
 
+def get_mmseqs2_mode(
+    use_env: bool = True,
+    use_filter: bool = True,
+    use_pairing: bool = False,
+    pairing_strategy: str = "greedy",
+) -> str:
+    """The search mode sent to the MMseqs2 server."""
+    if use_pairing:
+        # greedy is default, complete was the previous behavior
+        if pairing_strategy == "greedy":
+            return "pairgreedy"
+        elif pairing_strategy == "complete":
+            return "paircomplete"
+        return ""
+    if use_filter:
+        return "env" if use_env else "all"
+    return "env-nofilter" if use_env else "nofilter"
+
+
 def run_mmseqs2_service(
     x,
     prefix,
@@ -162,20 +184,10 @@ def run_mmseqs2_service(
         use_filter = filter
 
     # setup mode
-    if use_filter:
-        mode = "env" if use_env else "all"
-    else:
-        mode = "env-nofilter" if use_env else "nofilter"
-
+    mode = get_mmseqs2_mode(use_env, use_filter, use_pairing, pairing_strategy)
     if use_pairing:
         use_templates = False
         use_env = False
-        mode = ""
-        # greedy is default, complete was the previous behavior
-        if pairing_strategy == "greedy":
-            mode = "pairgreedy"
-        elif pairing_strategy == "complete":
-            mode = "paircomplete"
 
     # define path
     path = prefix
@@ -257,3 +269,261 @@ def run_mmseqs2_service(
                 )
             else:
                 print("Files downloaded and extracted successfully.")
+
+
+class MMseqs2ServiceError(Exception):
+    """The MMseqs2 server rejected a query or is not available."""
+
+
+class MMseqs2Client(object):
+    """
+    Runs many single-sequence searches on a ColabFold compatible MMseqs2 server concurrently.
+
+    Each search is submitted, polled and downloaded by one of max_in_flight threads, so at
+    most max_in_flight tickets are pending on the server at a time. The polling interval of
+    a ticket grows geometrically while it is running, and a RATELIMIT reply slows down all
+    the threads until the server accepts tickets again. Transient network and 5xx errors
+    are retried with jittered exponential backoff.
+    """
+
+    def __init__(
+        self,
+        host_url: str = "https://api.colabfold.com",
+        max_in_flight: int = 8,
+        mode: str = "env",
+        user_agent: str = "",
+        email: str = "",
+        timeout: float = 6.02,
+        max_retries: int = 5,
+        min_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        max_submit_wait: float = 1800.0,
+    ) -> None:
+        """
+        Args:
+            host_url (str): url of the server.
+            max_in_flight (int): maximal number of concurrent searches.
+            mode (str): search mode, see get_mmseqs2_mode.
+            user_agent (str): User-Agent header of the requests.
+            email (str): contact email sent with the tickets.
+            timeout (float): timeout of each http request in seconds.
+            max_retries (int): number of retries of a failing http request.
+            min_backoff (float): first polling and retry interval in seconds.
+            max_backoff (float): maximal polling and retry interval in seconds.
+            max_submit_wait (float): maximal time in seconds a submission waits while the
+                server replies RATELIMIT or UNKNOWN.
+        """
+        self.host_url = host_url.rstrip("/")
+        self.max_in_flight = max_in_flight
+        self.mode = mode
+        self.email = email
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.max_submit_wait = max_submit_wait
+        self.headers = {"User-Agent": user_agent} if user_agent else {}
+        self.auth = HTTPBasicAuth(username, password)
+        self._local = threading.local()
+        # Shared by all threads: no ticket is submitted before _not_before
+        self._lock = threading.Lock()
+        self._not_before = 0.0
+        self._ratelimit_backoff = min_backoff
+
+    def _session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _sleep_backoff(self, attempt: int) -> None:
+        delay = min(self.max_backoff, self.min_backoff * 2**attempt)
+        time.sleep(delay * random.uniform(0.5, 1.0))
+
+    def _request(self, method: str, endpoint: str, **kwargs) -> requests.Response:
+        url = f"{self.host_url}/{endpoint}"
+        for attempt in range(self.max_retries + 1):
+            try:
+                res = self._session().request(
+                    method,
+                    url,
+                    timeout=self.timeout,
+                    headers=self.headers,
+                    auth=self.auth,
+                    **kwargs,
+                )
+                if res.status_code < 500:
+                    return res
+                error = f"status {res.status_code}"
+            except requests.exceptions.RequestException as e:
+                error = str(e)
+            if attempt == self.max_retries:
+                raise MMseqs2ServiceError(
+                    f"{method} {url} failed after {attempt + 1} attempts: {error}"
+                )
+            logger.warning(
+                f"{method} {url} failed ({error}), retrying ({attempt + 1}/{self.max_retries})"
+            )
+            self._sleep_backoff(attempt)
+
+    def _json(self, res: requests.Response) -> dict:
+        try:
+            return res.json()
+        except ValueError:
+            logger.error(f"Server didn't reply with json: {res.text}")
+            return {"status": "ERROR"}
+
+    def _wait_ratelimit(self) -> None:
+        with self._lock:
+            delay = self._not_before - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _on_ratelimit(self) -> None:
+        with self._lock:
+            self._not_before = max(self._not_before, time.time() + self._ratelimit_backoff)
+            self._ratelimit_backoff = min(self.max_backoff, 2 * self._ratelimit_backoff)
+
+    def _on_accepted(self) -> None:
+        with self._lock:
+            self._ratelimit_backoff = max(self.min_backoff, self._ratelimit_backoff / 2)
+
+    def submit(self, seq: str) -> dict:
+        """
+        Submit a search, waiting while the server is rate limiting.
+
+        Args:
+            seq (str): protein sequence.
+
+        Returns:
+            dict: the ticket, with its "id" and "status".
+
+        Raises:
+            MMseqs2ServiceError: if the server still rate limits after max_submit_wait seconds.
+        """
+        deadline = time.time() + self.max_submit_wait
+        while True:
+            self._wait_ratelimit()
+            res = self._request(
+                "POST",
+                "ticket/msa",
+                data={"q": f">query_0\n{seq}", "mode": self.mode, "email": self.email},
+            )
+            out = self._json(res)
+            if out["status"] not in ["UNKNOWN", "RATELIMIT"]:
+                break
+            if time.time() >= deadline:
+                raise MMseqs2ServiceError(
+                    f"MSA server still replied {out['status']} after "
+                    f"{self.max_submit_wait:.0f}s, giving up"
+                )
+            logger.info(f"MSA server replied {out['status']}, backing off")
+            self._on_ratelimit()
+        if out["status"] == "ERROR":
+            raise MMseqs2ServiceError(
+                "MMseqs2 API is giving errors. Please confirm your input is a valid protein sequence."
+            )
+        if out["status"] == "MAINTENANCE":
+            raise MMseqs2ServiceError(
+                "MMseqs2 API is undergoing maintenance. Please try again in a few minutes."
+            )
+        self._on_accepted()
+        return out
+
+    def wait(self, ticket: dict) -> None:
+        """
+        Poll a ticket until the search is complete.
+
+        Args:
+            ticket (dict): the ticket returned by submit.
+        """
+        out, interval = ticket, self.min_backoff
+        while out["status"] in ["UNKNOWN", "RUNNING", "PENDING"]:
+            time.sleep(interval * random.uniform(0.8, 1.2))
+            interval = min(self.max_backoff, interval * 1.5)
+            out = self._json(self._request("GET", f"ticket/{ticket['id']}"))
+        if out["status"] != "COMPLETE":
+            raise MMseqs2ServiceError(
+                f"MMseqs2 search {ticket['id']} ended with status {out['status']}"
+            )
+
+    def download(self, ticket: dict, out_dir: str) -> None:
+        """
+        Download the result tarball of a complete ticket and extract it into out_dir.
+
+        Args:
+            ticket (dict): the ticket returned by submit.
+            out_dir (str): the directory of the a3m and m8 files.
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        tar_gz_file = os.path.join(out_dir, "out.tar.gz")
+        res = self._request("GET", f"result/download/{ticket['id']}", stream=True)
+        if res.status_code != 200:
+            raise MMseqs2ServiceError(
+                f"Download of {ticket['id']} failed with status {res.status_code}"
+            )
+        with open(tar_gz_file, "wb") as f:
+            for chunk in res.iter_content(chunk_size=1 << 16):
+                f.write(chunk)
+        with tarfile.open(tar_gz_file) as tar_gz:
+            tar_gz.extractall(out_dir)
+        if not os.path.exists(os.path.join(out_dir, "0.a3m")):
+            raise FileNotFoundError(f"0.a3m not found in the result of {ticket['id']}")
+
+    def search(self, seq: str, out_dir: str) -> str:
+        """
+        Run one search and extract its result into out_dir.
+
+        Args:
+            seq (str): protein sequence.
+            out_dir (str): the directory of the a3m and m8 files.
+
+        Returns:
+            str: out_dir.
+        """
+        ticket = self.submit(seq)
+        self.wait(ticket)
+        self.download(ticket, out_dir)
+        return out_dir
+
+    def search_many(
+        self,
+        seq_to_out_dir: Mapping[str, str],
+        on_done: Optional[Callable[[str, str], None]] = None,
+    ) -> Dict[str, Optional[Exception]]:
+        """
+        Run the searches concurrently, max_in_flight at a time.
+
+        Args:
+            seq_to_out_dir (Mapping[str, str]): the result directory of each sequence.
+            on_done (Callable[[str, str], None], optional): called with the sequence and
+                its result directory as soon as a search completes, from the worker thread.
+
+        Returns:
+            Dict[str, Optional[Exception]]: the error of each sequence, None on success.
+        """
+
+        def run(seq: str, out_dir: str) -> None:
+            self.search(seq, out_dir)
+            if on_done is not None:
+                on_done(seq, out_dir)
+
+        errors = {}
+        if not seq_to_out_dir:
+            return errors
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(self.max_in_flight, len(seq_to_out_dir))
+        ) as executor:
+            futures = {
+                executor.submit(run, seq, out_dir): seq
+                for seq, out_dir in seq_to_out_dir.items()
+            }
+            for future in tqdm(
+                concurrent.futures.as_completed(futures),
+                total=len(futures),
+                bar_format=TQDM_BAR_FORMAT,
+            ):
+                seq = futures[future]
+                errors[seq] = future.exception()
+                if errors[seq] is not None:
+                    logger.warning(f"MSA search failed for {seq}: {errors[seq]}")
+        return errors
@@ -0,0 +1,257 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A local stand-in for the ColabFold MMseqs2 server, to test the MSA clients offline.
+
+It speaks the ticket protocol used by MMseqs2Client and run_mmseqs2_service:
+    POST /ticket/msa              -> {"id", "status"}
+    GET  /ticket/<id>             -> {"id", "status"}
+    GET  /result/download/<id>    -> tar.gz with 0.a3m, uniref_tax.m8 and pdb70_220313_db.m8
+and serves canned results derived from the query, after a fixed search time. It can
+rate limit, reject invalid sequences and inject transient server errors.
+
+    python -m protenix.web_service.mock_mmseqs2_server --port 8080 --search_time 2
+"""
+
+import argparse
+import io
+import json
+import tarfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+from urllib.parse import parse_qs
+
+from protenix.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+AMINO_ACIDS = set("ACDEFGHIKLMNPQRSTVWYXBZUO")
+
+
+def make_result_tarball(seq: str, num_hits: int = 4) -> bytes:
+    """
+    Canned search result of a sequence: hits with one mutated residue, half of them
+    from the UniRef database with a taxonomy ID, half from the environmental database.
+
+    Args:
+        seq (str): the query sequence.
+        num_hits (int): number of hits per database.
+
+    Returns:
+        bytes: the tar.gz content.
+    """
+    lines, m8_lines = [">101", seq], []
+    for db in ["uniref", "env"]:
+        if db == "env":
+            # the query is repeated at the start of the environmental hits
+            lines.extend([">101", seq])
+        for i in range(num_hits):
+            j = i % len(seq)
+            hit = seq[:j] + ("A" if seq[j] != "A" else "G") + seq[j + 1 :]
+            name = f"UniRef100_MOCK{i}" if db == "uniref" else f"ENV_MOCK{i}"
+            lines.extend([f">{name}\t{90 - i}", hit])
+            if db == "uniref":
+                m8_lines.append(f"101\t{name}\t{9606 + i}")
+    files = {
+        "0.a3m": "\n".join(lines) + "\n",
+        "uniref_tax.m8": "\n".join(m8_lines) + "\n",
+        "pdb70_220313_db.m8": "",
+    }
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, content in files.items():
+            data = content.encode()
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+class MockMMseqs2Server(object):
+    """
+    Mock MMseqs2 server running in a background thread.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        search_time: float = 0.5,
+        max_running: int = 0,
+        fail_every: int = 0,
+    ) -> None:
+        """
+        Args:
+            host (str): host to listen on.
+            port (int): port to listen on, 0 picks a free port.
+            search_time (float): seconds before a ticket is COMPLETE.
+            max_running (int): reply RATELIMIT when this many tickets are running,
+                0 for no limit.
+            fail_every (int): reply 503 to every fail_every-th request, 0 never fails.
+        """
+        self.search_time = search_time
+        self.max_running = max_running
+        self.fail_every = fail_every
+        self.lock = threading.Lock()
+        self.tickets = {}
+        self.stats = {
+            "requests": 0,
+            "submitted": 0,
+            "ratelimited": 0,
+            "failed": 0,
+            "max_running": 0,
+        }
+        self.httpd = ThreadingHTTPServer((host, port), make_request_handler(self))
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockMMseqs2Server":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "MockMMseqs2Server":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def _num_running(self, now: float) -> int:
+        return sum(
+            now - t["submit_time"] < self.search_time
+            for t in self.tickets.values()
+            if t["status"] != "ERROR"
+        )
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            self.stats["requests"] += 1
+            fail = self.fail_every > 0 and self.stats["requests"] % self.fail_every == 0
+            self.stats["failed"] += fail
+            return fail
+
+    def submit(self, query: str) -> dict:
+        seq = "".join(
+            line.strip() for line in query.splitlines() if not line.startswith(">")
+        )
+        now = time.time()
+        with self.lock:
+            num_running = self._num_running(now)
+            if self.max_running > 0 and num_running >= self.max_running:
+                self.stats["ratelimited"] += 1
+                return {"status": "RATELIMIT"}
+            ticket_id = uuid.uuid4().hex
+            valid = len(seq) > 0 and set(seq.upper()) <= AMINO_ACIDS
+            self.tickets[ticket_id] = {
+                "seq": seq,
+                "submit_time": now,
+                "status": "RUNNING" if valid else "ERROR",
+            }
+            self.stats["submitted"] += 1
+            self.stats["max_running"] = max(self.stats["max_running"], num_running + 1)
+        return {"id": ticket_id, "status": self.tickets[ticket_id]["status"]}
+
+    def status(self, ticket_id: str) -> Optional[dict]:
+        with self.lock:
+            ticket = self.tickets.get(ticket_id)
+            if ticket is None:
+                return None
+            if ticket["status"] == "RUNNING":
+                if time.time() - ticket["submit_time"] >= self.search_time:
+                    ticket["status"] = "COMPLETE"
+            return {"id": ticket_id, "status": ticket["status"]}
+
+
+def make_request_handler(server: MockMMseqs2Server) -> type:
+    class MockMMseqs2RequestHandler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args) -> None:
+            logger.debug(f"{self.address_string()} - {format % args}")
+
+        def _send(self, body: bytes, content_type: str, code: int = 200) -> None:
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_json(self, obj: Any, code: int = 200) -> None:
+            self._send(json.dumps(obj).encode(), "application/json", code)
+
+        def do_GET(self) -> None:
+            if server.should_fail():
+                self._send_json({"error": "unavailable"}, code=503)
+                return
+            parts = [x for x in self.path.split("/") if x]
+            if len(parts) == 2 and parts[0] == "ticket":
+                out = server.status(parts[1])
+                if out is None:
+                    self._send_json({"status": "UNKNOWN"}, code=404)
+                else:
+                    self._send_json(out)
+            elif len(parts) == 3 and parts[:2] == ["result", "download"]:
+                out = server.status(parts[2])
+                if out is None or out["status"] != "COMPLETE":
+                    self._send_json({"error": f"no result for {parts[2]}"}, code=404)
+                else:
+                    seq = server.tickets[parts[2]]["seq"]
+                    self._send(make_result_tarball(seq), "application/gzip")
+            else:
+                self._send_json({"error": f"unknown path {self.path}"}, code=404)
+
+        def do_POST(self) -> None:
+            length = int(self.headers.get("Content-Length", 0))
+            form = parse_qs(self.rfile.read(length).decode())
+            if server.should_fail():
+                self._send_json({"error": "unavailable"}, code=503)
+                return
+            if self.path.rstrip("/") not in ["/ticket/msa", "/ticket/pair"]:
+                self._send_json({"error": f"unknown path {self.path}"}, code=404)
+                return
+            self._send_json(server.submit(form.get("q", [""])[0]))
+
+    return MockMMseqs2RequestHandler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--search_time", type=float, default=2.0)
+    parser.add_argument("--max_running", type=int, default=0)
+    parser.add_argument("--fail_every", type=int, default=0)
+    args = parser.parse_args()
+    mock_server = MockMMseqs2Server(
+        args.host, args.port, args.search_time, args.max_running, args.fail_every
+    )
+    logger.info(f"Mock MMseqs2 server listening on {mock_server.url}")
+    try:
+        mock_server.httpd.serve_forever()
+    finally:
+        mock_server.httpd.server_close()
+        logger.info(f"Mock MMseqs2 server stats: {mock_server.stats}")
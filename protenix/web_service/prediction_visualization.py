@@ -26,6 +26,8 @@ from biotite.structure.io.pdbx import CIFFile, get_structure
 from matplotlib.colors import ListedColormap
 from matplotlib.ticker import MaxNLocator
 
+from protenix.utils.file_io import load_npz_mmap
+
 
 class PredictionLoader:
 
@@ -78,14 +80,30 @@ class PredictionLoader:
             for fpath in fpath_summary_confidences
         ]
 
+        # Full data saved with confidence_format="npz": all the samples of a seed in one file
+        fpath_full_npzs = glob.glob(os.path.join(self.pred_fpath, "*_full_data.npz"))
+
         if fpath_full_confidences:
             self.full_confidence_data = [
                 self._convert_to_numpy(self._load_json(fpath))
                 for fpath in fpath_full_confidences
             ]
+        elif fpath_full_npzs:
+            self.full_confidence_data = []
+            for fpath in fpath_full_npzs:
+                self.full_confidence_data.extend(self._load_full_data_npz(fpath))
         else:
             self.full_confidence_data = None
 
+    def _load_full_data_npz(self, fpath: str) -> list[dict]:
+        """
+        Memory-map the full data NPZ of a seed, and split it into per-sample dicts in rank order.
+        The values are views of the mapped file, only read when used.
+        """
+        arrays = load_npz_mmap(fpath)
+        N_sample = len(arrays["coordinate"])
+        return [{k: v[idx] for k, v in arrays.items()} for idx in range(N_sample)]
+
 
 def plot_contact_maps_from_pred(
     preds: list,
@@ -15,27 +15,20 @@
 import json
 import logging
 import os
-import tempfile
 import time
 import uuid
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import TYPE_CHECKING, List, Optional, Union
 
 import click
 import tqdm
-from Bio import SeqIO
-from rdkit import Chem
-
-from configs.configs_base import configs as configs_base
-from configs.configs_data import data_configs
-from configs.configs_inference import inference_configs
-from protenix.config import parse_configs
-from protenix.data.json_maker import cif_to_input_json
-from protenix.data.json_parser import lig_file_to_atom_info
-from protenix.data.utils import pdb_to_cif
+
 from protenix.utils.logger import get_logger
-from runner.inference import InferenceRunner, download_infercence_cache, infer_predict
-from runner.msa_search import msa_search, update_infer_json
+
+# The subcommands import their dependencies when they run, so that light commands
+# (tojson, msa, --help) do not pay for torch and the model at start-up.
+if TYPE_CHECKING:
+    from runner.inference import InferenceRunner
 
 logger = get_logger(__name__)
 
@@ -51,6 +44,10 @@ def init_logging():
 
 
 def generate_infer_jsons(protein_msa_res: dict, ligand_file: str) -> List[str]:
+    from rdkit import Chem
+
+    from protenix.data.json_parser import lig_file_to_atom_info
+
     protein_chains = []
     if len(protein_msa_res) <= 0:
         raise RuntimeError(f"invalid `protein_msa_res` data in {protein_msa_res}")
@@ -164,7 +161,13 @@ def get_default_runner(
     n_cycle: int = 10,
     n_step: int = 200,
     n_sample: int = 5,
-) -> InferenceRunner:
+) -> "InferenceRunner":
+    from configs.configs_base import configs as configs_base
+    from configs.configs_data import data_configs
+    from configs.configs_inference import inference_configs
+    from protenix.config import parse_configs
+    from runner.inference import InferenceRunner, download_infercence_cache
+
     configs_base["use_deepspeed_evo_attention"] = (
         os.environ.get("USE_DEEPSPEED_EVO_ATTENTION", False) == "true"
     )
@@ -195,6 +198,10 @@ def inference_jsons(
     infer_json: json file or directory, will run infer with these jsons
 
     """
+    from configs.configs_inference import inference_configs
+    from runner.inference import infer_predict
+    from runner.msa_search import update_infer_json
+
     infer_jsons = []
     if os.path.isdir(json_file):
         infer_jsons = [
@@ -250,6 +257,9 @@ def batch_inference(
         }
     out_dir: the infer outout dir, default is `./output`
     """
+    from configs.configs_inference import inference_configs
+    from runner.inference import infer_predict
+    from runner.msa_search import update_infer_json
 
     infer_jsons = generate_infer_jsons(protein_msa_res, ligand_file, seeds)
     logger.info(f"will infer with {len(infer_jsons)} jsons")
@@ -310,7 +320,10 @@ def predict(input, out_dir, seeds, cycle, step, sample, use_msa_server):
 
 @click.command()
 @click.option(
-    "--input", type=str, help="pdb or cif files to generate jsons for inference"
+    "--input",
+    type=str,
+    help="pdb or cif file, dir, or manifest text file listing one file per line, "
+    "to generate jsons for inference",
 )
 @click.option("--out_dir", type=str, default="./output", help="dir to save json files")
 @click.option(
@@ -327,64 +340,62 @@ def predict(input, out_dir, seeds, cycle, step, sample, use_msa_server):
     help="Extends the structure based on the Assembly ID in \
                         the input file. The default is no extension",
 )
-def tojson(input, out_dir="./output", altloc="first", assembly_id=None):
+@click.option(
+    "--num_workers",
+    default=1,
+    type=int,
+    help="number of processes converting the files in parallel",
+)
+@click.option(
+    "--overwrite",
+    is_flag=True,
+    default=False,
+    help="convert all the files, even those whose json is up to date",
+)
+def tojson(
+    input,
+    out_dir="./output",
+    altloc="first",
+    assembly_id=None,
+    num_workers=1,
+    overwrite=False,
+):
     """
-    tojson: convert pdb/cif files or dir to json files for predict.
-    :param input, out_dir, altloc, assembly_id
+    tojson: convert pdb/cif files, dir or manifest to json files for predict.
+    :param input, out_dir, altloc, assembly_id, num_workers, overwrite
     :return:
     """
+    from protenix.data.json_maker import (
+        bulk_cif_to_input_json,
+        collect_structure_files,
+    )
+
     init_logging()
     logger.info(
-        f"run tojson with input={input}, out_dir={out_dir}, altloc={altloc}, assembly_id={assembly_id}"
+        f"run tojson with input={input}, out_dir={out_dir}, altloc={altloc}, "
+        f"assembly_id={assembly_id}, num_workers={num_workers}"
     )
-    input_files = []
-    if not os.path.exists(input):
-        raise RuntimeError(f"input file {input} not exists.")
-    if os.path.isdir(input):
-        input_files.extend(
-            [str(file) for file in Path(input).rglob("*") if file.is_file()]
-        )
-    elif os.path.isfile(input):
-        input_files.append(input)
-    else:
-        raise RuntimeError(f"can not read a special file: {input}")
-
-    input_files = [
-        file for file in input_files if file.endswith(".pdb") or file.endswith(".cif")
-    ]
+    input_files = collect_structure_files(input)
     if len(input_files) == 0:
         raise RuntimeError(f"can not read a valid `pdb` or `cif` file from {input}")
     logger.info(
         f"will tojson jsons for {len(input_files)} input files with `pdb` or `cif` format."
     )
-    output_jsons = []
-    os.makedirs(out_dir, exist_ok=True)
-    for input_file in input_files:
-        stem, _ = os.path.splitext(os.path.basename(input_file))
-        pdb_name = stem[:20]
-        output_json = os.path.join(out_dir, f"{pdb_name}-{uuid.uuid4().hex}.json")
-        if input_file.endswith(".pdb"):
-            with tempfile.NamedTemporaryFile(suffix=".cif") as tmp:
-                tmp_cif_file = tmp.name
-                pdb_to_cif(input_file, tmp_cif_file)
-                cif_to_input_json(
-                    tmp_cif_file,
-                    assembly_id=assembly_id,
-                    altloc=altloc,
-                    sample_name=pdb_name,
-                    output_json=output_json,
-                )
-        elif input_file.endswith(".cif"):
-            cif_to_input_json(
-                input_file,
-                assembly_id=assembly_id,
-                altloc=altloc,
-                output_json=output_json,
-            )
-        else:
-            raise RuntimeError(f"can not read a special ligand_file: {input_file}")
-        output_jsons.append(output_json)
+    results = bulk_cif_to_input_json(
+        input_files,
+        out_dir,
+        assembly_id=assembly_id,
+        altloc=altloc,
+        num_workers=num_workers,
+        overwrite=overwrite,
+    )
+    output_jsons = results["converted"] + results["skipped"]
     logger.info(f"{len(output_jsons)} generated jsons have been save to {out_dir}.")
+    if results["failed"]:
+        raise RuntimeError(
+            f"{len(results['failed'])} files failed to convert: "
+            f"{[input_file for input_file, _ in results['failed']]}"
+        )
     return output_jsons
 
 
@@ -393,27 +404,39 @@ def tojson(input, out_dir="./output", altloc="first", assembly_id=None):
     "--input", type=str, help="file to do msa search, support `json` or `fasta` format"
 )
 @click.option("--out_dir", type=str, default="./output", help="dir to save msa results")
-def msa(input, out_dir) -> Union[str, dict]:
+@click.option(
+    "--max_in_flight",
+    type=int,
+    default=8,
+    help="maximal number of concurrent searches on the msa server",
+)
+def msa(input, out_dir, max_in_flight=8) -> Union[str, dict]:
     """
     msa: do msa search by mmseqs. If input is in `fasta`, it should all be proteinChain.
-    :param input, out_dir
+    :param input, out_dir, max_in_flight
     :return:
     """
+    from runner.msa_search import batch_msa_search, update_infer_json
+
     init_logging()
     logger.info(f"run msa with input={input}, out_dir={out_dir}")
     if input.endswith(".json"):
-        msa_input_json = update_infer_json(input, out_dir, use_msa_server=True)
+        msa_input_json = update_infer_json(
+            input, out_dir, use_msa_server=True, max_in_flight=max_in_flight
+        )
         logger.info(f"msa results have been update to {msa_input_json}")
         return msa_input_json
     elif input.endswith(".fasta"):
+        from Bio import SeqIO
+
         records = list(SeqIO.parse(input, "fasta"))
         protein_seqs = []
         for seq in records:
             protein_seqs.append(str(seq.seq))
         protein_seqs = sorted(protein_seqs)
-        msa_res_subdirs = msa_search(protein_seqs, out_dir)
-        assert len(msa_res_subdirs) == len(msa_res_subdirs), "msa search failed"
-        fasta_msa_res = dict(zip(protein_seqs, msa_res_subdirs))
+        fasta_msa_res = batch_msa_search(
+            protein_seqs, out_dir, max_in_flight=max_in_flight
+        )
         logger.info(
             f"msa result is: {fasta_msa_res}, and it has been save to {out_dir}"
         )
@@ -422,9 +445,75 @@ def msa(input, out_dir) -> Union[str, dict]:
         raise RuntimeError(f"only support `json` or `fasta` format, but got : {input}")
 
 
+@click.command()
+@click.option("--out_dir", default="./output", type=str, help="infer result dir")
+@click.option(
+    "--seeds", type=str, default="101", help="the default seeds, split by comma"
+)
+@click.option("--cycle", type=int, default=10, help="pairformer cycle number")
+@click.option("--step", type=int, default=200, help="diffusion step")
+@click.option("--sample", type=int, default=5, help="sample number")
+@click.option("--host", type=str, default="127.0.0.1", help="host to listen on")
+@click.option("--port", type=int, default=8000, help="port to listen on")
+@click.option(
+    "--unix_socket", type=str, default=None, help="listen on a unix socket instead"
+)
+@click.option(
+    "--num_featurize_workers", type=int, default=2, help="cpu featurization workers"
+)
+@click.option(
+    "--max_featurized_jobs",
+    type=int,
+    default=2,
+    help="featurized jobs waiting for the model, featurization blocks beyond it",
+)
+@click.option(
+    "--job_ttl",
+    type=float,
+    default=3600.0,
+    help="seconds a finished job stays queryable",
+)
+def serve(
+    out_dir,
+    seeds,
+    cycle,
+    step,
+    sample,
+    host,
+    port,
+    unix_socket,
+    num_featurize_workers,
+    max_featurized_jobs,
+    job_ttl,
+):
+    """
+    serve: Keep the model loaded and serve prediction jobs over a local http api.
+    :param out_dir, seeds, host, port, unix_socket
+    :return:
+    """
+    from configs.configs_inference import inference_configs
+    from runner.inference_server import InferenceServer
+
+    init_logging()
+    logger.info(
+        f"run server with out_dir={out_dir}, cycle={cycle}, step={step}, sample={sample}"
+    )
+    seeds = list(map(int, seeds.split(",")))
+    inference_configs["dump_dir"] = out_dir
+    runner = get_default_runner(seeds, cycle, step, sample)
+    server = InferenceServer(
+        runner,
+        num_featurize_workers=num_featurize_workers,
+        max_featurized_jobs=max_featurized_jobs,
+        job_ttl=job_ttl,
+    )
+    server.serve_forever(host=host, port=port, unix_socket=unix_socket)
+
+
 protenix_cli.add_command(predict)
 protenix_cli.add_command(tojson)
 protenix_cli.add_command(msa)
+protenix_cli.add_command(serve)
 
 
 def test_batch_inference():
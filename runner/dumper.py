@@ -49,10 +49,16 @@ class DataDumper:
         base_dir,
         need_atom_confidence: bool = False,
         sorted_by_ranking_score: bool = True,
+        confidence_format: str = "json",
     ) -> None:
+        assert confidence_format in [
+            "json",
+            "npz",
+        ], f"Unknown confidence format: {confidence_format}"
         self.base_dir = base_dir
         self.need_atom_confidence = need_atom_confidence
         self.sorted_by_ranking_score = sorted_by_ranking_score
+        self.confidence_format = confidence_format
 
     def dump(
         self,
@@ -74,7 +80,7 @@ class DataDumper:
             atom_array (AtomArray): The AtomArray object containing the structure data.
             entity_poly_type (dict[str, str]): The entity poly type information.
         """
-        dump_dir = self._get_dump_dir(dataset_name, pdb_id, seed)
+        dump_dir = self.get_dump_dir(dataset_name, pdb_id, seed)
         Path(dump_dir).mkdir(parents=True, exist_ok=True)
 
         self.dump_predictions(
@@ -86,7 +92,7 @@ class DataDumper:
             seed=seed,
         )
 
-    def _get_dump_dir(self, dataset_name: str, sample_name: str, seed: int) -> str:
+    def get_dump_dir(self, dataset_name: str, sample_name: str, seed: int) -> str:
         """
         Generate the directory path for dumping data based on the dataset name, sample name, and seed.
         """
@@ -107,7 +113,8 @@ class DataDumper:
         """
         Dump raw predictions from the model:
             structure: Save the predicted coordinates as CIF files.
-            confidence: Save the confidence data as JSON files.
+            confidence: Save the confidence data as JSON files. With the "npz" confidence format,
+                the full data of all the samples is saved in a single NPZ file instead.
         """
         prediction_save_dir = os.path.join(dump_dir, "predictions")
         os.makedirs(prediction_save_dir, exist_ok=True)
@@ -204,22 +211,76 @@ class DataDumper:
         sorted_indices: None,
     ):
         N_sample = len(data["summary_confidence"])
+        if sorted_indices is None:
+            sorted_indices = range(N_sample)
+        save_full_data_json = (
+            self.need_atom_confidence and self.confidence_format == "json"
+        )
+        if self.need_atom_confidence and self.confidence_format == "npz":
+            self._save_full_data_npz(
+                data=data,
+                prediction_save_dir=prediction_save_dir,
+                sample_name=sample_name,
+                seed=seed,
+                sorted_indices=sorted_indices,
+            )
         for idx in range(N_sample):
-            if self.need_atom_confidence:
+            if save_full_data_json:
                 data["full_data"][idx] = get_clean_full_confidence(
                     data["full_data"][idx]
                 )
-        if sorted_indices is None:
-            sorted_indices = range(N_sample)
         for idx, rank in enumerate(sorted_indices):
             output_fpath = os.path.join(
                 prediction_save_dir,
                 f"{sample_name}_seed_{seed}_summary_confidence_sample_{rank}.json",
             )
             save_json(data["summary_confidence"][idx], output_fpath, indent=4)
-            if self.need_atom_confidence:
+            if save_full_data_json:
                 output_fpath = os.path.join(
                     prediction_save_dir,
                     f"{sample_name}_full_data_sample_{rank}.json",
                 )
                 save_json(data["full_data"][idx], output_fpath, indent=None)
+
+    def _save_full_data_npz(
+        self,
+        data: dict,
+        prediction_save_dir: str,
+        sample_name: str,
+        seed: int,
+        sorted_indices: list,
+    ):
+        """
+        Save the coordinates and the full confidence data of all the samples into
+        "{sample_name}_seed_{seed}_full_data.npz", stacked in rank order:
+            coordinate: [N_sample, N_atom, 3] float32
+            floating point data (atom_plddt, token_pair_pae, token_pair_pde, contact_probs, ...): float16
+            other data (token_asym_id, atom_to_token_idx, ...): unchanged dtype
+        The file is not compressed, so that the arrays can be memory-mapped by
+        protenix.utils.file_io.load_npz_mmap.
+        """
+        # sorted_indices[idx] is the rank of sample idx
+        samples = np.argsort([int(rank) for rank in sorted_indices])
+
+        def _to_numpy(x, dtype=None):
+            if isinstance(x, torch.Tensor):
+                x = x.detach().float() if x.is_floating_point() else x.detach()
+                x = x.cpu().numpy()
+            x = np.asarray(x)
+            if dtype is None and np.issubdtype(x.dtype, np.floating):
+                dtype = np.float16
+            return x.astype(dtype) if dtype is not None else x
+
+        arrays = {
+            "coordinate": _to_numpy(data["coordinate"], np.float32)[samples],
+        }
+        full_data = [data["full_data"][idx] for idx in samples]
+        for key in full_data[0]:
+            # Already saved as coordinate, or not needed downstream
+            if key in ["atom_coordinate", "atom_is_polymer"]:
+                continue
+            arrays[key] = np.stack([_to_numpy(d[key]) for d in full_data])
+        output_fpath = os.path.join(
+            prediction_save_dir, f"{sample_name}_seed_{seed}_full_data.npz"
+        )
+        np.savez(output_fpath, **arrays)
@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from typing import Optional
+
 import torch
 
 
@@ -38,7 +40,11 @@ class EMAWrapper(object):
         for name, param in self.model.named_parameters():
             self.shadow[name] = param.data.clone()
 
-    def update(self):
+    def update(self, is_finite: Optional[torch.Tensor] = None):
+        """
+        is_finite: bool tensor, the shadow is kept as is where it is False,
+            so that a skipped optimizer step does not need a host sync
+        """
         for name, param in self.model.named_parameters():
             if self.mutable_param_keywords and not any(
                 [keyword in name for keyword in self.mutable_param_keywords]
@@ -48,6 +54,8 @@ class EMAWrapper(object):
             new_average = (1.0 - self.decay) * param.data + self.decay * self.shadow[
                 name
             ]
+            if is_finite is not None:
+                new_average = torch.where(is_finite, new_average, self.shadow[name])
             self.shadow[name] = new_average.clone()
 
     def apply_shadow(self):
@@ -31,6 +31,11 @@ from runner.dumper import DataDumper
 from protenix.config import parse_configs, parse_sys_args
 from protenix.data.infer_data_pipeline import get_inference_dataloader
 from protenix.model.protenix import Protenix
+from protenix.utils.checkpoint_io import (
+    init_empty_model,
+    load_model_state_dict,
+    load_state_dict_to_empty_model,
+)
 from protenix.utils.distributed import DIST_WRAPPER
 from protenix.utils.seed import seed_everything
 from protenix.utils.torch_utils import to_device
@@ -49,6 +54,7 @@ class InferenceRunner(object):
         self.init_dumper(
             need_atom_confidence=configs.need_atom_confidence,
             sorted_by_ranking_score=configs.sorted_by_ranking_score,
+            confidence_format=configs.confidence_format,
         )
 
     def init_env(self) -> None:
@@ -95,7 +101,11 @@ class InferenceRunner(object):
         os.makedirs(self.error_dir, exist_ok=True)
 
     def init_model(self) -> None:
-        self.model = Protenix(self.configs).to(self.device)
+        if self.configs.get("fast_load_checkpoint", False):
+            # Parameters are materialized from the checkpoint in load_checkpoint()
+            self.model = init_empty_model(Protenix, self.configs)
+        else:
+            self.model = Protenix(self.configs).to(self.device)
 
     def load_checkpoint(self) -> None:
         checkpoint_path = self.configs.load_checkpoint_path
@@ -104,6 +114,16 @@ class InferenceRunner(object):
         self.print(
             f"Loading from {checkpoint_path}, strict: {self.configs.load_strict}"
         )
+        if self.configs.get("fast_load_checkpoint", False):
+            self.model = load_state_dict_to_empty_model(
+                self.model,
+                state_dict=load_model_state_dict(checkpoint_path, mmap=True),
+                device=self.device,
+                strict=self.configs.load_strict,
+            )
+            self.model.eval()
+            self.print(f"Finish loading checkpoint.")
+            return
         checkpoint = torch.load(checkpoint_path, self.device)
 
         sample_key = [k for k in checkpoint["model"].keys()][0]
@@ -120,12 +140,16 @@ class InferenceRunner(object):
         self.print(f"Finish loading checkpoint.")
 
     def init_dumper(
-        self, need_atom_confidence: bool = False, sorted_by_ranking_score: bool = True
+        self,
+        need_atom_confidence: bool = False,
+        sorted_by_ranking_score: bool = True,
+        confidence_format: str = "json",
     ):
         self.dumper = DataDumper(
             base_dir=self.dump_dir,
             need_atom_confidence=need_atom_confidence,
             sorted_by_ranking_score=sorted_by_ranking_score,
+            confidence_format=confidence_format,
         )
 
     # Adapted from runner.train.Trainer.evaluate
@@ -0,0 +1,434 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+A resident inference service built on top of `InferenceRunner`.
+
+The model, the checkpoint and the CCD caches are loaded once. Jobs (one sample dict in
+the input json format) are submitted over a local HTTP API, served either on a TCP port
+or on a Unix socket:
+
+    POST /jobs                  {"job": {...}, "priority": 0, "seeds": [101]}
+    GET  /jobs                  list all jobs
+    GET  /jobs/<job_id>         status and events of one job
+    GET  /jobs/<job_id>/stream  newline-delimited json events until the job finishes
+    GET  /health
+
+Featurization runs on a pool of CPU workers while the model predicts the previous job.
+Jobs with a higher priority are featurized and predicted first. At most
+`max_featurized_jobs` featurized jobs wait for the model, and finished jobs are forgotten
+`job_ttl` seconds after they finish.
+"""
+
+import http.client
+import itertools
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+import traceback
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Optional
+
+import torch
+
+from protenix.data.infer_data_pipeline import InferenceDataset
+from protenix.utils.seed import seed_everything
+from runner.inference import InferenceRunner, update_inference_configs
+
+logger = logging.getLogger(__name__)
+
+JOB_FINISHED_STATUS = ("done", "failed")
+
+
+class InferenceJob(object):
+    def __init__(
+        self,
+        sample_dict: dict[str, Any],
+        priority: int = 0,
+        seeds: Optional[list[int]] = None,
+    ) -> None:
+        self.job_id = uuid.uuid4().hex
+        self.sample_dict = sample_dict
+        self.name = sample_dict["name"]
+        self.priority = priority
+        self.seeds = seeds
+        self.status = "pending"
+        self.events = []
+        self.finish_time = None
+        self.data = None
+        self.atom_array = None
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in JOB_FINISHED_STATUS
+
+    def add_event(self, status: str, **kwargs) -> None:
+        with self._cond:
+            self.status = status
+            now = time.time()
+            self.events.append(
+                {"job_id": self.job_id, "status": status, "time": now, **kwargs}
+            )
+            if self.finished:
+                self.finish_time = now
+            self._cond.notify_all()
+
+    def iter_events(self, timeout: Optional[float] = None):
+        """
+        Yield events as they are added, until the job is finished.
+        """
+        idx = 0
+        while True:
+            with self._cond:
+                if idx >= len(self.events) and not self.finished:
+                    self._cond.wait(timeout=timeout)
+                new_events = self.events[idx:]
+                finished = self.finished
+            for event in new_events:
+                yield event
+            idx += len(new_events)
+            if finished and idx >= len(self.events):
+                return
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self.finished, timeout=timeout)
+
+    def to_dict(self) -> dict[str, Any]:
+        with self._cond:
+            return {
+                "job_id": self.job_id,
+                "name": self.name,
+                "priority": self.priority,
+                "seeds": self.seeds,
+                "status": self.status,
+                "events": list(self.events),
+            }
+
+
+class InferenceServer(object):
+    """
+    Keep an `InferenceRunner` resident and serve prediction jobs from a priority queue.
+
+    Args:
+        runner (InferenceRunner): the runner holding the loaded model and dumper.
+        num_featurize_workers (int): number of CPU featurization workers. Defaults to 2.
+        featurize_fn (Optional[Callable]): maps a sample dict to (data, atom_array, time_tracker).
+            Defaults to `InferenceDataset.process_one`.
+        max_featurized_jobs (int): featurized jobs waiting for the model, featurization blocks
+            beyond it so that the features of the whole queue are not held in memory.
+            Defaults to 2.
+        job_ttl (float): seconds a finished job stays queryable. Defaults to 3600.
+    """
+
+    def __init__(
+        self,
+        runner: InferenceRunner,
+        num_featurize_workers: int = 2,
+        featurize_fn: Optional[Callable] = None,
+        max_featurized_jobs: int = 2,
+        job_ttl: float = 3600.0,
+    ) -> None:
+        self.runner = runner
+        self.configs = runner.configs
+        self.num_featurize_workers = num_featurize_workers
+        self.job_ttl = job_ttl
+        if featurize_fn is None:
+            featurize_fn = InferenceDataset(
+                input_json_path=None,
+                dump_dir=self.configs.dump_dir,
+                use_msa=self.configs.use_msa,
+                inputs=[],
+            ).process_one
+        self.featurize_fn = featurize_fn
+
+        self.jobs = {}
+        self._jobs_lock = threading.Lock()
+        self._counter = itertools.count()
+        self._featurize_queue = queue.PriorityQueue()
+        self._predict_queue = queue.PriorityQueue(maxsize=max_featurized_jobs)
+        self._threads = []
+        self._httpd = None
+
+    def _put(self, q: queue.PriorityQueue, job: Optional[InferenceJob]) -> None:
+        # None is the stop signal and sorts after every job
+        priority = float("inf") if job is None else -job.priority
+        q.put((priority, next(self._counter), job))
+
+    def prune_jobs(self) -> None:
+        """
+        Forget the jobs that finished more than `job_ttl` seconds ago.
+        """
+        deadline = time.time() - self.job_ttl
+        with self._jobs_lock:
+            expired = [
+                job_id
+                for job_id, job in self.jobs.items()
+                if job.finish_time is not None and job.finish_time < deadline
+            ]
+            for job_id in expired:
+                del self.jobs[job_id]
+
+    def get_job(self, job_id: str) -> Optional[InferenceJob]:
+        self.prune_jobs()
+        with self._jobs_lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self) -> list[InferenceJob]:
+        self.prune_jobs()
+        with self._jobs_lock:
+            return list(self.jobs.values())
+
+    def submit(
+        self,
+        sample_dict: dict[str, Any],
+        priority: int = 0,
+        seeds: Optional[list[int]] = None,
+    ) -> InferenceJob:
+        """
+        Queue one sample for featurization and prediction.
+
+        Args:
+            sample_dict (dict[str, Any]): one sample in the inference json format.
+            priority (int): jobs with a higher priority run first. Defaults to 0.
+            seeds (Optional[list[int]]): model seeds. Defaults to `configs.seeds`.
+
+        Returns:
+            InferenceJob: the queued job.
+        """
+        if not isinstance(sample_dict, dict) or "sequences" not in sample_dict:
+            raise ValueError("A job must be a sample dict with `sequences`.")
+        if "name" not in sample_dict:
+            raise ValueError("A job must have a `name`.")
+        if seeds is None:
+            seeds = list(self.configs.seeds)
+        job = InferenceJob(sample_dict, priority=int(priority), seeds=list(seeds))
+        self.prune_jobs()
+        with self._jobs_lock:
+            self.jobs[job.job_id] = job
+        job.add_event("pending")
+        self._put(self._featurize_queue, job)
+        return job
+
+    def _featurize_loop(self) -> None:
+        while True:
+            _, _, job = self._featurize_queue.get()
+            if job is None:
+                return
+            job.add_event("featurizing")
+            try:
+                data, atom_array, time_tracker = self.featurize_fn(job.sample_dict)
+                job.data, job.atom_array = data, atom_array
+                job.add_event(
+                    "featurized",
+                    N_token=int(data["N_token"].item()),
+                    N_atom=int(data["N_atom"].item()),
+                    time_tracker=time_tracker,
+                )
+            except Exception as e:
+                error_message = f"{e}:\n{traceback.format_exc()}"
+                logger.info(error_message)
+                job.add_event("failed", error=error_message)
+                continue
+            # Blocks while the predict queue is full
+            self._put(self._predict_queue, job)
+
+    def _predict_loop(self) -> None:
+        while True:
+            _, _, job = self._predict_queue.get()
+            if job is None:
+                return
+            try:
+                self.predict_job(job)
+                job.add_event("done")
+            except Exception as e:
+                error_message = f"{e}:\n{traceback.format_exc()}"
+                logger.info(error_message)
+                job.add_event("failed", error=error_message)
+            finally:
+                job.data, job.atom_array = None, None
+                if hasattr(torch.cuda, "empty_cache"):
+                    torch.cuda.empty_cache()
+
+    def predict_job(self, job: InferenceJob) -> None:
+        """
+        Adapted from runner.inference.infer_predict, for an already featurized job.
+        """
+        data = job.data
+        new_configs = update_inference_configs(self.configs, data["N_token"].item())
+        self.runner.update_model_configs(new_configs)
+        for seed in job.seeds:
+            job.add_event("predicting", seed=seed)
+            seed_everything(seed=seed, deterministic=self.configs.deterministic)
+            # The model drops used features in inference, so pass a shallow copy
+            seed_data = dict(data)
+            seed_data["input_feature_dict"] = dict(data["input_feature_dict"])
+            prediction = self.runner.predict(seed_data)
+            self.runner.dumper.dump(
+                dataset_name="",
+                pdb_id=job.name,
+                seed=seed,
+                pred_dict=prediction,
+                atom_array=job.atom_array,
+                entity_poly_type=data["entity_poly_type"],
+            )
+            job.add_event(
+                "predicted",
+                seed=seed,
+                dump_dir=self.runner.dumper.get_dump_dir("", job.name, seed),
+                ranking_score=[
+                    float(x["ranking_score"])
+                    for x in prediction["summary_confidence"]
+                ],
+            )
+
+    def start_workers(self) -> None:
+        for _ in range(self.num_featurize_workers):
+            self._threads.append(
+                threading.Thread(target=self._featurize_loop, daemon=True)
+            )
+        self._threads.append(threading.Thread(target=self._predict_loop, daemon=True))
+        for t in self._threads:
+            t.start()
+
+    def stop_workers(self) -> None:
+        for _ in range(self.num_featurize_workers):
+            self._put(self._featurize_queue, None)
+        # Wait for featurization to drain so that no job is queued after the stop signal
+        for t in self._threads[:-1]:
+            t.join()
+        self._put(self._predict_queue, None)
+        self._threads[-1].join()
+        self._threads = []
+
+    def make_http_server(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        unix_socket: Optional[str] = None,
+    ) -> socketserver.BaseServer:
+        handler = make_request_handler(self)
+        if unix_socket is not None:
+            if os.path.exists(unix_socket):
+                os.remove(unix_socket)
+            return ThreadingUnixHTTPServer(unix_socket, handler)
+        return ThreadingHTTPServer((host, port), handler)
+
+    def serve_forever(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        unix_socket: Optional[str] = None,
+    ) -> None:
+        self.start_workers()
+        self._httpd = self.make_http_server(host, port, unix_socket)
+        logger.info(
+            f"Protenix inference server listening on "
+            f"{unix_socket if unix_socket is not None else f'{host}:{port}'}"
+        )
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._httpd.server_close()
+            self.stop_workers()
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_request_handler(server: InferenceServer) -> type:
+    class InferenceRequestHandler(BaseHTTPRequestHandler):
+        def address_string(self) -> str:
+            # client_address is an empty string on Unix sockets
+            if isinstance(self.client_address, tuple):
+                return self.client_address[0]
+            return "unix"
+
+        def log_message(self, format: str, *args) -> None:
+            logger.debug(f"{self.address_string()} - {format % args}")
+
+        def _send_json(self, obj: Any, code: int = 200) -> None:
+            body = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self) -> None:
+            parts = [x for x in self.path.split("/") if x]
+            if parts == ["health"]:
+                self._send_json({"status": "ok", "num_jobs": len(server.list_jobs())})
+            elif parts == ["jobs"]:
+                self._send_json([job.to_dict() for job in server.list_jobs()])
+            elif len(parts) in (2, 3) and parts[0] == "jobs":
+                job = server.get_job(parts[1])
+                if job is None:
+                    self._send_json({"error": f"unknown job {parts[1]}"}, code=404)
+                elif len(parts) == 2:
+                    self._send_json(job.to_dict())
+                elif parts[2] == "stream":
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/x-ndjson")
+                    self.end_headers()
+                    for event in job.iter_events():
+                        self.wfile.write((json.dumps(event) + "\n").encode())
+                        self.wfile.flush()
+                else:
+                    self._send_json({"error": f"unknown path {self.path}"}, code=404)
+            else:
+                self._send_json({"error": f"unknown path {self.path}"}, code=404)
+
+        def do_POST(self) -> None:
+            if self.path.rstrip("/") != "/jobs":
+                self._send_json({"error": f"unknown path {self.path}"}, code=404)
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length))
+                job = server.submit(
+                    request["job"],
+                    priority=request.get("priority", 0),
+                    seeds=request.get("seeds", None),
+                )
+            except (KeyError, ValueError, TypeError) as e:
+                self._send_json({"error": str(e)}, code=400)
+                return
+            self._send_json({"job_id": job.job_id, "status": job.status})
+
+    return InferenceRequestHandler
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    A http.client connection to a server listening on a Unix socket.
+    """
+
+    def __init__(self, unix_socket: str, timeout: Optional[float] = None) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self.unix_socket = unix_socket
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_socket)
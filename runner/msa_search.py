@@ -11,13 +11,19 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import hashlib
 import json
 import os
+import shutil
 import uuid
-from typing import Sequence
+from typing import Dict, Optional, Sequence
 
 from protenix.utils.logger import get_logger
-from protenix.web_service.colab_request_parser import RequestParser
+from protenix.web_service.colab_request_parser import (
+    MMSEQS_SERVICE_HOST_URL,
+    RequestParser,
+)
+from protenix.web_service.colab_request_utils import MMseqs2Client
 
 logger = get_logger(__name__)
 
@@ -54,16 +60,69 @@ def msa_search(seqs: Sequence[str], msa_res_dir: str) -> Sequence[str]:
     return msa_res_subdirs
 
 
-def update_seq_msa(infer_seq: dict, msa_res_dir: str) -> dict:
+def batch_msa_search(
+    seqs: Sequence[str],
+    msa_res_dir: str,
+    max_in_flight: int = 8,
+    host_url: str = MMSEQS_SERVICE_HOST_URL,
+) -> Dict[str, str]:
+    """
+    do msa search of many sequences concurrently, each distinct sequence once.
+    the result of a sequence is saved to msa_res_dir/<sequence hash> as soon as its
+    search completes, and is reused by later calls. a failed sequence gets a dummy msa
+    in msa_res_dir/<sequence hash>.failed, and is searched again by the next call.
+    return the precomputed msa dir of each sequence.
+    """
+    os.makedirs(msa_res_dir, exist_ok=True)
+    seq_dirs = {
+        seq: os.path.join(msa_res_dir, hashlib.sha1(seq.encode()).hexdigest()[:16])
+        for seq in dict.fromkeys(seqs)
+    }
+    pending = {
+        seq: f"{seq_dir}.{os.getpid()}.tmp"
+        for seq, seq_dir in seq_dirs.items()
+        if not os.path.isdir(seq_dir)
+    }
+    logger.info(
+        f"msa search for {len(pending)} sequences, "
+        f"{len(seq_dirs) - len(pending)} found in {msa_res_dir}"
+    )
+
+    def on_done(seq: str, raw_dir: str) -> None:
+        RequestParser.msa_postprocess(seqs_pending_msa=[seq], msa_res_dir=raw_dir)
+        os.replace(raw_dir, seq_dirs[seq])
+
+    client = MMseqs2Client(
+        host_url, max_in_flight=max_in_flight, user_agent="colabfold/1.5.5"
+    )
+    errors = client.search_many(pending, on_done)
+
+    seq_to_msa_dir = {}
+    for seq, seq_dir in seq_dirs.items():
+        if errors.get(seq) is not None:
+            raw_dir, seq_dir = pending[seq], f"{seq_dir}.failed"
+            shutil.rmtree(raw_dir, ignore_errors=True)
+            os.makedirs(raw_dir)
+            RequestParser.msa_postprocess(seqs_pending_msa=[seq], msa_res_dir=raw_dir)
+            shutil.rmtree(seq_dir, ignore_errors=True)
+            os.replace(raw_dir, seq_dir)
+        seq_to_msa_dir[seq] = os.path.abspath(os.path.join(seq_dir, "0"))
+    return seq_to_msa_dir
+
+
+def update_seq_msa(
+    infer_seq: dict,
+    msa_res_dir: str,
+    seq_to_msa_dir: Optional[Dict[str, str]] = None,
+) -> dict:
     protein_seqs = []
     for sequence in infer_seq["sequences"]:
         if "proteinChain" in sequence.keys():
             protein_seqs.append(sequence["proteinChain"]["sequence"])
     if len(protein_seqs) > 0:
-        protein_seqs = sorted(protein_seqs)
-        msa_res_subdirs = msa_search(protein_seqs, msa_res_dir)
-        assert len(msa_res_subdirs) == len(msa_res_subdirs), "msa search failed"
-        protein_msa_res = dict(zip(protein_seqs, msa_res_subdirs))
+        if seq_to_msa_dir is None:
+            seq_to_msa_dir = batch_msa_search(protein_seqs, msa_res_dir)
+        protein_msa_res = {seq: seq_to_msa_dir[seq] for seq in protein_seqs}
         for sequence in infer_seq["sequences"]:
             if "proteinChain" in sequence.keys():
                 sequence["proteinChain"]["msa"] = {
@@ -76,7 +135,7 @@ def update_seq_msa(infer_seq: dict, msa_res_dir: str) -> dict:
 
 
 def update_infer_json(
-    json_file: str, out_dir: str, use_msa_server: bool = False
+    json_file: str, out_dir: str, use_msa_server: bool = False, max_in_flight: int = 8
 ) -> str:
     """
     update json file for inference.
@@ -84,6 +143,7 @@ def update_infer_json(
     it will run msa searching if use_msa_server is True,
     else it will raise error.
     if it does not need to update msa result info, then pass.
+    the protein sequences of all the infer_data are searched together, see batch_msa_search.
     """
     if not os.path.exists(json_file):
         raise RuntimeError(f"`{json_file}` not exists.")
@@ -91,23 +151,26 @@ def update_infer_json(
         json_data = json.load(f)
 
     actual_updated = False
+    protein_seqs = []
     for seq_idx, infer_data in enumerate(json_data):
         if need_msa_search(infer_data):
             actual_updated = True
-            if use_msa_server:
-                seq_name = infer_data.get("name", f"seq_{seq_idx}")
-                logger.info(
-                    f"starting to update msa result for seq {seq_idx} in {json_file}"
-                )
-                update_seq_msa(
-                    infer_data,
-                    os.path.join(out_dir, seq_name, "msa_res" f"msa_seq_{seq_idx}"),
-                )
-            else:
+            if not use_msa_server:
                 raise RuntimeError(
                     f"infer seq {seq_idx} in `{json_file}` has no msa result, please add first."
                 )
+            for sequence in infer_data["sequences"]:
+                if "proteinChain" in sequence.keys():
+                    protein_seqs.append(sequence["proteinChain"]["sequence"])
     if actual_updated:
+        msa_res_dir = os.path.join(out_dir, "msa_res")
+        logger.info(f"starting to update msa result for {json_file} in {msa_res_dir}")
+        seq_to_msa_dir = batch_msa_search(
+            protein_seqs, msa_res_dir, max_in_flight=max_in_flight
+        )
+        for infer_data in json_data:
+            if need_msa_search(infer_data):
+                update_seq_msa(infer_data, msa_res_dir, seq_to_msa_dir)
         updated_json = os.path.join(
             os.path.dirname(os.path.abspath(json_file)),
             f"{os.path.splitext(os.path.basename(json_file))[0]}-add-msa.json",
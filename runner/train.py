@@ -17,6 +17,7 @@ import logging
 import os
 import time
 from contextlib import nullcontext
+from typing import Optional
 
 import torch
 import torch.distributed as dist
@@ -28,17 +29,17 @@ from configs.configs_base import configs as configs_base
 from configs.configs_data import data_configs
 from protenix.config import parse_configs, parse_sys_args
 from protenix.config.config import save_config
-from protenix.data.dataloader import get_dataloaders
+from protenix.data.dataloader import DevicePrefetcher, get_dataloaders
 from protenix.metrics.lddt_metrics import LDDTMetrics
 from protenix.model.loss import ProtenixLoss
 from protenix.model.protenix import Protenix
 from protenix.utils.distributed import DIST_WRAPPER
 from protenix.utils.lr_scheduler import get_lr_scheduler
-from protenix.utils.metrics import SimpleMetricAggregator
+from protenix.utils.metrics import DeviceMetricAggregator, SimpleMetricAggregator
 from protenix.utils.permutation.permutation import SymmetricPermutation
 from protenix.utils.seed import seed_everything
 from protenix.utils.torch_utils import autocasting_disable_decorator, to_device
-from protenix.utils.training import get_optimizer, is_loss_nan_check
+from protenix.utils.training import get_optimizer, zero_grads_if
 from runner.ema import EMAWrapper
 
 # Disable WANDB's console output capture to reduce unnecessary logging
@@ -103,7 +104,7 @@ class AF3Trainer(object):
                 config=vars(self.configs),
                 id=self.configs.wandb_id or None,
             )
-        self.train_metric_wrapper = SimpleMetricAggregator(["avg"])
+        self.train_metric_wrapper = DeviceMetricAggregator()
 
     def init_env(self):
         """Init pytorch/cuda envs."""
@@ -391,12 +392,28 @@ class AF3Trainer(object):
             if self.configs.use_wandb and DIST_WRAPPER.rank == 0:
                 wandb.log(metrics, step=self.step)
 
-    def update(self):
+    def update(self) -> Optional[torch.Tensor]:
+        """
+        Clip the gradients and check that their norm is finite, as the grad scaler does before the step.
+
+        Returns:
+            Optional[torch.Tensor]: whether the gradient norm is finite, on device.
+                None if there is no gradient.
+        """
+        grads = [p.grad for p in self.model.parameters() if p.grad is not None]
+        if len(grads) == 0:
+            return None
         # Clip the gradient
         if self.configs.grad_clip_norm != 0.0:
-            torch.nn.utils.clip_grad_norm_(
+            total_norm = torch.nn.utils.clip_grad_norm_(
                 self.model.parameters(), self.configs.grad_clip_norm
             )
+        else:
+            total_norm = torch.linalg.vector_norm(
+                torch.stack([torch.linalg.vector_norm(g) for g in grads])
+            )
+        # Checked on device, for the EMA. The gradients are all-reduced, so all the ranks agree.
+        return torch.isfinite(total_norm)
 
     def train_step(self, batch: dict):
         self.model.train()
@@ -414,20 +431,27 @@ class AF3Trainer(object):
             else nullcontext()
         )
 
+        # Without fp16, the scale stays at 1: the scaler only finds the non-finite
+        # gradients and skips their optimizer step, on device for the fused optimizers
         scaler = torch.GradScaler(
             device="cuda" if torch.cuda.is_available() else "cpu",
-            enabled=(self.configs.dtype == "float16"),
+            init_scale=2.0**16 if self.configs.dtype == "float16" else 1.0,
         )
 
+        self.step_is_finite = None
         with enable_amp:
             batch, _ = self.model_forward(batch, mode="train")
             loss, loss_dict, _ = self.get_loss(batch, mode="train")
 
+        grad_context = nullcontext()
         if self.configs.dtype in ["bf16", "fp32"]:
-            if is_loss_nan_check(loss):
-                self.print(f"Skip iteration with NaN loss: {self.step} steps")
-                loss = torch.tensor(0.0, device=loss.device, requires_grad=True)
-        scaler.scale(loss / self.iters_to_accumulate).backward()
+            # Checked on device, the NaN losses are counted in train/nan_loss and their
+            # gradients are zeroed before they are accumulated or reduced across ranks
+            is_nan = ~torch.isfinite(loss.detach())
+            self.train_metric_wrapper.add("nan_loss", is_nan, namespace="train")
+            grad_context = zero_grads_if(self.model.parameters(), is_nan)
+        with grad_context:
+            scaler.scale(loss / self.iters_to_accumulate).backward()
 
         # For simplicity, the global training step is used
         if (self.global_step + 1) % self.iters_to_accumulate == 0:
@@ -436,10 +460,12 @@ class AF3Trainer(object):
             )
             # Unscales the gradients of optimizer's assigned parameters in-place
             scaler.unscale_(self.optimizer)
-            # Do grad clip only
-            self.update()
-            scaler.step(self.optimizer)
-            scaler.update()
+            # Clip the gradient
+            self.step_is_finite = self.update()
+            if self.step_is_finite is not None:
+                # Skipped if the gradients are not finite
+                scaler.step(self.optimizer)
+                scaler.update()
             self.optimizer.zero_grad(set_to_none=True)
             self.lr_scheduler.step()
         for key, value in loss_dict.items():
@@ -483,8 +509,10 @@ class AF3Trainer(object):
         use_ema = hasattr(self, "ema_wrapper")
         self.print(f"Using ema: {use_ema}")
 
+        # Copies the next batch to the device while the current step runs
+        train_iter = DevicePrefetcher(self.train_dl, self.device)
         while True:
-            for batch in self.train_dl:
+            for batch in train_iter:
                 is_update_step = (self.global_step + 1) % self.iters_to_accumulate == 0
                 is_last_step = (self.step + 1) == self.configs.max_steps
                 step_need_log = (self.step + 1) % self.configs.log_interval == 0
@@ -503,14 +531,22 @@ class AF3Trainer(object):
                 step_need_eval &= is_update_step
                 step_need_save &= is_update_step
 
-                batch = to_device(batch, self.device)
                 self.progress_bar()
                 self.train_step(batch)
+                self.train_metric_wrapper.add(
+                    "data_stall_time", train_iter.pop_stall_time(), namespace="train"
+                )
                 if use_ema:
-                    self.ema_wrapper.update()
+                    # Not updated on the skipped optimizer steps
+                    self.ema_wrapper.update(is_finite=self.step_is_finite)
                 if step_need_log or is_last_step:
                     metrics = self.train_metric_wrapper.calc()
                     self.print(f"Step {self.step} train: {metrics}")
+                    if metrics.get("train/nan_loss.avg", 0.0) > 0:
+                        self.print(
+                            f"Skipped NaN losses in {metrics['train/nan_loss.avg']:.2%} "
+                            f"of the iterations before step {self.step}"
+                        )
                     last_lr = self.lr_scheduler.get_last_lr()[0]
                     if DIST_WRAPPER.rank == 0:
                         if self.configs.use_wandb:
@@ -0,0 +1,102 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+CPU benchmark of the rigid alignment of many point sets:
+a Python loop over the alignments (as the per-pocket / per-anchor call sites did),
+and one batched call with each solver of protenix.utils.kabsch.weighted_kabsch.
+
+    python scripts/benchmark_kabsch.py --shapes 5x5000 48x2000 200x1000 5000x24
+"""
+
+import argparse
+import time
+
+import torch
+
+from protenix.utils.kabsch import weighted_kabsch
+
+
+def time_fn(fn, repeats: int) -> float:
+    fn()  # warm up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def max_rotation_diff(rot_a: torch.Tensor, rot_b: torch.Tensor) -> float:
+    return (rot_a.double() - rot_b.double()).abs().max().item()
+
+
+def run_benchmark(shapes: list[str], repeats: int, num_threads: int, seed: int):
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    generator = torch.Generator().manual_seed(seed)
+    print(
+        f"{'batch x atoms':>16} {'loop svd':>10} {'batch svd':>10} "
+        f"{'batch quat':>10} {'max |dR|':>10}"
+    )
+    for shape in shapes:
+        batch, n_atom = (int(x) for x in shape.lower().split("x"))
+        src = torch.randn(batch, n_atom, 3, generator=generator)
+        tgt = src + 0.5 * torch.randn(batch, n_atom, 3, generator=generator)
+        weight = torch.rand(batch, n_atom, generator=generator)
+
+        def _loop():
+            return [
+                weighted_kabsch(src[i], tgt[i], weight[i], solver="svd")
+                for i in range(batch)
+            ]
+
+        # The loop is too slow to time on the largest batches
+        loop_ms = "-"
+        if batch <= 5000:
+            loop_ms = f"{time_fn(_loop, max(1, repeats // 10)) * 1e3:.2f}ms"
+        t_svd = time_fn(lambda: weighted_kabsch(src, tgt, weight, solver="svd"), repeats)
+        t_quat = time_fn(
+            lambda: weighted_kabsch(src, tgt, weight, solver="quaternion"), repeats
+        )
+        diff = max_rotation_diff(
+            weighted_kabsch(src, tgt, weight, solver="svd")[0],
+            weighted_kabsch(src, tgt, weight, solver="quaternion")[0],
+        )
+        print(
+            f"{shape:>16} {loop_ms:>10} {t_svd * 1e3:>8.2f}ms "
+            f"{t_quat * 1e3:>8.2f}ms {diff:>10.1e}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--shapes",
+        nargs="+",
+        default=["5x5000", "48x2000", "200x1000", "5000x24", "50000x8"],
+        help="Alignments to time, as <batch>x<atoms>.",
+    )
+    parser.add_argument(
+        "--repeats", type=int, default=20, help="Number of timed runs. Defaults to 20."
+    )
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        default=0,
+        help="Number of torch CPU threads, 0 keeps the default. Defaults to 0.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+
+    run_benchmark(args.shapes, args.repeats, args.num_threads, args.seed)
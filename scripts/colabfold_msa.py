@@ -14,6 +14,9 @@
 
 import argparse
 import os
+import queue
+import shutil
+import threading
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
@@ -36,22 +39,158 @@ class LocalColabFoldConfig:
     db_load_mode: int = 0
 
 
+class _WriterPool:
+    """Appends chunks of text to files, in background threads if num_writers > 0.
+
+    The chunks of a file always go to the same thread, so they are written in
+    order. The queues are bounded, so a slow disk blocks the reader instead of
+    piling up chunks in memory.
+    """
+
+    def __init__(self, num_writers: int = 0, max_pending: int = 4):
+        self.queues = [queue.Queue(maxsize=max_pending) for _ in range(num_writers)]
+        self.errors = []
+        self.threads = [
+            threading.Thread(target=self._run, args=(q,), daemon=True)
+            for q in self.queues
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    @staticmethod
+    def _append(path: Path, data: str) -> None:
+        with open(path, "a") as f:
+            f.write(data)
+
+    def _run(self, q: queue.Queue) -> None:
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            try:
+                self._append(*item)
+            except Exception as e:  # pylint: disable=broad-except
+                self.errors.append(e)
+
+    def submit(self, path: Path, data: str) -> None:
+        if not self.queues:
+            self._append(path, data)
+            return
+        if self.errors:
+            raise self.errors[0]
+        self.queues[hash(path) % len(self.queues)].put((path, data))
+
+    def close(self) -> None:
+        for q in self.queues:
+            q.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.errors:
+            raise self.errors[0]
+
+
+class _BufferedA3MWriter:
+    """Buffers the text of one output file, and hands it to the pool by chunks."""
+
+    def __init__(self, path: Path, pool: _WriterPool, buffer_size: int):
+        self.path = path
+        self.pool = pool
+        self.buffer_size = buffer_size
+        self.chunks = []
+        self.size = 0
+        # number of lines of the query received so far
+        self.num_lines = 0
+        path.write_text("")
+
+    def write(self, text: str) -> None:
+        self.chunks.append(text)
+        self.size += len(text)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.chunks:
+            self.pool.submit(self.path, "".join(self.chunks))
+            self.chunks = []
+            self.size = 0
+
+
+class _NonPairingWriter(_BufferedA3MWriter):
+    """Writes the unpaired MSA of a chain, renaming its query to ">query"."""
+
+    def add(self, line: str) -> None:
+        # line 0 is the ">101" header of the chain, line 1 its query sequence
+        if self.num_lines == 1:
+            self.write(f">query\n{line}\n")
+        elif self.num_lines == 2:
+            self.write(line)
+        elif self.num_lines > 2:
+            self.write(f"\n{line}")
+        self.num_lines += 1
+
+    def close(self) -> None:
+        if self.num_lines < 2:
+            self.write(">query\n")
+        self.flush()
+
+
+class _PairingWriter(_BufferedA3MWriter):
+    """Writes the paired MSA of a chain, naming the hits with a pseudo taxonomy ID."""
+
+    def __init__(self, path: Path, pool: _WriterPool, buffer_size: int, index: int):
+        super().__init__(path, pool, buffer_size)
+        self.index = index
+        self.current_name = None
+        self.current_seq = ""
+
+    def _write_current(self) -> None:
+        # Only write non-empty sequences
+        if self.current_seq:
+            self.write(f">{self.current_name}\n{self.current_seq}\n")
+        self.current_seq = ""
+
+    def add(self, line: str) -> None:
+        # line 0 is the ">101\t102" header of the pairs, line 1 the query sequence
+        if self.num_lines == 1:
+            self.write(f">query\n{line}\n")
+        elif self.num_lines > 1:
+            if line.startswith(">"):
+                self._write_current()
+                j = self.num_lines - 2
+                self.current_name = f"UniRef100_{line[1:].split()[self.index]}_{j}"
+            elif line and "DUMMY" not in self.current_name:
+                self.current_seq = line
+        self.num_lines += 1
+
+    def close(self) -> None:
+        if self.num_lines < 2:
+            self.write(">query\n")
+        self._write_current()
+        self.flush()
+
+
 class A3MProcessor:
-    """Processor for A3M file format."""
+    """Processor for A3M file format.
+
+    The a3m file is streamed line by line and the per-chain outputs are written
+    through bounded buffers, so the memory use does not depend on the size of
+    the colabfold_search output.
+    """
 
-    def __init__(self, a3m_file: str, out_dir: str):
+    def __init__(self, a3m_file: str, out_dir: str, buffer_size: int = 1 << 20):
         self.out_dir = out_dir
         self.a3m_file = Path(a3m_file)
-        self.a3m_content = self._read_a3m_file()
+        self.buffer_size = buffer_size
         self.chain_info = self._parse_header()
 
-    def _read_a3m_file(self) -> str:
-        """Read A3M file content."""
-        return self.a3m_file.read_text()
+    def _read_first_line(self) -> str:
+        """Read the first line of the A3M file."""
+        with open(self.a3m_file, "r") as f:
+            return f.readline().rstrip("\n")
 
     def _parse_header(self) -> Tuple[List[str], Dict[str, Tuple[int, int]]]:
         """Parse A3M header to get chain information."""
-        first_line = self.a3m_content.split("\n")[0]
+        first_line = self._read_first_line()
         if first_line[0] == "#":
             lengths, oligomeric_state = first_line.split("\t")
 
@@ -67,123 +206,109 @@ class A3MProcessor:
 
             return chain_names, seq_ranges
         else:
-            non_pairing = ">query\n" + "\n".join(self.a3m_content.split("\n")[1:])
-            query_seq = self.a3m_content.split("\n")[1]
-            pairing = f">query\n{query_seq}"
             msa_path = Path(self.out_dir) / "msa"
             msa_path.mkdir(exist_ok=True)
             msa_path = msa_path / "0"
             msa_path.mkdir(exist_ok=True)
-            with open(msa_path / "non_pairing.a3m", "w") as f:
-                f.write(non_pairing)
-
-            with open(msa_path / "pairing.a3m", "w") as f:
-                f.write(pairing)
+            with open(self.a3m_file, "r") as f_in:
+                f_in.readline()
+                query_line = f_in.readline()
+                query_seq = query_line.rstrip("\n")
+                with open(msa_path / "pairing.a3m", "w") as f:
+                    f.write(f">query\n{query_seq}")
+                with open(msa_path / "non_pairing.a3m", "w") as f:
+                    f.write(f">query\n{query_line}")
+                    shutil.copyfileobj(f_in, f, self.buffer_size)
 
             return [None]
 
-    def _extract_sequence(self, line: str, range_tuple: Tuple[int, int]) -> str:
-        """Extract sequence for specific range."""
-        seq = []
-        no_insert_count = 0
-        start, end = range_tuple
-
-        for char in line:
-            if char.isupper() or char == "-":
-                no_insert_count += 1
-            # we keep insertions
-            if start < no_insert_count <= end:
-                seq.append(char)
-            elif no_insert_count > end:
-                break
-
-        return "".join(seq)
-
-    def split_sequences(self) -> None:
-        """Split A3M file into pairing and non-pairing sequences."""
-        out_dir = Path(self.out_dir) / "msa"
-        chain_names, seq_ranges = self.chain_info
-
-        pairing_a3ms = {name: [] for name in chain_names}
-        nonpairing_a3ms = {name: [] for name in chain_names}
-
-        current_query = None
-        for line in self.a3m_content.split("\n"):
-            if line.startswith("#"):
-                continue
-
-            if line.startswith(">"):
-                name = line[1:]
-                if name in chain_names:
-                    current_query = chain_names[chain_names.index(name)]
-                elif name == "\t".join(chain_names):
-                    current_query = None
-
-                # Add header line to appropriate dictionary
-                if current_query:
-                    nonpairing_a3ms[current_query].append(line)
-                else:
-                    for name in chain_names:
-                        pairing_a3ms[name].append(line)
-                continue
-
-            # Process sequence line
-            if not line:
-                continue
-
-            if current_query:
-                seq = self._extract_sequence(line, seq_ranges[current_query])
-                nonpairing_a3ms[current_query].append(seq)
+    @staticmethod
+    def _extract_sequences(
+        line: str, ranges: List[Tuple[int, int]]
+    ) -> List[str]:
+        """Extract the sequence of each range, keeping the insertions.
+
+        A range (start, end) covers the match columns (uppercase or "-") start to
+        end - 1, and the insertions that follow them.
+        """
+        match_columns = [k for k, char in enumerate(line) if char.isupper() or char == "-"]
+        num_matches = len(match_columns)
+        seqs = []
+        for start, end in ranges:
+            if start >= num_matches:
+                seqs.append("")
+            elif end >= num_matches:
+                seqs.append(line[match_columns[start] :])
             else:
-                for name in chain_names:
-                    seq = self._extract_sequence(line, seq_ranges[name])
-                    pairing_a3ms[name].append(seq)
-
-        self._write_output_files(out_dir, nonpairing_a3ms, pairing_a3ms)
-
-    def _write_output_files(
-        self,
-        out_dir: Path,
-        nonpairing_a3ms: Dict[str, List[str]],
-        pairing_a3ms: Dict[str, List[str]],
-    ) -> None:
-        """Write split sequences to output files."""
-        out_dir.mkdir(exist_ok=True)
+                seqs.append(line[match_columns[start] : match_columns[end]])
+        return seqs
 
-        # Write non-pairing sequences
-        for i, (name, lines) in enumerate(nonpairing_a3ms.items()):
-            chain_dir = out_dir / str(i)
-            chain_dir.mkdir(exist_ok=True)
+    def split_sequences(self, num_writers: int = 0) -> None:
+        """Split A3M file into pairing and non-pairing sequences.
 
-            with open(chain_dir / "non_pairing.a3m", "w") as f:
-                query_seq = lines[1]
-                f.write(">query\n")
-                f.write(f"{query_seq}\n")
-                f.write("\n".join(lines[2:]))
+        Args:
+            num_writers (int): Number of background threads writing the outputs,
+                0 writes them from the reading thread.
+        """
+        out_dir = Path(self.out_dir) / "msa"
+        out_dir.mkdir(exist_ok=True)
+        chain_names, seq_ranges = self.chain_info
+        all_ranges = [seq_ranges[name] for name in chain_names]
+        pairing_header = "\t".join(chain_names)
 
-        # Write pairing sequences
-        for i, (name, lines) in enumerate(pairing_a3ms.items()):
+        pool = _WriterPool(num_writers)
+        nonpairing_writers, pairing_writers = {}, {}
+        for i, name in enumerate(chain_names):
             chain_dir = out_dir / str(i)
             chain_dir.mkdir(exist_ok=True)
+            nonpairing_writers[name] = _NonPairingWriter(
+                chain_dir / "non_pairing.a3m", pool, self.buffer_size
+            )
+            pairing_writers[name] = _PairingWriter(
+                chain_dir / "pairing.a3m", pool, self.buffer_size, i
+            )
+
+        try:
+            current_query = None
+            with open(self.a3m_file, "r") as f:
+                for line in f:
+                    line = line.rstrip("\n")
+                    if line.startswith("#"):
+                        continue
 
-            with open(chain_dir / "pairing.a3m", "w") as f:
-                query_seq = lines[1]
-                f.write(">query\n")
-                f.write(f"{query_seq}\n")
-
-                # Process remaining sequences
-                sequences = {}
-                for j, line in enumerate(lines[2:]):
                     if line.startswith(">"):
-                        current_name = f"UniRef100_{line[1:].split()[i]}_{j}"
-                        sequences[current_name] = ""
-                    elif line and "DUMMY" not in current_name:
-                        sequences[current_name] = line
-
-                # Write processed sequences
-                for seq_name, seq in sequences.items():
-                    if seq:  # Only write non-empty sequences
-                        f.write(f">{seq_name}\n{seq}\n")
+                        name = line[1:]
+                        if name in nonpairing_writers:
+                            current_query = name
+                        elif name == pairing_header:
+                            current_query = None
+
+                        # Add header line to appropriate outputs
+                        if current_query:
+                            nonpairing_writers[current_query].add(line)
+                        else:
+                            for writer in pairing_writers.values():
+                                writer.add(line)
+                        continue
+
+                    # Process sequence line
+                    if not line:
+                        continue
+
+                    if current_query:
+                        seq = self._extract_sequences(line, [seq_ranges[current_query]])
+                        nonpairing_writers[current_query].add(seq[0])
+                    else:
+                        seqs = self._extract_sequences(line, all_ranges)
+                        for writer, seq in zip(pairing_writers.values(), seqs):
+                            writer.add(seq)
+
+            for writer in nonpairing_writers.values():
+                writer.close()
+            for writer in pairing_writers.values():
+                writer.close()
+        finally:
+            pool.close()
 
 
 def run_colabfold_search(config: LocalColabFoldConfig) -> str:
@@ -252,6 +377,12 @@ def parse_args():
     parser.add_argument(
         "--output_split", help="Directory for split A3M files", default=None
     )
+    parser.add_argument(
+        "--num_writers",
+        help="Number of threads writing the split A3M files, 0 writes them inline",
+        type=int,
+        default=0,
+    )
     return parser.parse_args()
 
 
@@ -278,4 +409,4 @@ if __name__ == "__main__":
 
     processor = A3MProcessor(results_a3m, args.results_dir)
     if len(processor.chain_info) == 2:
-        processor.split_sequences()
+        processor.split_sequences(num_writers=args.num_writers)
@@ -0,0 +1,59 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import argparse
+from pathlib import Path
+
+import torch
+
+from protenix.utils.checkpoint_io import convert_checkpoint
+
+DTYPES = {"fp32": torch.float32, "bf16": torch.bfloat16, "fp16": torch.float16}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert a training checkpoint into a flat, prefix-normalized "
+        "weights file that can be memory-mapped by the fast model loading."
+    )
+    parser.add_argument(
+        "-i",
+        "--input_path",
+        type=Path,
+        required=True,
+        help="Path to the training checkpoint, e.g. release_data/checkpoint/model_v0.2.0.pt",
+    )
+    parser.add_argument(
+        "-o",
+        "--output_path",
+        type=Path,
+        required=True,
+        help="Path to the output weights file.",
+    )
+    parser.add_argument(
+        "--dtype",
+        type=str,
+        default=None,
+        choices=list(DTYPES.keys()),
+        help="Cast floating point weights to this dtype. Defaults to keeping the original dtype.",
+    )
+    args = parser.parse_args()
+
+    shapes = convert_checkpoint(
+        checkpoint_path=args.input_path,
+        output_path=args.output_path,
+        dtype=DTYPES[args.dtype] if args.dtype is not None else None,
+    )
+    print(f"Saved {len(shapes)} weights to {args.output_path}")
@@ -14,8 +14,11 @@
 
 import argparse
 import functools
+import hashlib
+import json
 import logging
 import multiprocessing
+import os
 import pickle
 import subprocess as sp
 from pathlib import Path
@@ -160,40 +163,140 @@ def _get_component_rdkit_mol_processing(
     return mol
 
 
-def precompute_ccd_mol(ccd_cif: Path, output_pkl: Path, num_cpu: int = 1):
+def get_ccd_block_fingerprints(ccd_cif: Path) -> dict[str, str]:
     """
-    Precompute the CCD CIF file.
+    Hash the text of each component block of the CCD CIF file, without parsing it.
 
     Args:
-        cif_file (Path): The path to the CCD CIF file.
-        output_pkl (Path): The output path for saving the precomputed CCD CIF file.
-        num_cpu (int): The number of CPUs to use for parallel processing.
+        ccd_cif (Path): The path to the CCD CIF file.
+
+    Returns:
+        dict[str, str]: ccd code to the sha1 of its block, in the file order.
     """
-    # preprocessing all ccd components in _components_file at first time run.
-    gemmi_load_ccd_cif(ccd_cif)
+    fingerprints = {}
+    ccd_code, block_hash = None, None
+    in_text_field = False
+    with open(ccd_cif, "rb") as f:
+        for line in f:
+            # "data_" only starts a block outside of the ;-delimited text fields
+            if line.startswith(b";"):
+                in_text_field = not in_text_field
+            elif not in_text_field and line.startswith(b"data_"):
+                if ccd_code is not None:
+                    fingerprints[ccd_code] = block_hash.hexdigest()
+                ccd_code = line[len(b"data_") :].strip().decode("utf-8")
+                block_hash = hashlib.sha1()
+            if block_hash is not None:
+                block_hash.update(line)
+    if ccd_code is not None:
+        fingerprints[ccd_code] = block_hash.hexdigest()
+    return fingerprints
+
+
+def get_fingerprints_path(output_pkl: Path) -> Path:
+    """The fingerprints of the blocks the rdkit mol pickle was computed from."""
+    return output_pkl.with_name(output_pkl.name + ".fingerprints.json")
+
+
+def load_previous_mols(
+    output_pkl: Path, fingerprints: dict[str, str], previous_fingerprints: dict[str, str]
+) -> tuple[dict, list[str]]:
+    """
+    Keep the mols of the previous cache whose component block did not change.
 
-    mols = {}
+    Args:
+        output_pkl (Path): The previous rdkit mol pickle.
+        fingerprints (dict[str, str]): The block fingerprints of the new CCD CIF file.
+        previous_fingerprints (dict[str, str]): The block fingerprints of the CCD CIF file
+            the previous pickle was computed from.
 
-    biotite_ccd_cif = biotite_load_ccd_cif(ccd_cif)
-    ccd_codes = list(biotite_ccd_cif.keys())
+    Returns:
+        tuple[dict, list[str]]: the kept mols, and the ccd codes to compute, i.e. the
+            added and changed components.
+    """
+    with open(output_pkl, "rb") as f:
+        previous_mols = pickle.load(f)
+    mols = {
+        ccd_code: mol
+        for ccd_code, mol in previous_mols.items()
+        if ccd_code in fingerprints
+        and fingerprints[ccd_code] == previous_fingerprints.get(ccd_code)
+    }
+    ccd_codes = [
+        ccd_code
+        for ccd_code, fingerprint in fingerprints.items()
+        if fingerprint != previous_fingerprints.get(ccd_code)
+    ]
+    n_removed = sum(ccd_code not in fingerprints for ccd_code in previous_fingerprints)
+    logging.info(
+        "incremental update: %d unchanged, %d added or changed, %d removed components",
+        len(fingerprints) - len(ccd_codes),
+        len(ccd_codes),
+        n_removed,
+    )
+    return mols, ccd_codes
 
-    tasks = list(zip(ccd_codes, [ccd_cif] * len(ccd_codes)))
 
-    with multiprocessing.Pool(num_cpu) as pool:
-        for mol in tqdm.tqdm(
-            pool.imap_unordered(
-                _get_component_rdkit_mol_processing,
-                tasks,
-            ),
-            smoothing=0,
-            total=len(ccd_codes),
-        ):
-            if mol is None:
-                continue
-            mols[mol.name] = mol
+def precompute_ccd_mol(
+    ccd_cif: Path,
+    output_pkl: Path,
+    num_cpu: int = 1,
+    incremental: bool = False,
+    previous_fingerprints: Optional[dict[str, str]] = None,
+):
+    """
+    Precompute the CCD CIF file.
+
+    Args:
+        cif_file (Path): The path to the CCD CIF file.
+        output_pkl (Path): The output path for saving the precomputed CCD CIF file.
+        num_cpu (int): The number of CPUs to use for parallel processing.
+        incremental (bool): Only compute the components added or changed since the
+            existing output_pkl was computed, and keep the others.
+        previous_fingerprints (dict[str, str], optional): The block fingerprints of the
+            previous CCD CIF file. Defaults to the ones saved next to output_pkl.
+    """
+    fingerprints = get_ccd_block_fingerprints(ccd_cif)
+    fingerprints_path = get_fingerprints_path(output_pkl)
+    if incremental and previous_fingerprints is None and fingerprints_path.exists():
+        with open(fingerprints_path, "r") as f:
+            previous_fingerprints = json.load(f)
+
+    if incremental and previous_fingerprints is not None and output_pkl.exists():
+        mols, ccd_codes = load_previous_mols(
+            output_pkl, fingerprints, previous_fingerprints
+        )
+    else:
+        if incremental:
+            logging.warning(
+                "No previous cache or fingerprints for %s, compute all components",
+                output_pkl,
+            )
+        mols, ccd_codes = {}, list(fingerprints.keys())
+
+    if ccd_codes:
+        # preprocessing all ccd components in _components_file at first time run.
+        gemmi_load_ccd_cif(ccd_cif)
+
+        tasks = list(zip(ccd_codes, [ccd_cif] * len(ccd_codes)))
+
+        with multiprocessing.Pool(num_cpu) as pool:
+            for mol in tqdm.tqdm(
+                pool.imap_unordered(
+                    _get_component_rdkit_mol_processing,
+                    tasks,
+                ),
+                smoothing=0,
+                total=len(ccd_codes),
+            ):
+                if mol is None:
+                    continue
+                mols[mol.name] = mol
+        # keep the file order, as a full run would
+        mols = {ccd_code: mols[ccd_code] for ccd_code in fingerprints if ccd_code in mols}
 
     # success rate
-    n_ccd = len(ccd_codes)
+    n_ccd = len(fingerprints)
     logging.info(
         "success rate: %.2f%% (%d/%d)", len(mols) / n_ccd * 100, len(mols), n_ccd
     )
@@ -216,17 +319,28 @@ def precompute_ccd_mol(ccd_cif: Path, output_pkl: Path, num_cpu: int = 1):
         n_ccd,
     )
 
-    with open(output_pkl, "wb") as f:
+    # write to temporary files first, an interrupted run keeps the previous cache usable
+    tmp_pkl = output_pkl.with_name(output_pkl.name + ".tmp")
+    with open(tmp_pkl, "wb") as f:
         pickle.dump(mols, f)
+    os.replace(tmp_pkl, output_pkl)
     logging.info("save rdkit mol to %s", output_pkl)
 
+    tmp_fingerprints = fingerprints_path.with_name(fingerprints_path.name + ".tmp")
+    with open(tmp_fingerprints, "w") as f:
+        json.dump(fingerprints, f)
+    os.replace(tmp_fingerprints, fingerprints_path)
+
     ccd_list_txt = ccd_cif.with_suffix(".txt")
     with open(ccd_list_txt, "w") as f:
         f.write("\n".join(mols.keys()))
 
 
 def run_update_ccd_cache(
-    ccd_cache_dir: Path, num_cpu: int = 1, disable_download: bool = False
+    ccd_cache_dir: Path,
+    num_cpu: int = 1,
+    disable_download: bool = False,
+    incremental: bool = False,
 ):
     """
     Updates the CCD (Chemical Component Dictionary) cache by downloading the latest
@@ -238,14 +352,33 @@ def run_update_ccd_cache(
                                  Defaults to 1.
         disable_download (bool, optional): If True, skips downloading the CCD CIF file.
                                            Defaults to False.
+        incremental (bool, optional): If True, only recomputes the components added or
+                                      changed since the previous cache. Defaults to False.
     """
+    ccd_cif = ccd_cache_dir / "components.cif"
+    ccd_rdkit_mol_pkl = ccd_cache_dir / "components.cif.rdkit_mol.pkl"
+
+    previous_fingerprints = None
+    if (
+        incremental
+        and not get_fingerprints_path(ccd_rdkit_mol_pkl).exists()
+        and ccd_cif.exists()
+        and ccd_rdkit_mol_pkl.exists()
+    ):
+        # cache written before the fingerprints existed: fingerprint the release it was
+        # computed from before the download replaces it
+        previous_fingerprints = get_ccd_block_fingerprints(ccd_cif)
 
     if not disable_download:
         download_ccd_cif(output_path=ccd_cache_dir)
 
-    ccd_cif = ccd_cache_dir / "components.cif"
-    ccd_rdkit_mol_pkl = ccd_cache_dir / "components.cif.rdkit_mol.pkl"
-    precompute_ccd_mol(ccd_cif, ccd_rdkit_mol_pkl, num_cpu=num_cpu)
+    precompute_ccd_mol(
+        ccd_cif,
+        ccd_rdkit_mol_pkl,
+        num_cpu=num_cpu,
+        incremental=incremental,
+        previous_fingerprints=previous_fingerprints,
+    )
 
 
 if __name__ == "__main__":
@@ -277,6 +410,13 @@ if __name__ == "__main__":
         action="store_true",
         help="Whether to disable downloading the CCD CIF file. Defaults to False.",
     )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="Only recompute the components added or changed since the previous cache. "
+        "Defaults to False.",
+    )
 
     args = parser.parse_args()
 
@@ -284,4 +424,5 @@ if __name__ == "__main__":
         ccd_cache_dir=args.ccd_cache_dir,
         num_cpu=args.n_cpu,
         disable_download=args.disable_download,
+        incremental=args.incremental,
     )
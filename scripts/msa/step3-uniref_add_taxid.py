@@ -13,17 +13,18 @@
 # limitations under the License.
 
 import os
+import tempfile
 from os.path import join as opjoin
-from typing import Dict, List, Tuple, Optional, Union, Any
+from typing import Dict, List, Tuple, Optional, Union
 import concurrent.futures
 import multiprocessing
 import math
 
 from tqdm import tqdm
 from utils import (
-    convert_to_shared_dict,  # To create new shared dictionaries
-    release_shared_dict,     # To manually release dictionaries
-    get_shared_dict_ids      # To list available dictionaries
+    MmapIndex,     # Memory-mapped lookup table shared by the workers
+    lookup_batch,  # Batch lookup in a dict or an MmapIndex
+    release_index  # To delete the index files
 )
 
 def process_block_binary(block_info):
@@ -255,23 +256,26 @@ def read_m8(
 
 def update_a3m(
     a3m_path: str,
-    uniref_to_ncbi_taxid: Dict[str, str],
+    uniref_to_ncbi_taxid: Union[Dict[str, str], MmapIndex],
     save_root: str,
 ) -> None:
     """add NCBI TaxID to header if "UniRef" in header
 
     Args:
         a3m_path (str): the original a3m path returned by mmseqs(colabfold search)
-        uniref_to_ncbi_taxid (Dict): the dict mapping uniref hit_name to NCBI TaxID
+        uniref_to_ncbi_taxid (Union[Dict, MmapIndex]): the mapping of uniref hit_name to NCBI TaxID
         save_root (str): the updated a3m
     """
     heads, seqs, uniref_index = read_a3m(a3m_path)
     fname = a3m_path.split("/")[-1]
     out_a3m_path = opjoin(save_root, fname)
+    uniref_ids = [head.split("\t")[0][1:] for head in heads]
+    # One lookup for all the headers of the a3m
+    ncbi_taxids = lookup_batch(uniref_to_ncbi_taxid, uniref_ids)
     with open(out_a3m_path, "w") as ofile:
         for idx, (head, seq) in enumerate(zip(heads, seqs)):
-            uniref_id = head.split("\t")[0][1:]
-            ncbi_taxid = uniref_to_ncbi_taxid.get(uniref_id, None)
+            uniref_id = uniref_ids[idx]
+            ncbi_taxid = ncbi_taxids[idx]
             if (ncbi_taxid is not None) and (idx < (uniref_index // 2)):
                 if not uniref_id.startswith("UniRef100_"):
                     head = head.replace(
@@ -282,12 +286,14 @@ def update_a3m(
             ofile.write(f"{head}{seq}")
 
 
-def update_a3m_batch(batch_paths: List[str], uniref_to_ncbi_taxid: Dict[str, str], save_root: str) -> int:
+def update_a3m_batch(
+    batch_paths: List[str], uniref_to_ncbi_taxid: Union[Dict[str, str], MmapIndex], save_root: str
+) -> int:
     """Process a batch of a3m files.
     
     Args:
         batch_paths (List[str]): List of paths to a3m files to process
-        uniref_to_ncbi_taxid (Dict[str, str]): Dictionary mapping UniRef IDs to NCBI TaxIDs
+        uniref_to_ncbi_taxid (Union[Dict[str, str], MmapIndex]): Mapping of UniRef IDs to NCBI TaxIDs
         save_root (str): Directory to save processed files
         
     Returns:
@@ -304,7 +310,7 @@ def update_a3m_batch(batch_paths: List[str], uniref_to_ncbi_taxid: Dict[str, str
 
 def process_files(
     a3m_paths: List[str],
-    uniref_to_ncbi_taxid: Union[Dict[str, str], Any],
+    uniref_to_ncbi_taxid: Union[Dict[str, str], MmapIndex],
     output_msa_dir: str,
     num_workers: Optional[int] = None,
     batch_size: Optional[int] = None
@@ -313,12 +319,12 @@ def process_files(
     
     This function uses a more efficient approach for multiprocessing by using batched 
     processing to reduce the overhead of process creation and task management.
-    Works with both regular dictionaries and shared dictionaries.
+    Works with both regular dictionaries and memory-mapped indices.
     
     Args:
         a3m_paths (List[str]): List of a3m file paths to process
-        uniref_to_ncbi_taxid (Union[Dict[str, str], Any]): 
-            Dictionary mapping UniRef IDs to NCBI TaxIDs, can be either a regular dict or a shared dict
+        uniref_to_ncbi_taxid (Union[Dict[str, str], MmapIndex]):
+            Mapping of UniRef IDs to NCBI TaxIDs, can be either a regular dict or an MmapIndex
         output_msa_dir (str): Directory to save processed files
         num_workers (int, optional): Number of worker processes. Defaults to None (uses CPU count).
         batch_size (int, optional): Size of batches for processing. Defaults to None (auto-calculated).
@@ -385,7 +391,9 @@ if __name__ == "__main__":
     parser.add_argument("--batch_size", type=int, default=None,
                         help="Number of a3m files per batch. Defaults to auto.")
     parser.add_argument("--shared_memory", action="store_true",
-                        help="Use shared memory for dictionary to reduce memory usage.")
+                        help="Share the mapping between workers as a memory-mapped index to reduce memory usage.")
+    parser.add_argument("--index_dir", type=str, default=None,
+                        help="Directory of the memory-mapped index. Defaults to a temporary directory.")
     parser.add_argument("--mp_read_workers", type=int, default=None,
                         help="Number of worker processes for reading m8 file. Defaults to auto.")
     parser.add_argument("--block_size_mb", type=int, default=64,
@@ -413,14 +421,11 @@ if __name__ == "__main__":
     
     print(f"Successfully read m8 file with {len(uniref_to_ncbi_taxid):,} entries")
     
-    # Convert to shared memory if needed for a3m processing
+    # Write the mapping to a memory-mapped index shared by the a3m workers
     if args.shared_memory:
-        try:
-            print("Converting dictionary to shared memory for a3m processing...")
-            uniref_to_ncbi_taxid = convert_to_shared_dict(uniref_to_ncbi_taxid)
-            print("Successfully converted dictionary to shared memory")
-        except Exception as e:
-            print(f"⚠️ Error converting to shared memory: {e}")
+        index_dir = args.index_dir or tempfile.mkdtemp(prefix="uniref_to_taxid_")
+        print(f"Writing memory-mapped index to {index_dir}...")
+        uniref_to_ncbi_taxid = MmapIndex.build(uniref_to_ncbi_taxid, index_dir)
     
     # Process the a3m files
     print(f"Processing {len(a3m_paths)} a3m files...")
@@ -432,12 +437,8 @@ if __name__ == "__main__":
         batch_size=args.batch_size
     )
     
-    # Release all shared dictionaries if necessary
-    if args.shared_memory:
-        for dict_id in get_shared_dict_ids():
-            try:
-                release_shared_dict(dict_id)
-            except Exception as e:
-                print(f"Warning: Failed to release shared dict {dict_id}: {e}")
+    # Remove the index unless it was asked to be kept
+    if args.shared_memory and args.index_dir is None:
+        release_index(uniref_to_ncbi_taxid)
 
     print("Processing complete")
@@ -14,6 +14,8 @@
 
 import json
 import os
+import shutil
+import tempfile
 import concurrent.futures
 import multiprocessing
 from functools import partial
@@ -23,28 +25,31 @@ from tqdm import tqdm
 import time
 import fcntl  # For file locking
 
-from utils import (
-    convert_to_shared_dict,  # To create new shared dictionaries
-    SharedDict,              # To handle type annotation
-    release_shared_dict,     # To manually release dictionaries
-    get_shared_dict_ids      # To list available dictionaries
-)
+from utils import MmapIndex  # Memory-mapped lookup table shared by the workers
 
-# Type alias for dictionary-like objects (regular dict or Manager.dict)
-DictLike = Union[Dict[str, Any], Mapping[str, Any], SharedDict]
+# Type alias for dictionary-like objects (regular dict or memory-mapped index)
+DictLike = Union[Dict[str, Any], Mapping[str, Any], MmapIndex]
 
 
-def load_mapping_data(seq_to_pdb_id_path: str, seq_to_pdb_index_path: str, use_shared_memory: bool = False) -> Tuple[Dict[str, Any], DictLike, DictLike]:
+def load_mapping_data(
+    seq_to_pdb_id_path: str,
+    seq_to_pdb_index_path: str,
+    use_shared_memory: bool = False,
+    index_dir: Optional[str] = None,
+) -> Tuple[Dict[str, Any], DictLike, DictLike]:
     """
     Load mapping data from JSON files.
     
     Args:
         seq_to_pdb_id_path: Path to the seq_to_pdb_id_entity_id.json file
         seq_to_pdb_index_path: Path to the seq_to_pdb_index.json file
-        use_shared_memory: Whether to use shared memory for dictionaries
+        use_shared_memory: Whether to share the dictionaries as memory-mapped indices
+        index_dir: Directory of the memory-mapped indices, defaults to a temporary directory
         
     Returns:
-        Tuple containing (seq_to_pdbid, first_pdbid_to_seq, seq_to_pdb_index) dictionaries
+        Tuple containing (seq_to_pdbid, first_pdbid_to_seq, seq_to_pdb_index) dictionaries.
+        With use_shared_memory, seq_to_pdb_index is keyed by the first PDB ID of each sequence
+        instead of the sequence, so that the index keys stay short.
     """
     # Load sequence to PDB ID mapping
     with open(seq_to_pdb_id_path, "r") as f:
@@ -57,13 +62,24 @@ def load_mapping_data(seq_to_pdb_id_path: str, seq_to_pdb_index_path: str, use_s
     with open(seq_to_pdb_index_path, "r") as f:
         seq_to_pdb_index_data = json.load(f)
     
-    # If using shared memory, convert the dictionaries to shared objects
+    # If using shared memory, write the dictionaries to memory-mapped indices
     if use_shared_memory:
-        # Create shared dictionaries
-        first_pdbid_to_seq = convert_to_shared_dict(first_pdbid_to_seq_data)
-        seq_to_pdb_index = convert_to_shared_dict(seq_to_pdb_index_data)
+        index_dir = index_dir or tempfile.mkdtemp(prefix="msa_split_index_")
+        # The fixed-width keys of an index would be as long as the longest sequence,
+        # so the pdb indices are looked up by first PDB ID like the sequences.
+        first_pdbid_to_pdb_index_data = {
+            pdb_id: seq_to_pdb_index_data[seq]
+            for pdb_id, seq in first_pdbid_to_seq_data.items()
+            if seq in seq_to_pdb_index_data
+        }
+        first_pdbid_to_seq = MmapIndex.build(
+            first_pdbid_to_seq_data, os.path.join(index_dir, "first_pdbid_to_seq")
+        )
+        seq_to_pdb_index = MmapIndex.build(
+            first_pdbid_to_pdb_index_data, os.path.join(index_dir, "first_pdbid_to_pdb_index")
+        )
         
-        print(f"Created shared memory dictionaries: {len(first_pdbid_to_seq)} PDB IDs, {len(seq_to_pdb_index)} index mappings")
+        print(f"Created memory-mapped indices: {len(first_pdbid_to_seq)} PDB IDs, {len(seq_to_pdb_index)} index mappings")
     else:
         first_pdbid_to_seq = first_pdbid_to_seq_data
         seq_to_pdb_index = seq_to_pdb_index_data
@@ -85,7 +101,11 @@ def rematch(pdb_line: str, first_pdbid_to_seq: DictLike, seq_to_pdb_index: DictL
     """
     pdb_id = pdb_line[1:-1]
     origin_query_seq = first_pdbid_to_seq[pdb_id]
-    pdb_index = seq_to_pdb_index[origin_query_seq]
+    if isinstance(seq_to_pdb_index, MmapIndex):
+        # Keyed by first PDB ID, see load_mapping_data
+        pdb_index = seq_to_pdb_index[pdb_id]
+    else:
+        pdb_index = seq_to_pdb_index[origin_query_seq]
     return pdb_index, origin_query_seq
 
 
@@ -353,7 +373,7 @@ def process_files_batched(
 
 
 if __name__ == "__main__":
-    # Set start method to spawn to ensure compatibility with shared memory
+    # Workers only receive the directory of the memory-mapped indices
     multiprocessing.set_start_method('spawn', force=True)
     import argparse
 
@@ -369,19 +389,26 @@ if __name__ == "__main__":
     parser.add_argument("--batch_size", type=int, default=None,
                         help="Number of files to process in each batch (default: adjusted automatically)")
     parser.add_argument("--shared_memory", action="store_true",
-                        help="Use shared memory for dictionaries to reduce memory usage")
+                        help="Share the dictionaries between workers as memory-mapped indices to reduce memory usage")
+    parser.add_argument("--index_dir", type=str, default=None,
+                        help="Directory of the memory-mapped indices. Defaults to a temporary directory.")
     args = parser.parse_args()
 
     msa_root = args.input_msa_dir
     save_root = args.output_msa_dir
     log_root = "./scripts/msa/data/mmcif_msa_log"
     
+    index_dir = args.index_dir
+    if args.shared_memory and index_dir is None:
+        index_dir = tempfile.mkdtemp(prefix="msa_split_index_")
+
     # Load mapping data
     print("Loading mapping data...")
     _, first_pdbid_to_seq, seq_to_pdb_index = load_mapping_data(
         args.seq_to_pdb_id, 
         args.seq_to_pdb_index,
-        use_shared_memory=args.shared_memory
+        use_shared_memory=args.shared_memory,
+        index_dir=index_dir,
     )
     print("Mapping data loaded successfully")
 
@@ -404,9 +431,8 @@ if __name__ == "__main__":
         batch_size=args.batch_size
     )
     
-    # Release all shared dictionaries if necessary
-    if args.shared_memory:
-        for dict_id in get_shared_dict_ids():
-            release_shared_dict(dict_id)
+    # Remove the indices unless they were asked to be kept
+    if args.shared_memory and args.index_dir is None:
+        shutil.rmtree(index_dir, ignore_errors=True)
 
     print("Processing complete")
\ No newline at end of file
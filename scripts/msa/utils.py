@@ -1,277 +1,293 @@
-import pickle
-import atexit
-import sys
-import uuid
-from multiprocessing import shared_memory
-from typing import Dict, Any, List, Optional
+import heapq
+import json
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, Iterable, List, Mapping, Sequence, Union
 
+import numpy as np
 
-# Global dictionary to track all shared memory blocks
-_shared_memory_blocks = {}
 
+def _write_chunk(chunk: Dict[bytes, bytes], tmp_dir: str, chunk_id: int) -> str:
+    """Write a chunk of (key, value) bytes sorted by key, in the layout of MmapIndex."""
+    chunk_dir = os.path.join(tmp_dir, str(chunk_id))
+    os.makedirs(chunk_dir)
+    keys = sorted(chunk)
+    values = [chunk[k] for k in keys]
+    value_offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum([len(v) for v in values], out=value_offsets[1:])
+    np.save(os.path.join(chunk_dir, "keys.npy"), np.array(keys, dtype=np.bytes_))
+    np.save(os.path.join(chunk_dir, "value_offsets.npy"), value_offsets)
+    np.save(
+        os.path.join(chunk_dir, "values.npy"),
+        np.frombuffer(b"".join(values), dtype=np.uint8),
+    )
+    return chunk_dir
 
-# Function to clean up shared memory resources on program exit
-def cleanup_shared_memory():
-    """Clean up all shared memory objects when the program exits."""
-    global _shared_memory_blocks
-    
-    if _shared_memory_blocks:
-        try:
-            # Close and unlink all shared memory blocks
-            for name, shm in list(_shared_memory_blocks.items()):
-                try:
-                    shm.close()
-                    shm.unlink()
-                    # No need to print anything during normal exit
-                except Exception as e:
-                    if not sys.stdout.closed:
-                        print(f"Error cleaning up shared memory '{name}': {e}")
-            
-            # Clear the dictionary
-            _shared_memory_blocks.clear()
-        except Exception as e:
-            if not sys.stdout.closed:
-                print(f"Error during shared memory cleanup: {e}")
-
-
-# Register the cleanup function to run on program exit
-atexit.register(cleanup_shared_memory)
-
-
-class SharedDict:
-    """A dictionary-like object that provides fast read access to shared memory data.
-    
-    This class provides dictionary-like access to shared memory with performance
-    approaching that of a local dictionary. On first access in each worker process,
-    the dictionary is loaded into local memory for maximum lookup performance while
-    still saving memory across the main process.
+
+def _iter_chunk(chunk_dir: str, chunk_id: int, block_size: int = 65536):
+    """Yield (key, -chunk_id, value) in key order, reading the chunk block by block."""
+    keys = np.load(os.path.join(chunk_dir, "keys.npy"), mmap_mode="r")
+    value_offsets = np.load(os.path.join(chunk_dir, "value_offsets.npy"), mmap_mode="r")
+    # Empty arrays can not be memory-mapped
+    values = np.load(
+        os.path.join(chunk_dir, "values.npy"),
+        mmap_mode="r" if value_offsets[-1] > 0 else None,
+    )
+    for start in range(0, len(keys), block_size):
+        block_keys = keys[start : start + block_size].tolist()
+        offsets = value_offsets[start : start + len(block_keys) + 1].tolist()
+        base = offsets[0]
+        blob = values[base : offsets[-1]].tobytes()
+        for i, key in enumerate(block_keys):
+            yield key, -chunk_id, blob[offsets[i] - base : offsets[i + 1] - base]
+
+
+def _write_npy(raw_path: str, npy_path: str, dtype: np.dtype, num_rows: int):
+    """Prepend the .npy header of a [num_rows] array to a raw file."""
+    with open(npy_path, "wb") as f_out, open(raw_path, "rb") as f_in:
+        np.lib.format.write_array_header_1_0(
+            f_out,
+            {
+                "descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                "fortran_order": False,
+                "shape": (num_rows,),
+            },
+        )
+        shutil.copyfileobj(f_in, f_out, 16 * 1024 * 1024)
+    os.remove(raw_path)
+
+
+def _merge_chunks(
+    chunk_dirs: List[str], tmp_dir: str, index_dir: str, block_size: int = 65536
+) -> Dict[str, int]:
+    """Merge sorted chunks into the index files of index_dir, streaming them to disk.
+
+    Returns:
+        Dict[str, int]: The meta of the index
     """
-    
-    def __init__(self, shared_dict_info, dict_id=None):
-        """Initialize with shared memory information.
-        
-        Args:
-            shared_dict_info (dict): Information about the shared memory block
-            dict_id (str, optional): Unique identifier for this shared dictionary
-        """
-        self.info = shared_dict_info
-        self.dict_id = dict_id
-        # Initialize with an empty dictionary to satisfy type checkers
-        self._dict = {}
-        self._shm = None
-        self._loaded = False
-    
-    def _load_dict(self):
-        """Load the dictionary from shared memory if not already loaded.
-        
-        This only happens once per process, making all subsequent lookups
-        as fast as a local dictionary.
-        """
-        if not self._loaded:
-            try:
-                # Access the shared memory block
-                shm = shared_memory.SharedMemory(name=self.info['name'])
-                # Deserialize the dictionary
-                data = bytes(shm.buf[:self.info['size']])
-                self._dict = pickle.loads(data)
-                # Keep a reference to the shared memory to prevent it from being garbage collected
-                self._shm = shm
-                self._loaded = True
-            except Exception as e:
-                print(f"Error loading shared dictionary: {e}")
-                # Ensure we have a valid dictionary even if loading fails
-                if not self._dict:
-                    self._dict = {}
-    
-    def __del__(self):
-        """Clean up shared memory when this object is garbage collected.
-        
-        This ensures that shared memory is released in worker processes.
-        Note: The main process still needs the atexit handler to clean up the
-        original shared memory block.
-        """
-        if hasattr(self, '_shm') and self._shm is not None:
-            try:
-                # Only close it - don't unlink as the main process manages that
-                self._shm.close()
-                self._shm = None
-            except Exception:
-                # Silently ignore errors during garbage collection
-                pass
-    
-    def get(self, key, default=None):
-        """Get a value for key, or default if key is not present.
-        
+    key_width = 1
+    for chunk_dir in chunk_dirs:
+        keys = np.load(os.path.join(chunk_dir, "keys.npy"), mmap_mode="r")
+        key_width = max(key_width, keys.itemsize)
+    key_dtype = np.dtype(f"S{key_width}")
+
+    raw_paths = {
+        name: os.path.join(tmp_dir, f"{name}.raw")
+        for name in ("keys", "value_offsets", "values")
+    }
+    num_keys = 0
+    values_size = 0
+    with open(raw_paths["keys"], "wb") as f_keys, open(
+        raw_paths["value_offsets"], "wb"
+    ) as f_offsets, open(raw_paths["values"], "wb") as f_values:
+        f_offsets.write(np.zeros(1, dtype=np.int64).tobytes())
+        block_keys, block_values = [], []
+
+        def flush():
+            nonlocal values_size
+            f_keys.write(np.array(block_keys, dtype=key_dtype).tobytes())
+            offsets = np.cumsum([len(v) for v in block_values], dtype=np.int64)
+            f_offsets.write((offsets + values_size).tobytes())
+            f_values.write(b"".join(block_values))
+            values_size += int(offsets[-1])
+            block_keys.clear()
+            block_values.clear()
+
+        last_key = None
+        # For equal keys, the item of the latest chunk comes first and is kept
+        for key, _, value in heapq.merge(
+            *[_iter_chunk(d, i) for i, d in enumerate(chunk_dirs)]
+        ):
+            if key == last_key:
+                continue
+            last_key = key
+            block_keys.append(key)
+            block_values.append(value)
+            num_keys += 1
+            if len(block_keys) >= block_size:
+                flush()
+        if block_keys:
+            flush()
+
+    _write_npy(
+        raw_paths["keys"], os.path.join(index_dir, "keys.npy"), key_dtype, num_keys
+    )
+    _write_npy(
+        raw_paths["value_offsets"],
+        os.path.join(index_dir, "value_offsets.npy"),
+        np.int64,
+        num_keys + 1,
+    )
+    _write_npy(
+        raw_paths["values"],
+        os.path.join(index_dir, "values.npy"),
+        np.uint8,
+        values_size,
+    )
+    return {"num_keys": num_keys, "values_size": values_size, "key_width": key_width}
+
+
+class MmapIndex:
+    """A read-only str -> str lookup table stored in memory-mapped files.
+
+    The keys are stored sorted in a fixed-width bytes array, and the values are
+    concatenated into a single bytes blob addressed by an offsets array:
+
+        keys.npy:           [N] |S{width}, sorted
+        value_offsets.npy:  [N + 1] int64
+        values.npy:         [value_offsets[-1]] uint8
+
+    Lookups are a vectorized binary search (np.searchsorted) over the mapped keys,
+    so nothing is deserialized: all the worker processes share the page cache of
+    the files instead of each holding a private copy of the mapping. Pickling an
+    index only sends its directory, the receiving process maps the same files.
+    """
+
+    def __init__(self, index_dir: str):
+        """Open an index written by MmapIndex.build.
+
         Args:
-            key: The key to look up
-            default: Value to return if key is not found
-            
-        Returns:
-            The value for key if present, otherwise default
+            index_dir (str): Directory of the index files
         """
-        self._load_dict()
-        return self._dict.get(key, default)
-    
-    def __getitem__(self, key):
-        """Get a value for key.
-        
+        self.index_dir = index_dir
+        self._open()
+
+    def _open(self):
+        with open(os.path.join(self.index_dir, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        # Empty arrays can not be memory-mapped
+        mmap_mode = "r" if self.meta["num_keys"] > 0 else None
+        self._keys = np.load(os.path.join(self.index_dir, "keys.npy"), mmap_mode=mmap_mode)
+        self._value_offsets = np.load(
+            os.path.join(self.index_dir, "value_offsets.npy"), mmap_mode=mmap_mode
+        )
+        self._values = np.load(
+            os.path.join(self.index_dir, "values.npy"),
+            mmap_mode="r" if self.meta["values_size"] > 0 else None,
+        )
+
+    def __getstate__(self):
+        return {"index_dir": self.index_dir}
+
+    def __setstate__(self, state):
+        self.index_dir = state["index_dir"]
+        self._open()
+
+    @classmethod
+    def build(
+        cls,
+        mapping: Union[Mapping[str, Any], Iterable[tuple]],
+        index_dir: str,
+        chunk_size: int = 10_000_000,
+    ) -> "MmapIndex":
+        """Write a mapping to index_dir and open it.
+
+        The items are sorted in chunks of chunk_size keys that are written to disk, and
+        the sorted chunks are merged into the index files. Only one chunk is held in
+        memory, whatever the size of the mapping.
+
         Args:
-            key: The key to look up
-            
+            mapping (Union[Mapping[str, Any], Iterable[tuple]]): A dict or (key, value) pairs.
+                The values are stored as str. Duplicated keys keep the last value.
+            index_dir (str): Output directory, created if needed
+            chunk_size (int): Number of keys sorted in memory at a time
+
         Returns:
-            The value for key
-            
-        Raises:
-            KeyError: If key is not found
+            MmapIndex: The opened index
         """
-        self._load_dict()
-        return self._dict[key]
-    
-    def __contains__(self, key):
-        """Check if key is in the dictionary.
-        
+        items = mapping.items() if isinstance(mapping, Mapping) else mapping
+        os.makedirs(index_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix="chunks_", dir=index_dir)
+        try:
+            chunk_dirs = []
+            chunk = {}
+            for key, value in items:
+                chunk[key.encode("utf-8")] = str(value).encode("utf-8")
+                if len(chunk) >= chunk_size:
+                    chunk_dirs.append(_write_chunk(chunk, tmp_dir, len(chunk_dirs)))
+                    chunk = {}
+            if chunk:
+                chunk_dirs.append(_write_chunk(chunk, tmp_dir, len(chunk_dirs)))
+            del chunk
+            meta = _merge_chunks(chunk_dirs, tmp_dir, index_dir)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        with open(os.path.join(index_dir, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        size = meta["num_keys"] * meta["key_width"] + meta["values_size"]
+        print(
+            f"Built index with {meta['num_keys']:,} keys in {index_dir} "
+            f"({size / 1024 / 1024:.1f} MB)"
+        )
+        return cls(index_dir)
+
+    def _search(self, keys: Sequence[str]) -> np.ndarray:
+        """Row of each key in the index, -1 if missing."""
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        if len(keys) == 0 or len(self) == 0:
+            return rows
+        queries = np.array([k.encode("utf-8") for k in keys], dtype=np.bytes_)
+        # Keys longer than the index width can not be in it, and must not be truncated
+        fits = np.char.str_len(queries) <= self._keys.itemsize
+        queries = queries.astype(self._keys.dtype)
+        pos = np.searchsorted(self._keys, queries)
+        pos_clipped = np.minimum(pos, len(self) - 1)
+        found = fits & (pos < len(self)) & (self._keys[pos_clipped] == queries)
+        rows[found] = pos_clipped[found]
+        return rows
+
+    def _value(self, row: int) -> str:
+        start, end = self._value_offsets[row], self._value_offsets[row + 1]
+        return self._values[start:end].tobytes().decode("utf-8")
+
+    def lookup(self, keys: Sequence[str], default: Any = None) -> List[Any]:
+        """Look up a batch of keys with a single binary search.
+
         Args:
-            key: The key to check for
-            
-        Returns:
-            bool: True if key is present, False otherwise
-        """
-        self._load_dict()
-        return key in self._dict
-    
-    def keys(self):
-        """Get the dictionary keys.
-        
-        Returns:
-            An iterable of keys
-        """
-        self._load_dict()
-        return self._dict.keys()
-    
-    def values(self):
-        """Get the dictionary values.
-        
-        Returns:
-            An iterable of values
-        """
-        self._load_dict()
-        return self._dict.values()
-    
-    def items(self):
-        """Get the dictionary items.
-        
-        Returns:
-            An iterable of (key, value) pairs
-        """
-        self._load_dict()
-        return self._dict.items()
-    
-    def __len__(self):
-        """Get the number of items in the dictionary.
-        
+            keys (Sequence[str]): The keys to look up
+            default: Value returned for the missing keys
+
         Returns:
-            int: Number of items
+            List: The value of each key, or default if the key is not present
         """
-        self._load_dict()
-        return len(self._dict)
-
-
-def convert_to_shared_dict(original_dict: Dict[str, Any], dict_id: Optional[str] = None) -> SharedDict:
-    """Convert a dictionary to a fast read-only shared memory structure.
-    
-    This implementation provides much faster read access than traditional 
-    shared dictionaries by using direct shared memory access. This approach 
-    is optimized for read-heavy workloads where the dictionary doesn't 
-    change after creation.
-    
-    For the best performance (close to local dictionary speed), each worker
-    process loads the dictionary into local memory on first access, giving
-    near-native speed for all subsequent lookups while still saving memory
-    across the main process.
-    
-    Args:
-        original_dict (dict): The regular Python dictionary to convert
-        dict_id (str, optional): Unique identifier for this shared dictionary.
-                                If None, a UUID will be generated.
-        
-    Returns:
-        SharedDict: A shared memory dictionary with fast read access
-    """
-    # Generate a unique ID if none provided
-    if dict_id is None:
-        dict_id = f"shared_dict_{uuid.uuid4().hex}"
-    
-    print(f"Converting dictionary '{dict_id}' to shared memory...")
-    
-    # Serialize the dictionary with pickle
-    serialized_dict = pickle.dumps(original_dict)
-    dict_size_bytes = len(serialized_dict)
-    
-    # Create a shared memory block to hold the serialized dictionary
-    shm = shared_memory.SharedMemory(create=True, size=dict_size_bytes)
-    
-    # Copy the serialized dictionary to shared memory
-    shm.buf[:dict_size_bytes] = serialized_dict
-    
-    # Store essential information for accessing the shared memory
-    shared_dict_info = {
-        'name': shm.name,
-        'size': dict_size_bytes
-    }
-    
-    # Keep reference to prevent garbage collection
-    global _shared_memory_blocks
-    _shared_memory_blocks[dict_id] = shm
-    
-    # Create a wrapper that provides dictionary-like access
-    result = SharedDict(shared_dict_info, dict_id)
-    
-    # Clear the original dictionary to free memory
-    original_dict.clear()
-    
-    # Force garbage collection to release memory
-    import gc
-    gc.collect()
-    
-    print(f"Shared memory conversion complete for '{dict_id}' ({dict_size_bytes/1024/1024:.1f} MB)")
-    
-    return result
-
-
-def release_shared_dict(dict_id: str) -> bool:
-    """Release a specific shared dictionary by its ID.
-    
+        return [self._value(row) if row >= 0 else default for row in self._search(keys)]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Get a value for key, or default if key is not present."""
+        return self.lookup([key], default)[0]
+
+    def __getitem__(self, key: str) -> str:
+        row = self._search([key])[0]
+        if row < 0:
+            raise KeyError(key)
+        return self._value(row)
+
+    def __contains__(self, key: str) -> bool:
+        return self._search([key])[0] >= 0
+
+    def __len__(self) -> int:
+        return self.meta["num_keys"]
+
+
+def lookup_batch(
+    mapping: Union[Dict[str, Any], MmapIndex], keys: Sequence[str], default: Any = None
+) -> List[Any]:
+    """Look up many keys at once in a dict or an MmapIndex.
+
     Args:
-        dict_id (str): The ID of the shared dictionary to release
-        
-    Returns:
-        bool: True if the dictionary was successfully released, False otherwise
-    """
-    global _shared_memory_blocks
-    
-    if dict_id in _shared_memory_blocks:
-        try:
-            # Get the shared memory block
-            shm = _shared_memory_blocks.pop(dict_id)
-            # Close and unlink the shared memory
-            shm.close()
-            shm.unlink()
-            return True
-        except Exception as e:
-            print(f"Error releasing shared dictionary '{dict_id}': {e}")
-            # If an error occurred, put it back in the tracking dictionary
-            # so it will be cleaned up on exit
-            if dict_id not in _shared_memory_blocks and shm is not None:
-                _shared_memory_blocks[dict_id] = shm
-    
-    return False
-
-
-def get_shared_dict_ids() -> List[str]:
-    """Get a list of all shared dictionary IDs.
-    
+        mapping (Union[Dict[str, Any], MmapIndex]): The mapping
+        keys (Sequence[str]): The keys to look up
+        default: Value returned for the missing keys
+
     Returns:
-        List[str]: List of shared dictionary IDs
+        List: The value of each key, or default if the key is not present
     """
-    global _shared_memory_blocks
-    return list(_shared_memory_blocks.keys())
+    if isinstance(mapping, MmapIndex):
+        return mapping.lookup(keys, default)
+    return [mapping.get(key, default) for key in keys]
+
+
+def release_index(index: MmapIndex) -> None:
+    """Delete the files of an index. Processes that still map them keep reading them."""
+    shutil.rmtree(index.index_dir, ignore_errors=True)
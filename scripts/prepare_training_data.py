@@ -14,8 +14,11 @@
 
 import argparse
 import csv
+import hashlib
+import json
+import os
 from pathlib import Path
-from typing import Optional
+from typing import Any, Optional
 
 import pandas as pd
 from joblib import Parallel, delayed
@@ -59,6 +62,209 @@ def gen_a_bioassembly_data(
         return sample_indices_list
 
 
+def get_file_fingerprint(path: Path, use_hash: bool = False) -> str:
+    """
+    Fingerprint of an input file, used to decide whether its outputs are up to date.
+
+    Args:
+        path (Path): Path to the file.
+        use_hash (bool, optional): Use the SHA-1 of the content instead of mtime and size. Defaults to False.
+
+    Returns:
+        str: The fingerprint.
+    """
+    if use_hash:
+        sha1 = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha1.update(block)
+        return f"sha1:{sha1.hexdigest()}"
+    stat = os.stat(path)
+    return f"mtime:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def _to_json_value(value: Any) -> Any:
+    # numpy scalars in the sample indices
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+def load_manifest(work_dir: Path) -> dict[str, dict]:
+    """
+    Loads the records of the processed mmCIF files from the manifest and the shard files
+    in the working directory. Later records overwrite earlier ones, and a partially written
+    last line (e.g. after a crash) is ignored.
+
+    Args:
+        work_dir (Path): The working directory of the incremental run.
+
+    Returns:
+        dict[str, dict]: mmCIF path -> {"mmcif", "fingerprint", "pdb_id", "rows"}.
+    """
+    manifest = {}
+    files = [work_dir / "manifest.jsonl"] + sorted(work_dir.glob("shard_*.jsonl"))
+    for file in files:
+        if not file.exists():
+            continue
+        with open(file) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                manifest[record["mmcif"]] = record
+    return manifest
+
+
+def is_up_to_date(
+    record: Optional[dict],
+    mmcif: Path,
+    bioassembly_output_dir: Path,
+    use_hash: bool = False,
+) -> bool:
+    """
+    Checks whether an mmCIF file was processed with its current content and its output still exists.
+
+    Args:
+        record (Optional[dict]): The manifest record of the mmCIF file.
+        mmcif (Path): Path to the mmCIF file.
+        bioassembly_output_dir (Path): Directory where the bioassembly data is saved.
+        use_hash (bool, optional): Compare content hashes instead of mtime and size. Defaults to False.
+
+    Returns:
+        bool: True if the mmCIF file can be skipped.
+    """
+    if record is None:
+        return False
+    if record["fingerprint"] != get_file_fingerprint(mmcif, use_hash):
+        return False
+    if record["pdb_id"] is None:
+        # no data was generated, which can be a transient failure: retry
+        return False
+    output = bioassembly_output_dir / f"{record['pdb_id']}.pkl.gz"
+    return output.exists() and output.stat().st_mtime >= os.stat(mmcif).st_mtime
+
+
+def gen_a_bioassembly_data_to_shard(
+    mmcif: Path,
+    bioassembly_output_dir: Path,
+    cluster_file: Optional[Path],
+    distillation: bool,
+    work_dir: Path,
+    use_hash: bool = False,
+) -> int:
+    """
+    Runs gen_a_bioassembly_data and appends the resulting record to the shard file of the current worker,
+    so that finished structures survive a crash of the whole run.
+
+    Args:
+        mmcif (Path): Path to the mmCIF file.
+        bioassembly_output_dir (Path): Directory where the bioassembly data will be saved.
+        cluster_file (Optional[Path]): Path to the cluster file, if available.
+        distillation (bool): Flag indicating whether to use the 'Distillation' setting.
+        work_dir (Path): The working directory of the incremental run.
+        use_hash (bool, optional): Fingerprint the input by content hash. Defaults to False.
+
+    Returns:
+        int: The number of generated sample indices.
+    """
+    fingerprint = get_file_fingerprint(mmcif, use_hash)
+    sample_indices_list = gen_a_bioassembly_data(
+        Path(mmcif), bioassembly_output_dir, cluster_file, distillation
+    )
+    rows = sample_indices_list or []
+    record = {
+        "mmcif": str(mmcif),
+        "fingerprint": fingerprint,
+        "pdb_id": rows[0]["pdb_id"] if rows else None,
+        "rows": rows,
+    }
+    line = json.dumps(record, default=_to_json_value) + "\n"
+    with open(work_dir / f"shard_{os.getpid()}.jsonl", "a") as f:
+        f.write(line)
+        f.flush()
+    return len(rows)
+
+
+def gen_data_from_mmcifs_incremental(
+    mmcif_list: list[Path],
+    output_indices_csv: Path,
+    bioassembly_output_dir: Path,
+    cluster_file: Optional[Path],
+    distillation: bool = False,
+    num_workers: int = 1,
+    use_hash: bool = False,
+):
+    """
+    Resumable version of gen_data_from_mmcifs.
+
+    Index rows are appended to per-worker shard files in "<output_indices_csv>.work/" as each
+    structure finishes. mmCIF files whose record in the manifest matches their fingerprint and whose
+    output is up to date are skipped. At the end, the shards are compacted into the manifest and
+    the rows of all the input files are written to the CSV.
+
+    Args:
+        mmcif_list (list[Path]): List of paths to mmCIF files.
+        output_indices_csv (Path): Path to the output CSV file where the indices will be saved.
+        bioassembly_output_dir (Path): Directory where the bioassembly output will be stored.
+        cluster_file (Optional[Path]): Path to the cluster file. If None, clustering is not performed.
+        distillation (bool, optional): Flag indicating whether to use the 'Distillation' setting. Defaults to False.
+        num_workers (int, optional): Number of parallel workers to use. Defaults to 1.
+        use_hash (bool, optional): Fingerprint the inputs by content hash instead of mtime and size. Defaults to False.
+    """
+    output_indices_csv = Path(output_indices_csv)
+    bioassembly_output_dir = Path(bioassembly_output_dir)
+    work_dir = output_indices_csv.parent / f"{output_indices_csv.name}.work"
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    manifest = load_manifest(work_dir)
+    todo_list = [
+        mmcif
+        for mmcif in mmcif_list
+        if not is_up_to_date(
+            manifest.get(str(mmcif)), mmcif, bioassembly_output_dir, use_hash
+        )
+    ]
+    print(
+        f"{len(mmcif_list) - len(todo_list)} of {len(mmcif_list)} mmCIF files are up to date"
+    )
+
+    for _ in tqdm(
+        Parallel(n_jobs=num_workers, return_as="generator_unordered")(
+            delayed(gen_a_bioassembly_data_to_shard)(
+                mmcif,
+                bioassembly_output_dir,
+                cluster_file,
+                distillation,
+                work_dir,
+                use_hash,
+            )
+            for mmcif in todo_list
+        ),
+        total=len(todo_list),
+    ):
+        pass
+
+    # Merge the shards into the manifest and the final CSV
+    manifest = load_manifest(work_dir)
+    tmp_manifest = work_dir / "manifest.jsonl.tmp"
+    with open(tmp_manifest, "w") as f:
+        for record in manifest.values():
+            f.write(json.dumps(record) + "\n")
+    os.replace(tmp_manifest, work_dir / "manifest.jsonl")
+    for shard in work_dir.glob("shard_*.jsonl"):
+        shard.unlink()
+
+    merged_results = []
+    for mmcif in mmcif_list:
+        record = manifest.get(str(mmcif))
+        if record is not None:
+            merged_results += record["rows"]
+    df = pd.DataFrame(merged_results)
+    df.to_csv(output_indices_csv, index=False, quoting=csv.QUOTE_NONNUMERIC)
+
+
 def gen_data_from_mmcifs(
     mmcif_list: list[Path],
     output_indices_csv: Path,
@@ -108,6 +314,8 @@ def run_gen_data(
     cluster_file: Optional[Path],
     distillation: bool = False,
     num_workers: int = 1,
+    incremental: bool = False,
+    use_hash: bool = False,
 ):
     """
     Generates data from MMCIF files and saves the output to specified locations.
@@ -119,6 +327,8 @@ def run_gen_data(
         cluster_file (Optional[str]): Path to the cluster file, if any.
         distillation (bool, optional): Flag indicating whether to use the 'Distillation' setting. Defaults to False.
         num_workers (int, optional): Number of worker processes to use. Defaults to 1.
+        incremental (bool, optional): Resume from the previous run and skip up-to-date files. Defaults to False.
+        use_hash (bool, optional): In incremental mode, compare inputs by content hash instead of mtime. Defaults to False.
 
     Raises:
         NotImplementedError: If the input path is not a directory or a text file.
@@ -140,14 +350,25 @@ def run_gen_data(
     else:
         raise NotImplementedError(f"Unsupported input path: {input_path}")
 
-    gen_data_from_mmcifs(
-        mmcif_list,
-        output_indices_csv,
-        bioassembly_output_dir,
-        cluster_file,
-        distillation,
-        num_workers,
-    )
+    if incremental:
+        gen_data_from_mmcifs_incremental(
+            mmcif_list,
+            output_indices_csv,
+            bioassembly_output_dir,
+            cluster_file,
+            distillation,
+            num_workers,
+            use_hash,
+        )
+    else:
+        gen_data_from_mmcifs(
+            mmcif_list,
+            output_indices_csv,
+            bioassembly_output_dir,
+            cluster_file,
+            distillation,
+            num_workers,
+        )
 
 
 if __name__ == "__main__":
@@ -195,6 +416,16 @@ if __name__ == "__main__":
         default=1,
         help="Number of worker processes to use. Defaults to 1.",
     )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Write results as structures finish, resume from the previous run and skip up-to-date files",
+    )
+    parser.add_argument(
+        "--use_hash",
+        action="store_true",
+        help="In incremental mode, detect changed inputs by content hash instead of mtime and size",
+    )
 
     args = parser.parse_args()
 
@@ -205,4 +436,6 @@ if __name__ == "__main__":
         cluster_file=args.cluster_file,
         distillation=args.distillation,
         num_workers=args.n_cpu,
+        incremental=args.incremental,
+        use_hash=args.use_hash,
     )
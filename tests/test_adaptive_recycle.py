@@ -0,0 +1,128 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+import torch
+import torch.nn as nn
+from ml_collections.config_dict import ConfigDict
+
+from protenix.model.protenix import Protenix
+
+
+class FakeEmbedder(nn.Module):
+    n_blocks = 0
+
+    def forward(self, input_feature_dict, *args, **kwargs):
+        return input_feature_dict["s_inputs"]
+
+
+class FakeMSAModule(nn.Module):
+    def forward(self, input_feature_dict, z, s_inputs, **kwargs):
+        return z
+
+
+class FakePairformer(nn.Module):
+    """Halves the distance to a fixed point, so the trunk converges"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def forward(self, s, z, **kwargs):
+        self.calls += 1
+        return s / 2, z / 2
+
+
+class FakeTrunk(nn.Module):
+    # The parts of Protenix used by get_pairformer_output
+    get_pairformer_output = Protenix.get_pairformer_output
+    get_recycle_signal = Protenix.get_recycle_signal
+    get_recycle_delta = staticmethod(Protenix.get_recycle_delta)
+
+    def __init__(self, adaptive_recycle: dict, N_cycle: int = 10):
+        super().__init__()
+        self.configs = ConfigDict({"model": {"adaptive_recycle": adaptive_recycle}})
+        self.configs.use_memory_efficient_kernel = False
+        self.configs.use_deepspeed_evo_attention = False
+        self.configs.use_lma = False
+        self.N_cycle = N_cycle
+        self.train_confidence_only = False
+        self.input_embedder = FakeEmbedder()
+        self.template_embedder = FakeEmbedder()
+        self.msa_module = FakeMSAModule()
+        self.pairformer_stack = FakePairformer()
+        for name in [
+            "linear_no_bias_sinit",
+            "linear_no_bias_zinit1",
+            "linear_no_bias_zinit2",
+            "layernorm_z_cycle",
+            "linear_no_bias_z_cycle",
+            "layernorm_s",
+            "linear_no_bias_s",
+        ]:
+            setattr(self, name, nn.Identity())
+        self.linear_no_bias_token_bond = lambda x: x
+        self.relative_position_encoding = lambda input_feature_dict: 0.0
+
+
+class TestAdaptiveRecycle(unittest.TestCase):
+    def setUp(self):
+        N_token = 20
+        self.input_feature_dict = {
+            "residue_index": torch.arange(N_token),
+            "s_inputs": torch.ones(N_token, 1),
+            "token_bonds": torch.zeros(N_token, N_token),
+        }
+
+    def run_trunk(self, adaptive_recycle, **kwargs):
+        trunk = FakeTrunk(
+            {
+                "enable": True,
+                "min_cycle": 3,
+                "max_cycle": -1,
+                "signal": "norm",
+                "tolerance": 1e-3,
+                **adaptive_recycle,
+            }
+        ).eval()
+        _, _, _, num_cycles = trunk.get_pairformer_output(
+            self.input_feature_dict, **kwargs
+        )
+        self.assertEqual(num_cycles, trunk.pairformer_stack.calls)
+        return num_cycles
+
+    def test_converged_trunk_stops_at_min_cycle(self):
+        # s and z converge geometrically to s_init and z_init
+        self.assertEqual(self.run_trunk({"tolerance": 0.5}), 3)
+        self.assertEqual(self.run_trunk({"tolerance": 0.5, "min_cycle": 5}), 5)
+        # Never converges within the tolerance
+        self.assertEqual(self.run_trunk({"tolerance": 0.0}), 10)
+
+    def test_explicit_n_cycle_wins(self):
+        self.assertEqual(self.run_trunk({"tolerance": 0.0, "max_cycle": 6}), 6)
+        self.assertEqual(
+            self.run_trunk({"tolerance": 0.0, "max_cycle": 6}, N_cycle=1), 1
+        )
+        self.assertEqual(
+            self.run_trunk({"tolerance": 0.5, "max_cycle": 6}, N_cycle=2), 2
+        )
+
+    def test_disabled(self):
+        self.assertEqual(self.run_trunk({"enable": False, "tolerance": 0.5}), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
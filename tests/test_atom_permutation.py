@@ -0,0 +1,124 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import torch
+
+from protenix.utils.permutation.atom_permutation import (
+    correct_symmetric_atoms,
+    get_residue_permutations,
+)
+
+
+def make_residues(n_res=20):
+    """Residues of 6 atoms with two symmetric pairs, (2, 3) and (4, 5), and residues of 4 atoms
+    without symmetry."""
+    ref_space_uid, atom_perm_list = [], []
+    swaps = [
+        [0, 1, 2, 3, 4, 5],
+        [0, 1, 3, 2, 4, 5],
+        [0, 1, 2, 3, 5, 4],
+        [0, 1, 3, 2, 5, 4],
+        [0, 1, 3, 2, 4, 5],  # duplicated
+    ]
+    for i in range(n_res):
+        if i % 2 == 0:
+            ref_space_uid.extend([i] * 6)
+            atom_perm_list.extend([[perm[j] for perm in swaps] for j in range(6)])
+        else:
+            ref_space_uid.extend([i] * 4)
+            atom_perm_list.extend([[j] for j in range(4)])
+    return torch.tensor(ref_space_uid), atom_perm_list
+
+
+class TestAtomPermutation(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.ref_space_uid, self.atom_perm_list = make_residues()
+        self.N_atom = len(self.ref_space_uid)
+        self.true_coord = torch.randn(self.N_atom, 3) * 5
+        self.true_coord_mask = torch.ones(self.N_atom)
+
+    def _swapped_prediction(self, batch_size):
+        # Swap one symmetric pair in residues 0, 4, 8, 12 and 16
+        expected = torch.arange(self.N_atom).repeat(batch_size, 1)
+        for b in range(batch_size):
+            for start in torch.nonzero(self.ref_space_uid % 4 == 0).squeeze(-1)[::6]:
+                i, j = start + 2 + 2 * (b % 2), start + 3 + 2 * (b % 2)
+                expected[b, i], expected[b, j] = j, i
+        pred_coord = self.true_coord[expected]
+        pred_coord = pred_coord + torch.randn_like(pred_coord) * 0.01
+        return pred_coord, expected
+
+    def test_residue_permutations(self):
+        residue_permutations = get_residue_permutations(
+            self.ref_space_uid, self.atom_perm_list
+        )
+        self.assertEqual(residue_permutations["N_res"], 20)
+        self.assertEqual(residue_permutations["N_perm_res"], 10)
+        # identity + 4 unique permutations, one of which is the identity itself
+        self.assertEqual(residue_permutations["N_max_perm"], 6)
+        self.assertEqual(residue_permutations["is_candidate"].sum().item(), 50)
+        # Cached per input
+        self.assertIs(
+            get_residue_permutations(self.ref_space_uid, self.atom_perm_list),
+            residue_permutations,
+        )
+
+    def test_correct_swapped_atoms(self):
+        pred_coord, expected = self._swapped_prediction(batch_size=3)
+        _, _, log_dict, permutation = correct_symmetric_atoms(
+            pred_coord,
+            self.true_coord,
+            self.true_coord_mask,
+            self.ref_space_uid,
+            self.atom_perm_list,
+            permute_label=True,
+        )
+        self.assertTrue(torch.equal(permutation, expected))
+        self.assertEqual(log_dict["N_res_with_symmetry"], 10)
+        self.assertAlmostEqual(log_dict["N_res_permuted"], 5.0)
+        self.assertLess(log_dict["permuted_rmsd"], log_dict["unpermuted_rmsd"])
+
+        # Unbatched prediction
+        _, _, _, permutation = correct_symmetric_atoms(
+            pred_coord[0],
+            self.true_coord,
+            self.true_coord_mask,
+            self.ref_space_uid,
+            self.atom_perm_list,
+            permute_label=True,
+        )
+        self.assertTrue(torch.equal(permutation, expected[0]))
+
+    def test_unresolved_symmetric_atoms(self):
+        pred_coord, expected = self._swapped_prediction(batch_size=1)
+        # Permutations only moving unresolved atoms are dropped
+        true_coord_mask = self.true_coord_mask.clone()
+        true_coord_mask[expected[0] != torch.arange(self.N_atom)] = 0
+        _, _, log_dict, permutation = correct_symmetric_atoms(
+            pred_coord,
+            self.true_coord,
+            true_coord_mask,
+            self.ref_space_uid,
+            self.atom_perm_list,
+            permute_label=True,
+        )
+        self.assertTrue(torch.equal(permutation[0], torch.arange(self.N_atom)))
+        self.assertEqual(log_dict["N_res_permuted"], 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import unittest
+
+import torch
+
+from protenix.utils.permutation.chain_permutation.heuristic import (
+    _correct_symmetric_chains_for_one_sample,
+    correct_symmetric_chains,
+)
+
+
+def random_rotation():
+    q, r = torch.linalg.qr(torch.randn(3, 3))
+    q = q * torch.sign(torch.diagonal(r))
+    if torch.det(q) < 0:
+        q[:, 0] = -q[:, 0]
+    return q
+
+
+def make_complex(n_sample=6, atoms_per_token=2):
+    # entity 0: 3 copies of 12 tokens, entity 1: 2 copies of 20 tokens, entity 2: a 5-token ligand
+    chains = [(0, 12), (0, 12), (0, 12), (1, 20), (1, 20), (2, 5)]
+    shapes = {e: torch.randn(n * atoms_per_token, 3) * 3 for e, n in set(chains)}
+    entity_mol_id, mol_id, mol_atom_index, coordinate = [], [], [], []
+    for asym_id, (entity_id, n_token) in enumerate(chains):
+        n_atom = n_token * atoms_per_token
+        entity_mol_id.append(torch.full((n_atom,), entity_id))
+        mol_id.append(torch.full((n_atom,), asym_id))
+        mol_atom_index.append(torch.arange(n_atom))
+        center = torch.randn(3) * 15
+        coordinate.append(shapes[entity_id] @ random_rotation().T + center)
+    n_atom = sum(n for _, n in chains) * atoms_per_token
+    features = {
+        "entity_mol_id": torch.cat(entity_mol_id),
+        "mol_id": torch.cat(mol_id),
+        "mol_atom_index": torch.cat(mol_atom_index),
+        "pae_rep_atom_mask": (torch.arange(n_atom) % atoms_per_token == 0),
+        "is_ligand": torch.cat(mol_id) == 5,
+    }
+    coordinate = torch.cat(coordinate)
+    coordinate_mask = torch.ones(n_atom, dtype=torch.bool)
+    # A partially resolved chain and an unresolved chain
+    coordinate_mask[(features["mol_id"] == 1) & (features["mol_atom_index"] < 8)] = False
+    coordinate_mask[features["mol_id"] == 2] = False
+    label_full_dict = {
+        **features,
+        "coordinate": coordinate,
+        "coordinate_mask": coordinate_mask,
+    }
+
+    # Predictions: swap the positions of symmetric chains, add noise and a global transform
+    pred_coordinate = []
+    for _ in range(n_sample):
+        pred = coordinate.clone()
+        for entity_id in range(2):
+            asym_ids = sorted({a for a, (e, _) in enumerate(chains) if e == entity_id})
+            perm = [asym_ids[i] for i in torch.randperm(len(asym_ids)).tolist()]
+            for src, tgt in zip(asym_ids, perm):
+                pred[features["mol_id"] == tgt] = coordinate[features["mol_id"] == src]
+        pred = pred + torch.randn_like(pred) * 0.5
+        pred_coordinate.append(pred @ random_rotation().T + torch.randn(3) * 5)
+    return features, label_full_dict, torch.stack(pred_coordinate)
+
+
+class TestBatchedChainPermutation(unittest.TestCase):
+    def _check(self, **kwargs):
+        torch.manual_seed(0)
+        features, label_full_dict, pred_coordinate = make_complex()
+
+        random.seed(1)
+        expected = [
+            _correct_symmetric_chains_for_one_sample(
+                {**features, "coordinate": pred_coordinate_i},
+                dict(label_full_dict),
+                max_num_chains=-1,
+                permute_label=False,
+                **kwargs,
+            )
+            for pred_coordinate_i in pred_coordinate
+        ]
+        random.seed(1)
+        output_dict, log_dict, permute_pred_indices, _ = correct_symmetric_chains(
+            {**features, "coordinate": pred_coordinate},
+            dict(label_full_dict),
+            max_num_chains=-1,
+            permute_label=False,
+            **kwargs,
+        )
+
+        self.assertEqual(len(permute_pred_indices), len(expected))
+        for i, (_, pred_indices, _, output_dict_i, _) in enumerate(expected):
+            self.assertTrue(torch.equal(permute_pred_indices[i], pred_indices))
+            self.assertTrue(
+                torch.equal(output_dict["coordinate"][i], output_dict_i["coordinate"])
+            )
+        expected_permuted = sum(log["is_permuted"] for *_, log in expected)
+        self.assertAlmostEqual(
+            log_dict["is_permuted"], expected_permuted / len(expected)
+        )
+        # The symmetric chains are swapped in the predictions
+        self.assertGreater(expected_permuted, 0)
+
+    def test_match_per_sample_results(self):
+        for use_center_rmsd in [False, True]:
+            for find_gt_anchor_first in [False, True]:
+                with self.subTest(
+                    use_center_rmsd=use_center_rmsd,
+                    find_gt_anchor_first=find_gt_anchor_first,
+                ):
+                    self._check(
+                        use_center_rmsd=use_center_rmsd,
+                        find_gt_anchor_first=find_gt_anchor_first,
+                        accept_it_as_it_is=False,
+                    )
+
+    def test_no_symmetric_chain(self):
+        torch.manual_seed(0)
+        features, label_full_dict, pred_coordinate = make_complex(n_sample=2)
+        # Give every chain its own entity
+        for d in [features, label_full_dict]:
+            d["entity_mol_id"] = d["mol_id"].clone()
+        output_dict, log_dict, permute_pred_indices, _ = correct_symmetric_chains(
+            {**features, "coordinate": pred_coordinate},
+            label_full_dict,
+            permute_label=False,
+            use_center_rmsd=False,
+            find_gt_anchor_first=False,
+            accept_it_as_it_is=False,
+        )
+        self.assertEqual(log_dict["has_sym_chain"], 0)
+        self.assertTrue(torch.equal(output_dict["coordinate"], pred_coordinate))
+        for indices in permute_pred_indices:
+            self.assertTrue(torch.equal(indices, torch.arange(len(indices))))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from protenix.data import json_maker
+from protenix.data.json_maker import (
+    bulk_cif_to_input_json,
+    collect_structure_files,
+    get_output_json_path,
+)
+
+
+def fake_cif_to_input_json(mmcif_file, output_json=None, **kwargs):
+    # The CCD is not needed to check the bookkeeping of the bulk conversion
+    with open(mmcif_file, "r") as f:
+        content = f.read()
+    if "bad" in content:
+        raise ValueError(f"can not parse {mmcif_file}")
+    with open(output_json, "w") as f:
+        json.dump([{"name": os.path.basename(mmcif_file), "content": content}], f)
+
+
+class TestBulkToJson(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.in_dir = os.path.join(self.tmp_dir.name, "in")
+        self.out_dir = os.path.join(self.tmp_dir.name, "out")
+        for name in ["a.cif", "b.cif", "sub/a.cif", "c.cif", "notes.txt"]:
+            path = os.path.join(self.in_dir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write("bad" if name == "c.cif" else name)
+        patcher = mock.patch.object(
+            json_maker, "cif_to_input_json", fake_cif_to_input_json
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def test_collect(self):
+        files = collect_structure_files(self.in_dir)
+        self.assertEqual(
+            [os.path.relpath(f, self.in_dir) for f in files],
+            ["a.cif", "b.cif", "c.cif", "sub/a.cif"],
+        )
+        manifest = os.path.join(self.in_dir, "manifest.txt")
+        with open(manifest, "w") as f:
+            f.write("# comment\nb.cif\n\nsub/a.cif\n")
+        self.assertEqual(
+            collect_structure_files(manifest),
+            [os.path.join(self.in_dir, "b.cif"), os.path.join(self.in_dir, "sub/a.cif")],
+        )
+        # Same names in different dirs do not collide
+        self.assertNotEqual(
+            get_output_json_path(files[0], self.out_dir),
+            get_output_json_path(files[3], self.out_dir),
+        )
+
+    def _check(self, num_workers):
+        files = collect_structure_files(self.in_dir)
+        results = bulk_cif_to_input_json(files, self.out_dir, num_workers=num_workers)
+        self.assertEqual(len(results["converted"]), 3)
+        self.assertEqual(results["skipped"], [])
+        self.assertEqual([f for f, _ in results["failed"]], [files[2]])
+        self.assertIn("ValueError", results["failed"][0][1])
+        for output_json in results["converted"]:
+            with open(output_json, "r") as f:
+                self.assertEqual(len(json.load(f)), 1)
+        self.assertFalse(any(f.endswith(".tmp") for f in os.listdir(self.out_dir)))
+
+        # Rerun: only the failed input is converted again
+        results = bulk_cif_to_input_json(files, self.out_dir, num_workers=num_workers)
+        self.assertEqual(len(results["skipped"]), 3)
+        self.assertEqual(len(results["failed"]), 1)
+
+        # A modified input is converted again
+        with open(files[1], "w") as f:
+            f.write("new")
+        output_json = get_output_json_path(files[1], self.out_dir)
+        os.utime(files[1], (0, os.path.getmtime(output_json) + 1))
+        results = bulk_cif_to_input_json(files, self.out_dir, num_workers=num_workers)
+        self.assertEqual(results["converted"], [output_json])
+        with open(output_json, "r") as f:
+            self.assertEqual(json.load(f)[0]["content"], "new")
+
+        with open(os.path.join(self.out_dir, "tojson_log.jsonl"), "r") as f:
+            log = [json.loads(line) for line in f]
+        self.assertEqual(len(log), 4 + 1 + 2)
+        self.assertEqual(sum(entry["error"] is not None for entry in log), 3)
+
+    def test_options(self):
+        files = collect_structure_files(self.in_dir)[:1]
+        results = bulk_cif_to_input_json(files, self.out_dir)
+        self.assertEqual(len(results["converted"]), 1)
+        # Another assembly or altloc is not an up to date output of the first conversion
+        for options in [{"assembly_id": "1"}, {"altloc": "all"}]:
+            results = bulk_cif_to_input_json(files, self.out_dir, **options)
+            self.assertEqual(results["skipped"], [])
+            self.assertEqual(
+                results["converted"],
+                [get_output_json_path(files[0], self.out_dir, **options)],
+            )
+        results = bulk_cif_to_input_json(files, self.out_dir, altloc="all")
+        self.assertEqual(len(results["skipped"]), 1)
+
+    def test_serial(self):
+        self._check(num_workers=1)
+
+    def test_process_pool(self):
+        self._check(num_workers=2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import tempfile
+import unittest
+
+import torch
+import torch.nn as nn
+
+from protenix.utils.checkpoint_io import (
+    convert_checkpoint,
+    init_empty_model,
+    load_model_state_dict,
+    load_state_dict_to_empty_model,
+)
+
+
+class ToyModel(nn.Module):
+    def __init__(self, c_in: int = 8, c_out: int = 4) -> None:
+        super(ToyModel, self).__init__()
+        self.linear = nn.Linear(c_in, 16)
+        self.layernorm = nn.LayerNorm(16)
+        self.output = nn.Linear(16, c_out, bias=False)
+
+    def forward(self, x):
+        return self.output(self.layernorm(self.linear(x)))
+
+
+class TestCheckpointIO(unittest.TestCase):
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        self.model = ToyModel().eval()
+        self.x = torch.randn(3, 8)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        # DDP-style training checkpoint
+        self.checkpoint_path = os.path.join(self.tmp_dir.name, "ckpt.pt")
+        torch.save(
+            {
+                "model": {f"module.{k}": v for k, v in self.model.state_dict().items()},
+                "step": 10,
+            },
+            self.checkpoint_path,
+        )
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_fast_load(self):
+        model = init_empty_model(ToyModel, c_in=8, c_out=4)
+        self.assertTrue(all(p.is_meta for p in model.parameters()))
+        state_dict = load_model_state_dict(self.checkpoint_path, mmap=True)
+        model = load_state_dict_to_empty_model(model, state_dict, device="cpu").eval()
+        self.assertTrue(torch.equal(model(self.x), self.model(self.x)))
+
+    def test_missing_keys(self):
+        model = init_empty_model(ToyModel)
+        state_dict = load_model_state_dict(self.checkpoint_path)
+        state_dict.pop("output.weight")
+        with self.assertRaises(RuntimeError):
+            load_state_dict_to_empty_model(model, state_dict, "cpu", strict=False)
+
+    def test_convert(self):
+        flat_path = os.path.join(self.tmp_dir.name, "flat.pt")
+        shapes = convert_checkpoint(self.checkpoint_path, flat_path)
+        self.assertEqual(shapes["output.weight"], (4, 16))
+        flat = torch.load(flat_path, mmap=True)
+        self.assertEqual(set(flat.keys()), set(self.model.state_dict().keys()))
+        model = load_state_dict_to_empty_model(
+            init_empty_model(ToyModel), load_model_state_dict(flat_path), "cpu"
+        ).eval()
+        self.assertTrue(torch.equal(model(self.x), self.model(self.x)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import os
+import tempfile
+import time
+import unittest
+
+import torch
+
+from protenix.utils.chunk_tuning import PersistentChunkSizeTuner
+
+
+class FakeModule(object):
+    """Slower for small chunks, out of memory without chunking or with large chunks"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, chunk_size):
+        self.calls.append(chunk_size)
+        if chunk_size is None or chunk_size > 32:
+            raise torch.cuda.OutOfMemoryError("CUDA out of memory")
+        time.sleep(0.02 / chunk_size)
+
+
+class TestPersistentChunkSizeTuner(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmp_dir.name, "cache", "chunk_sizes.json")
+        self.device = torch.device("cpu")
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def make_tuner(self, config_key="model"):
+        return PersistentChunkSizeTuner(
+            candidates=[1, 4, 16, 64],
+            cache_path=self.cache_path,
+            config_key=config_key,
+        )
+
+    def test_tune(self):
+        fn = FakeModule()
+        tuner = self.make_tuner()
+        self.assertEqual(tuner.tune(fn, self.device, 300, 4000, 10), 16)
+        # Warm-up, then 2 runs of each candidate that fits
+        self.assertEqual(fn.calls, [1, None, 64, 16, 16, 4, 4, 1, 1])
+        # Same bucket
+        self.assertEqual(tuner.tune(fn, self.device, 500, 3000, 1), 16)
+        self.assertEqual(len(fn.calls), 9)
+        with open(self.cache_path) as f:
+            self.assertEqual(json.load(f), {"cpu|model": {"512_4096_1024": 16}})
+
+        # Persisted across tuners
+        fn = FakeModule()
+        self.assertEqual(self.make_tuner().tune(fn, self.device, 300, 4000, 10), 16)
+        self.assertEqual(fn.calls, [])
+        # New bucket and new model config
+        self.make_tuner().tune(fn, self.device, 600, 4000, 10)
+        self.make_tuner("other").tune(fn, self.device, 300, 4000, 10)
+        self.assertEqual(len(fn.calls), 18)
+        with open(self.cache_path) as f:
+            cache = json.load(f)
+        self.assertEqual(len(cache["cpu|model"]), 2)
+        self.assertEqual(cache["cpu|other"], {"512_4096_1024": 16})
+
+    def test_warm_up_and_noise(self):
+        calls = []
+
+        def fn(chunk_size):
+            calls.append(chunk_size)
+            # Slow first call, and one noisy run of the fastest candidate
+            if len(calls) == 1 or calls.count(4) == 1 and chunk_size == 4:
+                time.sleep(0.1)
+            else:
+                time.sleep(0.001 if chunk_size == 4 else 0.01)
+
+        self.assertEqual(self.make_tuner().tune(fn, self.device, 10, 10, 10), 4)
+
+    def test_nothing_fits(self):
+        def fn(chunk_size):
+            raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+
+        self.assertEqual(self.make_tuner().tune(fn, self.device, 10, 10, 10), 1)
+
+    def test_other_errors_raise(self):
+        def fn(chunk_size):
+            raise ValueError("bug")
+
+        with self.assertRaises(ValueError):
+            self.make_tuner().tune(fn, self.device, 10, 10, 10)
+        self.assertFalse(os.path.exists(self.cache_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
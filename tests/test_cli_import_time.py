@@ -0,0 +1,70 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import subprocess
+import sys
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cumulative import time of the CLI module. Importing torch alone takes over a second.
+CLI_IMPORT_BUDGET_US = 1_000_000
+
+# Start the CLI, show the help of all the subcommands, and import the modules the
+# lightweight subcommands (tojson, msa) run with.
+CLI_SCRIPT = """
+import sys
+from runner.batch_inference import protenix_cli
+for command in ["predict", "tojson", "msa", "serve"]:
+    protenix_cli([command, "--help"], standalone_mode=False)
+import protenix.data.json_maker
+import runner.msa_search
+"""
+
+
+def parse_importtime(stderr: str) -> dict[str, int]:
+    """Cumulative import time in us of each module, from the output of python -X importtime."""
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, value, name = line.split("|")
+        cumulative[name.strip()] = int(value)
+    return cumulative
+
+
+class TestCliImportTime(unittest.TestCase):
+    def test_lightweight_commands_do_not_import_torch(self):
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            [REPO_DIR] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else [])
+        )
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", CLI_SCRIPT],
+            cwd=REPO_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+            timeout=300,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+        cumulative = parse_importtime(result.stderr)
+        self.assertIn("runner.batch_inference", cumulative)
+        self.assertNotIn("torch", cumulative)
+        self.assertLess(cumulative["runner.batch_inference"], CLI_IMPORT_BUDGET_US)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import glob
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+from protenix.utils.file_io import load_npz_mmap
+from runner.dumper import DataDumper
+
+
+def make_pred_dict(N_sample=3, N_token=40, N_atom=100):
+    torch.manual_seed(0)
+    full_data = []
+    for _ in range(N_sample):
+        full_data.append(
+            {
+                "atom_plddt": torch.rand(N_atom),
+                "token_pair_pae": torch.rand(N_token, N_token) * 32,
+                "token_pair_pde": torch.rand(N_token, N_token) * 32,
+                "contact_probs": torch.rand(N_token, N_token).to(torch.bfloat16),
+                "token_asym_id": torch.arange(N_token) // 10,
+                "atom_is_polymer": torch.ones(N_atom, dtype=torch.bool),
+                "atom_coordinate": torch.rand(N_atom, 3),
+            }
+        )
+    return {
+        "coordinate": torch.rand(N_sample, N_atom, 3) * 10,
+        "summary_confidence": [
+            {"ranking_score": torch.tensor(score)} for score in [0.2, 0.9, 0.5]
+        ],
+        "full_data": full_data,
+    }
+
+
+class TestConfidenceNPZ(unittest.TestCase):
+    def test_load_npz_mmap(self):
+        arrays = {
+            "a": np.arange(12, dtype=np.float16).reshape(3, 4),
+            "b": np.asfortranarray(np.random.rand(5, 6)),
+            "c": np.zeros((0, 3), dtype=np.int32),
+            "d": np.array(True),
+        }
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for save in [np.savez, np.savez_compressed]:
+                fpath = os.path.join(tmp_dir, f"{save.__name__}.npz")
+                save(fpath, **arrays)
+                loaded = load_npz_mmap(fpath)
+                self.assertEqual(set(loaded), set(arrays))
+                for k, v in arrays.items():
+                    self.assertEqual(loaded[k].dtype, v.dtype)
+                    np.testing.assert_array_equal(loaded[k], v)
+                if save is np.savez:
+                    self.assertIsInstance(loaded["a"], np.memmap)
+
+    def test_dump_npz(self):
+        pred_dict = make_pred_dict()
+        expected = {k: v.clone() for k, v in pred_dict["full_data"][1].items()}
+        coordinate = pred_dict["coordinate"].clone()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dumper = DataDumper(
+                base_dir=tmp_dir, need_atom_confidence=True, confidence_format="npz"
+            )
+            sorted_indices = dumper._get_ranker_indices(pred_dict)
+            dumper._save_confidence(pred_dict, tmp_dir, "7pzb", 101, sorted_indices)
+            self.assertEqual(len(glob.glob(os.path.join(tmp_dir, "*full_data*"))), 1)
+            self.assertEqual(
+                len(glob.glob(os.path.join(tmp_dir, "*summary_confidence*.json"))), 3
+            )
+            arrays = load_npz_mmap(os.path.join(tmp_dir, "7pzb_seed_101_full_data.npz"))
+            self.assertNotIn("atom_coordinate", arrays)
+            self.assertNotIn("atom_is_polymer", arrays)
+            self.assertEqual(arrays["token_pair_pae"].shape, (3, 40, 40))
+            self.assertEqual(arrays["token_pair_pae"].dtype, np.float16)
+            self.assertEqual(arrays["coordinate"].dtype, np.float32)
+            self.assertEqual(arrays["token_asym_id"].dtype, np.int64)
+            # Sample 1 has the best ranking score
+            np.testing.assert_allclose(arrays["coordinate"][0], coordinate[1].numpy())
+            for key in ["atom_plddt", "token_pair_pae", "contact_probs"]:
+                np.testing.assert_allclose(
+                    arrays[key][0], expected[key].float().numpy(), rtol=1e-3, atol=1e-3
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from protenix.data.dataloader import DevicePrefetcher
+
+
+class SlowDataset(Dataset):
+    def __len__(self):
+        return 4
+
+    def __getitem__(self, idx):
+        time.sleep(0.02)
+        return {
+            "input_feature_dict": {"x": torch.full((8, 8), float(idx)), "name": "x"},
+            "label_dict": {"y": torch.tensor(idx)},
+        }
+
+
+class TestDevicePrefetcher(unittest.TestCase):
+    def _check(self, device):
+        dataloader = DataLoader(
+            SlowDataset(),
+            batch_size=1,
+            collate_fn=lambda batch: batch[0],
+            pin_memory=device.type == "cuda",
+        )
+        prefetcher = DevicePrefetcher(dataloader, device)
+        for _ in range(2):  # epochs
+            batches = list(prefetcher)
+            self.assertEqual([b["label_dict"]["y"].item() for b in batches], [0, 1, 2, 3])
+            for idx, batch in enumerate(batches):
+                x = batch["input_feature_dict"]["x"]
+                self.assertEqual(x.device.type, device.type)
+                self.assertTrue(torch.all(x == idx))
+                self.assertEqual(batch["input_feature_dict"]["name"], "x")
+            self.assertGreater(prefetcher.pop_stall_time(), 4 * 0.02)
+            self.assertEqual(prefetcher.pop_stall_time(), 0.0)
+
+    def test_cpu(self):
+        self._check(torch.device("cpu"))
+
+    @unittest.skipIf(not torch.cuda.is_available(), "no cuda")
+    def test_cuda(self):
+        self._check(torch.device("cuda"))
+
+
+if __name__ == "__main__":
+    unittest.main()
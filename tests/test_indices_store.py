@@ -0,0 +1,169 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pickle
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from protenix.data import indices_store
+from protenix.data.indices_store import (
+    IndicesStore,
+    IndicesView,
+    PDBGroupedIndices,
+)
+from protenix.data.kv_store import get_cache_path
+from protenix.utils.file_io import read_indices_csv
+
+
+def make_indices_csv(fpath, n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    is_chain = rng.random(n) < 0.5
+    mol_types = ["protein", "nuc", "ligand", "ions"]
+    pd.DataFrame(
+        {
+            "type": np.where(is_chain, "chain", "interface"),
+            "pdb_id": np.char.add("pdb", rng.integers(0, 40, n).astype(str)),
+            "num_tokens": rng.integers(10, 2000, n),
+            "eval_type": rng.choice(["intra_protein", "protein_ligand", "other"], n),
+            "mol_1_type": rng.choice(mol_types, n),
+            "chain_1_id": rng.choice(["A", "B", "C"], n),
+            "mol_2_type": np.where(is_chain, "", rng.choice(mol_types, n)),
+            "chain_2_id": np.where(is_chain, "", rng.choice(["A", "B", "C"], n)),
+        }
+    ).to_csv(fpath, index=False)
+
+
+class TestIndicesStore(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.tmp_dir.name, "indices.csv")
+        make_indices_csv(self.csv_path)
+        self.cache_dir = os.path.join(self.tmp_dir.name, "cache")
+        patcher = mock.patch.dict(os.environ, {"PROTENIX_CACHE_DIR": self.cache_dir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_store(self):
+        df = read_indices_csv(self.csv_path)
+        store = IndicesStore.from_csv(self.csv_path)
+        self.assertTrue(os.path.exists(store.store_dir / "meta.json"))
+        self.assertEqual(store.column("num_tokens").dtype, np.int64)
+        self.assertIsInstance(store.column("pdb_id"), np.memmap)
+        pd.testing.assert_frame_equal(store.to_dataframe(), df)
+
+        rows = np.array([5, 1, 7])
+        pd.testing.assert_frame_equal(store.to_dataframe(rows), df.iloc[rows])
+
+        mask = store.isin("pdb_id", {"pdb1", "pdb2"})
+        np.testing.assert_array_equal(mask, df["pdb_id"].isin({"pdb1", "pdb2"}))
+        excluded = {("protein", "ligand"), ("nuc", "nuc")}
+        mask = store.isin(["mol_1_type", "mol_2_type"], excluded)
+        expected = [
+            (a, b) in excluded for a, b in zip(df["mol_1_type"], df["mol_2_type"])
+        ]
+        np.testing.assert_array_equal(mask, expected)
+
+        # Pickling maps the same files again
+        unpickled = pickle.loads(pickle.dumps(store))
+        pd.testing.assert_frame_equal(unpickled.to_dataframe(rows), df.iloc[rows])
+
+        # A new store is built next to the old one when the CSV changes
+        make_indices_csv(self.csv_path, n=50, seed=1)
+        new_store = IndicesStore.from_csv(self.csv_path)
+        self.assertEqual(len(new_store), 50)
+        self.assertNotEqual(new_store.store_dir, store.store_dir)
+        self.assertEqual(
+            os.listdir(f"{self.csv_path}.columns"), [new_store.store_dir.name]
+        )
+        # The pages of the old store are still mapped
+        self.assertEqual(len(store.to_dataframe()), len(df))
+
+    def test_read_only_csv_dir(self):
+        mkdir = Path.mkdir
+
+        def mkdir_outside_csv_dir(path, *args, **kwargs):
+            if str(path).startswith(self.csv_path):
+                raise PermissionError(f"Read-only directory: {path}")
+            return mkdir(path, *args, **kwargs)
+
+        df = read_indices_csv(self.csv_path)
+        cache_dir = get_cache_path(self.csv_path, "columns")
+        with mock.patch.object(Path, "mkdir", mkdir_outside_csv_dir):
+            store = IndicesStore.from_csv(self.csv_path)
+            self.assertFalse(os.path.exists(f"{self.csv_path}.columns"))
+            self.assertEqual(store.store_dir.parent, cache_dir)
+            pd.testing.assert_frame_equal(store.to_dataframe(), df)
+
+            # The other processes and runs reuse the cached store
+            with mock.patch.object(
+                indices_store, "convert_indices_csv", side_effect=AssertionError
+            ):
+                self.assertEqual(
+                    IndicesStore.from_csv(self.csv_path).store_dir, store.store_dir
+                )
+
+            make_indices_csv(self.csv_path, n=50, seed=1)
+            new_store = IndicesStore.from_csv(self.csv_path)
+            self.assertEqual(len(new_store), 50)
+            self.assertEqual(os.listdir(cache_dir), [new_store.store_dir.name])
+
+    def test_view(self):
+        df = read_indices_csv(self.csv_path)
+        view = IndicesView(IndicesStore.from_csv(self.csv_path))
+        selected = view.select(np.array([9, 4, 2, 8]))[1:]
+        rows = np.array([4, 2, 8])
+        np.testing.assert_array_equal(selected.rows, rows)
+        np.testing.assert_array_equal(
+            selected.column("num_tokens"), df["num_tokens"].iloc[rows].astype(int)
+        )
+        np.testing.assert_array_equal(
+            selected.isin("pdb_id", {"pdb1"}), df["pdb_id"].iloc[rows] == "pdb1"
+        )
+        pd.testing.assert_series_equal(selected.row(1), df.iloc[2])
+        pd.testing.assert_frame_equal(
+            selected.to_dataframe(columns=["pdb_id", "chain_2_id"]),
+            df.iloc[rows][["pdb_id", "chain_2_id"]],
+        )
+
+    def test_grouped(self):
+        df = read_indices_csv(self.csv_path)
+        grouped = PDBGroupedIndices.from_indices(
+            IndicesView(IndicesStore.from_csv(self.csv_path))
+        )
+        expected = [x.reset_index() for _, x in df.groupby("pdb_id", sort=True)]
+        self.assertEqual(len(grouped), len(expected))
+        for x, y in zip(grouped, expected):
+            pd.testing.assert_frame_equal(x, y)
+
+        selected = grouped.select(np.array([3, 0]))[1:]
+        self.assertEqual(len(selected), 1)
+        pd.testing.assert_frame_equal(selected[0], expected[0])
+        is_ligand = (df["mol_2_type"] == "ligand").to_numpy()
+        np.testing.assert_array_equal(
+            grouped.any_row(is_ligand[grouped.indices.rows]),
+            [(x["mol_2_type"] == "ligand").any() for x in expected],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
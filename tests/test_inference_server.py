@@ -0,0 +1,206 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import urllib.request
+
+import torch
+from ml_collections.config_dict import ConfigDict
+
+from runner.inference_server import InferenceServer, UnixHTTPConnection
+
+
+class ToyDumper(object):
+    def __init__(self):
+        self.dumped = []
+
+    def get_dump_dir(self, dataset_name, sample_name, seed):
+        return f"{sample_name}/seed_{seed}"
+
+    def dump(self, dataset_name, pdb_id, seed, pred_dict, atom_array, **kwargs):
+        self.dumped.append((pdb_id, seed))
+
+
+class ToyRunner(object):
+    """Stands in for InferenceRunner: predicts without a model checkpoint."""
+
+    def __init__(self):
+        self.configs = ConfigDict(
+            {
+                "seeds": [101],
+                "dump_dir": "./output",
+                "use_msa": False,
+                "deterministic": False,
+                "skip_amp": {"confidence_head": True, "sample_diffusion": True},
+            }
+        )
+        self.dumper = ToyDumper()
+        self.gate = threading.Event()
+
+    def update_model_configs(self, new_configs):
+        self.configs = new_configs
+
+    def predict(self, data):
+        self.gate.wait(timeout=30)
+        feat = data["input_feature_dict"]
+        del feat["token_index"]
+        return {"summary_confidence": [{"ranking_score": torch.tensor(0.5)}]}
+
+
+def toy_featurize(sample_dict):
+    if sample_dict["name"] == "bad":
+        raise ValueError("can not featurize")
+    N_token = len(sample_dict["sequences"][0]["proteinChain"]["sequence"])
+    data = {
+        "input_feature_dict": {"token_index": torch.arange(N_token)},
+        "N_token": torch.tensor([N_token]),
+        "N_atom": torch.tensor([N_token * 5]),
+        "entity_poly_type": {},
+    }
+    return data, None, {"featurizer": 0.0}
+
+
+def make_job(name, seq="MAG"):
+    return {"name": name, "sequences": [{"proteinChain": {"sequence": seq, "count": 1}}]}
+
+
+class TestInferenceServer(unittest.TestCase):
+    def setUp(self) -> None:
+        self.runner = ToyRunner()
+        self.server = InferenceServer(
+            self.runner, num_featurize_workers=2, featurize_fn=toy_featurize
+        )
+        self.server.start_workers()
+
+    def tearDown(self) -> None:
+        self.runner.gate.set()
+        self.server.stop_workers()
+
+    def test_priority_and_failures(self):
+        first = self.server.submit(make_job("first"))
+        # wait until the first job blocks the predictor
+        for event in first.iter_events(timeout=10):
+            if event["status"] == "predicting":
+                break
+        low = self.server.submit(make_job("low"), priority=0, seeds=[1, 2])
+        high = self.server.submit(make_job("high"), priority=5)
+        bad = self.server.submit(make_job("bad"))
+        for job in (low, high, bad):
+            for event in job.iter_events(timeout=10):
+                if event["status"] in ("featurized", "failed"):
+                    break
+        self.runner.gate.set()
+        for job in (first, low, high, bad):
+            self.assertTrue(job.wait(timeout=30))
+
+        self.assertEqual(bad.status, "failed")
+        self.assertEqual(first.status, "done")
+        self.assertEqual(
+            self.runner.dumper.dumped,
+            [("first", 101), ("high", 101), ("low", 1), ("low", 2)],
+        )
+        # features are not consumed across seeds
+        self.assertEqual(
+            [e["seed"] for e in low.events if e["status"] == "predicted"], [1, 2]
+        )
+
+    def test_featurized_jobs_are_bounded(self):
+        jobs = [self.server.submit(make_job(f"job{i}")) for i in range(6)]
+        for event in jobs[0].iter_events(timeout=10):
+            if event["status"] == "predicting":
+                break
+        time.sleep(0.2)
+        # One job predicting, two waiting for the model, one per blocked featurizer
+        featurized = [job for job in jobs if job.status == "featurized"]
+        self.assertEqual(len(featurized), 4)
+        self.assertEqual(jobs[-1].status, "pending")
+        self.runner.gate.set()
+        for job in jobs:
+            self.assertTrue(job.wait(timeout=30))
+            self.assertEqual(job.status, "done")
+
+    def test_finished_jobs_expire(self):
+        self.runner.gate.set()
+        self.server.job_ttl = 0.1
+        job = self.server.submit(make_job("old"))
+        self.assertTrue(job.wait(timeout=30))
+        self.assertIs(self.server.get_job(job.job_id), job)
+        time.sleep(0.2)
+        pending = self.server.submit(make_job("new"))
+        self.assertIsNone(self.server.get_job(job.job_id))
+        self.assertTrue(pending.wait(timeout=30))
+
+    def _check_http(self, request_fn):
+        self.runner.gate.set()
+        job_id = request_fn("POST", "/jobs", {"job": make_job("http"), "seeds": [7]})[
+            "job_id"
+        ]
+        events = request_fn("GET", f"/jobs/{job_id}/stream", None)
+        self.assertEqual(events[-1]["status"], "done")
+        self.assertIn("predicted", [e["status"] for e in events])
+        status = request_fn("GET", f"/jobs/{job_id}", None)
+        self.assertEqual(status["status"], "done")
+        self.assertEqual(request_fn("GET", "/health", None)["status"], "ok")
+
+    @staticmethod
+    def _parse(path, body):
+        if path.endswith("/stream"):
+            return [json.loads(x) for x in body.decode().splitlines()]
+        return json.loads(body)
+
+    def test_tcp(self):
+        httpd = self.server.make_http_server(host="127.0.0.1", port=0)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{httpd.server_address[1]}"
+
+        def request_fn(method, path, obj):
+            data = None if obj is None else json.dumps(obj).encode()
+            req = urllib.request.Request(url + path, data=data, method=method)
+            with urllib.request.urlopen(req, timeout=30) as f:
+                return self._parse(path, f.read())
+
+        try:
+            self._check_http(request_fn)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+    def test_unix_socket(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sock_path = os.path.join(tmp_dir, "protenix.sock")
+            httpd = self.server.make_http_server(unix_socket=sock_path)
+            threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+            def request_fn(method, path, obj):
+                conn = UnixHTTPConnection(sock_path, timeout=30)
+                body = None if obj is None else json.dumps(obj)
+                conn.request(method, path, body=body)
+                out = self._parse(path, conn.getresponse().read())
+                conn.close()
+                return out
+
+            try:
+                self._check_http(request_fn)
+            finally:
+                httpd.shutdown()
+                httpd.server_close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import math
+import unittest
+
+import torch
+
+from protenix.utils.kabsch import apply_transform, kabsch_align, weighted_kabsch
+
+
+def random_rotation(*batch_shape, generator=None) -> torch.Tensor:
+    q = torch.randn(*batch_shape, 3, 3, dtype=torch.float64, generator=generator)
+    q, r = torch.linalg.qr(q)
+    q = q * torch.sign(torch.diagonal(r, dim1=-2, dim2=-1)).unsqueeze(-2)
+    # Make it a proper rotation
+    det = torch.linalg.det(q)
+    q[..., :, 0] = q[..., :, 0] * det.unsqueeze(-1)
+    return q
+
+
+def rotation_around_z(angle: float) -> torch.Tensor:
+    c, s = math.cos(angle), math.sin(angle)
+    return torch.tensor([[c, -s, 0.0], [s, c, 0.0], [0.0, 0.0, 1.0]], dtype=torch.float64)
+
+
+class TestWeightedKabsch(unittest.TestCase):
+    def setUp(self):
+        self.generator = torch.Generator().manual_seed(0)
+
+    def _randn(self, *shape):
+        return torch.randn(*shape, dtype=torch.float64, generator=self.generator)
+
+    def test_recovers_transform(self):
+        src = self._randn(4, 3, 30, 3)
+        rot = random_rotation(4, 3, generator=self.generator)
+        trans = self._randn(4, 3, 1, 3)
+        tgt = apply_transform(src, rot, trans)
+        for solver in ["svd", "quaternion", "auto"]:
+            rot_fit, trans_fit = weighted_kabsch(src, tgt, solver=solver)
+            self.assertTrue(torch.allclose(rot_fit, rot, atol=1e-8), solver)
+            self.assertTrue(torch.allclose(trans_fit, trans, atol=1e-8), solver)
+
+    def test_solvers_agree(self):
+        src = self._randn(64, 20, 3)
+        tgt = src @ random_rotation(64, generator=self.generator) + self._randn(64, 20, 3)
+        weight = torch.rand(64, 20, dtype=torch.float64, generator=self.generator)
+        rot_svd, trans_svd = weighted_kabsch(src, tgt, weight, solver="svd")
+        rot_quat, trans_quat = weighted_kabsch(src, tgt, weight, solver="quaternion")
+        self.assertTrue(torch.allclose(rot_svd, rot_quat, atol=1e-8))
+        self.assertTrue(torch.allclose(trans_svd, trans_quat, atol=1e-8))
+        det = torch.linalg.det(rot_quat)
+        self.assertTrue(torch.allclose(det, torch.ones_like(det)))
+
+    def test_half_turn_and_degenerate(self):
+        src = self._randn(10, 3)
+        line = torch.linspace(0, 1, 10, dtype=torch.float64)[:, None] * torch.ones(3)
+        cases = {
+            "half_turn": (src, src @ rotation_around_z(math.pi).T),
+            "collinear": (line, line @ rotation_around_z(1.0).T),
+            "single_point": (src[:1], src[:1] + 1.0),
+        }
+        for name, (x, y) in cases.items():
+            for solver in ["svd", "quaternion"]:
+                rot, trans = weighted_kabsch(x, y, solver=solver)
+                self.assertTrue(torch.isfinite(rot).all(), (name, solver))
+                eye = torch.eye(3, dtype=torch.float64)
+                self.assertTrue(torch.allclose(rot @ rot.T, eye, atol=1e-8))
+                aligned = apply_transform(x, rot, trans)
+                self.assertTrue(torch.allclose(aligned, y, atol=1e-6), (name, solver))
+
+    def test_mask_and_broadcast(self):
+        src = self._randn(25, 3)
+        tgt = self._randn(5, 25, 3)
+        mask = torch.rand(5, 25, generator=self.generator) > 0.3
+        # Masked points must not matter, whatever their coordinates
+        tgt_noisy = torch.where(mask[..., None], tgt, 100.0)
+        rot, trans = weighted_kabsch(src, tgt_noisy, mask=mask.double())
+        self.assertEqual(rot.shape, (5, 3, 3))
+        self.assertEqual(trans.shape, (5, 1, 3))
+        for i in range(5):
+            rot_i, trans_i = weighted_kabsch(src[mask[i]], tgt[i][mask[i]])
+            self.assertTrue(torch.allclose(rot[i], rot_i, atol=1e-8))
+            self.assertTrue(torch.allclose(trans[i], trans_i, atol=1e-8))
+
+    def test_reflection(self):
+        src = self._randn(30, 3)
+        mirror = torch.diag(torch.tensor([1.0, 1.0, -1.0], dtype=torch.float64))
+        tgt = src @ mirror
+        rot, _ = weighted_kabsch(src, tgt, allow_reflection=True, solver="quaternion")
+        self.assertTrue(torch.allclose(rot, mirror, atol=1e-8))
+        rot, _ = weighted_kabsch(src, tgt, allow_reflection=False)
+        self.assertAlmostEqual(torch.linalg.det(rot).item(), 1.0)
+
+    def test_half_precision(self):
+        src = self._randn(2, 50, 3)
+        tgt = apply_transform(src, random_rotation(2, generator=self.generator), 1.0)
+        aligned, rot, _ = kabsch_align(src.bfloat16(), tgt.bfloat16())
+        self.assertEqual(aligned.dtype, torch.bfloat16)
+        self.assertEqual(rot.dtype, torch.float32)
+        self.assertLess((aligned.double() - tgt).abs().max().item(), 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
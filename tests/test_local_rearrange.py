@@ -17,6 +17,9 @@ import unittest
 import torch
 
 from protenix.model.modules.primitives import (
+    LocalAttentionLayout,
+    _local_attention,
+    broadcast_token_to_local_atom_pair,
     rearrange_qk_to_dense_trunk,
     rearrange_to_dense_trunk,
 )
@@ -66,6 +69,56 @@ class TestUtils(unittest.TestCase):
         self.assertTrue(torch.allclose(q_b, q_trunked))
         self.assertTrue(torch.allclose(k_b, k_trunked))
 
+    def test_layout(self):
+        n_queries = 32
+        n_keys = 128
+        d = 9
+        torch.random.manual_seed(42)
+        for n in [5, 32, 100, 128 * 2 + 18]:
+            atom_to_token_idx = torch.sort(torch.randint(0, 20, size=(n,)))[0]
+            layout = LocalAttentionLayout(
+                n, n_queries, n_keys, atom_to_token_idx=atom_to_token_idx
+            )
+            q, k, v = create_qkv((2, 3), n, n, d)
+            q_trunked, k_trunked, v_trunked, attn_bias_trunked, q_pad_length = (
+                rearrange_to_dense_trunk(q, k, v, n_queries, n_keys)
+            )
+            self.assertEqual(layout.q_pad, q_pad_length)
+            self.assertTrue(torch.equal(layout.trunk_q(q, dim=-2), q_trunked))
+            self.assertTrue(torch.equal(layout.trunk_k(k, dim=-2), k_trunked))
+            self.assertTrue(torch.equal(layout.trunk_k(v, dim=-2), v_trunked))
+            self.assertTrue(
+                torch.equal(layout.attn_bias_trunked(), attn_bias_trunked[0, 0])
+            )
+
+            _, _, padding_info = rearrange_qk_to_dense_trunk(
+                q, k, dim_q=-2, dim_k=-2, n_queries=n_queries, n_keys=n_keys
+            )
+            self.assertTrue(
+                torch.equal(layout.mask_trunked, padding_info["mask_trunked"][0, 0])
+            )
+
+            z_token = torch.rand(2, 20, 20, d)
+            z_local, _ = broadcast_token_to_local_atom_pair(
+                z_token, atom_to_token_idx, n_queries, n_keys, compute_mask=False
+            )
+            self.assertTrue(torch.equal(layout.gather_pair_embedding(z_token), z_local))
+
+            trunked_bias = torch.rand(2, 3, layout.n_trunks, n_queries, n_keys)
+            out = _local_attention(
+                q, k, v, n_queries, n_keys, trunked_attn_bias=trunked_bias
+            )
+            out_layout = _local_attention(
+                q,
+                k,
+                v,
+                n_queries,
+                n_keys,
+                trunked_attn_bias=trunked_bias,
+                local_layout=layout,
+            )
+            self.assertTrue(torch.equal(out, out_layout))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,86 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import os
+import socket
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from protenix.utils.metrics import DeviceMetricAggregator, SimpleMetricAggregator
+
+
+def add_values(aggregator, rank=0):
+    for step in range(5):
+        aggregator.add("loss", torch.tensor(float(step + rank)), namespace="train")
+        aggregator.add("lddt", torch.arange(3.0) * step, namespace="train")
+        aggregator.add("stall", 0.5 * step)
+    if rank == 1:
+        # Only seen by one rank
+        aggregator.add("nan_loss", torch.tensor(True), namespace="train")
+
+
+def run_rank(rank, port, out_dir):
+    dist.init_process_group(
+        "gloo",
+        init_method=f"tcp://127.0.0.1:{port}",
+        rank=rank,
+        world_size=2,
+        timeout=datetime.timedelta(seconds=60),
+    )
+    aggregator = DeviceMetricAggregator()
+    add_values(aggregator, rank)
+    torch.save(aggregator.calc(), os.path.join(out_dir, f"{rank}.pt"))
+    dist.destroy_process_group()
+
+
+class TestDeviceMetricAggregator(unittest.TestCase):
+    def test_single_process(self):
+        aggregator = DeviceMetricAggregator()
+        expected = SimpleMetricAggregator(["avg"])
+        add_values(aggregator)
+        add_values(expected)
+        results = aggregator.calc()
+        expected = expected.calc()
+        self.assertEqual(set(results), set(expected))
+        for key, value in expected.items():
+            self.assertAlmostEqual(results[key], value)
+        # Reset after calc
+        self.assertEqual(aggregator.calc(), {})
+
+    def test_distributed(self):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        with tempfile.TemporaryDirectory() as out_dir, mock.patch.dict(
+            os.environ, {"WORLD_SIZE": "2"}
+        ):
+            mp.spawn(run_rank, args=(port, out_dir), nprocs=2)
+            results = [torch.load(os.path.join(out_dir, f"{r}.pt")) for r in range(2)]
+        self.assertEqual(results[0], results[1])
+        self.assertAlmostEqual(
+            results[0]["train/loss.avg"], np.mean([0, 1, 2, 3, 4, 1, 2, 3, 4, 5])
+        )
+        self.assertAlmostEqual(results[0]["train/nan_loss.avg"], 1.0)
+        self.assertAlmostEqual(results[0]["stall.avg"], 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
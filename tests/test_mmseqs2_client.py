@@ -0,0 +1,130 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import time
+import unittest
+
+from protenix.web_service.colab_request_utils import MMseqs2Client, MMseqs2ServiceError
+from protenix.web_service.mock_mmseqs2_server import MockMMseqs2Server
+from runner.msa_search import batch_msa_search
+
+SEQS = ["MKTAYIAKQR", "GSHMLEDPVR", "MADEEKLPPG", "MSTNPKPQRK", "MVLSPADKTN", "MKVLAAGIVG"]
+
+
+def read_a3m(path):
+    with open(path, "r") as f:
+        return f.read().split("\n")
+
+
+class TestMMseqs2Client(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def make_client(self, server, **kwargs):
+        kwargs.setdefault("min_backoff", 0.02)
+        kwargs.setdefault("max_backoff", 0.2)
+        return MMseqs2Client(server.url, **kwargs)
+
+    def test_concurrent_searches(self):
+        search_time = 0.3
+        with MockMMseqs2Server(search_time=search_time) as server:
+            client = self.make_client(server, max_in_flight=3)
+            seq_to_dir = {
+                seq: os.path.join(self.tmp_dir.name, str(i)) for i, seq in enumerate(SEQS)
+            }
+            done = []
+            start = time.time()
+            errors = client.search_many(
+                seq_to_dir, on_done=lambda seq, out_dir: done.append(seq)
+            )
+            elapsed = time.time() - start
+        self.assertEqual(errors, {seq: None for seq in SEQS})
+        self.assertEqual(sorted(done), sorted(SEQS))
+        self.assertEqual(server.stats["submitted"], len(SEQS))
+        self.assertLessEqual(server.stats["max_running"], 3)
+        self.assertGreater(server.stats["max_running"], 1)
+        self.assertLess(elapsed, len(SEQS) * search_time)
+        for seq, out_dir in seq_to_dir.items():
+            self.assertEqual(read_a3m(os.path.join(out_dir, "0.a3m"))[1], seq)
+
+    def test_failures(self):
+        # transient 503s and rate limiting are retried, invalid sequences fail alone
+        with MockMMseqs2Server(search_time=0.05, max_running=2, fail_every=4) as server:
+            client = self.make_client(server, max_in_flight=4)
+            seq_to_dir = {
+                seq: os.path.join(self.tmp_dir.name, str(i))
+                for i, seq in enumerate(SEQS + ["NOT_A_PROTEIN"])
+            }
+            errors = client.search_many(seq_to_dir)
+        self.assertGreater(server.stats["failed"], 0)
+        self.assertGreater(server.stats["ratelimited"], 0)
+        self.assertIsInstance(errors.pop("NOT_A_PROTEIN"), MMseqs2ServiceError)
+        self.assertEqual(errors, {seq: None for seq in SEQS})
+
+    def test_ratelimit_wait_is_bounded(self):
+        with MockMMseqs2Server(search_time=5.0, max_running=1) as server:
+            client = self.make_client(server, max_submit_wait=0.3)
+            client.submit(SEQS[0])
+            start = time.time()
+            with self.assertRaises(MMseqs2ServiceError):
+                client.submit(SEQS[1])
+            self.assertLess(time.time() - start, 2.0)
+        self.assertGreater(server.stats["ratelimited"], 1)
+
+    def test_unreachable_server(self):
+        client = MMseqs2Client(
+            "http://127.0.0.1:9", max_retries=2, min_backoff=0.01, timeout=0.5
+        )
+        with self.assertRaises(MMseqs2ServiceError):
+            client.search(SEQS[0], self.tmp_dir.name)
+
+    def test_batch_msa_search(self):
+        seqs = SEQS[:3] + SEQS[:2] + ["NOT_A_PROTEIN"]
+        with MockMMseqs2Server(search_time=0.05) as server:
+            msa_dirs = batch_msa_search(
+                seqs, self.tmp_dir.name, max_in_flight=4, host_url=server.url
+            )
+            # identical sequences are searched once
+            self.assertEqual(server.stats["submitted"], 4)
+            self.assertEqual(set(msa_dirs), set(seqs))
+            for seq in SEQS[:3]:
+                pairing = read_a3m(os.path.join(msa_dirs[seq], "pairing.a3m"))
+                non_pairing = read_a3m(os.path.join(msa_dirs[seq], "non_pairing.a3m"))
+                self.assertEqual(pairing[:2], [">query", seq])
+                self.assertTrue(pairing[2].startswith(">UniRef100_MOCK0_9606/"))
+                self.assertEqual(non_pairing[:2], [">query", seq])
+                self.assertGreater(len(non_pairing), 4)
+            # the failed sequence falls back to a dummy msa
+            self.assertTrue(msa_dirs["NOT_A_PROTEIN"].endswith(".failed/0"))
+            self.assertEqual(
+                read_a3m(os.path.join(msa_dirs["NOT_A_PROTEIN"], "non_pairing.a3m")),
+                [">query", "NOT_A_PROTEIN", ""],
+            )
+
+            # finished searches are reused, only the failed one is searched again
+            self.assertEqual(
+                batch_msa_search(seqs, self.tmp_dir.name, host_url=server.url),
+                msa_dirs,
+            )
+            self.assertEqual(server.stats["submitted"], 5)
+        self.assertFalse(
+            any(name.endswith(".tmp") for name in os.listdir(self.tmp_dir.name))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+import torch
+
+from protenix.model.modules.pairformer import MSAPairWeightedAveraging, MSAStack
+
+
+class TestMSAPairWeightedAveraging(unittest.TestCase):
+    def setUp(self) -> None:
+        torch.manual_seed(0)
+        self.m = torch.randn(2, 37, 20, 64)
+        self.z = torch.randn(2, 20, 20, 128)
+
+    def test_chunked(self):
+        module = MSAPairWeightedAveraging(c=8)
+        with torch.no_grad():
+            expected = module(self.m, self.z)
+            for chunk_size in [1, 5, 37, 100]:
+                out = module(self.m, self.z, chunk_size=chunk_size)
+                self.assertTrue(torch.allclose(out, expected, atol=1e-5))
+                m = self.m.clone()
+                out = module(
+                    m,
+                    self.z,
+                    inplace_safe=True,
+                    chunk_size=chunk_size,
+                    _add_with_inplace=True,
+                )
+                self.assertEqual(out.data_ptr(), m.data_ptr())
+                self.assertTrue(torch.allclose(out, self.m + expected, atol=1e-5))
+
+    def test_chunked_grad(self):
+        module = MSAPairWeightedAveraging(c=8)
+        grads = []
+        for chunk_size in [None, 8]:
+            m = self.m.clone().requires_grad_()
+            module.zero_grad()
+            module(m, self.z, chunk_size=chunk_size).square().sum().backward()
+            grads.append((m.grad, module.linear_no_bias_mv.weight.grad.clone()))
+        for expected, grad in zip(*grads):
+            self.assertTrue(torch.allclose(expected, grad, atol=1e-4))
+
+    def test_msa_stack_inplace(self):
+        module = MSAStack(c_m=64, c=8).eval()
+        with torch.no_grad():
+            expected = module(self.m, self.z)
+            out = module(self.m.clone(), self.z, inplace_safe=True, chunk_size=4)
+        self.assertTrue(torch.allclose(out, expected, atol=1e-5))
+
+
+if __name__ == "__main__":
+    unittest.main()
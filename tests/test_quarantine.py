@@ -0,0 +1,148 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import multiprocessing
+import os
+import pickle
+import tempfile
+import unittest
+
+import pandas as pd
+
+from protenix.data.dataloader import WeightedSampler
+from protenix.data.dataset import BaseSingleDataset, WeightedMultiDataset
+from protenix.data.quarantine import QuarantineRegistry
+
+
+class ToyDataset(BaseSingleDataset):
+    """Fails on the pdb ids starting with "bad"."""
+
+    def process_one(self, idx: int) -> dict:
+        self.processed.append(idx)
+        pdb_id = self._get_sample_indice(idx).pdb_id
+        if pdb_id.startswith("bad"):
+            raise KeyError(pdb_id)
+        return {"pdb_id": pdb_id}
+
+
+def record_failures(error_dir: str, worker_id: int) -> None:
+    registry = QuarantineRegistry(error_dir)
+    for i in range(50):
+        registry.record("toy", f"{worker_id}-{i}", "ValueError")
+
+
+class TestQuarantine(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.error_dir = os.path.join(self.tmp_dir.name, "errors")
+        os.makedirs(self.error_dir)
+        self.csv_path = os.path.join(self.tmp_dir.name, "indices.csv")
+        pdb_ids = ["good0", "bad0", "good1", "bad1", "good2"]
+        pd.DataFrame(
+            {
+                "type": "chain",
+                "pdb_id": pdb_ids,
+                "cluster_id": [str(i) for i in range(len(pdb_ids))],
+                "num_tokens": 10,
+                "mol_1_type": "protein",
+                "chain_1_id": "A",
+                "mol_2_type": "",
+                "chain_2_id": "",
+            }
+        ).to_csv(self.csv_path, index=False)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def make_dataset(self, registry: QuarantineRegistry) -> ToyDataset:
+        dataset = ToyDataset(
+            mmcif_dir=None,
+            bioassembly_dict_dir=None,
+            indices_fpath=self.csv_path,
+            cropping_configs={},
+            name="toy",
+            pdb_list="",
+            random_sample_if_failed=True,
+            error_dir=self.error_dir,
+            quarantine=registry,
+        )
+        dataset.processed = []
+        return dataset
+
+    def test_dataset_and_sampler(self):
+        dataset = self.make_dataset(
+            QuarantineRegistry(self.error_dir, min_failures=1)
+        )
+        for idx in range(len(dataset)):
+            self.assertTrue(dataset[idx]["pdb_id"].startswith("good"))
+        self.assertTrue(os.path.exists(os.path.join(self.error_dir, "bad0-A-nan.json")))
+
+        # A new run loads the registry of the previous one
+        old_registry = os.path.join(self.error_dir, "quarantine.jsonl")
+        new_error_dir = os.path.join(self.tmp_dir.name, "new_errors")
+        os.makedirs(new_error_dir)
+        registry = QuarantineRegistry(
+            new_error_dir, min_failures=1, extra_fpaths=[old_registry]
+        )
+        self.assertEqual(
+            dict(registry.failures("toy")["bad1-A-nan"]), {"KeyError": 1}
+        )
+        dataset = pickle.loads(pickle.dumps(self.make_dataset(registry)))
+        dataset.processed = []
+        dataset[1]
+        self.assertNotIn(1, dataset.processed)
+
+        multi_dataset = WeightedMultiDataset(
+            datasets=[dataset, dataset],
+            dataset_names=["toy", "toy"],
+            datapoint_weights=[[1.0] * 5, [1.0] * 5],
+            dataset_sample_weights=[1.0, 1.0],
+        )
+        self.assertEqual(multi_dataset.get_quarantined_indices().tolist(), [1, 3, 6, 8])
+        sampler = WeightedSampler(
+            weights=multi_dataset.merged_datapoint_weights,
+            num_samples=200,
+            replacement=True,
+            quarantine_fn=multi_dataset.get_quarantined_indices,
+        )
+        self.assertTrue(set(sampler).isdisjoint({1, 3, 6, 8}))
+        sampler.quarantine_weight = 0.5
+        self.assertTrue(set(sampler).intersection({1, 3, 6, 8}))
+
+    def test_concurrent_records(self):
+        processes = [
+            multiprocessing.Process(target=record_failures, args=(self.error_dir, i))
+            for i in range(4)
+        ]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        registry = QuarantineRegistry(self.error_dir, min_failures=1)
+        self.assertEqual(len(registry.quarantined_keys("toy")), 200)
+        self.assertEqual(len(registry.quarantined_keys("other")), 0)
+        registry.min_failures = 2
+        self.assertFalse(registry.is_quarantined("toy", "0-0"))
+
+    def test_min_failures(self):
+        # A single transient failure does not quarantine a sample by default
+        registry = QuarantineRegistry(self.error_dir)
+        registry.record("toy", "bad0-A-nan", "OSError")
+        self.assertFalse(registry.is_quarantined("toy", "bad0-A-nan"))
+        registry.record("toy", "bad0-A-nan", "OSError")
+        self.assertTrue(registry.is_quarantined("toy", "bad0-A-nan"))
+
+
+if __name__ == "__main__":
+    unittest.main()
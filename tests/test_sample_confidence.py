@@ -0,0 +1,112 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import torch
+
+from protenix.model.sample_confidence import (
+    calculate_chain_based_ptm,
+    calculate_iptm,
+    calculate_ptm,
+)
+
+BIN_PARAMS = {"min_bin": 0.0, "max_bin": 32.0, "no_bins": 64}
+
+
+def chain_based_ptm_by_pair(pae_prob, has_frame, asym_id, token_is_ligand):
+    """Reference: call calculate_ptm / calculate_iptm for every chain and chain pair."""
+    N_chain = len(torch.unique(asym_id))
+    masks = [asym_id == i for i in range(N_chain)]
+    is_ligand = [token_is_ligand[m].sum() >= m.sum() // 2 for m in masks]
+    batch_shape = pae_prob.shape[:-3]
+
+    chain_pair_iptm = torch.zeros(batch_shape + (N_chain, N_chain))
+    for i in range(N_chain):
+        for j in range(N_chain):
+            if i != j:
+                chain_pair_iptm[..., i, j] = calculate_iptm(
+                    pae_prob,
+                    has_frame,
+                    asym_id,
+                    token_mask=masks[i] + masks[j],
+                    **BIN_PARAMS,
+                )
+    chain_ptm = torch.stack(
+        [
+            calculate_ptm(pae_prob, has_frame, token_mask=m, **BIN_PARAMS)
+            for m in masks
+        ],
+        dim=-1,
+    )
+    chain_has_frame = [has_frame[m].any() for m in masks]
+    chain_iptm = torch.zeros(batch_shape + (N_chain,))
+    for c in range(N_chain):
+        vals = [
+            chain_pair_iptm[..., i, j]
+            for i in range(N_chain)
+            for j in range(N_chain)
+            if (i == c or j == c) and i != j and chain_has_frame[i]
+        ]
+        if len(vals) > 0:
+            chain_iptm[..., c] = torch.stack(vals, dim=-1).mean(dim=-1)
+    chain_pair_iptm_global = torch.zeros(batch_shape + (N_chain, N_chain))
+    for i in range(N_chain):
+        for j in range(N_chain):
+            if i == j:
+                continue
+            if is_ligand[i]:
+                chain_pair_iptm_global[..., i, j] = chain_iptm[..., i]
+            elif is_ligand[j]:
+                chain_pair_iptm_global[..., i, j] = chain_iptm[..., j]
+            else:
+                chain_pair_iptm_global[..., i, j] = (
+                    chain_iptm[..., i] + chain_iptm[..., j]
+                ) * 0.5
+    return {
+        "chain_ptm": chain_ptm,
+        "chain_iptm": chain_iptm,
+        "chain_pair_iptm": chain_pair_iptm,
+        "chain_pair_iptm_global": chain_pair_iptm_global,
+    }
+
+
+class TestChainBasedPTM(unittest.TestCase):
+    def test_equivalence(self):
+        torch.manual_seed(0)
+        for chain_sizes in [[7, 5, 5, 1, 1, 12], [20], [3] * 12]:
+            asym_id = torch.cat(
+                [torch.full((n,), i) for i, n in enumerate(chain_sizes)]
+            )
+            # non-contiguous chains
+            asym_id = asym_id[torch.randperm(len(asym_id))]
+            N_token = len(asym_id)
+            pae_prob = torch.softmax(torch.randn(3, N_token, N_token, 64), dim=-1)
+            has_frame = torch.rand(N_token) > 0.3
+            has_frame[asym_id == 0] = False
+            token_is_ligand = torch.rand(N_token) > 0.6
+
+            expected = chain_based_ptm_by_pair(
+                pae_prob, has_frame, asym_id, token_is_ligand
+            )
+            result = calculate_chain_based_ptm(
+                pae_prob, has_frame, asym_id, token_is_ligand, **BIN_PARAMS
+            )
+            for key, value in expected.items():
+                self.assertEqual(result[key].shape, value.shape)
+                self.assertTrue(torch.allclose(result[key], value, atol=1e-6), key)
+
+
+if __name__ == "__main__":
+    unittest.main()
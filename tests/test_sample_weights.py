@@ -0,0 +1,97 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from protenix.data.dataset import (
+    calc_weights_for_df,
+    get_sample_weights,
+    get_weighted_pdb_weight,
+)
+
+BETA_DICT = {"chain": 0.5, "interface": 1}
+ALPHA_DICT = {"prot": 3, "nuc": 3, "ligand": 1}
+
+
+def make_indices_df(n=500, seed=0):
+    rng = np.random.default_rng(seed)
+    is_chain = rng.random(n) < 0.5
+    mol_types = ["prot", "nuc", "ligand", "ions"]
+    return pd.DataFrame(
+        {
+            "pdb_id": rng.integers(0, 40, n).astype(str),
+            "assembly_id": rng.integers(1, 3, n).astype(str),
+            "entity_1_id": rng.integers(1, 12, n).astype(str),
+            "entity_2_id": np.where(
+                is_chain, np.nan, rng.integers(1, 12, n).astype(str)
+            ),
+            "cluster_id": rng.integers(0, 30, n).astype(str),
+            "type": np.where(is_chain, "chain", "interface"),
+            "mol_1_type": rng.choice(mol_types, n),
+            "mol_2_type": np.where(is_chain, np.nan, rng.choice(mol_types, n)),
+        }
+    )
+
+
+class TestSampleWeights(unittest.TestCase):
+    def test_calc_weights(self):
+        df = calc_weights_for_df(make_indices_df(), BETA_DICT, ALPHA_DICT)
+        # Row-by-row reference
+        cluster_size = df.groupby("cluster_id")["pdb_sorted_entity_id"].nunique()
+        member_num = df["pdb_sorted_entity_id"].value_counts()
+        for _, row in df.iterrows():
+            chain_count = {"prot": 0, "nuc": 0, "ligand": 0}
+            for mol_type in [row["mol_1_type"], row["mol_2_type"]]:
+                if mol_type in chain_count:
+                    chain_count[mol_type] += 1
+            expected = get_weighted_pdb_weight(
+                data_type=row["type"],
+                cluster_size=cluster_size[row["cluster_id"]],
+                chain_count=chain_count,
+                beta_dict=BETA_DICT,
+                alpha_dict=ALPHA_DICT,
+            )
+            expected /= member_num[row["pdb_sorted_entity_id"]]
+            self.assertEqual(row["weights"], expected)
+
+    def test_weight_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            indices_fpath = os.path.join(tmp_dir, "indices.csv")
+            kwargs = {
+                "sampler_type": "weighted",
+                "beta_dict": BETA_DICT,
+                "alpha_dict": ALPHA_DICT,
+                "force_recompute_weight": True,
+                "cache_weight": True,
+                "indices_fpath": indices_fpath,
+            }
+            weights = get_sample_weights(indices_df=make_indices_df(), **kwargs)
+            cache_files = [f for f in os.listdir(tmp_dir) if f.endswith(".npy")]
+            self.assertEqual(len(cache_files), 1)
+            cached = get_sample_weights(indices_df=make_indices_df(), **kwargs)
+            self.assertTrue(np.array_equal(weights.values, cached.values))
+
+            # different indices use a different cache file
+            get_sample_weights(indices_df=make_indices_df(seed=1), **kwargs)
+            cache_files = [f for f in os.listdir(tmp_dir) if f.endswith(".npy")]
+            self.assertEqual(len(cache_files), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import os
+import pickle
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from torch.utils.data import DataLoader, Dataset
+
+from protenix.data.kv_store import StringTable, get_cache_path, load_json_items
+from protenix.data.utils import parse_pdb_cluster_file_to_dict
+
+
+class LookupDataset(Dataset):
+    def __init__(self, table, keys):
+        self.table = table
+        self.keys = keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, idx):
+        return self.table.get(self.keys[idx])
+
+
+class TestStringTable(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.mapping = {
+            "MKTAYIAKQR": 12,
+            "MKTAYIAKQRQ": "7",
+            "GGGGS": ["1abc_1", "2xyz_3"],
+            "äöü": {"a": None},
+            "A": 0,
+        }
+        self.json_path = os.path.join(self.tmp_dir.name, "seq_to_pdb_index.json")
+        with open(self.json_path, "w") as f:
+            json.dump(self.mapping, f)
+        self.cache_dir = os.path.join(self.tmp_dir.name, "cache")
+        patcher = mock.patch.dict(os.environ, {"PROTENIX_CACHE_DIR": self.cache_dir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_lookup(self):
+        table = StringTable.from_source(self.json_path, load_json_items)
+        self.assertTrue(os.path.isdir(self.json_path + ".kv"))
+        self.assertEqual(len(table), len(self.mapping))
+        self.assertEqual(dict(table.items()), self.mapping)
+        for key, value in self.mapping.items():
+            self.assertIn(key, table)
+            self.assertEqual(table[key], value)
+        for key in ["", "MKTAYIAKQ", "Z", "GGGGSS"]:
+            self.assertNotIn(key, table)
+            self.assertIsNone(table.get(key))
+        with self.assertRaises(KeyError):
+            table["B"]
+        # Attach to the same files
+        table = pickle.loads(pickle.dumps(table))
+        self.assertEqual(table["GGGGS"], ["1abc_1", "2xyz_3"])
+
+    def test_rebuild_if_stale(self):
+        StringTable.from_source(self.json_path, load_json_items)
+        with open(self.json_path, "w") as f:
+            json.dump({"MKTAYIAKQR": 13}, f)
+        table = StringTable.from_source(self.json_path, load_json_items)
+        self.assertEqual(dict(table.items()), {"MKTAYIAKQR": 13})
+
+    def test_read_only_source_dir(self):
+        mkdir = Path.mkdir
+
+        def mkdir_outside_source_dir(path, *args, **kwargs):
+            if str(path).startswith(self.json_path):
+                raise PermissionError(f"Read-only directory: {path}")
+            return mkdir(path, *args, **kwargs)
+
+        num_loads = []
+
+        def load_items(source_path):
+            num_loads.append(source_path)
+            # A generator can only be consumed once
+            yield from load_json_items(source_path)
+
+        with mock.patch.object(Path, "mkdir", mkdir_outside_source_dir):
+            table = StringTable.from_source(self.json_path, load_items)
+            self.assertFalse(os.path.exists(self.json_path + ".kv"))
+            self.assertEqual(table.table_dir, get_cache_path(self.json_path, "kv"))
+            self.assertEqual(dict(table.items()), self.mapping)
+
+            # The other processes and runs reuse the cached table
+            num_loads.clear()
+            table = StringTable.from_source(self.json_path, load_items)
+            self.assertEqual(num_loads, [])
+            self.assertEqual(table.table_dir, get_cache_path(self.json_path, "kv"))
+
+            # Rebuilt in place when the source changes
+            with open(self.json_path, "w") as f:
+                json.dump({"A": 1}, f)
+            os.utime(self.json_path, ns=(0, os.stat(self.json_path).st_mtime_ns + 1))
+            table = StringTable.from_source(self.json_path, load_items)
+            self.assertEqual(table.table_dir, get_cache_path(self.json_path, "kv"))
+            self.assertEqual(dict(table.items()), {"A": 1})
+        # A single table, no leftover directories
+        self.assertEqual(os.listdir(self.cache_dir), [table.table_dir.name])
+
+    def test_empty(self):
+        with open(self.json_path, "w") as f:
+            json.dump({}, f)
+        table = StringTable.from_source(self.json_path, load_json_items)
+        self.assertEqual(len(table), 0)
+        self.assertFalse(table)
+        self.assertNotIn("A", table)
+
+    def test_workers(self):
+        table = StringTable.from_source(self.json_path, load_json_items)
+        keys = list(self.mapping) + ["missing"]
+        dataloader = DataLoader(
+            LookupDataset(table, keys),
+            batch_size=None,
+            num_workers=2,
+            multiprocessing_context="spawn",
+        )
+        self.assertEqual(list(dataloader), list(self.mapping.values()) + [None])
+
+    def test_pdb_cluster_file(self):
+        cluster_file = os.path.join(self.tmp_dir.name, "clusters-by-entity-40.txt")
+        with open(cluster_file, "w") as f:
+            f.write("1ABC_1 AF_P12345 2XYZ_2\n")
+            f.write("AF_Q99999 MA_ABC\n")
+            f.write("3DEF_1\n")
+        cluster_dict = parse_pdb_cluster_file_to_dict(cluster_file)
+        self.assertEqual(
+            dict(cluster_dict.items()),
+            {
+                "1abc_1": ["pdb_cluster_1ABC_1", 2],
+                "2xyz_2": ["pdb_cluster_1ABC_1", 2],
+                "3def_1": ["pdb_cluster_3DEF_1", 1],
+            },
+        )
+        cluster_id, _ = cluster_dict["2xyz_2"]
+        self.assertEqual(cluster_id, "pdb_cluster_1ABC_1")
+        cluster_dict = parse_pdb_cluster_file_to_dict(cluster_file, False)
+        self.assertEqual(cluster_dict["af_p12345"], ["pdb_cluster_1ABC_1", 3])
+        self.assertEqual(cluster_dict["ma_abc"], ["pdb_cluster_AF_Q99999", 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+# Copyright 2024 ByteDance and/or its affiliates.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+import torch
+
+from protenix.utils.training import zero_grads_if
+
+
+class TestZeroGradsIf(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = torch.nn.Linear(4, 1)
+        self.optimizer = torch.optim.AdamW(self.model.parameters(), lr=0.1)
+        self.inputs = [torch.randn(8, 4), torch.full((8, 4), float("nan"))]
+
+    def backward(self, x: torch.Tensor, iters_to_accumulate: int) -> None:
+        loss = self.model(x).square().mean()
+        is_nan = ~torch.isfinite(loss.detach())
+        with zero_grads_if(self.model.parameters(), is_nan):
+            (loss / iters_to_accumulate).backward()
+
+    def test_nan_loss_in_accumulated_step(self):
+        self.backward(self.inputs[0], iters_to_accumulate=1)
+        expected_grads = [p.grad.clone() / 2 for p in self.model.parameters()]
+        self.optimizer.zero_grad(set_to_none=True)
+
+        # One of the two accumulated samples has a NaN loss
+        for x in self.inputs:
+            self.backward(x, iters_to_accumulate=2)
+        for p, expected_grad in zip(self.model.parameters(), expected_grads):
+            self.assertTrue(torch.allclose(p.grad, expected_grad))
+
+        # The step is still applied
+        params = [p.detach().clone() for p in self.model.parameters()]
+        total_norm = torch.nn.utils.clip_grad_norm_(self.model.parameters(), 1.0)
+        self.assertTrue(torch.isfinite(total_norm))
+        self.optimizer.step()
+        for p, old_p in zip(self.model.parameters(), params):
+            self.assertTrue(torch.isfinite(p).all())
+            self.assertFalse(torch.equal(p, old_p))
+
+    def test_hooks_removed(self):
+        self.backward(self.inputs[1], iters_to_accumulate=1)
+        self.assertTrue(all(torch.all(p.grad == 0) for p in self.model.parameters()))
+        self.model(self.inputs[1]).square().mean().backward()
+        self.assertTrue(all(torch.isnan(p.grad).any() for p in self.model.parameters()))
+
+
+if __name__ == "__main__":
+    unittest.main()
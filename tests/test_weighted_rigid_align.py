@@ -17,7 +17,7 @@ import unittest
 
 import torch
 
-from protenix.model.loss import weighted_rigid_align
+from protenix.metrics.rmsd import weighted_rigid_align
 from protenix.utils.seed import seed_everything
 
 